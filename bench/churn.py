@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Churn simulation for the routing table replacement caches.
+
+A node keeps hearing from random members of a population in which a
+fraction of nodes leaves and is replaced by newcomers every round.
+Dead contacts are reported unreachable, as the peer pinger does, so
+live contacts are promoted from the replacement caches. Reports how
+many routing table entries are alive and how large the caches grow,
+with and without promotion.
+
+Run from the root dir as: python -m bench.churn [--rounds N]
+"""
+import argparse
+import os
+import random
+
+from node import constants, guid, routingtable
+
+
+def random_guid():
+    return os.urandom(20).encode('hex')
+
+
+def simulate(args, promote):
+    rng = random.Random(args.seed)
+    table = routingtable.OptimizedTreeRoutingTable(random_guid(), 1)
+    live = set(random_guid() for _ in range(args.population))
+    dead = set()
+    max_cached = 0
+
+    for _ in range(args.rounds):
+        # Some nodes leave and are replaced by as many newcomers
+        leaving = rng.sample(sorted(live), int(len(live) * args.churn))
+        live.difference_update(leaving)
+        dead.update(leaving)
+        live.update(random_guid() for _ in leaving)
+
+        # We hear from a random part of the live population
+        for node_id in rng.sample(sorted(live), args.contacts_per_round):
+            table.add_contact(guid.GUIDMixin(node_id))
+
+        # The pinger notices contacts that left
+        if promote:
+            for contact, _ in list(table.iter_contacts()):
+                if contact.guid in dead:
+                    table.report_unreachable(contact.guid)
+
+        max_cached = max(
+            max_cached,
+            sum(len(bucket.replacement_cache) for bucket in table.buckets)
+        )
+
+    in_table = [contact.guid for contact, _ in table.iter_contacts()]
+    alive = sum(1 for node_id in in_table if node_id in live)
+    return {
+        'buckets': len(table.buckets),
+        'contacts': len(in_table),
+        'alive': alive,
+        'max_cached': max_cached,
+        'cache_bound': len(table.buckets) * constants.CACHE_K,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--population', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=100)
+    parser.add_argument('--churn', type=float, default=0.05,
+                        help='fraction of the population replaced every round')
+    parser.add_argument('--contacts-per-round', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    for promote in (False, True):
+        stats = simulate(args, promote)
+        print 'Promotion %s' % ('on' if promote else 'off')
+        print '  Buckets:            %d' % stats['buckets']
+        print '  Contacts:           %d' % stats['contacts']
+        print '  Alive contacts:     %d (%.1f%%)' % (
+            stats['alive'], 100.0 * stats['alive'] / max(stats['contacts'], 1)
+        )
+        print '  Max cached:         %d (bound %d)' % (
+            stats['max_cached'], stats['cache_bound']
+        )
+
+if __name__ == '__main__':
+    main()
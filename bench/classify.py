@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Per-datagram classification cost of the peer listener.
+
+Classifies a mix of control datagrams and RUDP packets the way the
+listener used to, with a chain of prefix comparisons followed by a
+JSON parse for the transport, and with node.packettype, for both
+legacy text prefixes and one-byte type headers.
+
+Run from the root dir as: python -m bench.classify [--packets N] [--data-ratio R]
+"""
+import argparse
+import json
+import random
+import timeit
+
+from node import packettype
+from node.constants import PACKET_TYPE_PING, PACKET_TYPE_PONG, PACKET_TYPE_RELAY_PING, \
+    PACKET_TYPE_SEND_RELAY_PONG, PACKET_TYPE_HEARTBEAT, PACKET_TYPE_PUNCH, PACKET_TYPE_DATA
+
+GUID = '8c8a5bd6d0a2a5ee3a9d6f6e1e09e8c2bf4e1ba2'
+RUDP_PACKET = json.dumps({
+    'guid': GUID,
+    'pubkey': '04' + 'ab' * 64,
+    'hostname': '10.0.0.1',
+    'port': 12345,
+    'nick': 'Default',
+    'nat_type': 'Full Cone',
+    'size': 1000,
+    'payload': 'cd' * 500,
+    'seq': 7,
+})
+
+CONTROL_PACKETS = (
+    (PACKET_TYPE_PING, ''),
+    (PACKET_TYPE_PONG, ''),
+    (PACKET_TYPE_RELAY_PING, GUID),
+    (PACKET_TYPE_SEND_RELAY_PONG, '%s %s' % (GUID, GUID)),
+    (PACKET_TYPE_HEARTBEAT, ''),
+    (PACKET_TYPE_PUNCH, GUID),
+)
+
+
+def classify_chain(data):
+    """ The listener and transport before type headers. """
+    if data[:4] == 'ping':
+        return PACKET_TYPE_PING
+    elif data[:4] == 'pong':
+        return PACKET_TYPE_PONG
+    elif data[:15] == 'send_relay_ping':
+        return 'send_relay_ping'
+    elif data[:10] == 'relay_ping':
+        return PACKET_TYPE_RELAY_PING
+    elif data[:15] == 'send_relay_pong':
+        return PACKET_TYPE_SEND_RELAY_PONG
+    elif data[:9] == 'heartbeat':
+        return PACKET_TYPE_HEARTBEAT
+    elif data[:7] == 'relayto':
+        return 'relayto'
+    elif data[:6] == 'relay ':
+        return 'relay'
+    elif data[:5] == 'punch':
+        return PACKET_TYPE_PUNCH
+    json.loads(data)
+    return PACKET_TYPE_DATA
+
+
+def classify_table(data):
+    packet_type, payload = packettype.classify(data)
+    if packet_type == PACKET_TYPE_DATA:
+        json.loads(payload)
+    return packet_type
+
+
+def make_packets(count, data_ratio):
+    packets = []
+    for _ in xrange(count):
+        if random.random() < data_ratio:
+            packets.append((PACKET_TYPE_DATA, RUDP_PACKET))
+        else:
+            packets.append(random.choice(CONTROL_PACKETS))
+    return packets
+
+
+def encode(packets, header):
+    return [packettype.encode(packet_type, payload, header=header) for packet_type, payload in packets]
+
+
+def measure(classify, packets, repeat):
+    def run():
+        for data in packets:
+            classify(data)
+    return min(timeit.repeat(run, number=1, repeat=repeat)) / len(packets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--packets', type=int, default=10000)
+    parser.add_argument('--data-ratio', type=float, default=0.5,
+                        help='share of the datagrams that are RUDP packets')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(0)
+    packets = make_packets(args.packets, args.data_ratio)
+    control = [packet for packet in packets if packet[0] != PACKET_TYPE_DATA]
+    legacy, headers = encode(packets, False), encode(packets, True)
+    legacy_control, headers_control = encode(control, False), encode(control, True)
+
+    print 'Per datagram (%d datagrams, %.0f%% RUDP):' % (args.packets, 100 * args.data_ratio)
+    for name, classify, packets in (
+            ('prefix chain, legacy', classify_chain, legacy),
+            ('table, legacy', classify_table, legacy),
+            ('table, headers', classify_table, headers),
+            ('prefix chain, control only', classify_chain, legacy_control),
+            ('table, legacy control only', classify_table, legacy_control),
+            ('table, header control only', classify_table, headers_control)):
+        print '  %-28s %.2fus' % (name + ':', 1e6 * measure(classify, packets, args.repeat))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Size and CPU cost of zlib and the compression policy on peer messages.
+
+Compresses typical messages of a few sizes with zlib at the default
+level, as every message used to be, and with a CompressionPolicy
+(threshold, level by type and preset dictionary), then decompresses
+them again. Reports the compressed size and the time per message.
+
+Run from the root dir as: python -m bench.compression [--number N]
+"""
+import argparse
+import json
+import timeit
+import zlib
+
+from node import compression
+from node.compression import CompressionPolicy
+
+
+def make_messages():
+    header = {
+        'senderGUID': 'ab' * 20, 'guid': 'ab' * 20, 'hostname': '10.0.0.1', 'port': 12345,
+        'senderNick': 'alice', 'v': '0.5.1', 'pubkey': '04' + ''.join('%02x' % num for num in xrange(64))
+    }
+    nodes = [['%040x' % (num * 7919), '10.0.0.%d' % num, 12345, '04' + '%0128x' % num]
+             for num in xrange(8)]
+    return [
+        ('ping', dict(header, type='ping')),
+        ('findNode', dict(header, type='findNode', findID='cd' * 20)),
+        ('findNodeResponse', dict(header, type='findNodeResponse', findID='cd' * 20, foundNodes=nodes)),
+        ('store', dict(header, type='store', key='ef' * 20, ttl=604800,
+                       value=json.dumps({'Contract': {'item_title': 'Widget %d' % num,
+                                                      'item_price': num, 'item_desc': 'A widget.' * 20}
+                                         for num in xrange(4)}))),
+    ]
+
+
+def measure(func, number, repeat):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    policy = CompressionPolicy()
+    print '%-18s %6s %17s %17s' % ('', 'bytes', 'zlib', 'policy')
+    for name, message in make_messages():
+        data = json.dumps(message)
+        legacy = zlib.compress(data)
+        compressed = policy.compress(data, message['type'], '0.5.1')
+        print '%-18s %6d %6d bytes %4.0f%% %6d bytes %4.0f%%' % (
+            name, len(data), len(legacy), 100.0 * len(legacy) / len(data),
+            len(compressed), 100.0 * len(compressed) / len(data))
+        print '%-18s %6s %6.1fus %6.1fus %6.1fus %6.1fus   (compress, decompress)' % (
+            '', '',
+            1e6 * measure(lambda: zlib.compress(data), args.number, args.repeat),
+            1e6 * measure(lambda: zlib.decompress(legacy), args.number, args.repeat),
+            1e6 * measure(lambda: policy.compress(data, message['type'], '0.5.1'), args.number, args.repeat),
+            1e6 * measure(lambda: compression.decompress(compressed), args.number, args.repeat))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Memory cost of a known contact.
+
+Every node learned from a findNode response used to become a
+CryptoPeerConnection, with its RUDP connection, packet sender, event
+emitter, logger and timers. The routing table now holds a ContactRecord
+and a connection is only made to send data to the node. Reports the
+resident memory added per object for both.
+
+Run from the root dir as: python -m bench.contacts [--contacts N]
+"""
+import argparse
+import gc
+import os
+import resource
+import socket
+
+from node import connection, contact, transport
+from node.openbazaar_daemon import OpenBazaarContext
+
+
+def random_guid():
+    return os.urandom(20).encode('hex')
+
+
+def max_rss_kb():
+    # Kilobytes on Linux; the peak only grows, so a delta is what was added
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(make, count):
+    gc.collect()
+    before = max_rss_kb()
+    objects = [make(num) for num in range(count)]
+    gc.collect()
+    added = max_rss_kb() - before
+    return objects, added * 1024.0 / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--contacts', type=int, default=5000)
+    args = parser.parse_args()
+
+    ob_ctx = OpenBazaarContext.create_default_instance()
+    ob_ctx.nat_status = {'nat_type': 'Restric NAT'}
+    layer = transport.TransportLayer(ob_ctx, random_guid())
+    layer.market_id = 1
+    peer_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    guids = [random_guid() for _ in range(args.contacts)]
+
+    # Records first: measured on a fresh heap they cannot reuse memory
+    # freed by the connections
+    records, record_bytes = measure(
+        lambda num: contact.ContactRecord(
+            guids[num], '127.0.0.1', 30000 + num, 'pub', 'nick', 'Restric NAT'
+        ),
+        args.contacts
+    )
+    peers, peer_bytes = measure(
+        lambda num: connection.CryptoPeerConnection(
+            layer, '127.0.0.1', 30000 + num, 'pub', guids[num], 'nick',
+            peer_socket=peer_socket, nat_type='Restric NAT'
+        ),
+        args.contacts
+    )
+    peer_socket.close()
+
+    print 'Known contacts:        %d' % args.contacts
+    print 'ContactRecord:         %8.0f bytes each' % record_bytes
+    print 'CryptoPeerConnection:  %8.0f bytes each' % peer_bytes
+    if record_bytes > 0:
+        print 'Ratio:                 %8.1fx' % (peer_bytes / record_bytes)
+    del records, peers
+
+
+if __name__ == '__main__':
+    main()
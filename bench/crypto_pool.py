@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Inbound message rate with messages opened inline and on worker processes.
+
+Encrypts and signs messages from a few senders the legacy way (ECIES and
+ECDSA), then feeds them to a CryptoPeerListener that opens them on the
+IOLoop and to ones with a crypto pool of 1, 2, ... worker processes, and
+reports the messages opened per second. Workers only help up to the
+number of cores.
+
+Run from the root dir as: python -m bench.crypto_pool [--messages N] [--max-workers N]
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import time
+
+from bitcoin import main as arithmetic
+
+from node.connection import CryptoPeerListener
+from node.crypto_util import Cryptor
+
+
+def make_key(name):
+    secret = hashlib.sha256(name).hexdigest()
+    return secret, arithmetic.privkey_to_pubkey(secret)
+
+
+def make_messages(count, senders, recipient_pubkey, size):
+    keys = [make_key('sender%d' % num) for num in xrange(senders)]
+    recipient = Cryptor(pubkey_hex=recipient_pubkey)
+    messages = []
+    for num in xrange(count):
+        secret, pubkey = keys[num % senders]
+        data = json.dumps({'type': 'store', 'seq': num, 'pubkey': pubkey, 'value': 'x' * size}).encode('hex')
+        signature = Cryptor(privkey_hex=secret).sign(data).encode('hex')
+        messages.append((
+            ('10.0.0.%d' % (num % senders), 12345),
+            recipient.encrypt(json.dumps({'sig': signature, 'data': data}).encode('zlib'))
+        ))
+    return messages
+
+
+def measure(secret, pubkey, messages, workers):
+    opened = []
+    listener = CryptoPeerListener('127.0.0.1', 0, pubkey, secret, 'bench', opened.append,
+                                  crypto_workers=workers)
+    try:
+        started = time.time()
+        for peer, message in messages:
+            listener.on_raw_message(message, peer)
+        if listener.crypto_pool is not None:
+            listener.crypto_pool.drain()
+        elapsed = time.time() - started
+    finally:
+        if listener.crypto_pool is not None:
+            listener.crypto_pool.close()
+    assert len(opened) == len(messages)
+    return len(messages) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=400)
+    parser.add_argument('--senders', type=int, default=8)
+    parser.add_argument('--message-size', type=int, default=1000,
+                        help='size of the message payload in bytes')
+    parser.add_argument('--max-workers', type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    secret, pubkey = make_key('recipient')
+    messages = make_messages(args.messages, args.senders, pubkey, args.message_size)
+
+    inline = measure(secret, pubkey, messages, 0)
+    print 'Messages opened per second (%d cores):' % multiprocessing.cpu_count()
+    print '  %-12s %6.0f' % ('inline:', inline)
+    for workers in xrange(1, args.max_workers + 1):
+        rate = measure(secret, pubkey, messages, workers)
+        label = '%d worker%s:' % (workers, '' if workers == 1 else 's')
+        print '  %-12s %6.0f (%.2fx)' % (label, rate, rate / inline)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Encrypt and verify throughput with and without the Cryptor cache.
+
+Encrypts messages to, and verifies signatures of, a set of peers taken
+in turn, building a Cryptor from the peer's key for every message as
+before and taking it from crypto_util.get_cryptor.
+
+Run from the root dir as: python -m bench.cryptor_cache [--peers N] [--messages N]
+"""
+import argparse
+import timeit
+
+from bitcoin import main as arithmetic
+
+from node import crypto_util
+from node.crypto_util import Cryptor
+
+
+def make_peers(count):
+    peers = []
+    for num in xrange(1, count + 1):
+        cryptor = Cryptor(privkey_hex='%064x' % (num * 7919))
+        pubkey = arithmetic.privkey_to_pubkey('%064x' % (num * 7919))
+        peers.append((pubkey, cryptor.sign('hello')))
+    return peers
+
+
+def encrypt(get_cryptor, peers, messages, data):
+    for num in xrange(messages):
+        get_cryptor(peers[num % len(peers)][0]).encrypt(data)
+
+
+def verify(get_cryptor, peers, messages, data):
+    for num in xrange(messages):
+        pubkey, signature = peers[num % len(peers)]
+        assert get_cryptor(pubkey).verify(signature, data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--peers', type=int, default=32)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    peers = make_peers(args.peers)
+    uncached = lambda pubkey: Cryptor(pubkey_hex=pubkey)
+
+    print 'Messages per second (%d peers):' % args.peers
+    for name, operation in (('encrypt', encrypt), ('verify', verify)):
+        rates = []
+        for get_cryptor in (uncached, crypto_util.get_cryptor):
+            seconds = min(timeit.repeat(
+                lambda: operation(get_cryptor, peers, args.messages, 'hello'), number=1, repeat=args.repeat
+            ))
+            rates.append(args.messages / seconds)
+        print '  %-8s new Cryptor %8.0f   cached %8.0f   (%.2fx)' % (
+            name + ':', rates[0], rates[1], rates[1] / rates[0]
+        )
+
+    stats = crypto_util.cryptor_cache.get_stats()
+    print 'Cache: %d hits, %d misses' % (stats['hits'], stats['misses'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,454 @@
+#!/usr/bin/env python
+"""
+In-process simulation of DHT lookups across many nodes.
+
+Every node is a real node.dht.DHT with an in-memory datastore, connected
+to the others through a fake transport. Messages are serialised as on
+the wire and delivered through an event queue on a simulated clock,
+with configurable latency, jitter and loss; nodes can leave and join
+between rounds of lookups. Nodes start out knowing their closest
+neighbours and a few random nodes, so no bootstrap traffic is needed.
+
+The DHT's own timers (bucket refresh, republishing, search expiry) do
+not run. When no messages are left in flight, a waiting lookup gives up
+on its unanswered probes DHT_PROBE_TIMEOUT later, as the search sweeper
+would, and times out once DHT_SEARCH_TIMEOUT has passed.
+
+Reports per lookup the hops to the answering node, the messages sent
+(including responses and lost messages), the success rate, the
+simulated latency and the wall time spent.
+
+Run from the root dir as: python -m bench.dht_sim [--nodes N] [--lookup node|value]
+"""
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import random
+import time
+
+from tornado import ioloop
+
+from node import constants, datastore, dht, ranking
+
+MARKET_ID = 1
+
+
+class SimNetwork(object):
+    """
+    Delivers messages between simulated nodes on a simulated clock.
+    """
+
+    def __init__(self, rng, latency=0.05, jitter=0.02, loss=0.0):
+        """
+        @param latency: Mean one-way delay of a message in seconds.
+        @type latency: float
+
+        @param jitter: Delays vary uniformly by up to this many seconds.
+        @type jitter: float
+
+        @param loss: Probability that a message is dropped.
+        @type loss: float
+        """
+        self.rng = rng
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+
+        self.now = 0.0
+        self.nodes = {}  # guid -> SimNode, online nodes only
+        self.trace = None  # LookupTrace of the lookup being measured
+        self._events = []
+        self._seq = itertools.count()
+
+        self.num_sent = 0
+        self.num_lost = 0
+        self.bytes_sent = 0
+
+    def send(self, sender, guid, msg):
+        data = json.dumps(msg)
+        self.num_sent += 1
+        self.bytes_sent += len(data)
+        if self.trace is not None:
+            self.trace.sent(sender.guid, guid, msg)
+
+        node = self.nodes.get(guid)
+        if node is None or self.rng.random() < self.loss:
+            self.num_lost += 1
+            return
+
+        delay = max(self.latency + self.rng.uniform(-self.jitter, self.jitter), 0)
+        self.schedule(delay, self._deliver, node, json.loads(data), (sender.hostname, sender.port))
+
+    def _deliver(self, node, msg, addr):
+        if node.guid not in self.nodes:
+            # Left while the message was in flight
+            self.num_lost += 1
+            return
+        if self.trace is not None:
+            self.trace.delivered(msg['senderGUID'], node.guid, msg)
+        node.receive(msg, addr)
+
+    def schedule(self, delay, callback, *args):
+        heapq.heappush(self._events, (self.now + delay, next(self._seq), callback, args))
+
+    def run(self):
+        """ Deliver messages until none are left in flight. """
+        while self._events:
+            self.now, _, callback, args = heapq.heappop(self._events)
+            callback(*args)
+
+
+class SimPeer(object):
+    """ Stands in for a CryptoPeerConnection. """
+
+    def __init__(self, transport, guid, hostname, port, pub=None, nickname=None,
+                 nat_type=None, avatar_url=None):
+        self.transport = transport
+        self.guid = guid
+        self.hostname = hostname
+        self.port = port
+        self.pub = pub
+        self.nickname = nickname
+        self.nat_type = nat_type
+        self.avatar_url = avatar_url
+        self.seed = False
+        self.reachable = True
+
+    def send(self, data, callback=None):
+        # Sender information, as CryptoPeerConnection.send adds it
+        data['guid'] = self.guid
+        data['senderGUID'] = self.transport.guid
+        data['pubkey'] = self.transport.pubkey
+        data['senderNick'] = self.transport.nickname
+        data['avatar_url'] = self.transport.avatar_url
+        data['v'] = constants.VERSION
+        self.transport.network.send(self.transport, self.guid, data)
+
+    def init_packetsender(self):
+        pass
+
+    def setup_emitters(self):
+        pass
+
+
+class SimTransport(object):
+    """ The parts of CryptoTransportLayer the DHT uses. """
+
+    def __init__(self, network, guid, hostname, port):
+        self.network = network
+        self.guid = guid
+        self.hostname = hostname
+        self.port = port
+        self.pubkey = 'pub-%s' % guid
+        self.nickname = 'node-%s' % guid[:8]
+        self.avatar_url = None
+        self.nat_type = 'Full Cone'
+        self.handler = None
+        self.mediation_mode = {}
+        self.peers = {}
+
+    def get_crypto_peer(self, guid=None, hostname=None, port=None, pubkey=None,
+                        nickname=None, nat_type=None, avatar_url=None):
+        peer = self.peers.get(guid)
+        if peer is None:
+            peer = SimPeer(self, guid, hostname, port, pubkey, nickname, nat_type, avatar_url)
+            self.peers[guid] = peer
+        return peer
+
+
+class SimNode(object):
+
+    def __init__(self, network, guid, hostname, port):
+        self.guid = guid
+        self.transport = SimTransport(network, guid, hostname, port)
+        self.dht = dht.DHT(
+            self.transport, MARKET_ID, {'guid': guid}, None,
+            data_store=datastore.MemoryDataStore()
+        )
+
+    def receive(self, msg, addr):
+        # What CryptoTransportLayer does with every inbound message
+        self.dht.add_peer(
+            addr[0], addr[1], msg['pubkey'], msg['senderGUID'], msg['senderNick'],
+            msg.get('nat_type'), msg.get('avatar_url')
+        )
+        self.dht.mark_reached(msg['senderGUID'])
+
+        msg_type = msg['type']
+        if msg_type == 'findNode':
+            self.dht.on_find_node(msg)
+        elif msg_type == 'findNodeResponse':
+            self.dht.on_find_node_response(msg)
+        elif msg_type == 'store':
+            self.dht._on_store_value(msg)
+        elif msg_type == 'storeBatch':
+            for store_msg in msg['stores']:
+                self.dht._on_store_value(store_msg)
+
+        # Queued stores are flushed by the IOLoop, which does not run
+        if self.dht.pending_stores:
+            self.dht._flush_stores()
+
+
+class LookupTrace(object):
+    """
+    Follows one lookup through the network. A node the origin knew
+    before the lookup is one hop away; a node learned from the answer
+    of a node `n` hops away is `n + 1` hops away.
+    """
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.hops = {}
+        self.queried = {}
+        self.answered_by = None
+        self.num_messages = 0
+
+    def sent(self, sender, guid, msg):
+        self.num_messages += 1
+        if sender == self.origin and msg['type'] == 'findNode':
+            self.queried.setdefault(guid, self.hops.get(guid, 1))
+
+    def delivered(self, sender, guid, msg):
+        if guid != self.origin or msg['type'] != 'findNodeResponse':
+            return
+        hops = self.queried.get(sender, 1)
+        for node in msg.get('foundNodes', []):
+            self.hops.setdefault(node[0], hops + 1)
+        if 'foundKey' in msg and self.answered_by is None:
+            self.answered_by = sender
+
+    def hops_to(self, guid):
+        return self.queried.get(guid, self.hops.get(guid, 1))
+
+
+class Simulation(object):
+
+    def __init__(self, num_nodes, random_contacts=20, latency=0.05, jitter=0.02,
+                 loss=0.0, seed=1):
+        """
+        @param num_nodes: Number of nodes to start with.
+        @type num_nodes: int
+
+        @param random_contacts: Nodes every node knows besides its
+                                closest neighbours.
+        @type random_contacts: int
+        """
+        self.rng = random.Random(seed)
+        self.network = SimNetwork(self.rng, latency, jitter, loss)
+        self.random_contacts = random_contacts
+        self.values = {}
+        self.results = []
+
+        # The DHTs register their timers with this loop; it never runs
+        self.loop = ioloop.IOLoop()
+        self._next_address = itertools.count(1)
+
+        nodes = [self._add_node() for _ in range(num_nodes)]
+        self._bootstrap(nodes)
+
+    def close(self):
+        self.loop.close()
+
+    def _random_guid(self):
+        return '%040x' % self.rng.getrandbits(160)
+
+    def _add_node(self):
+        address = next(self._next_address)
+        hostname = '10.%d.%d.%d' % (address >> 16 & 255, address >> 8 & 255, address & 255)
+        self.loop.make_current()
+        try:
+            node = SimNode(self.network, self._random_guid(), hostname, 12345)
+        finally:
+            ioloop.IOLoop.clear_current()
+        self.network.nodes[node.guid] = node
+        return node
+
+    def _bootstrap(self, nodes):
+        ranker = ranking.DistanceRanker([node.guid for node in nodes])
+        for node in nodes:
+            closest = ranker.closest(node.guid, constants.K + 1)
+            randoms = self.rng.sample(range(len(nodes)), min(self.random_contacts, len(nodes)))
+            for index in closest + randoms:
+                contact = nodes[index]
+                node.dht.learn_contact(
+                    contact.transport.hostname, contact.transport.port,
+                    contact.transport.pubkey, contact.guid, contact.transport.nickname
+                )
+
+    def _online(self):
+        return sorted(self.network.nodes)
+
+    def store_values(self, count):
+        """ Place `count` values at the K closest nodes to their keys. """
+        online = self._online()
+        ranker = ranking.DistanceRanker(online)
+        now = int(time.time())
+        for _ in range(count):
+            key = self._random_guid()
+            value = 'value-%s' % key
+            for index in ranker.closest(key, constants.K):
+                node = self.network.nodes[online[index]]
+                node.dht.data_store.set_item(key, value, now, now, node.guid, MARKET_ID)
+            self.values[key] = value
+
+    def churn(self, fraction):
+        """ Take `fraction` of the nodes offline and have as many new
+        nodes join through a random live node. """
+        online = self._online()
+        leaving = self.rng.sample(online, int(len(online) * fraction))
+        for guid in leaving:
+            del self.network.nodes[guid]
+
+        online = self._online()
+        for _ in leaving:
+            node = self._add_node()
+            seed = self.network.nodes[self.rng.choice(online)]
+            node.dht.learn_contact(
+                seed.transport.hostname, seed.transport.port,
+                seed.transport.pubkey, seed.guid, seed.transport.nickname
+            )
+            node.dht.iterative_find_node(node.guid)
+            self.network.run()
+
+    def lookup(self, call='findNode'):
+        """
+        Run one lookup from a random node, for a random live node or
+        a random stored value, until no messages are left in flight.
+
+        @return: The result; see get_stats for the keys.
+        @rtype: dict
+        """
+        online = self._online()
+        origin = self.network.nodes[self.rng.choice(online)]
+        if call == 'findNode':
+            target = self.rng.choice([guid for guid in online if guid != origin.guid])
+        else:
+            target = self.rng.choice(sorted(self.values))
+
+        trace = LookupTrace(origin.guid)
+        outcome = {}
+        started = self.network.now
+        wall_started = time.time()
+
+        def on_done(result):
+            outcome['result'] = result
+            outcome['latency'] = self.network.now - started
+
+        self.network.trace = trace
+        if call == 'findNode':
+            origin.dht.iterative_find_node(target, on_done)
+        else:
+            origin.dht.iterative_find_value(target, on_done)
+        self.network.run()
+        while 'result' not in outcome and self.network.now - started < origin.dht.searches.timeout:
+            # Everything still awaited was lost
+            self.network.now += constants.DHT_PROBE_TIMEOUT_IN_SECONDS
+            origin.dht._expire_probes(time.time() + constants.DHT_PROBE_TIMEOUT_IN_SECONDS)
+            self.network.run()
+        self.network.trace = None
+
+        timed_out = 'result' not in outcome
+        if timed_out:
+            origin.dht.searches.expire(time.time() + origin.dht.searches.timeout)
+            outcome['latency'] = origin.dht.searches.timeout
+
+        result = outcome.get('result')
+        if call == 'findNode':
+            success = isinstance(result, list) and target in [node[2] for node in result]
+            hops = trace.hops_to(target) if success else None
+        else:
+            success = result == self.values[target]
+            hops = trace.hops_to(trace.answered_by) if trace.answered_by else None
+            if success and hops is None:
+                # Answered from the origin's value cache
+                hops = 0
+
+        lookup = {
+            'success': success,
+            'timed_out': timed_out,
+            'hops': hops,
+            'messages': trace.num_messages,
+            'latency': outcome['latency'],
+            'wall_time': time.time() - wall_started,
+        }
+        self.results.append(lookup)
+        return lookup
+
+    def get_stats(self):
+        lookups = self.results
+        hops = sorted(lookup['hops'] for lookup in lookups if lookup['hops'] is not None)
+
+        def mean(values):
+            values = list(values)
+            return float(sum(values)) / len(values) if values else 0.0
+
+        return {
+            'nodes': len(self.network.nodes),
+            'lookups': len(lookups),
+            'success_rate': mean(lookup['success'] for lookup in lookups),
+            'timed_out': sum(1 for lookup in lookups if lookup['timed_out']),
+            'mean_hops': mean(hops),
+            'max_hops': hops[-1] if hops else 0,
+            'mean_messages': mean(lookup['messages'] for lookup in lookups),
+            'mean_latency': mean(lookup['latency'] for lookup in lookups),
+            'mean_wall_time': mean(lookup['wall_time'] for lookup in lookups),
+            'messages_sent': self.network.num_sent,
+            'messages_lost': self.network.num_lost,
+            'bytes_sent': self.network.bytes_sent,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=1000)
+    parser.add_argument('--lookup', choices=('node', 'value'), default='node')
+    parser.add_argument('--lookups', type=int, default=100,
+                        help='lookups per round')
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--churn', type=float, default=0.0,
+                        help='fraction of the nodes replaced between rounds')
+    parser.add_argument('--values', type=int, default=100,
+                        help='values stored for value lookups')
+    parser.add_argument('--random-contacts', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='mean one-way delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    call = 'findNode' if args.lookup == 'node' else 'findValue'
+
+    started = time.time()
+    sim = Simulation(args.nodes, args.random_contacts, args.latency, args.jitter,
+                     args.loss, args.seed)
+    print 'Set up %d nodes in %.1fs' % (args.nodes, time.time() - started)
+    if call == 'findValue':
+        sim.store_values(args.values)
+
+    started = time.time()
+    for num in range(args.rounds):
+        if num and args.churn:
+            sim.churn(args.churn)
+        for _ in range(args.lookups):
+            sim.lookup(call)
+    wall_time = time.time() - started
+
+    stats = sim.get_stats()
+    sim.close()
+    print '%s lookups:      %d over %d nodes' % (args.lookup.capitalize(), stats['lookups'], stats['nodes'])
+    print '  Success rate:     %.1f%% (%d timed out)' % (100 * stats['success_rate'], stats['timed_out'])
+    print '  Hops:             %.2f mean, %d max' % (stats['mean_hops'], stats['max_hops'])
+    print '  Messages:         %.1f per lookup' % stats['mean_messages']
+    print '  Latency:          %.3fs simulated' % stats['mean_latency']
+    print '  Wall time:        %.1fms per lookup, %.1fs total' % (
+        1000 * stats['mean_wall_time'], wall_time
+    )
+    print '  Messages lost:    %d of %d' % (stats['messages_lost'], stats['messages_sent'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Encode and decode cost of legacy messages and signed envelopes.
+
+Encodes a message the legacy way (JSON, hex, sign, hex signature, JSON
+again) and as a node.envelope, then decodes it again, with and without
+the ECDSA signature and its check, which cost the same for both.
+Reports the time per message and the size after compression; ECIES
+encryption, also the same for both, is left out.
+
+Run from the root dir as: python -m bench.envelope [--message-size BYTES]
+"""
+import argparse
+import hashlib
+import json
+import timeit
+
+from bitcoin import main as arithmetic
+
+from node import envelope
+from node.crypto_util import Cryptor, get_cryptor
+
+
+def legacy_encode(message, sign):
+    sig_data = json.dumps(message).encode('hex')
+    return json.dumps({'sig': sign(sig_data).encode('hex'), 'data': sig_data})
+
+
+def legacy_decode(data, verify=True):
+    wrapper = json.loads(data)
+    signed_data = wrapper['data']
+    message = json.loads(signed_data.decode('hex'))
+    signature = wrapper['sig'].decode('hex')
+    if verify:
+        assert get_cryptor(message['pubkey']).verify(signature, signed_data)
+    return message
+
+
+def envelope_decode(data, verify=True):
+    if verify:
+        return envelope.decode(data)
+    return envelope.parse(data)[0]
+
+
+def measure(func, number, repeat):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--message-size', type=int, default=1000,
+                        help='size of the message payload in bytes')
+    parser.add_argument('--number', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    secret = hashlib.sha256('bench').hexdigest()
+    cryptor = Cryptor(privkey_hex=secret)
+    message = {
+        'type': 'store', 'key': 'ab' * 20, 'value': 'x' * args.message_size,
+        'pubkey': arithmetic.privkey_to_pubkey(secret), 'senderGUID': 'cd' * 20, 'v': '0.5.1'
+    }
+    # A fixed-size stand-in for framing only
+    no_sign = lambda data: '\x30' * 71
+
+    print 'A %d byte message:' % args.message_size
+    for name, encode, decode in (
+            ('legacy', legacy_encode, legacy_decode),
+            ('envelope', envelope.encode, envelope_decode)):
+        data = encode(message, cryptor.sign)
+        framed = encode(message, no_sign)
+        print '  %s: %d bytes, %d compressed' % (name, len(data), len(data.encode('zlib')))
+        print '    Framing only:   encode %7.1fus   decode %7.1fus' % (
+            1e6 * measure(lambda: encode(message, no_sign), args.number, args.repeat),
+            1e6 * measure(lambda: decode(framed, verify=False), args.number, args.repeat)
+        )
+        print '    With ECDSA:     encode %7.1fus   decode %7.1fus' % (
+            1e6 * measure(lambda: encode(message, cryptor.sign), args.number / 10, args.repeat),
+            1e6 * measure(lambda: decode(data), args.number / 10, args.repeat)
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Throughput and latency of the UDP peer listener.
+
+A separate process sends datagrams carrying their send time to a
+PeerListener on the loopback interface, once with the socket read on
+the IOLoop and once with the fallback listening thread. Reports the
+datagrams handled per second and the delay from sending a datagram to
+its on_message event running on the IOLoop, and the datagrams the
+kernel dropped where it reports them.
+
+Run from the root dir as: python -m bench.listener [--packets N] [--rate PPS]
+"""
+import argparse
+import multiprocessing
+import socket
+import time
+
+from tornado import ioloop
+
+from node import connection
+
+
+def send_packets(address, count, rate, size):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    padding = 'x' * max(size - 20, 0)
+    interval = 1.0 / rate if rate else 0
+    started = time.time()
+    for num in xrange(count):
+        if interval:
+            delay = started + num * interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        sock.sendto('%.6f %s' % (time.time(), padding), address)
+    sock.close()
+
+
+def measure(args, use_thread):
+    loop = ioloop.IOLoop()
+    loop.make_current()
+    listener = connection.PeerListener('127.0.0.1', 0, '1', None, use_thread=use_thread)
+    listener.listen()
+    address = listener.socket.getsockname()
+
+    latencies = []
+    first_last = []
+
+    def on_message(msg):
+        now = time.time()
+        latencies.append(now - float(msg[0].split(' ', 1)[0]))
+        if not first_last:
+            first_last.append(now)
+        first_last[1:] = [now]
+        if len(latencies) == args.packets:
+            loop.stop()
+
+    listener.event_emitter.on('on_message', on_message)
+
+    sender = multiprocessing.Process(
+        target=send_packets, args=(address, args.packets, args.rate, args.size)
+    )
+    sender.start()
+    # Datagrams dropped by a full receive buffer never arrive
+    loop.call_later(args.timeout, loop.stop)
+    loop.start()
+    sender.join()
+
+    kernel_drops = listener.get_stats()['kernel_drops']
+    listener.stop()
+    if use_thread:
+        # Wake the listening thread up so it sees it has to stop
+        listener.socket.sendto('heartbeat', address)
+    ioloop.IOLoop.clear_current()
+    loop.close()
+
+    latencies.sort()
+    received = len(latencies)
+    elapsed = first_last[1] - first_last[0] if len(first_last) == 2 else 0
+    return {
+        'received': received,
+        'kernel_drops': kernel_drops,
+        'packets_per_second': received / elapsed if elapsed else 0,
+        'mean_latency': sum(latencies) / received if received else 0,
+        'p99_latency': latencies[int(received * 0.99)] if received else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--packets', type=int, default=50000)
+    parser.add_argument('--rate', type=int, default=0,
+                        help='datagrams sent per second; as fast as possible if 0')
+    parser.add_argument('--size', type=int, default=512,
+                        help='datagram size in bytes')
+    parser.add_argument('--timeout', type=float, default=10,
+                        help='seconds to wait for the datagrams')
+    args = parser.parse_args()
+
+    for use_thread in (False, True):
+        stats = measure(args, use_thread)
+        print 'Listening %s' % ('thread' if use_thread else 'IOLoop')
+        print '  Received:     %d of %d (%s dropped by the kernel)' % (
+            stats['received'], args.packets, stats['kernel_drops']
+        )
+        print '  Throughput:   %.0f datagrams/s' % stats['packets_per_second']
+        print '  Latency:      %.3fms mean, %.3fms p99' % (
+            1000 * stats['mean_latency'], 1000 * stats['p99_latency']
+        )
+
+if __name__ == '__main__':
+    main()
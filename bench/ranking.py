@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Benchmark of XOR distance ranking across candidate set sizes.
+
+Compares the cmp-based sort the DHT used for shortlists with the pure
+Python and NumPy paths of node.ranking.DistanceRanker, for a full sort
+and for picking the K closest IDs. Times include building the ranker,
+as every shortlist sort does. The 'reused' rows rank K IDs for many
+targets with one ranker, as the routing table's find_close_nodes does
+between changes to the table.
+
+Run from the root dir as: python -m bench.ranking [--sizes 100,1000]
+"""
+import argparse
+import random
+import time
+
+from node import constants, ranking, routingtable
+
+
+def random_id(rng):
+    return '%040x' % rng.getrandbits(constants.BIT_NODE_ID_LEN)
+
+
+def cmp_sort(node_ids, target, count):
+    distance = routingtable.RoutingTable.distance
+    ranked = sorted(node_ids, lambda first, second: cmp(
+        distance(first, target), distance(second, target)))
+    return ranked[:count]
+
+
+def ranker_sort(use_numpy):
+    def rank(node_ids, target, count):
+        ranker = ranking.DistanceRanker(node_ids, use_numpy=use_numpy)
+        return ranker.closest(target, count)
+    rank.use_numpy = use_numpy
+    return rank
+
+
+def best_time(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        best = min(best, time.time() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='24,128,1000,10000,100000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--targets', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    methods = [('cmp sort', cmp_sort), ('python', ranker_sort(False))]
+    if ranking.numpy is not None:
+        methods.append(('numpy', ranker_sort(True)))
+    else:
+        print 'NumPy is not installed; only the pure Python path is measured.'
+
+    rng = random.Random(args.seed)
+    print '%-8s %-6s' % ('size', 'top') + ''.join('%14s' % name for name, _ in methods)
+    for size in [int(size) for size in args.sizes.split(',')]:
+        node_ids = [random_id(rng) for _ in range(size)]
+        target = random_id(rng)
+        for label, count in (('all', None), ('K', constants.K)):
+            timings = [
+                best_time(lambda: method(node_ids, target, count), args.repeat)
+                for _, method in methods
+            ]
+            print '%-8d %-6s' % (size, label) + ''.join('%12.2fms' % (t * 1000) for t in timings)
+
+        targets = [random_id(rng) for _ in range(args.targets)]
+        timings = []
+        for _, method in methods[1:]:
+            ranker = ranking.DistanceRanker(node_ids, use_numpy=method.use_numpy)
+            timings.append(best_time(
+                lambda: [ranker.closest(key, constants.K) for key in targets], args.repeat
+            ) / len(targets))
+        print '%-8d %-6s' % (size, 'reused') + '%14s' % '-' + ''.join(
+            '%12.2fms' % (t * 1000) for t in timings
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Head-to-head benchmark of the routing table implementations.
+
+Offers the same contacts to every implementation and times adding
+them, looking them up, finding close nodes and building the refresh
+list. Memory is the size of the table's own structures (buckets,
+contact lists, replacement caches), not counting the contacts.
+
+Run from the root dir as: python -m bench.routing_tables [--contacts N]
+"""
+import argparse
+import collections
+import logging
+import os
+import random
+import sys
+import time
+
+from node import constants, guid, routingtable
+
+IMPLEMENTATIONS = (
+    routingtable.OptimizedTreeRoutingTable,
+    routingtable.CachingTreeRoutingTable,
+)
+
+
+class FakeContact(guid.GUIDMixin):
+    def __init__(self, guid_):
+        super(FakeContact, self).__init__(guid_)
+        self.hostname = '127.0.0.1'
+        self.port = 12345
+
+
+def random_guid(rng):
+    return '%040x' % rng.getrandbits(constants.BIT_NODE_ID_LEN)
+
+
+def deep_size(obj, seen):
+    if id(obj) in seen or isinstance(obj, (FakeContact, logging.Logger)):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen)
+                    for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, collections.deque)):
+        size += sum(deep_size(item, seen) for item in obj)
+    if hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+    return size
+
+
+def timed(func, repeat):
+    start = time.time()
+    for _ in xrange(repeat):
+        func()
+    elapsed = time.time() - start
+    return repeat / elapsed if elapsed else float('inf')
+
+
+def run(table_class, contacts, lookups, args):
+    table = table_class(os.urandom(20).encode('hex'), 1)
+    results = collections.OrderedDict()
+
+    contact_iter = iter(contacts)
+    results['add/s'] = timed(lambda: table.add_contact(next(contact_iter)), len(contacts))
+
+    lookup_iter = iter(lookups)
+    results['get/s'] = timed(lambda: table.get_contact(next(lookup_iter)), len(lookups))
+
+    lookup_iter = iter(lookups)
+    results['find_close/s'] = timed(
+        lambda: table.find_close_nodes(next(lookup_iter), constants.K), args.finds
+    )
+    results['refresh/s'] = timed(lambda: table.get_refresh_list(0, True), args.refreshes)
+
+    results['buckets'] = len(table.buckets)
+    results['contacts'] = len(list(table.iter_contacts()))
+    results['table KiB'] = deep_size(table, set()) / 1024.0
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--contacts', type=int, default=100000)
+    parser.add_argument('--finds', type=int, default=20000)
+    parser.add_argument('--refreshes', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    contacts = [FakeContact(random_guid(rng)) for _ in xrange(args.contacts)]
+    # Half of the lookups are for known contacts, half for random IDs
+    lookups = [contact.guid for contact in rng.sample(contacts, args.contacts // 2)]
+    lookups += [random_guid(rng) for _ in xrange(args.contacts - len(lookups))]
+    rng.shuffle(lookups)
+    args.finds = min(args.finds, len(lookups))
+
+    results = [(impl.__name__, run(impl, contacts, lookups, args)) for impl in IMPLEMENTATIONS]
+
+    print '%-14s' % '' + ''.join('%26s' % name for name, _ in results)
+    for metric in results[0][1]:
+        print '%-14s' % metric + ''.join('%26.1f' % stats[metric] for _, stats in results)
+
+if __name__ == '__main__':
+    main()
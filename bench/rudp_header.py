@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Size and parse time of RUDP packets with JSON and binary headers.
+
+Splits a message into segments and acknowledgements the legacy way,
+hex encoded in JSON envelopes, and as raw fragments behind the binary
+header, the sender's identity attached to the first segment only.
+Reports the wire bytes sent per message byte and the time to parse a
+packet.
+
+Run from the root dir as: python -m bench.rudp_header [--message-size BYTES]
+"""
+import argparse
+import random
+import timeit
+
+from rudp import constants, helpers
+from rudp.packet import Packet
+
+IDENTITY = {
+    'guid': '8c8a5bd6d0a2a5ee3a9d6f6e1e09e8c2bf4e1ba2',
+    'pubkey': '04' + 'ab' * 64,
+    'hostname': '203.0.113.10',
+    'port': 12345,
+    'nick': 'Default',
+    'nat_type': 'Full Cone',
+}
+
+
+def make_packets(message, raw_fragments):
+    size = constants.UDP_SAFE_SEGMENT_SIZE
+    if raw_fragments:
+        chunks = helpers.split_fragments(message, size)
+    else:
+        data_encoded = message.encode('hex')
+        chunks = [
+            '42|%d|%s' % (len(data_encoded), data_encoded[i:i + size])
+            for i in xrange(0, len(data_encoded), size)
+        ]
+    return [
+        Packet(1000 + num, chunk, not num, num == len(chunks) - 1, message_id=42,
+               fragment=num, fragments=len(chunks), raw_fragment=raw_fragments)
+        for num, chunk in enumerate(chunks)
+    ]
+
+
+def make_acks(packets):
+    return [
+        Packet.create_acknowledgement_packet(packet.get_sequence_number(), IDENTITY['guid'],
+                                             IDENTITY['pubkey'], 7)
+        for packet in packets
+    ]
+
+
+def measure_parse(parse, buffers, repeat):
+    def run():
+        for data in buffers:
+            parse(data)
+    return min(timeit.repeat(run, number=1, repeat=repeat)) / len(buffers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--message-size', type=int, default=20000,
+                        help='size of the message in bytes')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(0)
+    message = ''.join(chr(random.getrandbits(8)) for _ in xrange(args.message_size))
+    json_packets = make_packets(message, False)
+    binary_packets = make_packets(message, True)
+
+    json_buffers = [packet.to_buffer(**IDENTITY) for packet in json_packets]
+    json_acks = [ack.to_buffer(**IDENTITY) for ack in make_acks(json_packets)]
+    binary_buffers = [
+        packet.to_binary(7, IDENTITY if not num else None) for num, packet in enumerate(binary_packets)
+    ]
+    binary_acks = [ack.to_binary(ack._session_id) for ack in make_acks(binary_packets)]
+
+    print 'A %d byte message:' % args.message_size
+    for name, buffers, ack_buffers, parse in (
+            ('JSON', json_buffers, json_acks, lambda data: Packet(data, packet_buffer=True)),
+            ('binary', binary_buffers, binary_acks, Packet.from_binary)):
+        wire_bytes = sum(len(data) for data in buffers + ack_buffers)
+        print '  %s: %d segments' % (name, len(buffers))
+        print '    Bytes per message byte:   %.3f (%d bytes per ack)' % (
+            float(wire_bytes) / len(message),
+            sum(len(data) for data in ack_buffers) / len(ack_buffers)
+        )
+        print '    Parse time:               %.2fus per segment, %.2fus per ack' % (
+            1e6 * measure_parse(parse, buffers, args.repeat),
+            1e6 * measure_parse(parse, ack_buffers, args.repeat)
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Per-message crypto cost of ECIES and ECDSA against peer sessions.
+
+Seals and opens a message the way CryptoPeerConnection.send and
+CryptoPeerListener used to for every message (ECDSA signature over the
+hex of the JSON, ECIES encryption to the recipient, each with a Cryptor
+built from the key), and in a session set up with one ECDH handshake
+(AES-256-CTR and HMAC-SHA256). Also reports the cost of the handshake.
+
+Run from the root dir as: python -m bench.session_crypto [--message-size BYTES]
+"""
+import argparse
+import hashlib
+import json
+import timeit
+
+from bitcoin import main as arithmetic
+
+from node.crypto_util import Cryptor
+from node.session import SessionManager
+
+
+def make_node(guid):
+    privkey_hex = hashlib.sha256(guid).hexdigest()
+    pubkey_hex = arithmetic.privkey_to_pubkey(privkey_hex)
+    return SessionManager(Cryptor(pubkey_hex=pubkey_hex, privkey_hex=privkey_hex), guid), pubkey_hex
+
+
+def handshake(alice, alice_pubkey, bob, bob_pubkey):
+    init = dict(alice.start_handshake('bob', bob_pubkey), senderGUID='alice', pubkey=alice_pubkey, guid='bob')
+    accept = dict(bob.accept_handshake(init), senderGUID='bob', pubkey=bob_pubkey, guid='alice')
+    alice.complete_handshake(accept)
+
+
+def legacy_seal(sender, recipient_pubkey, data):
+    sig_data = json.dumps(data).encode('hex')
+    signature = sender.sign(sig_data).encode('hex')
+    message = json.dumps({'sig': signature, 'data': sig_data}).encode('zlib')
+    return Cryptor(pubkey_hex=recipient_pubkey).encrypt(message)
+
+
+def legacy_open(recipient, ciphertext):
+    message = json.loads(recipient.decrypt(ciphertext).decode('zlib'))
+    data = json.loads(message['data'].decode('hex'))
+    assert Cryptor(pubkey_hex=data['pubkey']).verify(message['sig'].decode('hex'), message['data'])
+    return data
+
+
+def session_seal(sessions, data):
+    return sessions.seal('bob', json.dumps(data).encode('zlib'))
+
+
+def session_open(sessions, frame):
+    return json.loads(sessions.open(frame)[1].decode('zlib'))
+
+
+def measure(func, number, repeat):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--message-size', type=int, default=1000,
+                        help='size of the message payload in bytes')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    alice, alice_pubkey = make_node('alice')
+    bob, bob_pubkey = make_node('bob')
+    data = {
+        'type': 'store', 'key': 'ab' * 20, 'value': 'x' * args.message_size,
+        'senderGUID': 'alice', 'pubkey': alice_pubkey, 'guid': 'bob'
+    }
+
+    handshake_time = measure(lambda: handshake(alice, alice_pubkey, bob, bob_pubkey), 10, args.repeat)
+
+    ciphertext = legacy_seal(alice.cryptor, bob_pubkey, data)
+    legacy = (
+        measure(lambda: legacy_seal(alice.cryptor, bob_pubkey, data), args.messages, args.repeat),
+        measure(lambda: legacy_open(bob.cryptor, ciphertext), args.messages, args.repeat)
+    )
+
+    # Fresh frames, since opening one twice is a replay
+    frames = [session_seal(alice, data) for _ in xrange(args.messages * args.repeat)]
+    frames.reverse()
+    session = (
+        measure(lambda: session_seal(alice, data), args.messages, args.repeat),
+        measure(lambda: session_open(bob, frames.pop()), args.messages, args.repeat)
+    )
+
+    print 'A %d byte message:' % args.message_size
+    for name, (seal_time, open_time) in (('ECIES + ECDSA', legacy), ('session', session)):
+        print '  %-16s seal %8.1fus   open %8.1fus' % (name + ':', 1e6 * seal_time, 1e6 * open_time)
+    print '  Speedup:         seal %7.1fx   open %7.1fx' % (legacy[0] / session[0], legacy[1] / session[1])
+    print '  Handshake:       %.1fus, paid for by %.1f messages' % (
+        1e6 * handshake_time, handshake_time / (sum(legacy) - sum(session))
+    )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+from sqlite3 import dbapi2
+
+from db.migrations import migrations_util
+from node import constants
+
+
+def upgrade(db_path):
+    with dbapi2.connect(db_path) as con:
+        cur = con.cursor()
+
+        # Use PRAGMA key to encrypt / decrypt database.
+        cur.execute("PRAGMA key = '%s';" % constants.DB_PASSPHRASE)
+
+        try:
+            cur.execute("CREATE TABLE republish_schedule("
+                        "id INTEGER PRIMARY KEY "
+                        "AUTOINCREMENT, "
+                        "market_id INT, "
+                        "key TEXT, "
+                        "next_due INT)")
+            print 'Upgraded'
+        except dbapi2.Error as exc:
+            print 'Exception: %s' % exc
+
+
+def downgrade(db_path):
+    with dbapi2.connect(db_path) as con:
+        cur = con.cursor()
+
+        # Use PRAGMA key to encrypt / decrypt database.
+        cur.execute("PRAGMA key = '%s';" % constants.DB_PASSPHRASE)
+        cur.execute("DROP TABLE IF EXISTS republish_schedule;")
+
+        print 'Downgraded'
+
+
+def main():
+    parser = migrations_util.make_argument_parser(constants.DB_PATH)
+    args = parser.parse_args()
+    if args.action == "upgrade":
+        upgrade(args.path)
+    else:
+        downgrade(args.path)
+
+if __name__ == "__main__":
+    main()
@@ -320,6 +320,23 @@ class CachingKBucket(KBucket):
         super(CachingKBucket, self).remove_guid(guid)
         self.fill_from_cache()
 
+    def remove_cached_guid(self, guid):
+        """
+        Remove contact with given guid from the replacement cache.
+
+        Args:
+            guid: The guid of the contact that we want removed,
+                as a string or unicode.
+
+        Returns:
+            True if such a contact was cached, False otherwise.
+        """
+        for cached in self._replacement_cache:
+            if cached.guid == guid:
+                self._replacement_cache.remove(cached)
+                return True
+        return False
+
     def split_kbucket(self):
         """
         Split the high half of this KBucket's range and assign it
@@ -86,17 +86,27 @@ class RoutingTable(collections.Sequence):
             # If not, the KBucket can't be split. Put the new node in the
             # corresponding KBucket's replacement cache.
             if bucket.guid_in_range(self.own_guid):
-                new_kbucket = bucket.split_kbucket()
-                # The new KBucket should be responsible for the high
-                # half of the split range. Add it in the list of
-                # buckets right after the split KBucket, to ensure the
-                # ID space produced by concatenating successive KBuckets
-                # is monotonic.
-                self._buckets.insert(kbucket_index + 1, new_kbucket)
+                self.split_kbucket(kbucket_index)
                 self.add_contact(contact)
             else:
                 bucket.cache_contact(contact)
 
+    def split_kbucket(self, kbucket_index):
+        """
+        Split the KBucket at the given index in two KBuckets which
+        together cover the same range in the ID space.
+
+        Args:
+            kbucket_index: The index of the KBucket to split.
+        """
+        new_kbucket = self._buckets[kbucket_index].split_kbucket()
+        # The new KBucket should be responsible for the high
+        # half of the split range. Add it in the list of
+        # buckets right after the split KBucket, to ensure the
+        # ID space produced by concatenating successive KBuckets
+        # is monotonic.
+        self._buckets.insert(kbucket_index + 1, new_kbucket)
+
     def get_contact(self, guid):
         """
         Return the known node with the given guid, None if not found.
@@ -143,6 +153,32 @@ class RoutingTable(collections.Sequence):
         bucket = self._get_kbucket_by_guid(guid)
         bucket.remove_guid(guid)
 
+    def report_unreachable(self, guid):
+        """
+        Replace the unreachable contact with the given guid by the
+        freshest contact of its KBucket's replacement cache. If the
+        cache is empty the contact is kept; if the contact is itself
+        cached, it is dropped from the cache.
+
+        Args:
+            guid: The guid of the unreachable contact, as a string or
+                unicode, in hexadecimal.
+
+        Returns:
+            The contact that took its place or None.
+
+        Raises:
+            BadGUIDError: `guid` is outside the range of the RoutingTable.
+        """
+        bucket = self._get_kbucket_by_guid(guid)
+        if bucket.remove_cached_guid(guid):
+            return None
+        cached = bucket.get_cached_contacts()
+        if not cached or bucket.get_contact(guid) is None:
+            return None
+        bucket.remove_guid(guid)
+        return cached[-1]
+
     def find_close_nodes(self, guid, count=constants.K, sender_guid=None):
         """
         Find a number of known nodes closest to the node/value with the
@@ -0,0 +1,177 @@
+"""
+Compression of messages to peers.
+
+Messages used to be zlib compressed at the default level whatever
+their size or type. A CompressionPolicy leaves small messages as they
+are, picks the level by message type, and primes zlib with a
+dictionary of the field names and values that recur in OpenBazaar
+messages, which is where short messages gain the most. Python 2's zlib
+takes no preset dictionary, so it is fed through a compressor and a
+decompressor once and flushed; copies of these primed objects start
+every message with the dictionary in their window.
+
+Compressed messages start with a format byte. Legacy zlib streams
+never start with one (their first byte is 0x08 to 0x78), so both are
+read; peers before COMPRESSION_MIN_VERSION get plain zlib.
+
+Classes:
+    CompressionPolicy -- Compresses messages to peers and counts the cost.
+"""
+
+import time
+import zlib
+
+from node import constants
+from node.envelope import parse_version
+
+FORMAT_NONE = '\x00'
+FORMAT_DICTIONARY_1 = '\x01'
+
+# Never change a dictionary once released, as peers decompress with
+# the same bytes; add a new format instead. zlib finds the strings at
+# the end of the dictionary cheapest, so the most common come last.
+_DICTIONARY_1_TYPES = (
+    'query_listings', 'query_listing', 'query_page', 'page', 'order', 'inbox_message',
+    'hello', 'hello_response', 'goodbye', 'get_nat_type', 'nat_type', 'punch',
+    'storeBatch', 'store', 'session_init', 'session_accept', 'findNodeResponse', 'findNode',
+)
+_DICTIONARY_1_KEYS = (
+    'listings', 'contract', 'signature', 'peer_guid', 'session_id', 'ephemeral', 'nonce', 'session_sig',
+    'foundNodes', 'foundKey', 'findValue', 'findID', 'key', 'value', 'ttl', 'nat_type', 'hostname', 'port',
+    'senderNamecoin', 'avatar_url', 'senderNick', 'v', 'guid', 'senderGUID', 'pubkey', 'type',
+)
+DICTIONARY_1 = ''.join(
+    ['"Full Cone", "Restric NAT", "Restric Port NAT", "Symmetric NAT", "tcp://"'] +
+    ['"type"%s"%s"%s' % (colon, msg_type, comma)
+     for colon, comma in ((': ', ', '), (':', ',')) for msg_type in _DICTIONARY_1_TYPES] +
+    ['%s"%s"%s"' % (comma, key, colon)
+     for colon, comma in ((': ', ', '), (':', ',')) for key in _DICTIONARY_1_KEYS] +
+    ['"v": "0.5.1", "pubkey": "04']
+)
+
+_decompressor = None
+
+
+def _primed_compressor(level):
+    """ Return a compressor that has compressed DICTIONARY_1, and what
+    it output for it. """
+    # An 8 KB window and less memory than the default: the state is
+    # copied for every message, and most messages are far smaller
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 13, 4)
+    primer = compressor.compress(DICTIONARY_1) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return compressor, primer
+
+
+def supports_compression(version):
+    """ Return whether a peer with protocol version `version` reads the
+    compression formats. """
+    return parse_version(version) >= parse_version(constants.COMPRESSION_MIN_VERSION)
+
+
+def decompress(data):
+    """
+    Decompress a message in any format, legacy zlib included.
+
+    @raise zlib.error: The data is corrupt.
+    """
+    global _decompressor  # pylint: disable=global-statement
+
+    data_format = data[:1]
+    if data_format == FORMAT_NONE:
+        return data[1:]
+    if data_format == FORMAT_DICTIONARY_1:
+        if _decompressor is None:
+            # After the flush the stream is at a block boundary, so it
+            # continues with whatever compressed the dictionary
+            _decompressor = zlib.decompressobj()
+            _decompressor.decompress(_primed_compressor(zlib.Z_DEFAULT_COMPRESSION)[1])
+        decompressor = _decompressor.copy()
+        return decompressor.decompress(data[1:]) + decompressor.flush()
+    return zlib.decompress(data)
+
+
+class CompressionPolicy(object):
+    """
+    Compresses messages to peers: not at all below min_size, at the
+    level levels gives for the message type, or default_level.
+
+    Counts the bytes before and after, and the process CPU time spent.
+    """
+
+    def __init__(self, min_size=constants.COMPRESSION_MIN_SIZE,
+                 levels=constants.COMPRESSION_LEVELS,
+                 default_level=constants.COMPRESSION_DEFAULT_LEVEL):
+        self.min_size = min_size
+        self.levels = levels
+        self.default_level = default_level
+        self._compressors = {}
+
+        self.num_compressed = 0
+        self.num_uncompressed = 0
+        self.num_legacy = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_time = 0.0
+        self.decompress_time = 0.0
+
+    def compress(self, data, msg_type=None, version=None):
+        """
+        Compress a message to a peer.
+
+        @param data: The serialized message.
+        @type data: str
+
+        @param msg_type: The type of the message.
+        @type msg_type: str
+
+        @param version: The protocol version of the peer.
+        @type version: str
+
+        @return: The compressed message.
+        @rtype: str
+        """
+        started = time.clock()
+
+        if not supports_compression(version):
+            result = zlib.compress(data)
+            self.num_legacy += 1
+        elif len(data) < self.min_size:
+            result = FORMAT_NONE + data
+            self.num_uncompressed += 1
+        else:
+            level = self.levels.get(msg_type, self.default_level)
+            if level not in self._compressors:
+                self._compressors[level] = _primed_compressor(level)[0]
+            compressor = self._compressors[level].copy()
+            result = compressor.compress(data) + compressor.flush()
+            if len(result) < len(data):
+                result = FORMAT_DICTIONARY_1 + result
+                self.num_compressed += 1
+            else:
+                result = FORMAT_NONE + data
+                self.num_uncompressed += 1
+
+        self.compress_time += time.clock() - started
+        self.bytes_in += len(data)
+        self.bytes_out += len(result)
+        return result
+
+    def decompress(self, data):
+        """ Decompress a message from a peer (see decompress). """
+        started = time.clock()
+        try:
+            return decompress(data)
+        finally:
+            self.decompress_time += time.clock() - started
+
+    def get_stats(self):
+        return {
+            'compressed': self.num_compressed,
+            'uncompressed': self.num_uncompressed,
+            'legacy': self.num_legacy,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': float(self.bytes_out) / self.bytes_in if self.bytes_in else 0,
+            'compress_cpu_seconds': self.compress_time,
+            'decompress_cpu_seconds': self.decompress_time
+        }
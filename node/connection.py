@@ -1,15 +1,16 @@
+import errno
 import json
 import logging
 from pprint import pformat
 from pyee import EventEmitter
 from threading import Thread
-from node.constants import VERSION, MSG_PING_ID, PEERCONNECTION_NO_RESPONSE_DELAY_IN_SECONDS, \
+from node.constants import VERSION, PEERCONNECTION_NO_RESPONSE_DELAY_IN_SECONDS, \
     PEERCONNECTION_PINGER_TIMEOUT_IN_SECONDS, PEERCONNECTION_PING_TASK_INTERVAL_IN_SECONDS, \
     PEERCONNECTION_SENDING_OUT_DELAY_IN_SECONDS, PEERLISTENER_RECV_FROM_BUFFER_SIZE, \
-    MSG_PING_ID_SIZE, MSG_PONG_ID_SIZE, MSG_PONG_ID, MSG_SEND_RELAY_PING_ID_SIZE, MSG_SEND_RELAY_PING_ID, \
-    MSG_RELAY_PING_ID_SIZE, MSG_RELAY_PING_ID, \
-    MSG_SEND_RELAY_PONG_ID_SIZE, MSG_SEND_RELAY_PONG_ID, MSG_HEARTBEAT_ID_SIZE, MSG_HEARTBEAT_ID, \
-    MSG_RELAYTO_ID_SIZE, MSG_RELAYTO_ID, MSG_RELAY_ID_SIZE, MSG_RELAY_ID
+    PEERLISTENER_RECV_BUDGET, PEERLISTENER_USE_THREAD, PEERLISTENER_SO_RCVBUF, PEERLISTENER_SO_SNDBUF, \
+    PACKET_TYPE_PING, PACKET_TYPE_PONG, PACKET_TYPE_SEND_RELAY_PING, PACKET_TYPE_RELAY_PING, \
+    PACKET_TYPE_SEND_RELAY_PONG, PACKET_TYPE_RELAY_PONG, PACKET_TYPE_HEARTBEAT, PACKET_TYPE_RELAYTO, \
+    PACKET_TYPE_RELAY, PACKET_TYPE_PUNCH, PACKET_TYPE_DATA, PACKET_TYPE_RUDP, CRYPTO_POOL_WORKERS
 from node.network_util import count_incoming_packet, count_outgoing_packet
 import sys
 import time
@@ -17,13 +18,18 @@ import time
 import obelisk
 import socket
 
-from node import network_util
-from node.crypto_util import Cryptor
+from node import compression, envelope, network_util, packettype
+from node.cryptopool import CryptoPool
+from node.crypto_util import Cryptor, get_cryptor
 from node.guid import GUIDMixin
+from node.session import supports_sessions
 from rudp.connection import Connection
 from rudp.packetsender import PacketSender
 from tornado import ioloop
 
+# Not available on every platform
+_MSG_TRUNC = getattr(socket, 'MSG_TRUNC', 0)
+
 
 class PeerConnection(GUIDMixin, object):
     def __init__(self, guid, transport, hostname, port=12345, nickname="",
@@ -52,7 +58,20 @@ class PeerConnection(GUIDMixin, object):
         self.relaying = False
         self.reachable = False
         self.last_reached = time.time()
+        # When application data was last sent to or received from the peer
+        self.last_used = time.time()
         self.seed = False
+        self.closed = False
+        # Messages waiting for the first ping to be answered
+        self._send_queue = []
+        self._send_timeout = None
+        # The peer's RUDP session, learned from its binary packets
+        self.remote_session_id = None
+        # The peer's protocol version, learned from its messages
+        self.version = None
+        self._no_response_timeout = None
+        self._pinger_timeout = None
+        self.timers = transport.timers
 
         self.init_packetsender()
         self.setup_emitters()
@@ -69,6 +88,9 @@ class PeerConnection(GUIDMixin, object):
 
             def no_response():
 
+                if self.closed:
+                    return
+
                 hello_msg = {
                     'type': 'hello',
                     'pubkey': self.transport.pubkey,
@@ -104,21 +126,33 @@ class PeerConnection(GUIDMixin, object):
 
                 self.pinging = False
 
-            self.loop.call_later(PEERCONNECTION_NO_RESPONSE_DELAY_IN_SECONDS, no_response)
+            self._no_response_timeout = self.timers.call_later(
+                PEERCONNECTION_NO_RESPONSE_DELAY_IN_SECONDS, no_response
+            )
 
         self.seed = False
         self.punching = False
 
         # Recurring check for peer accessibility
         def pinger():
-            self.log.debug('Pinging: %s', self.guid)
+            if self.closed:
+                return
+            since_reached = time.time() - self.last_reached
 
-            if time.time() - self.last_reached <= PEERCONNECTION_PINGER_TIMEOUT_IN_SECONDS:
+            if since_reached <= PEERCONNECTION_PINGER_TIMEOUT_IN_SECONDS:
                 self.reachable = True
-                self.send_ping()
-                self.loop.call_later(PEERCONNECTION_PING_TASK_INTERVAL_IN_SECONDS, pinger)
+                # No keepalive needed if we just heard from the peer
+                if since_reached >= PEERCONNECTION_PING_TASK_INTERVAL_IN_SECONDS:
+                    self.log.debug('Pinging: %s', self.guid)
+                    self.send_ping()
+                self._pinger_timeout = self.timers.call_later(
+                    PEERCONNECTION_PING_TASK_INTERVAL_IN_SECONDS, pinger
+                )
             else:
+                self._pinger_timeout = None
                 self.reachable = False
+                if self.guid:
+                    self.transport.dht.report_unreachable(self.guid)
                 # if self.guid:
                     # self.log.error('Peer not responding. Removing.')
                     # TODO: Remove peers who are malicious/unresponsive
@@ -130,7 +164,9 @@ class PeerConnection(GUIDMixin, object):
 
                     # yappi.get_thread_stats().print_all()
 
-        self.loop.call_later(PEERCONNECTION_PING_TASK_INTERVAL_IN_SECONDS, pinger)
+        self._pinger_timeout = self.timers.call_later(
+            PEERCONNECTION_PING_TASK_INTERVAL_IN_SECONDS, pinger
+        )
 
     def setup_emitters(self):
         self.log.debug('Setting up emitters')
@@ -147,36 +183,48 @@ class PeerConnection(GUIDMixin, object):
             self.log.debug('Got the whole message: %s', msg.get('payload'))
             payload = msg.get('payload')
 
+            peer = (self.hostname, self.port)
+            if msg.get('binary'):
+                # Sent as raw fragments, so these are the message's bytes
+                self.transport.listener.on_raw_message(payload, peer)
+                return
+
+            # Legacy peers hex encode their messages
             if payload[:1] == '{':
                 try:
                     payload = json.loads(msg.get('payload'))
-                    self.transport.listener.on_raw_message(payload)
+                    self.transport.listener.on_raw_message(payload, peer)
                     return
                 except Exception as exc:
                     self.log.debug('Problem with serializing: %s', exc)
             else:
                 try:
                     payload = msg.get('payload').decode('hex')
-                    self.transport.listener.on_raw_message(payload)
+                    self.transport.listener.on_raw_message(payload, peer)
                 except Exception as exc:
                     self.log.debug('not yet %s', exc)
-                    self.transport.listener.on_raw_message(msg.get('payload'))
+                    self.transport.listener.on_raw_message(msg.get('payload'), peer)
 
     def send_ping(self):
-        self.sock.sendto(MSG_PING_ID, (self.hostname, self.port))
-        count_outgoing_packet(MSG_PING_ID)
+        ping = packettype.encode(PACKET_TYPE_PING)
+        self.sock.sendto(ping, (self.hostname, self.port))
+        count_outgoing_packet(ping)
         return True
 
     def send_relayed_ping(self):
         self.log.debug('Sending Relay Ping to: %s', self)
         for active_peer in self.transport.dht.active_peers:
             if active_peer.hostname == 'seed2.openbazaar.org' or active_peer.hostname == '205.186.156.31':
-                self.sock.sendto('send_relay_ping %s' % self.guid, (active_peer.hostname, active_peer.port))
-                count_outgoing_packet('send_relay_ping %s' % self.guid)
+                send_relay_ping = packettype.encode(PACKET_TYPE_SEND_RELAY_PING, self.guid)
+                self.sock.sendto(send_relay_ping, (active_peer.hostname, active_peer.port))
+                count_outgoing_packet(send_relay_ping)
         return True
 
     def init_packetsender(self):
 
+        if getattr(self, '_packet_sender', None) is not None:
+            self.transport.rudp_sessions.pop(self._packet_sender.session_id, None)
+
         self._packet_sender = PacketSender(
             self.sock,
             self.hostname,
@@ -188,6 +236,7 @@ class PeerConnection(GUIDMixin, object):
         )
 
         self._rudp_connection = Connection(self._packet_sender)
+        self.transport.rudp_sessions[self._packet_sender.session_id] = self
 
         self.packetsmasher = {}
         self.message_size = 0
@@ -203,6 +252,12 @@ class PeerConnection(GUIDMixin, object):
 
     def send_raw(self, serialized, callback=None, relay=False):
 
+        if self.closed:
+            self.log.debug('Not sending to closed connection %s', self.guid)
+            return
+
+        self.last_used = time.time()
+
         if self.transport.seed_mode or relay or self.seed:
             self.send_to_rudp(serialized)
             return
@@ -212,34 +267,79 @@ class PeerConnection(GUIDMixin, object):
         # self.transport.relay_message(serialized, self.guid)
         #     return
 
-        def sending_out():
+        self._send_queue.append(serialized)
+        if self._send_timeout is None:
+            self._flush_send_queue()
 
-            if not self.pinging:
-                if self.reachable:
-                    self.send_to_rudp(serialized)
-                    return
-                else:
-                    if self.nat_type == 'Restric NAT' and not self.punching and not self.relaying:
-                        self.log.debug('Found restricted NAT client')
-                        self.transport.start_mediation(self.guid)
-                    if self.nat_type == 'Full Cone' and not self.relaying:
-                        self.send_to_rudp(serialized)
-                        return
-                    else:
-                        self.log.debug('Relay through seed')
-                        # self.transport.relay_message(serialized, self.guid)
-                        self.send_to_rudp(serialized)
-                        return
+    def _flush_send_queue(self):
+        self._send_timeout = None
+        if self.closed:
+            return
 
+        if self.pinging:
+            # Everything queued until the next try goes out together
+            self._send_timeout = self.timers.call_later(
+                PEERCONNECTION_SENDING_OUT_DELAY_IN_SECONDS, self._flush_send_queue
+            )
+            return
 
-            self.loop.call_later(PEERCONNECTION_SENDING_OUT_DELAY_IN_SECONDS, sending_out)
+        queue, self._send_queue = self._send_queue, []
+        for serialized in queue:
+            self._send_out(serialized)
 
-        sending_out()
+    def _send_out(self, serialized):
+        if self.reachable:
+            self.send_to_rudp(serialized)
+        else:
+            if self.nat_type == 'Restric NAT' and not self.punching and not self.relaying:
+                self.log.debug('Found restricted NAT client')
+                self.transport.start_mediation(self.guid)
+            if self.nat_type == 'Full Cone' and not self.relaying:
+                self.send_to_rudp(serialized)
+            else:
+                self.log.debug('Relay through seed')
+                # self.transport.relay_message(serialized, self.guid)
+                self.send_to_rudp(serialized)
 
     def send_to_rudp(self, data):
+        if self.closed:
+            return
         self._rudp_connection.send(data)
 
+    def has_pending_messages(self):
+        """ True while a message to or from the peer is in flight. """
+        if self.closed:
+            return False
+        return bool(self._send_queue) or self._rudp_connection.has_pending()
+
+    def close(self):
+        """ Stop pinging the peer and release the RUDP connection.
+
+        Stale references may still be held by timers, copies of the
+        active peers or the transport; sending on or resetting a closed
+        connection does nothing.
+        """
+        self.log.debug('Closing connection to %s', self.guid)
+        self.closed = True
+        for timeout in (self._no_response_timeout, self._pinger_timeout, self._send_timeout):
+            if timeout is not None:
+                self.timers.remove_timeout(timeout)
+        self._no_response_timeout = None
+        self._pinger_timeout = None
+        self._send_timeout = None
+        self._send_queue = []
+
+        if self._packet_sender is not None:
+            self.transport.rudp_sessions.pop(self._packet_sender.session_id, None)
+        if self.remote_session_id is not None:
+            self.transport.remote_rudp_sessions.pop(self.remote_session_id, None)
+        self._rudp_connection = None
+        self._packet_sender = None
+        self.packetsmasher = {}
+
     def reset(self):
+        if self.closed:
+            return
         self.log.debug('Reset 2')
         self._rudp_connection._sender._sending = None
         self._rudp_connection._sender._push()
@@ -277,19 +377,22 @@ class CryptoPeerConnection(PeerConnection):
     def sign(self, data):
         return self.transport.cryptor.sign(data)
 
-    def encrypt(self, data):
+    def encrypt(self, data, msg_type=None):
         """
         Encrypt the data with self.pub and return the ciphertext.
         @raises Exception: The encryption failed.
         """
         assert self.pub, "Attempt to encrypt without key."
-        cryptor = Cryptor(pubkey_hex=self.pub)
+        cryptor = get_cryptor(self.pub)
 
-        # zlib the data
-        data = data.encode('zlib')
+        data = self.compress(data, msg_type)
 
         return cryptor.encrypt(data)
 
+    def compress(self, data, msg_type=None):
+        """ Compress the data in a format the peer reads. """
+        return self.transport.compression.compress(data, msg_type, self.version)
+
     def send(self, data, callback=None):
         assert self.guid, 'Uninitialized own guid'
 
@@ -306,19 +409,40 @@ class CryptoPeerConnection(PeerConnection):
         data['senderNamecoin'] = self.transport.namecoin_id
         data['v'] = VERSION
 
-        # Sign cleartext data
-        sig_data = json.dumps(data).encode('hex')
-        signature = self.sign(sig_data).encode('hex')
+        sessions = self.transport.sessions
+        # Rejects go out the old way, as the peer lost its session
+        if sessions is not None and data.get('type') != 'session_reject':
+            if data.get('type') not in ('session_init', 'session_accept') and \
+                    supports_sessions(self.version) and sessions.needs_handshake(self.guid):
+                # Goes out first, the old way
+                self.send(sessions.start_handshake(self.guid, self.pub))
+
+            frame = sessions.seal(self.guid, self.compress(json.dumps(data), data.get('type')))
+            if frame is not None:
+                self.log.datadump('Sending to peer in session: %s %s', self.hostname, pformat(data))
+                try:
+                    self.send_raw(frame, callback)
+                except Exception as exc:
+                    self.log.error("Was not able to send raw data: %s", exc)
+                return
 
         self.log.datadump('Sending to peer: %s %s', self.hostname,
                           pformat(data))
 
         try:
-            # Encrypt signature and data
-            data = self.encrypt(json.dumps({
-                'sig': signature,
-                'data': sig_data
-            }))
+            msg_type = data.get('type')
+            if envelope.supports_envelope(self.version):
+                data = self.encrypt(envelope.encode(data, self.sign), msg_type)
+            else:
+                # Sign cleartext data
+                sig_data = json.dumps(data).encode('hex')
+                signature = self.sign(sig_data).encode('hex')
+
+                # Encrypt signature and data
+                data = self.encrypt(json.dumps({
+                    'sig': signature,
+                    'data': sig_data
+                }), msg_type)
         except Exception as exc:
             self.log.error('Encryption failed. %s', exc)
             return
@@ -332,7 +456,19 @@ class CryptoPeerConnection(PeerConnection):
 
 
 class PeerListener(GUIDMixin):
-    def __init__(self, hostname, port, guid, data_cb):
+    """
+    Receives the UDP datagrams of all peers.
+
+    By default the socket is non-blocking and read on the IOLoop, which
+    calls back when datagrams are waiting; a thread blocking on the
+    socket can be used instead (use_thread).
+
+    Datagrams are read into one preallocated buffer of recv_buffer_size
+    bytes; rcvbuf and sndbuf set the kernel socket buffers.
+    """
+    def __init__(self, hostname, port, guid, data_cb, use_thread=PEERLISTENER_USE_THREAD,
+                 recv_buffer_size=PEERLISTENER_RECV_FROM_BUFFER_SIZE,
+                 rcvbuf=PEERLISTENER_SO_RCVBUF, sndbuf=PEERLISTENER_SO_SNDBUF):
         super(PeerListener, self).__init__(guid)
 
         self.hostname = hostname
@@ -342,11 +478,43 @@ class PeerListener(GUIDMixin):
         self.socket = None
         self._ok_msg = None
         self._connections = {}
+        self.use_thread = use_thread
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+
+        self._recv_buffer = bytearray(recv_buffer_size)
+        self._recv_view = memoryview(self._recv_buffer)
+        self.num_received = 0
+        self.num_truncated = 0
+
+        self._handlers = {
+            PACKET_TYPE_PING: self._on_ping,
+            PACKET_TYPE_PONG: self._on_pong,
+            PACKET_TYPE_SEND_RELAY_PING: self._on_send_relay_ping,
+            PACKET_TYPE_RELAY_PING: self._on_relay_ping,
+            PACKET_TYPE_SEND_RELAY_PONG: self._on_send_relay_pong,
+            PACKET_TYPE_RELAY_PONG: self._on_relay_pong,
+            PACKET_TYPE_HEARTBEAT: self._on_heartbeat,
+            PACKET_TYPE_RELAYTO: self._on_relayto,
+            PACKET_TYPE_RELAY: self._on_relay,
+            PACKET_TYPE_PUNCH: self._on_punch,
+            PACKET_TYPE_DATA: self._on_data,
+            PACKET_TYPE_RUDP: self._on_rudp,
+        }
 
         self.log = logging.getLogger(self.__class__.__name__)
 
         self.event_emitter = EventEmitter()
 
+        # Events are emitted on the IOLoop, not on the listening thread
+        self.loop = ioloop.IOLoop.current()
+
+    def _emit(self, event, *args):
+        if self.use_thread:
+            self.loop.add_callback(self.event_emitter.emit, event, *args)
+        else:
+            self.event_emitter.emit(event, *args)
+
     def set_ip_address(self, new_ip):
         self.hostname = new_ip
         if not self.is_listening:
@@ -363,6 +531,10 @@ class PeerListener(GUIDMixin):
     def listen(self):
         self.log.info("Listening at: %s:%s", self.hostname, self.port)
 
+        if self.socket is not None and not self.use_thread:
+            # Peer connections may still send through the old socket
+            self.loop.remove_handler(self.socket.fileno())
+
         if network_util.is_loopback_addr(self.hostname):
             # we are in local test mode so bind that socket on the
             # specified IP
@@ -380,46 +552,18 @@ class PeerListener(GUIDMixin):
 
         self.is_listening = True
 
+        if not self.use_thread:
+            self.socket.setblocking(0)
+            self.loop.add_handler(self.socket.fileno(), self._on_readable, ioloop.IOLoop.READ)
+            return
+
         def start_listening():
             while self.is_listening:
 
                 try:
-                    data, addr = self.socket.recvfrom(PEERLISTENER_RECV_FROM_BUFFER_SIZE)
-                    self.log.debug('Got data from %s:%d: %s', addr[0], addr[1], data[:50])
-                    count_incoming_packet(data)
-
-                    if data[:MSG_PING_ID_SIZE] == MSG_PING_ID:
-                        self.socket.sendto('pong', (addr[0], addr[1]))
-                        count_outgoing_packet('pong')
-                    elif data[:MSG_PONG_ID_SIZE] == MSG_PONG_ID:
-                        self.event_emitter.emit('on_pong_message', (data, addr))
-
-                    elif data[:MSG_SEND_RELAY_PING_ID_SIZE] == MSG_SEND_RELAY_PING_ID:
-                        self.event_emitter.emit('on_send_relay_ping', (data, addr))
-
-                    elif data[:MSG_RELAY_PING_ID_SIZE] == MSG_RELAY_PING_ID:
-                        data = data.split(' ')
-                        sender = self.guid
-                        recipient = data[1]
-                        self.socket.sendto('send_relay_pong %s %s' % (sender, recipient), (addr[0], addr[1]))
-                        count_outgoing_packet('send_relay_pong %s %s' % (sender, recipient))
-
-                    elif data[:MSG_SEND_RELAY_PONG_ID_SIZE] == MSG_SEND_RELAY_PONG_ID:
-                        self.event_emitter.emit('on_send_relay_pong', (data, addr))
-
-                    elif data[:MSG_HEARTBEAT_ID_SIZE] == MSG_HEARTBEAT_ID:
-                        self.log.debug('We just received a heartbeat.')
-
-                    elif data[:MSG_RELAYTO_ID_SIZE] == MSG_RELAYTO_ID:
-                        self.log.debug('Relay To Packet')
-                        self.event_emitter.emit('on_relayto', data)
-
-                    elif data[:MSG_RELAY_ID_SIZE] == MSG_RELAY_ID:
-                        self.log.debug('Relay Packet')
-                        self.event_emitter.emit('on_message', (data, addr))
-
-                    else:
-                        self.event_emitter.emit('on_message', (data, addr))
+                    datagram = self._recv()
+                    if datagram is not None:
+                        self._on_datagram(*datagram)
 
                 except socket.timeout as exc:
                     err = exc.args[0]
@@ -437,7 +581,125 @@ class PeerListener(GUIDMixin):
 
         Thread(target=start_listening).start()
 
-    def on_raw_message(self, serialized):
+    def _on_readable(self, fd, events):
+        """ Read the waiting datagrams, up to PEERLISTENER_RECV_BUDGET
+        of them; the IOLoop calls again if there are more. """
+        for _ in xrange(PEERLISTENER_RECV_BUDGET):
+            try:
+                datagram = self._recv()
+            except socket.error as exc:
+                if exc.args[0] not in (errno.EWOULDBLOCK, errno.EAGAIN):
+                    self.log.error('Could not read from socket: %s', exc)
+                return
+            if datagram is None:
+                continue
+
+            data, addr = datagram
+            try:
+                self._on_datagram(data, addr)
+            except Exception:
+                self.log.exception('Error handling datagram from %s:%d', addr[0], addr[1])
+
+    def _recv(self):
+        """
+        Read one datagram into the receive buffer.
+
+        @return: (data, addr), or None if the datagram did not fit.
+        """
+        # With MSG_TRUNC, Linux returns the full size of a datagram
+        # that was cut short
+        nbytes, addr = self.socket.recvfrom_into(self._recv_buffer, 0, _MSG_TRUNC)
+        if nbytes > len(self._recv_buffer):
+            self.num_truncated += 1
+            self.log.warning('Dropped %d byte datagram from %s:%d', nbytes, addr[0], addr[1])
+            return None
+        self.num_received += 1
+        return self._recv_view[:nbytes].tobytes(), addr
+
+    def _on_datagram(self, data, addr):
+        self.log.debug('Got data from %s:%d: %s', addr[0], addr[1], data[:50])
+        count_incoming_packet(data)
+
+        packet_type, payload = packettype.classify(data)
+        self._handlers[packet_type](data, payload, addr)
+
+    def _on_ping(self, data, payload, addr):
+        # Answer in the format we were asked in
+        pong = packettype.encode(PACKET_TYPE_PONG, header=packettype.has_header(data))
+        self.socket.sendto(pong, (addr[0], addr[1]))
+        count_outgoing_packet(pong)
+
+    def _on_pong(self, data, payload, addr):
+        self._emit('on_pong_message', (payload, addr))
+
+    def _on_send_relay_ping(self, data, payload, addr):
+        self._emit('on_send_relay_ping', (payload, addr))
+
+    def _on_relay_ping(self, data, payload, addr):
+        sender = self.guid
+        recipient = payload
+        send_relay_pong = packettype.encode(
+            PACKET_TYPE_SEND_RELAY_PONG, '%s %s' % (sender, recipient),
+            header=packettype.has_header(data)
+        )
+        self.socket.sendto(send_relay_pong, (addr[0], addr[1]))
+        count_outgoing_packet(send_relay_pong)
+
+    def _on_send_relay_pong(self, data, payload, addr):
+        self._emit('on_send_relay_pong', (payload, addr))
+
+    def _on_relay_pong(self, data, payload, addr):
+        self._emit('on_relay_pong_message', (payload, addr))
+
+    def _on_heartbeat(self, data, payload, addr):
+        self.log.debug('We just received a heartbeat.')
+
+    def _on_relayto(self, data, payload, addr):
+        self.log.debug('Relay To Packet')
+        self._emit('on_relayto', payload)
+
+    def _on_relay(self, data, payload, addr):
+        self.log.debug('Relay Packet')
+        self._emit('on_relay_message', (payload, addr))
+
+    def _on_punch(self, data, payload, addr):
+        self._emit('on_punch', (payload, addr))
+
+    def _on_data(self, data, payload, addr):
+        self._emit('on_message', (payload, addr))
+
+    def _on_rudp(self, data, payload, addr):
+        self._emit('on_rudp_packet', (payload, addr))
+
+    def stop(self):
+        """ Stop reading from the socket. """
+        if not self.is_listening:
+            return
+        self.is_listening = False
+        if not self.use_thread:
+            self.loop.remove_handler(self.socket.fileno())
+
+    def get_stats(self):
+        stats = {
+            'received': self.num_received,
+            'truncated': self.num_truncated,
+            'recv_buffer_size': len(self._recv_buffer),
+            'kernel_drops': None,
+            'rcvbuf': None,
+        }
+        if self.socket is not None:
+            stats['kernel_drops'] = network_util.get_udp_drops(self.socket)
+            stats['rcvbuf'] = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        return stats
+
+    def log_stats(self):
+        stats = self.get_stats()
+        self.log.info('Datagrams received: %d', stats['received'])
+        self.log.info('Datagrams truncated: %d', stats['truncated'])
+        self.log.info('Datagrams dropped by the kernel: %s', stats['kernel_drops'])
+        self.log.info('Socket receive buffer: %s bytes', stats['rcvbuf'])
+
+    def on_raw_message(self, serialized, peer=None):
         self.log.info("connected %d", len(serialized))
         try:
             msg = json.loads(serialized[0])
@@ -450,23 +712,72 @@ class PeerListener(GUIDMixin):
     def _prepare_datagram_socket(self, family=socket.AF_INET):
         self.socket = socket.socket(family, socket.SOCK_DGRAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        # self.socket.setblocking(0)
+        for option, size in ((socket.SO_RCVBUF, self.rcvbuf), (socket.SO_SNDBUF, self.sndbuf)):
+            if not size:
+                continue
+            try:
+                self.socket.setsockopt(socket.SOL_SOCKET, option, size)
+            except socket.error as exc:
+                self.log.warning('Could not set socket buffer size to %d: %s', size, exc)
         self.socket.bind((self.hostname, self.port))
 
 
+# The node key in the worker processes of a CryptoPeerListener's crypto pool
+_worker_cryptor = None
+
+
+def _init_crypto_worker(pubkey, secret):
+    global _worker_cryptor  # pylint: disable=global-statement
+    _worker_cryptor = Cryptor(pubkey_hex=pubkey, privkey_hex=secret)
+
+
+def _open_in_crypto_worker(encrypted_message):
+    return CryptoPeerListener.open_encrypted_message(_worker_cryptor, encrypted_message)
+
+
 class CryptoPeerListener(PeerListener):
-    def __init__(self, hostname, port, pubkey, secret, guid, data_cb):
+    """
+    Opens the messages of peers and passes them to data_cb.
+
+    With crypto_workers, legacy (ECIES) messages are decrypted and
+    verified on that many worker processes (cryptopool.CryptoPool).
+    """
+    def __init__(self, hostname, port, pubkey, secret, guid, data_cb, sessions=None,
+                 crypto_workers=CRYPTO_POOL_WORKERS, compression_policy=None, reject_cb=None, **kwargs):
 
-        super(CryptoPeerListener, self).__init__(hostname, port, guid, data_cb)
+        super(CryptoPeerListener, self).__init__(hostname, port, guid, data_cb, **kwargs)
 
         self.pubkey = pubkey
         self.secret = secret
+        # Opens messages sealed in a peer session (session.SessionManager)
+        self.sessions = sessions
+        # Sends a 'session_reject' to the peer at an address
+        self._reject_cb = reject_cb
+        # Counts the cost of decompressing (compression.CompressionPolicy)
+        self.compression = compression_policy
 
         # FIXME: refactor this mess
         # this was copied as is from CryptoTransportLayer
         # soon all crypto code will be refactored and this will be removed
         self.cryptor = Cryptor(pubkey_hex=self.pubkey, privkey_hex=self.secret)
 
+        # Created before listen() binds the socket, so that the forked
+        # workers do not inherit it
+        self.crypto_pool = None
+        if crypto_workers:
+            self.crypto_pool = CryptoPool(
+                _open_in_crypto_worker, self._deliver, crypto_workers,
+                initializer=_init_crypto_worker, initargs=(self.pubkey, self.secret)
+            )
+
+    def stop(self):
+        """ Stop reading from the socket and the crypto pool workers;
+        later messages are opened inline. """
+        super(CryptoPeerListener, self).stop()
+        if self.crypto_pool is not None:
+            self.crypto_pool.close()
+            self.crypto_pool = None
+
     def is_plaintext_message(self, message):
         """
         Return whether message is a plaintext handshake
@@ -485,25 +796,54 @@ class CryptoPeerListener(PeerListener):
 
         return 'type' in message
 
-    def on_raw_message(self, serialized):
+    def on_raw_message(self, serialized, peer=None):
         """
         Handles receipt of encrypted/plaintext message
         and passes to appropriate callback.
 
         :param serialized:
+        :param peer: address of the sending peer; with a crypto pool,
+                     its messages are passed on in the order received
         :return:
         """
 
-        if not self.is_plaintext_message(serialized):
+        if self.sessions is not None and self.sessions.is_session_frame(serialized):
+            message = self.process_session_message(serialized)
+            if message is None:
+                return
+        elif self.sessions is not None and self.sessions.is_unknown_frame(serialized):
+            self.reject_session_frame(serialized, peer)
+            return
+        elif not self.is_plaintext_message(serialized):
+            if self.crypto_pool is not None:
+                self.crypto_pool.submit(peer, serialized)
+                return
             message = self.process_encrypted_message(serialized)
         else:
             message = json.loads(serialized)
 
             # If relayed then unwrap and process again
             if message['type'] == 'relayed_msg':
-                self.on_raw_message(message['data'].decode('hex'))
+                self.on_raw_message(message['data'].decode('hex'), peer)
                 return
 
+        if self.crypto_pool is not None:
+            # After the messages of the peer still being opened
+            self.crypto_pool.put(peer, message)
+        else:
+            self._deliver(message)
+
+    def reject_session_frame(self, frame, peer):
+        """ Have the peer drop the session of a frame we cannot open. """
+        self.log.debug('Message from %s in an unknown session', peer)
+        reject = self.sessions.reject_unknown(frame)
+        if reject is not None and self._reject_cb:
+            self._reject_cb(peer, reject)
+
+    def _deliver(self, message):
+        if not message:
+            return
+
         self.log.debugv('Received message of type "%s"',
                         message.get('type', 'unknown'))
 
@@ -513,29 +853,34 @@ class CryptoPeerListener(PeerListener):
         else:
             self.log.debugv('Callbacks not ready yet')
 
+    def process_session_message(self, frame):
+        """
+        Open a message sealed in a peer session.
+
+        @return: The message, or None if it was rejected.
+        @rtype: dict
+        """
+        try:
+            session, data = self.sessions.open(frame)
+            message = json.loads(self.decompress(data))
+        except Exception as exc:
+            self.log.error('Cannot open session message: %s', exc)
+            return None
+
+        # The session vouches for the sender, not for what it claims
+        if message.get('senderGUID') != session.guid or message.get('pubkey') != session.pubkey:
+            self.log.error('Session message from %s claims to be from %s',
+                           session.guid, message.get('senderGUID'))
+            return None
+
+        return message
+
     def process_encrypted_message(self, encrypted_message):
         if isinstance(encrypted_message, dict):
             message = encrypted_message
         else:
             try:
-
-                message = self.cryptor.decrypt(encrypted_message)
-
-                # un-zlib data
-                message = message.decode('zlib')
-
-                message = json.loads(message)
-
-                signature = message['sig'].decode('hex')
-                signed_data = message['data']
-
-                self.log.debug('Decrypted Data: %s', message)
-
-                if CryptoPeerListener.validate_signature(signature, signed_data):
-                    message = signed_data.decode('hex')
-                    message = json.loads(message)
-                else:
-                    return
+                message = self.open_encrypted_message(self.cryptor, encrypted_message, self.decompress)
             except RuntimeError as exc:
                 self.log.error('Could not decrypt message properly %s', exc)
                 return False
@@ -545,10 +890,49 @@ class CryptoPeerListener(PeerListener):
 
         return message
 
+    def decompress(self, data):
+        if self.compression is not None:
+            return self.compression.decompress(data)
+        return compression.decompress(data)
+
+    @staticmethod
+    def open_encrypted_message(cryptor, encrypted_message, decompress=compression.decompress):
+        """
+        Decrypt, inflate and verify a message sent with ECIES, either as
+        an envelope or the legacy way.
+
+        @param cryptor: Holds the private key of the node.
+        @type cryptor: crypto_util.Cryptor
+
+        @param decompress: Inflates the decrypted message.
+        @type decompress: function
+
+        @return: The message, or None if its signature is invalid.
+        @rtype: dict
+
+        @raise RuntimeError: The message cannot be decrypted.
+        @raise Exception: The message is malformed.
+        """
+        message = cryptor.decrypt(encrypted_message)
+
+        message = decompress(message)
+
+        if envelope.is_envelope(message):
+            return envelope.decode(message)
+
+        message = json.loads(message)
+
+        signature = message['sig'].decode('hex')
+        signed_data = message['data']
+
+        if CryptoPeerListener.validate_signature(signature, signed_data):
+            return json.loads(signed_data.decode('hex'))
+        return None
+
     @staticmethod
     def validate_signature(signature, data):
         data_json = json.loads(data.decode('hex'))
-        sig_cryptor = Cryptor(pubkey_hex=data_json['pubkey'])
+        sig_cryptor = get_cryptor(data_json['pubkey'])
 
         if sig_cryptor.verify(signature, data):
             return True
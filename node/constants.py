@@ -1,6 +1,14 @@
 # ####### IMPLEMENTATION-SPECIFIC CONSTANTS ###########
 # OpenBazaar Version Number
-VERSION = "0.5.0"
+VERSION = "0.5.1"
+
+# Peers send signed binary envelopes (node.envelope) instead of
+# hex-in-JSON messages to peers of this version and newer
+ENVELOPE_MIN_VERSION = "0.5.1"
+
+# Stores for the same node are sent together in one storeBatch message
+# to peers of this version and newer
+STORE_BATCH_MIN_VERSION = "0.5.1"
 
 # Max size of a single UDP datagram.
 # Any larger message will be spread accross several UDP packets.
@@ -47,7 +55,7 @@ ITERATIVE_LOOKUP_DELAY = RPC_TIMEOUT / 2
 
 # If a KBucket has not been used for this amount of time, refresh it.
 # [seconds]
-REFRESH_TIMEOUT = 60 * 60 * 1000  # 1 hour
+REFRESH_TIMEOUT = 60 * 60  # 1 hour
 
 # The interval in which the node should check whether any buckets
 # need refreshing or whether any data needs to be republished
@@ -59,28 +67,108 @@ CHECK_REFRESH_INTERVAL = REFRESH_TIMEOUT / 5
 # [seconds]
 REPLICATE_INTERVAL = REFRESH_TIMEOUT
 
+# Bucket refresh lookups are started one every DHT_REFRESH_SPACING,
+# with at most DHT_REFRESH_MAX_CONCURRENT of them running at once.
+# [seconds]
+DHT_REFRESH_SPACING_IN_SECONDS = 2
+DHT_REFRESH_MAX_CONCURRENT = ALPHA
+
+# Republish scheduler: every key is republished once per interval,
+# give or take REPUBLISH_JITTER of it, and no more than
+# REPUBLISH_STORES_PER_SECOND store RPCs are sent on average.
+# [seconds]
+REPUBLISH_INTERVAL_IN_SECONDS = 60 * 60  # 1 hour
+REPUBLISH_JITTER = 0.1
+REPUBLISH_STORES_PER_SECOND = 20
+REPUBLISH_TICK_IN_SECONDS = 1
+
 # The time it takes for data to expire in the network;
 # the original publisher of the data  will also republish
 # the data at this time if it is still valid
 # [seconds]
 DATE_EXPIRE_TIMEOUT = 86400  # 24 hours
 
+# Time after which an unfinished iterative lookup is abandoned and its
+# callback is fired with whatever partial results it has gathered.
+# [seconds]
+DHT_SEARCH_TIMEOUT_IN_SECONDS = 15
+
+# Time after which a lookup stops waiting for the answer to one of its
+# findNode/findValue probes and moves on to the next closest nodes.
+# [seconds]
+DHT_PROBE_TIMEOUT_IN_SECONDS = 2
+
+# Interval at which live searches are checked for expired deadlines
+# and unanswered probes.
+# [seconds]
+DHT_SEARCH_SWEEP_INTERVAL_IN_SECONDS = 1
+
+# Upper bounds of the buckets used for the search age histogram.
+# [seconds]
+DHT_SEARCH_AGE_BUCKETS_IN_SECONDS = (1, 5, 15, 60)
+
+# Number of keys republished, or buckets refreshed, per IOLoop iteration.
+DHT_MAINTENANCE_BATCH_SIZE = 10
+
+# How long a value found by a findValue lookup is served from memory
+# before the network is queried again.
+# [seconds]
+DHT_VALUE_CACHE_TTL_IN_SECONDS = 10
+
+# Maximum number of findValue results kept in memory.
+DHT_VALUE_CACHE_SIZE = 256
+
+# Lower bound for the expiry of values cached along a lookup path;
+# the expiry halves for every node closer to the key than the cache.
+# [seconds]
+PATH_CACHE_MIN_TTL_IN_SECONDS = 60
+
+# Interval at which the routing table is saved for a warm start.
+# [seconds]
+ROUTING_SNAPSHOT_INTERVAL_IN_SECONDS = 5 * 60
+
 # ####### CONNECTION/NETWORKING RELATED CONSTANTS #######
 PEERCONNECTION_NO_RESPONSE_DELAY_IN_SECONDS = 10
 PEERCONNECTION_SENDING_OUT_DELAY_IN_SECONDS = 5
 PEERCONNECTION_PINGER_TIMEOUT_IN_SECONDS = 30
 PEERCONNECTION_PING_TASK_INTERVAL_IN_SECONDS = 5
 
-PEERLISTENER_RECV_FROM_BUFFER_SIZE = 2048
+# Most connections (CryptoPeerConnections) kept open at once; the least
+# recently used idle ones are closed first. Seeds are not counted.
+PEER_TABLE_MAX_SIZE = 128
+
+# Connections unused for this long are closed
+PEERCONNECTION_IDLE_TIMEOUT_IN_SECONDS = 10 * 60
+
+# How often idle connections are looked for
+PEER_EVICTION_INTERVAL_IN_SECONDS = 60
 
-MSG_PING_ID_SIZE = 4
-MSG_PONG_ID_SIZE = 4
-MSG_RELAY_ID_SIZE = 6
-MSG_RELAYTO_ID_SIZE = 7
-MSG_HEARTBEAT_ID_SIZE = 9
-MSG_RELAY_PING_ID_SIZE = 10
-MSG_SEND_RELAY_PING_ID_SIZE = 15
-MSG_SEND_RELAY_PONG_ID_SIZE = 15
+# Granularity and size of the timing wheel running the peer connection
+# timers: 3 wheels of 64 slots cover 0.5 * 64 ** 3 seconds (36 hours)
+TIMING_WHEEL_TICK_IN_SECONDS = 0.5
+TIMING_WHEEL_SLOTS = 64
+TIMING_WHEEL_LEVELS = 3
+
+# How many times a mediator tries to introduce two peers it does not
+# both know yet, PEERCONNECTION_SENDING_OUT_DELAY_IN_SECONDS apart
+MEDIATE_MAX_ATTEMPTS = 12
+
+# Interval between UDP hole punching packets
+PUNCH_INTERVAL_IN_SECONDS = 0.5
+
+# Fits the largest UDP datagram, so none is ever cut short
+PEERLISTENER_RECV_FROM_BUFFER_SIZE = 65536
+
+# Kernel socket buffers of the listener, in bytes (0 keeps the system
+# default). The kernel may cap them; see net.core.rmem_max/wmem_max.
+PEERLISTENER_SO_RCVBUF = 4 * 1024 * 1024
+PEERLISTENER_SO_SNDBUF = 1024 * 1024
+
+# Most datagrams read per readiness event before yielding to the IOLoop
+PEERLISTENER_RECV_BUDGET = 64
+
+# Read the socket on a dedicated thread instead of the IOLoop
+PEERLISTENER_USE_THREAD = False
 
 MSG_PING_ID = 'ping'
 MSG_PONG_ID = 'pong'
@@ -88,7 +176,71 @@ MSG_SEND_RELAY_PING_ID = 'send_relay_ping'
 MSG_RELAY_PING_ID = 'relay_ping'
 MSG_SEND_RELAY_PONG_ID = 'send_relay_pong'
 MSG_HEARTBEAT_ID = 'heartbeat'
+MSG_RELAY_PONG_ID = 'relay_pong'
 MSG_RELAYTO_ID = 'relayto'
-MSG_RELAY_ID = 'relay '  # Trailing space is intentional.
+MSG_RELAY_ID = 'relay'
+MSG_PUNCH_ID = 'punch'
+
+# One-byte type headers of control and data datagrams. Legacy datagrams
+# start with a text prefix or '{', so control bytes never clash with them.
+PACKET_TYPE_PING = '\x01'
+PACKET_TYPE_PONG = '\x02'
+PACKET_TYPE_SEND_RELAY_PING = '\x03'
+PACKET_TYPE_RELAY_PING = '\x04'
+PACKET_TYPE_SEND_RELAY_PONG = '\x05'
+PACKET_TYPE_RELAY_PONG = '\x06'
+PACKET_TYPE_HEARTBEAT = '\x07'
+PACKET_TYPE_RELAYTO = '\x08'
+PACKET_TYPE_RELAY = '\x09'
+PACKET_TYPE_PUNCH = '\x0a'
+PACKET_TYPE_DATA = '\x0b'
+# RUDP packet with a binary header (rudp.packet.Packet.to_binary)
+PACKET_TYPE_RUDP = '\x0c'
+
+# Send datagrams with a type header instead of a legacy text prefix.
+# Both are always accepted; switch on once most peers understand headers.
+PACKET_TYPE_HEADERS = False
+
+# Most public-key Cryptors kept ready for encrypting to and verifying
+# peers (crypto_util.get_cryptor); the least recently used go first
+CRYPTOR_CACHE_SIZE = 1024
+
+# Worker processes that decrypt and verify inbound messages
+# (cryptopool.CryptoPool); with 0 they are opened inline on the IOLoop
+CRYPTO_POOL_WORKERS = 0
+# Messages handed to a worker at once
+CRYPTO_POOL_BATCH_SIZE = 16
+# Messages queued or being opened before the IOLoop waits for the workers
+CRYPTO_POOL_MAX_PENDING = 1024
+
+# Compression of messages to peers (compression.CompressionPolicy).
+# Peers from this protocol version on read the compression formats
+COMPRESSION_MIN_VERSION = "0.5.1"
+# Smaller messages are sent uncompressed
+# [bytes]
+COMPRESSION_MIN_SIZE = 128
+# zlib level by message type: bulk data is compressed harder
+COMPRESSION_LEVELS = {
+    'store': 6,
+    'storeBatch': 6,
+    'page': 6,
+    'order': 6,
+    'inbox_message': 6,
+}
+COMPRESSION_DEFAULT_LEVEL = 1
+
+# Peer sessions: after one signed ECDH handshake, messages to a peer are
+# encrypted with symmetric keys instead of ECIES and ECDSA (node.session).
+# Handshakes are only started with peers of this version and newer
+SESSION_MIN_VERSION = "0.5.1"
+# Start a new session after this many seconds or messages sent
+SESSION_REKEY_INTERVAL_IN_SECONDS = 60 * 60
+SESSION_REKEY_MESSAGES = 100000
+# Replaced sessions still open messages in flight for this long
+SESSION_GRACE_PERIOD_IN_SECONDS = 5 * 60
+# Wait this long for an answer before retrying a handshake
+SESSION_HANDSHAKE_TIMEOUT_IN_SECONDS = 5 * 60
+# Out-of-order messages accepted behind the newest one
+SESSION_REPLAY_WINDOW = 64
 
 CLOSE_NODE_TIMELIMIT_IN_SECONDS = 5*60
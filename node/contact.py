@@ -0,0 +1,53 @@
+"""
+Contacts the DHT knows about but is not necessarily connected to.
+
+A node hears about many more peers, through findNode responses, than it
+ever exchanges application data with. Routing tables hold ContactRecords
+for them; a CryptoPeerConnection is only created when a message has to
+be sent (see DHT.get_peer).
+"""
+
+from node.guid import GUIDMixin
+
+
+class ContactRecord(GUIDMixin):
+    """
+    The address and identity of a node, and when it was last heard from.
+    """
+    __slots__ = (
+        'hostname', 'port', 'pub', 'nickname', 'nat_type', 'avatar_url', 'last_reached'
+    )
+
+    def __init__(self, guid, hostname, port, pub=None, nickname=None,
+                 nat_type=None, avatar_url=None, last_reached=0):
+        """
+        @param last_reached: When the node last answered us, in seconds
+                             since the epoch.
+        @type last_reached: int or float
+        """
+        GUIDMixin.__init__(self, guid)
+        self.hostname = hostname
+        self.port = port
+        self.pub = pub
+        self.nickname = nickname
+        self.nat_type = nat_type
+        self.avatar_url = avatar_url
+        self.last_reached = last_reached
+
+    def update(self, hostname=None, port=None, pub=None, nickname=None,
+               nat_type=None, avatar_url=None):
+        """
+        Overwrite the fields that are given; None leaves a field as is.
+        """
+        if hostname:
+            self.hostname = hostname
+        if port:
+            self.port = port
+        if pub:
+            self.pub = pub
+        if nickname:
+            self.nickname = nickname
+        if nat_type:
+            self.nat_type = nat_type
+        if avatar_url:
+            self.avatar_url = avatar_url
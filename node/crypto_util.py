@@ -1,6 +1,10 @@
+from collections import OrderedDict
+
 import pyelliptic as ec
 from bitcoin import main as arithmetic
 
+from node import constants
+
 BTC_CURVE = 'secp256k1'
 BTC_CURVE_OPENSSL_ID_HEX = '{:0>4x}'.format(ec.OpenSSL.get_curve(BTC_CURVE))
 BTC_EC_POINT_LENGTH = 32
@@ -178,3 +182,64 @@ class Cryptor(object):
         @raise Exception: Verification terminated abnormally.
         """
         return self._ec.verify(sig, data)
+
+
+class CryptorCache(object):
+    """
+    Size-bounded memory of public-key Cryptors, so that messages to and
+    from the same peers do not convert the key and set up the OpenSSL
+    key objects again each time.
+    """
+
+    def __init__(self, max_size=constants.CRYPTOR_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # pubkey hex -> Cryptor
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, pubkey_hex):
+        """
+        Return a Cryptor for a public key, creating it if absent.
+
+        @param pubkey_hex: Uncompressed BTC public key in hex format.
+        @type pubkey_hex: str
+
+        @return: The Cryptor, without private key.
+        @rtype: Cryptor
+        """
+        cryptor = self.entries.pop(pubkey_hex, None)
+        if cryptor is None:
+            self.num_misses += 1
+            cryptor = Cryptor(pubkey_hex=pubkey_hex)
+            while len(self.entries) >= self.max_size:
+                self.entries.popitem(last=False)
+        else:
+            self.num_hits += 1
+        self.entries[pubkey_hex] = cryptor
+        return cryptor
+
+    def get_stats(self):
+        return {
+            'size': len(self.entries),
+            'max': self.max_size,
+            'hits': self.num_hits,
+            'misses': self.num_misses
+        }
+
+
+cryptor_cache = CryptorCache()
+
+
+def get_cryptor(pubkey_hex):
+    """
+    Return a shared Cryptor for a public key from cryptor_cache.
+
+    @param pubkey_hex: Uncompressed BTC public key in hex format.
+    @type pubkey_hex: str
+
+    @rtype: Cryptor
+    """
+    return cryptor_cache.get(pubkey_hex)
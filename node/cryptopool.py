@@ -0,0 +1,247 @@
+"""
+Opening of inbound messages on worker processes.
+
+Decrypting, inflating and verifying legacy (ECIES and ECDSA) messages
+inline on the IOLoop limits a node to the message rate of one core. A
+CryptoPool queues the messages instead, hands them in batches to a
+multiprocessing.Pool and delivers the results back on the IOLoop, in
+arrival order per peer. Once max_pending messages are queued or being
+opened, the IOLoop waits for the oldest batch, which keeps it from
+reading more datagrams until the workers catch up.
+
+Workers are forked, so they would inherit the sockets of the node; they
+close them on start so that a worker does not keep a port bound after
+the node has stopped.
+
+Classes:
+    CryptoPool -- Runs a function over inbound messages on worker processes.
+"""
+
+from collections import defaultdict, deque
+import logging
+import multiprocessing
+import os
+import stat
+
+from tornado import ioloop
+
+from node import constants
+
+
+def _close_inherited_sockets():
+    """ Close the sockets a worker inherited from the node. The pipes
+    the pool talks to the worker over are not sockets and stay open. """
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except OSError:
+        return
+    for fd in fds:
+        if fd <= 2:
+            continue
+        try:
+            if stat.S_ISSOCK(os.fstat(fd).st_mode):
+                os.close(fd)
+        except OSError:
+            # Closed since it was listed, like the one listdir read
+            pass
+
+
+def _init_worker(initializer, initargs):
+    _close_inherited_sockets()
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_batch(func, items):
+    """ Run func over a batch in a worker; exceptions are returned, as
+    they may not survive pickling. """
+    results = []
+    for item in items:
+        try:
+            results.append((True, func(item)))
+        except Exception as exc:
+            results.append((False, '%s: %s' % (exc.__class__.__name__, exc)))
+    return results
+
+
+class _Batch(object):
+    __slots__ = ('entries', 'result', 'done')
+
+    def __init__(self, entries):
+        self.entries = entries  # [(peer, sequence number, item)]
+        self.result = None
+        self.done = False
+
+
+class CryptoPool(object):
+    """
+    Runs func over inbound messages on worker processes and passes the
+    results to deliver_cb on the IOLoop.
+
+    Results for the same peer are delivered in the order the messages
+    were submitted (or put, for messages opened without the pool).
+    Messages func fails on or returns None for are dropped.
+    """
+
+    def __init__(self, func, deliver_cb, workers, initializer=None, initargs=(),
+                 batch_size=constants.CRYPTO_POOL_BATCH_SIZE,
+                 max_pending=constants.CRYPTO_POOL_MAX_PENDING, loop=None):
+        """
+        @param func: Opens a message; a module-level function, so it
+                     can be pickled.
+        @type func: function
+
+        @param deliver_cb: Called with each result on the IOLoop.
+        @type deliver_cb: function
+
+        @param workers: Number of worker processes.
+        @type workers: int
+
+        @param initializer: Called with initargs in each worker on start.
+        @type initializer: function
+        """
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.func = func
+        self.deliver_cb = deliver_cb
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.loop = loop or ioloop.IOLoop.current()
+        self.pool = multiprocessing.Pool(workers, _init_worker, (initializer, initargs))
+        self.closed = False
+
+        self._queue = []
+        self._flush_scheduled = False
+        self._batches = deque()  # dispatched, oldest first
+
+        # Per peer: next sequence number to hand out and to deliver, and
+        # the results waiting for earlier ones
+        self._next_sequence = defaultdict(int)
+        self._next_delivery = defaultdict(int)
+        self._ready = defaultdict(dict)
+
+        self.num_pending = 0
+        self.num_submitted = 0
+        self.num_batches = 0
+        self.num_failed = 0
+        self.num_waits = 0
+
+    def submit(self, peer, item):
+        """
+        Queue a message to be opened on a worker.
+
+        @param peer: Any hashable that identifies the sender.
+        @param item: The message as received.
+        """
+        if self.num_pending >= self.max_pending:
+            self.num_waits += 1
+            self._wait_oldest()
+
+        self._queue.append((peer, self._take_sequence(peer), item))
+        self.num_pending += 1
+        self.num_submitted += 1
+
+        if len(self._queue) >= self.batch_size:
+            self._dispatch()
+        elif not self._flush_scheduled:
+            # Send what came in during this IOLoop iteration
+            self._flush_scheduled = True
+            self.loop.add_callback(self._flush)
+
+    def put(self, peer, result):
+        """ Deliver a message opened without the pool, after the pending
+        messages of the same peer. """
+        self._ready[peer][self._take_sequence(peer)] = (True, result)
+        self._release(peer)
+
+    def drain(self):
+        """ Wait for all queued messages and deliver them. """
+        self._dispatch()
+        while self._batches:
+            self._wait_oldest()
+
+    def close(self):
+        """ Stop the workers; queued messages are dropped. """
+        if self.closed:
+            return
+        self.closed = True
+        self.pool.terminate()
+        self.pool.join()
+
+    def _take_sequence(self, peer):
+        sequence = self._next_sequence[peer]
+        self._next_sequence[peer] = sequence + 1
+        return sequence
+
+    def _flush(self):
+        self._flush_scheduled = False
+        self._dispatch()
+
+    def _dispatch(self):
+        if not self._queue:
+            return
+
+        batch = _Batch(self._queue)
+        self._queue = []
+        self._batches.append(batch)
+        self.num_batches += 1
+
+        def on_result(results):
+            # Runs on a thread of the pool
+            self.loop.add_callback(self._complete, batch, results)
+
+        batch.result = self.pool.apply_async(
+            _run_batch, (self.func, [item for _, _, item in batch.entries]), callback=on_result
+        )
+
+    def _wait_oldest(self):
+        if not self._batches:
+            self._dispatch()
+        batch = self._batches[0]
+        self._complete(batch, batch.result.get())
+
+    def _complete(self, batch, results):
+        if batch.done:
+            return
+        batch.done = True
+        self._batches.remove(batch)
+        self.num_pending -= len(batch.entries)
+
+        peers = set()
+        for (peer, sequence, _), result in zip(batch.entries, results):
+            self._ready[peer][sequence] = result
+            peers.add(peer)
+        for peer in peers:
+            self._release(peer)
+
+    def _release(self, peer):
+        """ Deliver the results of a peer that are next in order. """
+        ready = self._ready[peer]
+        sequence = self._next_delivery[peer]
+        while sequence in ready:
+            success, result = ready.pop(sequence)
+            sequence += 1
+            if not success:
+                self.num_failed += 1
+                self.log.error('Cannot open message: %s', result)
+            elif result is not None:
+                try:
+                    self.deliver_cb(result)
+                except Exception:
+                    self.log.exception('Error handling message')
+
+        if sequence == self._next_sequence[peer]:
+            # Nothing outstanding
+            del self._ready[peer], self._next_delivery[peer], self._next_sequence[peer]
+        else:
+            self._next_delivery[peer] = sequence
+
+    def get_stats(self):
+        return {
+            'workers': self.workers,
+            'pending': self.num_pending,
+            'submitted': self.num_submitted,
+            'batches': self.num_batches,
+            'failed': self.num_failed,
+            'waits': self.num_waits
+        }
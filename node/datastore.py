@@ -1,6 +1,7 @@
 import UserDict
 import logging
 import ast
+import time
 from abc import ABCMeta, abstractmethod
 
 
@@ -45,15 +46,32 @@ class DataStore(UserDict.DictMixin, object):
         was originally published """
         pass
 
+    @abstractmethod
+    def get_ttl(self, key):
+        """ Get the number of seconds after its last publication that the
+        C{(key, value)} pair identified by C{key} expires, or 0 if it does
+        not expire on its own """
+        pass
+
     @abstractmethod
     def set_item(self, key, value, last_published, originally_published,
-                 original_publisher_id, market_id):
+                 original_publisher_id, market_id, ttl=0):
         """ Set the value of the (key, value) pair identified by C{key};
         this should set the "last published" value for the (key, value)
         pair to the current time
         """
         pass
 
+    def is_expired(self, key, now=None):
+        """ Return True if the C{(key, value)} pair identified by C{key}
+        was cached with a TTL that has run out """
+        ttl = self.get_ttl(key)
+        if not ttl:
+            return False
+        if now is None:
+            now = time.time()
+        return self.get_last_published(key) + ttl <= now
+
     @abstractmethod
     def __getitem__(self, key):
         """ Get the value identified by C{key} """
@@ -111,8 +129,14 @@ class SqliteDataStore(DataStore):
         was originally published """
         return int(self._db_query(key, 'originallyPublished'))
 
+    def get_ttl(self, key):
+        """ Get the number of seconds after its last publication that the
+        C{(key, value)} pair identified by C{key} expires, or 0 if it does
+        not expire on its own """
+        return int(self._db_query(key, 'ttl') or 0)
+
     def set_item(self, key, value, last_published, originally_published,
-                 original_publisher_id, market_id=1):
+                 original_publisher_id, market_id=1, ttl=0):
 
         rows = self.db_connection.select_entries(
             "datastore",
@@ -128,7 +152,8 @@ class SqliteDataStore(DataStore):
                     'lastPublished': last_published,
                     'originallyPublished': originally_published,
                     'originalPublisherID': original_publisher_id,
-                    'market_id': market_id
+                    'market_id': market_id,
+                    'ttl': ttl or 0
                 }
             )
         else:
@@ -140,7 +165,8 @@ class SqliteDataStore(DataStore):
                     'lastPublished': last_published,
                     'originallyPublished': originally_published,
                     'originalPublisherID': original_publisher_id,
-                    'market_id': market_id
+                    'market_id': market_id,
+                    'ttl': ttl or 0
                 },
                 {
                     'key': key,
@@ -148,20 +174,95 @@ class SqliteDataStore(DataStore):
                 }
             )
 
+    def _db_row(self, key):
+        rows = self.db_connection.select_entries("datastore", {"key": key})
+        if len(rows) != 0:
+            return rows[0]
+
+    @staticmethod
+    def _column_value(row, column_name):
+        value = row[column_name]
+        try:
+            value = ast.literal_eval(value)
+        except Exception:
+            pass
+        return value
+
     def _db_query(self, key, column_name):
+        row = self._db_row(key)
+        if row is not None:
+            return self._column_value(row, column_name)
+
+    def __getitem__(self, key):
+        row = self._db_row(key)
+        if row is None:
+            return None
+
+        # Cached copies are dropped once their TTL has run out
+        ttl = int(row.get('ttl') or 0)
+        if ttl and int(row['lastPublished']) + ttl <= time.time():
+            return None
 
-        row = self.db_connection.select_entries("datastore", {"key": key})
+        return self._column_value(row, 'value')
+
+    def __delitem__(self, key):
+        # Keys are stored as given to set_item
+        self.db_connection.delete_entries("datastore", {"key": key})
 
-        if len(row) != 0:
-            value = row[0][column_name]
-            try:
-                value = ast.literal_eval(value)
-            except Exception:
-                pass
-            return value
+
+class MemoryDataStore(DataStore):
+    """In-memory datastore, for nodes without a database (simulations)."""
+    def __init__(self):
+        super(MemoryDataStore, self).__init__()
+        # key -> (value, lastPublished, originallyPublished,
+        #         originalPublisherID, market_id, ttl)
+        self._entries = {}
+
+    def keys(self):
+        """ Return a list of the keys in this data store """
+        return self._entries.keys()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get_last_published(self, key):
+        """ Get the time the C{(key, value)} pair identified by C{key}
+        was last published """
+        return self._entries[key][1]
+
+    def get_original_publisher_id(self, key):
+        """ Get the original publisher of the data's node ID """
+        return self._entries[key][3]
+
+    def get_original_publish_time(self, key):
+        """ Get the time the C{(key, value)} pair identified by C{key}
+        was originally published """
+        return self._entries[key][2]
+
+    def get_ttl(self, key):
+        """ Get the number of seconds after its last publication that the
+        C{(key, value)} pair identified by C{key} expires, or 0 if it does
+        not expire on its own """
+        entry = self._entries.get(key)
+        return entry[5] if entry is not None else 0
+
+    def set_item(self, key, value, last_published, originally_published,
+                 original_publisher_id, market_id=1, ttl=0):
+        self._entries[key] = (
+            value, last_published, originally_published,
+            original_publisher_id, market_id, ttl or 0
+        )
 
     def __getitem__(self, key):
-        return self._db_query(key, 'value')
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        # Cached copies are dropped once their TTL has run out
+        if entry[5] and entry[1] + entry[5] <= time.time():
+            return None
+
+        return entry[0]
 
     def __delitem__(self, key):
-        self.db_connection.delete_entries("datastore", {"key": key.encode("hex")})
+        self._entries.pop(key, None)
@@ -173,6 +173,49 @@ class Obdb(object):
         if lastrowid:
             return lastrowid
 
+    @_managedmethod
+    def insert_entries(self, table, rows):
+        """
+        A wrapper for inserting many rows with one SQL INSERT statement
+        executed in a single transaction.
+
+        @param table: The table to insert to
+        @param rows: A list of dictionaries with the values to set; all
+                     of them must have the same keys
+        """
+        self._insert_rows(table, rows)
+
+    @_managedmethod
+    def replace_entries(self, table, where_dict, rows):
+        """
+        Delete the rows matching where_dict and insert rows in their
+        place, in a single transaction: either both happen or neither.
+
+        @param table: The table to replace rows in
+        @param where_dict: A dictionary with the WHERE clauses of the
+                           rows to delete
+        @param rows: A list of dictionaries with the values to set; all
+                     of them must have the same keys
+        """
+        self._delete_rows(table, where_dict)
+        self._insert_rows(table, rows)
+
+    def _insert_rows(self, table, rows):
+        if not rows:
+            return
+        fields = rows[0].keys()
+        query = "INSERT INTO %s(%s) VALUES(%s)" % (
+            table,
+            ",".join(self._before_storing(field) for field in fields),
+            ",".join("?" for _ in fields)
+        )
+        self._log.debug("query: %s", query)
+        cur = self.con.cursor()
+        cur.executemany(
+            query,
+            [tuple(self._before_storing(row[field]) for field in fields) for row in rows]
+        )
+
     @_managedmethod
     def select_entries(self, table, where_dict=None, operator="AND", order_field="id",
                        order="ASC", limit=None, limit_offset=None, select_fields="*"):
@@ -224,6 +267,9 @@ class Obdb(object):
         @param where_dict: A dictionary with the WHERE clauses. If ommited,
                            it will delete all the rows of the table.
         """
+        self._delete_rows(table, where_dict, operator)
+
+    def _delete_rows(self, table, where_dict=None, operator="AND"):
         if where_dict is None:
             where_dict = {'"1"': '1'}
         cur = self.con.cursor()
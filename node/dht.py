@@ -2,48 +2,116 @@ import hashlib
 import json
 import logging
 import os
+import sys
+import thread
 import time
 import functools
-from threading import RLock
+from collections import OrderedDict, deque
 
-from node import constants, datastore, routingtable
-from node.protocol import proto_store
+from tornado import ioloop
+from tornado.concurrent import Future
+
+from node import constants, datastore, ranking, republisher, routingtable
+from node.contact import ContactRecord
+from node.protocol import proto_store, proto_store_batch, supports_store_batch
 
 class DHT(object):
-    def __init__(self, transport, market_id, settings, db_connection):
+    def __init__(self, transport, market_id, settings, db_connection,
+                 routing_table_class=routingtable.CachingTreeRoutingTable,
+                 data_store=None):
 
         self.log = logging.getLogger(
             '[%s] %s' % (market_id, self.__class__.__name__)
         )
         self.settings = settings
+        self.db_connection = db_connection
         self.known_nodes = []
-        self.searches = []
+        self.searches = SearchManager(market_id)
+        self.value_cache = ValueCache()
+
+        # Store messages waiting to be flushed, per target GUID
+        self.pending_stores = {}
+        self.store_stats = StoreStats(market_id)
         self.active_peers = []
         self.transport = transport
         self.market_id = market_id
 
-        # Routing table
-        self.routing_table = routingtable.OptimizedTreeRoutingTable(
-            self.settings['guid'], market_id)
-        self.data_store = datastore.SqliteDataStore(db_connection)
+        # Routing table; any routingtable.RoutingTable implementation
+        self.routing_table = routing_table_class(self.settings['guid'], market_id)
+        # Values stored at this node; kept in the database by default
+        if data_store is None:
+            data_store = datastore.SqliteDataStore(db_connection)
+        self.data_store = data_store
+
+        # All DHT state is owned by the IOLoop thread; it is recorded as
+        # soon as the loop runs (see _loop_confined).
+        self.loop = ioloop.IOLoop.current()
+        self._loop_thread = None
+        self.loop.add_callback(self._claim_loop_thread)
+
+        # Bucket refresh lookups, paced
+        self.refresh_pacer = RefreshPacer(
+            market_id,
+            self.iterative_find_node,
+            self._bucket_needs_refresh
+        )
+        self._refresh_ticker = ioloop.PeriodicCallback(
+            self.refresh_pacer.tick,
+            constants.DHT_REFRESH_SPACING_IN_SECONDS * 1000,
+            io_loop=self.loop
+        )
+        self._refresh_ticker.start()
+
+        # Abandon lookups whose deadline passed, and probes left unanswered
+        self._search_sweeper = ioloop.PeriodicCallback(
+            self._expire_searches,
+            constants.DHT_SEARCH_SWEEP_INTERVAL_IN_SECONDS * 1000,
+            io_loop=self.loop
+        )
+        self._search_sweeper.start()
+
+        # Spreads republishing of stored data and own listings over time
+        self.republisher = republisher.RepublishScheduler(
+            db_connection, market_id, loop=self.loop
+        )
+        self.republisher.start()
 
-        self._lock = RLock()
+    def _claim_loop_thread(self):
+        self._loop_thread = thread.get_ident()
 
     # pylint: disable=no-self-argument
     # pylint: disable=not-callable
-    def _synchronized(func):
-        """Decorator for synchronizing access to DHT attributes."""
+    def _loop_confined(func):
+        """
+        Decorator confining access to DHT attributes to the IOLoop thread.
+
+        Calls made on the loop thread, or before the loop has started,
+        run inline and return the method's result. Calls from any other
+        thread are handed over to the loop with add_callback and return
+        a Future, which the loop resolves with the result or exception
+        once the call has run.
+        """
         @functools.wraps(func)
-        def synced_f(self, *args, **kwargs):
-            with self._lock:
+        def confined_f(self, *args, **kwargs):
+            if self._loop_thread is None or self._loop_thread == thread.get_ident():
                 return func(self, *args, **kwargs)
-        return synced_f
 
-    @_synchronized
+            future = Future()
+
+            def run():
+                try:
+                    future.set_result(func(self, *args, **kwargs))
+                except Exception:  # pylint: disable=broad-except
+                    future.set_exc_info(sys.exc_info())
+            self.loop.add_callback(run)
+            return future
+        return confined_f
+
+    @_loop_confined
     def get_active_peers(self):
         return self.active_peers
 
-    @_synchronized
+    @_loop_confined
     def start(self, seed_peer):
         """ This method executes only when the server is starting up for the
             first time and add the seed peer(s) to known node list and
@@ -80,13 +148,29 @@ class DHT(object):
             if self.transport.handler:
                 self.transport.handler.refresh_peers()
 
-    @_synchronized
+    @_loop_confined
+    def report_unreachable(self, guid):
+        """ Called when a peer stopped answering pings. Its routing
+        table slot goes to a live contact from the replacement cache,
+        if there is one. """
+        if not guid or guid[:4] == 'seed':
+            return
+        replacement = self.routing_table.report_unreachable(guid)
+        if replacement is not None:
+            self.log.debug('Unreachable peer %s replaced by %s', guid, replacement)
+
+    @_loop_confined
     def add_peer(self, hostname, port, pubkey=None, guid=None, nickname=None, nat_type=None, avatar_url=None):
         """ This takes a tuple (pubkey, hostname, port, guid) and adds it to the active
         peers list if it doesn't already reside there.
 
+        Only nodes we exchange messages with should be added here; the
+        routing table gets a ContactRecord of the node, not the connection.
+        Use learn_contact for nodes we only heard about.
+
         TODO: Refactor to just pass a peer object. evil tuples.
         """
+        self.learn_contact(hostname, port, pubkey, guid, nickname, nat_type, avatar_url)
 
         # peer_tuple = (hostname, port, pubkey, guid, nickname)
         # found_peer = False
@@ -109,7 +193,6 @@ class DHT(object):
                     self.log.debug('Hostname/Port combo changed.')
                     peer.init_packetsender()
                     peer.setup_emitters()
-                    self.routing_table.add_contact(peer)
 
                     if self.transport.handler:
                         self.transport.handler.refresh_peers()
@@ -133,8 +216,6 @@ class DHT(object):
                 if avatar_url:
                     peer.avatar_url = avatar_url
 
-                self.routing_table.add_contact(peer)
-
                 if self.transport.handler:
                     self.transport.handler.refresh_peers()
 
@@ -148,7 +229,6 @@ class DHT(object):
 
             self.active_peers.append(new_peer)
             self.log.debug('Active peers after adding new one: %s', self.active_peers)
-            self.routing_table.add_contact(new_peer)
 
             if self.transport.handler:
                 self.transport.handler.refresh_peers()
@@ -158,7 +238,68 @@ class DHT(object):
             self.log.error('Could not create a new peer.')
             return None
 
-    @_synchronized
+    @_loop_confined
+    def learn_contact(self, hostname, port, pubkey=None, guid=None, nickname=None,
+                      nat_type=None, avatar_url=None, last_reached=None):
+        """ Add a node to the routing table, or update what it knows
+        about the node, without connecting to it.
+
+        @param last_reached: When the node was last heard from. New
+                             contacts default to now; if None, an
+                             existing contact keeps its own.
+        @type last_reached: int or float
+
+        @return: The routing table's record of the node, or None if it
+                 has no usable GUID.
+        @rtype: ContactRecord
+        """
+        if not guid or guid[:4] == 'seed' or guid == self.transport.guid:
+            return None
+
+        record = self.routing_table.get_contact(guid)
+        if record is None:
+            if last_reached is None:
+                last_reached = time.time()
+            record = ContactRecord(
+                guid, hostname, port, pubkey, nickname, nat_type, avatar_url, last_reached
+            )
+            self.routing_table.add_contact(record)
+        else:
+            record.update(hostname, port, pubkey, nickname, nat_type, avatar_url)
+            if last_reached is not None and last_reached > record.last_reached:
+                record.last_reached = last_reached
+                self.routing_table.add_contact(record)
+        return record
+
+    @_loop_confined
+    def mark_reached(self, guid):
+        """ Note that the node with this GUID just answered us: its
+        contact counts as live and moves to the tail of its KBucket. """
+        if not guid or guid[:4] == 'seed' or guid == self.transport.guid:
+            return
+        record = self.routing_table.get_contact(guid)
+        if record is not None:
+            record.last_reached = time.time()
+            self.routing_table.add_contact(record)
+
+    def get_peer(self, guid):
+        """ Return the connection to a node, creating it from the node's
+        routing table contact if there is none yet.
+
+        @return: The connection, or None if the node is unknown.
+        @rtype: connection.CryptoPeerConnection
+        """
+        peer = self.transport.peers.get(guid)
+        if peer is None:
+            record = self.routing_table.get_contact(guid)
+            if record is not None:
+                peer = self.add_peer(
+                    record.hostname, record.port, record.pub, record.guid,
+                    record.nickname, record.nat_type, record.avatar_url
+                )
+        return peer
+
+    @_loop_confined
     def _add_known_node(self, node):
         """ Accept a peer tuple and add it to known nodes list
         :param node: (tuple)
@@ -168,7 +309,7 @@ class DHT(object):
         if node not in self.known_nodes and node[1] is not None:
             self.known_nodes.append(node)
 
-    @_synchronized
+    @_loop_confined
     def on_find_node(self, msg):
         """ When a findNode message is received it will be of several types:
         - findValue: Looking for a specific key-value
@@ -237,7 +378,7 @@ class DHT(object):
                 response_msg['foundNodes'] = close_nodes
                 querying_peer.send(response_msg)
 
-    @_synchronized
+    @_loop_confined
     def close_nodes(self, key, guid=None):
         contacts = self.routing_table.find_close_nodes(key, constants.K, guid)
         contact_list = []
@@ -263,7 +404,7 @@ class DHT(object):
 
         return close_nodes
 
-    @_synchronized
+    @_loop_confined
     def on_find_node_response(self, msg):
 
         # Update existing peer's pubkey if active peer
@@ -272,110 +413,220 @@ class DHT(object):
                 peer.nickname = msg['senderNick']
                 peer.pub = msg['pubkey']
 
+        find_id = msg['findID']
+        search = self.searches.get(find_id)
+
+        if search is None:
+            self.log.info('No search found')
+            return
+
         # If key was found by this node then
         if 'foundKey' in msg.keys():
             self.log.debug('Found the key-value pair. Executing callback.')
-
-            for idx, search in enumerate(self.searches):
-                if search.find_id == msg['findID']:
-                    search.callback(msg['foundKey'])
-                    if idx in self.searches:
-                        del self.searches[idx]
+            self.value_cache.set(search.key, msg['foundKey'])
+            self._cache_along_path(search, msg['senderGUID'], msg['foundKey'])
+            self.searches.finish(find_id, msg['foundKey'])
+
+        elif 'foundNode' in msg.keys():
+            found_node = msg['foundNodes']
+
+            # Add foundNode to the routing table
+            if found_node[0] != self.transport.guid:
+                self.log.debug('Found a tuple %s', found_node)
+                if len(found_node) == 3:
+                    found_node.append('')
+                # Stale until it answers, as we have not heard from it
+                self.learn_contact(found_node[1], found_node[2], found_node[3],
+                                   found_node[0], found_node[4], avatar_url=found_node[6],
+                                   last_reached=0)
+
+            self.searches.finish(
+                find_id, (found_node[2], found_node[1], found_node[0], found_node[3])
+            )
 
         else:
+            # Get current shortlist length
+            shortlist_length = len(search.shortlist)
+
+            nodes_to_extend = []
+
+            # Extends shortlist if necessary
+            for node in msg['foundNodes']:
+                if node[0] != self.transport.guid and node[3] != self.transport.pubkey \
+                        and not (node[1] == self.transport.hostname) \
+                        or not node[2] == self.transport.port:
+
+                    self.log.debug('Adding a findNode contact')
+                    # Stale until it answers, as we have not heard from it
+                    self.learn_contact(
+                        node[1],
+                        node[2],
+                        node[3],
+                        node[0],
+                        node[4],
+                        node[5],
+                        node[6],
+                        last_reached=0
+                    )
+                    nodes_to_extend.append(node)
+
+            self.extend_shortlist(find_id, nodes_to_extend)
+
+            # Remove active probe to this node for this findID
+            search_ip = msg['hostname']
+            search_port = msg['port']
+            search_guid = msg['senderGUID']
+            search_tuple = (search_ip, search_port, search_guid)
+
+            # Probes may be short (hostname, port, guid) tuples or the
+            # longer ones learned from foundNodes, so match on the GUID.
+            search.active_probes = [
+                probe for probe in search.active_probes
+                if probe[2] != search_guid
+            ]
+            self.log.datadump(
+                'Find Node Response - Active Probes After: %s',
+                search.active_probes
+            )
 
-            if 'foundNode' in msg.keys():
-                found_node = msg['foundNodes']
+            # Add this to already contacted list
+            if search_tuple not in search.already_contacted:
+                search.already_contacted.append(search_tuple)
+            self.log.datadump(
+                'Already Contacted: %s',
+                search.already_contacted
+            )
 
-                # Add foundNode to active peers list and routing table
-                if found_node[0] != self.transport.guid:
-                    self.log.debug('Found a tuple %s', found_node)
-                    if len(found_node) == 3:
-                        found_node.append('')
-                    self.add_peer(found_node[1], found_node[2], found_node[3],
-                                  found_node[0], found_node[4], avatar_url=found_node[6])
+            # Remember who could not answer a findValue for path caching
+            if search.call == 'findValue' and search_tuple not in search.nodes_without_value:
+                search.nodes_without_value.append(search_tuple)
 
-                for idx, search in enumerate(self.searches):
-                    if search.find_id == msg['findID']:
+            # If we added more to shortlist then keep searching
+            if len(search.shortlist) > shortlist_length:
+                self.log.info('Lets keep searching')
+                self._search_iteration(search)
+            elif not search.active_probes:
+                self.log.info('Search Finished')
+                self.searches.finish(find_id, search.shortlist)
 
-                        # Execute callback
-                        if search.callback is not None:
-                            search.callback((found_node[2], found_node[1], found_node[0], found_node[3]))
+    @_loop_confined
+    def _cache_along_path(self, search, holder_guid, value):
+        """ Store a found value at the closest probed node that did not
+        have it (Kademlia path caching). The copy expires after
+        DATE_EXPIRE_TIMEOUT halved once for every contacted node that is
+        closer to the key than the caching node.
 
-                        # Clear search
-                        del self.searches[idx]
+        @param search: The findValue search that found the value.
+        @type search: DHTSearch
 
-            else:
-                found_search = False
-                search = None
-                find_id = msg['findID']
-                for ser in self.searches:
-                    if ser.find_id == find_id:
-                        search = ser
-                        found_search = True
-
-                if not found_search:
-                    self.log.info('No search found')
-                    return
-                else:
+        @param holder_guid: GUID of the node that returned the value.
+        @type holder_guid: str
+        """
+        def distance_to_key(node_guid):
+            return self.routing_table.distance(node_guid, search.key)
+
+        candidates = [
+            node for node in search.nodes_without_value
+            if node[2] != holder_guid and distance_to_key(node[2]) is not None
+        ]
+        if not candidates:
+            return
 
-                    # Get current shortlist length
-                    shortlist_length = len(search.shortlist)
-
-                    nodes_to_extend = []
-
-                    # Extends shortlist if necessary
-                    for node in msg['foundNodes']:
-                        if node[0] != self.transport.guid and node[3] != self.transport.pubkey \
-                                and not (node[1] == self.transport.hostname) \
-                                or not node[2] == self.transport.port:
-
-                            self.log.debug('Adding a findNode peer')
-                            self.add_peer(
-                                node[1],
-                                node[2],
-                                node[3],
-                                node[0],
-                                node[4],
-                                node[5],
-                                node[6]
-                            )
-                            nodes_to_extend.append(node)
-
-                    self.extend_shortlist(msg['findID'], nodes_to_extend)
-
-                    # Remove active probe to this node for this findID
-                    search_ip = msg['hostname']
-                    search_port = msg['port']
-                    search_guid = msg['senderGUID']
-                    search_tuple = (search_ip, search_port, search_guid)
-
-                    for idx, probe in enumerate(search.active_probes):
-                        if probe == search_tuple:
-                            del search.active_probes[idx]
-                    self.log.datadump(
-                        'Find Node Response - Active Probes After: %s',
-                        search.active_probes
-                    )
+        cache_node = min(candidates, key=lambda node: distance_to_key(node[2]))
+        cache_distance = distance_to_key(cache_node[2])
 
-                    # Add this to already contacted list
-                    if search_tuple not in search.already_contacted:
-                        search.already_contacted.append(search_tuple)
-                    self.log.datadump(
-                        'Already Contacted: %s',
-                        search.already_contacted
-                    )
+        closer_nodes = set()
+        for node in search.already_contacted:
+            node_distance = distance_to_key(node[2])
+            if node_distance is not None and node_distance < cache_distance:
+                closer_nodes.add(node[2])
 
-                    # If we added more to shortlist then keep searching
-                    if len(search.shortlist) > shortlist_length:
-                        self.log.info('Lets keep searching')
-                        self._search_iteration(search)
-                    else:
-                        self.log.info('Shortlist is empty')
-                        if search.callback is not None:
-                            search.callback(search.shortlist)
+        ttl = max(
+            constants.DATE_EXPIRE_TIMEOUT >> len(closer_nodes),
+            constants.PATH_CACHE_MIN_TTL_IN_SECONDS
+        )
+
+        self.log.debug('Caching %s at %s for %ds', search.key, cache_node[2], ttl)
+        self._queue_store(cache_node[2], proto_store(search.key, value, holder_guid, 0, ttl))
+
+    def save_routing_snapshot(self):
+        """ Save the contacts of the routing table, and the bucket each
+        lives in, so a restart can rebuild it without bootstrapping.
+
+        This is not confined to the loop so that it can run on shutdown.
+        """
+        rows = []
+        for contact, range_min in self.routing_table.iter_contacts():
+            if not contact.guid or contact.guid[:4] == 'seed' or not contact.pub:
+                continue
+            rows.append({
+                'market_id': self.market_id,
+                'guid': contact.guid,
+                'hostname': contact.hostname,
+                'port': contact.port,
+                'pubkey': contact.pub,
+                'nickname': contact.nickname or '',
+                'nat_type': contact.nat_type or '',
+                'avatar_url': contact.avatar_url or '',
+                'last_reached': int(contact.last_reached),
+                'bucket_min': self.routing_table.num_to_id(range_min)
+            })
+
+        try:
+            self.db_connection.replace_entries(
+                "routing_snapshot", {"market_id": self.market_id}, rows
+            )
+        except Exception as exc:
+            self.log.error('Could not save routing table snapshot: %s', exc)
+            return
+        self.log.info('Saved routing table snapshot of %d contacts', len(rows))
 
-    @_synchronized
+    @_loop_confined
+    def restore_routing_snapshot(self, callback=None):
+        """ Refill the routing table from the last snapshot.
+
+        Contacts are added in batches, yielding to the IOLoop in between,
+        oldest first so that buckets keep their most recently seen order.
+        No connections are made; restored contacts keep their saved
+        last_reached until they answer, so stale ones are not handed out
+        to other nodes in the meantime.
+
+        @param callback: Called without arguments once all contacts are
+                         back in the routing table.
+
+        @return: The number of contacts in the snapshot.
+        @rtype: int
+        """
+        try:
+            rows = self.db_connection.select_entries(
+                "routing_snapshot", {"market_id": self.market_id}, order_field="last_reached"
+            )
+        except Exception as exc:
+            self.log.error('Could not load routing table snapshot: %s', exc)
+            rows = []
+
+        self.routing_table.restore_layout(int(row['bucket_min'], 16) for row in rows)
+        self.log.info('Restoring %d contacts from routing table snapshot', len(rows))
+
+        def restore_next_contacts():
+            for row in rows[:constants.DHT_MAINTENANCE_BATCH_SIZE]:
+                self.learn_contact(
+                    row['hostname'], int(row['port']), row['pubkey'], row['guid'],
+                    row['nickname'], row['nat_type'] or None, row['avatar_url'] or None,
+                    last_reached=int(row['last_reached'])
+                )
+            del rows[:constants.DHT_MAINTENANCE_BATCH_SIZE]
+
+            if rows:
+                self.loop.add_callback(restore_next_contacts)
+            elif callback is not None:
+                callback()
+
+        num_contacts = len(rows)
+        restore_next_contacts()
+        return num_contacts
+
+    @_loop_confined
     def _refresh_node(self):
         """ Periodically called to perform k-bucket refreshes and data
         replication/republishing as necessary """
@@ -386,40 +637,45 @@ class DHT(object):
             self.transport.handler.send_to_client(None, {"type": "republish_notify",
                                                          "msg": "P2P Data Republished"})
 
-    @_synchronized
+    @_loop_confined
     def _refresh_routing_table(self):
-        self.log.info('Started Refreshing Routing Table')
-
-        # Get Random ID from every KBucket
+        """ Queue a lookup for a random ID of every stale KBucket; the
+        refresh pacer starts them a few at a time. """
         node_ids = self.routing_table.get_refresh_list(0, False)
+        self.log.info('Queueing %d bucket refreshes', len(node_ids))
+        self.refresh_pacer.enqueue(node_ids)
 
-        def search_for_next_node_id():
-            if len(node_ids) > 0:
-                search_id = node_ids.pop()
-                self.iterative_find_node(search_id)
-                search_for_next_node_id()
-            else:
-                # If this is reached, we have finished refreshing the routing table
-                return
-
-        # Start the refreshing cycle
-        search_for_next_node_id()
+    def _bucket_needs_refresh(self, node_id):
+        last_accessed = self.routing_table.kbucket_last_accessed(node_id)
+        return time.time() - last_accessed >= constants.REFRESH_TIMEOUT
 
-    @_synchronized
+    @_loop_confined
     def _republish_data(self, *args):
-        self._threaded_republish_data()
+        """ Hand any stored data not yet known to the republish scheduler
+        over to it; the scheduler republishes and expires each key at its
+        own jittered time, within the store rate limit.
+        """
+        self.log.debug('Scheduling Data Republishing')
+        for key in self.data_store.keys():
+            if key == 'nodeState':
+                continue
+            schedule_key = 'data-%s' % key.encode('hex')
+            if schedule_key not in self.republisher:
+                self.republisher.schedule(
+                    schedule_key, functools.partial(self._republish_keys, [key])
+                )
 
-    @_synchronized
-    def _threaded_republish_data(self, *args):
-        """ Republishes and expires any stored data (i.e. stored
-        C{(key, value pairs)} that need to be republished/expired
+    @_loop_confined
+    def _republish_keys(self, keys):
+        """ Republish or expire stored keys.
 
-        This method should run in a deferred thread
+        @return: The number of keys stored to the network.
+        @rtype: int
         """
-        self.log.debug('Republishing Data')
         expired_keys = []
+        stores = 0
 
-        for key in self.data_store.keys():
+        for key in keys:
 
             # Filter internal variables stored in the data store
             if key == 'nodeState':
@@ -427,6 +683,19 @@ class DHT(object):
 
             now = int(time.time())
             key = key.encode('hex')
+
+            # Copies cached along a lookup path are never republished;
+            # they are dropped once their TTL runs out.
+            if self.data_store.get_ttl(key):
+                if self.data_store.is_expired(key, now):
+                    expired_keys.append(key)
+                continue
+
+            # Deleted since it was scheduled
+            if self.data_store[key] is None:
+                self.republisher.unschedule('data-%s' % key)
+                continue
+
             original_publisher_id = self.data_store.get_original_publisher_id(key)
             age = now - self.data_store.get_original_publish_time(key) + 500000
 
@@ -435,6 +704,7 @@ class DHT(object):
                 # the data before it expires (24 hours in basic Kademlia)
                 if age >= constants.DATE_EXPIRE_TIMEOUT:
                     self.iterative_store(key, self.data_store[key])
+                    stores += 1
 
             else:
                 # This node needs to replicate the data at set intervals,
@@ -447,22 +717,22 @@ class DHT(object):
                     expired_keys.append(key)
                 elif now - self.data_store.get_last_published(key) >= constants.REPLICATE_INTERVAL:
                     self.iterative_store(key, self.data_store[key], original_publisher_id, age)
+                    stores += 1
 
         for key in expired_keys:
             del self.data_store[key]
+            self.republisher.unschedule('data-%s' % key)
+
+        return stores
 
-    @_synchronized
+    @_loop_confined
     def extend_shortlist(self, find_id, found_nodes):
 
         self.log.datadump('found_nodes: %s', found_nodes)
 
-        found_search = False
-        for ser in self.searches:
-            if ser.find_id == find_id:
-                search = ser
-                found_search = True
+        search = self.searches.get(find_id)
 
-        if not found_search:
+        if search is None:
             self.log.error('There was no search found for this ID')
             return
 
@@ -480,18 +750,12 @@ class DHT(object):
             if node_guid == self.settings['guid']:
                 continue
 
-            for peer in self.active_peers:
-                if node_guid == peer.guid:
-                    # Already an active peer or it's myself
-                    continue
-
-            if node_guid != self.settings['guid']:
-                self.log.debug('Adding new peer to active peers list: %s', node)
-                self.add_peer(node_hostname, node_port, node_pubkey, node_guid, node_nick, avatar_url=avatar_url)
+            self.log.debug('Adding contact to routing table: %s', node)
+            self.learn_contact(node_hostname, node_port, node_pubkey, node_guid, node_nick, avatar_url=avatar_url)
 
         self.log.datadump('Short list after: %s', search.shortlist)
 
-    @_synchronized
+    @_loop_confined
     def find_listings(self, key, listing_filter=None, callback=None):
         """
         Send a get product listings call to the node in question and
@@ -502,7 +766,7 @@ class DHT(object):
         already have.
         """
 
-        peer = self.routing_table.get_contact(key)
+        peer = self.get_peer(key)
 
         if peer:
             peer.send({
@@ -524,7 +788,7 @@ class DHT(object):
         #
         # self.iterative_find_value(listing_index_key, callback)
 
-    @_synchronized
+    @_loop_confined
     def find_listings_by_keyword(self, keyword, listing_filter=None, callback=None):
 
         hashvalue = hashlib.new('ripemd160')
@@ -534,13 +798,15 @@ class DHT(object):
 
         self.log.info('Finding contracts for keyword: %s', keyword)
 
-        self.iterative_find_value(listing_index_key, callback)
+        return self.iterative_find_value(listing_index_key, callback)
 
-    @_synchronized
+    @_loop_confined
     def iterative_store(self, key, value_to_store=None, original_publisher_id=None, age=0):
         """ The Kademlia store operation
 
-        Call this to store/republish data in the DHT.
+        Call this to store/republish data in the DHT. The value is stored
+        locally and at the K closest responsive nodes found by a node
+        lookup for the key.
 
         @param key: The hashtable key of the data
         @type key: str
@@ -564,16 +830,46 @@ class DHT(object):
                 key,
                 lambda msg, findKey=key, value=value_to_store,
                        original_publisher_id=original_publisher_id, age=age:
-                self.store_key_value(msg, findKey, value, original_publisher_id, age)
+                self.store_key_value(
+                    self._closest_responsive_nodes(findKey, msg),
+                    findKey, value, original_publisher_id, age
+                )
             )
 
-            nodes_to_store = []
-            for node in self.transport.dht.active_peers:
-                nodes_to_store.append((node.hostname, node.port, node.guid))
+    @_loop_confined
+    def _closest_responsive_nodes(self, key, nodes, count=constants.K):
+        """ Pick the store targets for `key` out of a lookup result.
+
+        @param nodes: Shortlist of a findNode search; entries are
+                      (hostname, port, guid, ...) tuples.
+        @type nodes: list
 
-            self.store_key_value(nodes_to_store, key, value_to_store, original_publisher_id, age)
+        @return: Up to `count` (hostname, port, guid) tuples, one per
+                 GUID, of nodes heard from within
+                 CLOSE_NODE_TIMELIMIT_IN_SECONDS, closest to the key first.
+        @rtype: list of tuple
+        """
+        if not isinstance(nodes, list):
+            return []
 
-    @_synchronized
+        stale_contact_time = time.time() - constants.CLOSE_NODE_TIMELIMIT_IN_SECONDS
+        targets = {}
+        for node in nodes:
+            guid = node[2]
+            if guid is None or guid in targets or guid == self.transport.guid:
+                continue
+            if self.routing_table.distance(guid, key) is None:
+                continue
+            contact = self.routing_table.get_contact(guid)
+            if contact is None or contact.last_reached <= stale_contact_time:
+                continue
+            targets[guid] = (node[0], node[1], guid)
+
+        return ranking.sort_by_distance(
+            targets.values(), key, key=lambda node: node[2], count=count
+        )
+
+    @_loop_confined
     def store_key_value(self, nodes, key, value, original_publisher_id, age):
 
         self.log.datadump('Store Key Value: (%s, %s %s)', nodes, key, type(value))
@@ -639,48 +935,89 @@ class DHT(object):
         now = int(time.time())
         originally_published = now - age
 
+        # Lookups must not be answered with the value being replaced
+        self.value_cache.discard(key)
+
         # Store it in your own node
         self.data_store.set_item(
             key, value, now, originally_published, original_publisher_id, market_id=self.market_id
         )
 
+        targets = set()
         for node in nodes:
-            self.log.debug('Sending data to store in DHT: %s', node)
-            #uri = network_util.get_peer_url(node[0], node[1])
             guid = node[2]
+            if guid[:4] == 'seed' or guid == self.transport.guid or guid in targets:
+                continue
 
-            if guid[:4] != 'seed':
+            self.log.debug('Sending data to store in DHT: %s', node)
+            # Stale until it answers, as we have not heard from it
+            self.learn_contact(node[0], node[1], guid=guid, last_reached=0)
 
-                peer = self.routing_table.get_contact(guid)
+            self._queue_store(guid, proto_store(key, value, original_publisher_id, age))
+            targets.add(guid)
 
-                if guid == self.transport.guid:
-                    break
+        self.store_stats.add_store(len(targets))
+        self.log.info('Storing %s at %d nodes', key, len(targets))
 
-                if not peer:
-                    peer = self.transport.get_crypto_peer(guid, node[0], node[1])
+    @_loop_confined
+    def _queue_store(self, guid, store_msg):
+        """ Queue a store message for `guid`. All stores queued for the
+        same node before the next IOLoop iteration are sent together.
+        """
+        if not self.pending_stores:
+            self.loop.add_callback(self._flush_stores)
+
+        # A newer store for the same key replaces the queued one
+        stores = self.pending_stores.setdefault(guid, [])
+        stores[:] = [msg for msg in stores if msg['key'] != store_msg['key']]
+        stores.append(store_msg)
+
+    @_loop_confined
+    def _flush_stores(self):
+        pending_stores, self.pending_stores = self.pending_stores, {}
+
+        for guid, stores in pending_stores.items():
+            peer = self.get_peer(guid)
+            if peer is None:
+                self.log.error('No contact to store %d values at: %s', len(stores), guid)
+                continue
 
-                peer.send(proto_store(key, value, original_publisher_id, age))
+            if len(stores) > 1 and supports_store_batch(peer.version):
+                self.store_stats.add_batch(len(stores))
+                peer.send(proto_store_batch(stores))
+            else:
+                # Older peers drop storeBatch messages
+                for store_msg in stores:
+                    peer.send(store_msg)
 
-    @_synchronized
+    @_loop_confined
     def _on_store_value(self, msg):
 
         key = msg['key']
         value = msg['value']
         original_publisher_id = msg['originalPublisherID']
         age = msg['age']
+        ttl = msg.get('ttl', 0)
 
         self.log.info('Storing key %s for %s', key, original_publisher_id)
         self.log.datadump('Value: %s', value)
 
+        # A path-cached copy must not replace a copy we hold for good
+        if ttl and self.data_store[key] is not None and not self.data_store.get_ttl(key):
+            self.log.debug('Ignoring cached copy of %s', key)
+            return
+
         now = int(time.time())
         originally_published = now - age
 
         if value:
-            self.data_store.set_item(key, value, now, originally_published, original_publisher_id, self.market_id)
+            self.data_store.set_item(
+                key, value, now, originally_published, original_publisher_id, self.market_id, ttl
+            )
         else:
             self.log.error('No value to store')
 
-    @_synchronized
+    @_loop_confined
     def store(self, key, value, original_publisher_id=None, age=0, **kwargs):
         """ Store the received data in this node's local hash table
 
@@ -725,7 +1062,7 @@ class DHT(object):
         )
         return 'OK'
 
-    @_synchronized
+    @_loop_confined
     def iterative_find_node(self, key, callback=None):
         """ The basic Kademlia node lookup operation
 
@@ -735,25 +1072,46 @@ class DHT(object):
         @type key: str
         """
         self.log.info('Looking for node at: %s', key)
-        self.iterative_find(key, [], callback=callback)
+        return self.iterative_find(key, [], callback=callback)
 
-    @_synchronized
+    @_loop_confined
     def iterative_find(self, key, startup_shortlist=None, call='findNode', callback=None):
         """
-        - Create a new DHTSearch object and add the key and call back to it
-        - Add the search to our search queue (self.searches)
+        - Answer findValue lookups from the value cache when possible
+        - Attach the callback to an in-flight search for the same key
+        - Otherwise create a new DHTSearch object and add the key and
+          call back to it
+        - Register the search with the search manager (self.searches)
         - Find out if we're looking for a value or for a node
-        -
 
+        @return: The findID of the search, which can be used to cancel it,
+                 or None if the lookup was answered from the cache.
+        @rtype: str
         """
         if not startup_shortlist:
             startup_shortlist = []
 
+            if call == 'findValue':
+                value = self.value_cache.get(key)
+                if value is not None:
+                    self.log.debug('Found %s in value cache', key)
+                    if callback is not None:
+                        callback(value)
+                    return None
+
+            # Piggyback on an identical lookup that is still running
+            running_search = self.searches.find(call, key)
+            if running_search is not None:
+                self.log.debug('Coalescing %s for %s', call, key)
+                self.searches.attach(running_search, callback)
+                return running_search.find_id
+
         # Create a new search object
         self.log.debug('Startup short list: %s', startup_shortlist)
 
         new_search = DHTSearch(self.market_id, key, call, callback=callback)
-        self.searches.append(new_search)
+        # Only lookups from our own routing table are shared
+        self.searches.add(new_search, coalesce=not startup_shortlist)
 
         # Determine if we're looking for a node or a key
         find_value = call != 'findNode'
@@ -778,17 +1136,16 @@ class DHT(object):
             # Abandon the search if the shortlist has no nodes
             if len(new_search.shortlist) == 0:
                 self.log.info('Search Finished')
-                if callback is not None:
-                    callback([])
-                else:
-                    return []
+                self.searches.finish(new_search.find_id, [])
+                return new_search.find_id
 
         else:
             new_search.shortlist = startup_shortlist
 
         self._search_iteration(new_search, find_value=find_value)
+        return new_search.find_id
 
-    @_synchronized
+    @_loop_confined
     def _search_iteration(self, new_search, find_value=False):
 
         # Update slow nodes count
@@ -800,9 +1157,9 @@ class DHT(object):
                 del self.active_peers[i]
 
         # Sort shortlist from closest to farthest
-        self.active_peers.sort(lambda firstNode, secondNode, targetKey=new_search.key: cmp(
-            self.routing_table.distance(firstNode.guid, targetKey),
-            self.routing_table.distance(secondNode.guid, targetKey)))
+        self.active_peers[:] = ranking.sort_by_distance(
+            self.active_peers, new_search.key, key=lambda peer: peer.guid
+        )
 
         # TODO: Put this in the callback
         # if new_search.key in new_search.find_value_result:
@@ -831,9 +1188,9 @@ class DHT(object):
             new_search.shortlist = self.dedupe(new_search.shortlist)
             self.log.datadump('Deduped Shortlist: %s', new_search.shortlist)
 
-            new_search.shortlist.sort(lambda firstNode, secondNode, targetKey=new_search.key: cmp(
-                self.routing_table.distance(firstNode[2], targetKey),
-                self.routing_table.distance(secondNode[2], targetKey)))
+            new_search.shortlist = ranking.sort_by_distance(
+                new_search.shortlist, new_search.key, key=lambda node: node[2]
+            )
 
             new_search.prev_shortlist_length = len(new_search.shortlist)
 
@@ -847,12 +1204,18 @@ class DHT(object):
             if node not in new_search.already_contacted:
                 if node[2] is not None and node[2] != self.transport.guid:
 
-                    new_search.active_probes.append(node)
                     new_search.already_contacted.append(node)
 
-                    contact = self.routing_table.get_contact(node[2])
+                    peer = self.get_peer(node[2])
+                    if peer is None and len(node) > 5:
+                        # Learned during this search, but left out of a
+                        # full KBucket
+                        peer = self.add_peer(node[0], node[1], node[3], node[2], node[4],
+                                             avatar_url=node[5])
 
-                    if contact:
+                    if peer:
+                        new_search.active_probes.append(node)
+                        new_search.probes_sent[node[2]] = time.time()
 
                         msg = {"type": "findNode",
                                "hostname": self.transport.hostname,
@@ -864,29 +1227,55 @@ class DHT(object):
                                "senderNick": self.transport.nickname,
                                "avatar_url": self.transport.avatar_url,
                                "findID": new_search.find_id,
-                               "pubkey": contact.transport.pubkey,
+                               "pubkey": self.transport.pubkey,
                                'v': constants.VERSION}
-                        self.log.debug('Sending findNode to: %s %s', contact.hostname, msg)
+                        self.log.debug('Sending findNode to: %s %s', peer.hostname, msg)
 
-                        contact.send(msg)
+                        peer.send(msg)
                         new_search.contacted_now += 1
 
                     else:
                         self.log.error('No contact was found for this guid: %s', node[2])
 
-    @_synchronized
+    @_loop_confined
     def active_search_exists(self, find_id):
+        return find_id in self.searches
 
-        active_search_exists = False
-        for search in self.searches:
-            if find_id == search.find_id:
-                return True
-        if not active_search_exists:
-            return False
+    @_loop_confined
+    def cancel_search(self, find_id, callback=None):
+        """ Stop an in-flight search without firing its callback.
+
+        @param find_id: The findID returned when the search was started.
+        @type find_id: str
+
+        @param callback: Only detach this callback; the search goes on
+                         for the other lookups coalesced with it.
+        @type callback: function
+
+        @return: True if a live search was cancelled, False otherwise.
+        @rtype: bool
+        """
+        return self.searches.cancel(find_id, callback)
+
+    @_loop_confined
+    def _expire_searches(self):
+        self._expire_probes()
+        self.searches.expire()
+
+    @_loop_confined
+    def _expire_probes(self, now=None):
+        """ Give up on probes left unanswered for DHT_PROBE_TIMEOUT and
+        query the next closest nodes instead, or finish the searches
+        that have none left. """
+        for search in self.searches.expire_probes(constants.DHT_PROBE_TIMEOUT_IN_SECONDS, now):
+            self._search_iteration(search, find_value=search.call != 'findNode')
+            if not search.active_probes and search.find_id in self.searches:
+                self.log.info('Search Finished')
+                self.searches.finish(search.find_id, search.shortlist)
 
-    @_synchronized
+    @_loop_confined
     def iterative_find_value(self, key, callback=None):
-        self.iterative_find(key, call='findValue', callback=callback)
+        return self.iterative_find(key, call='findValue', callback=callback)
 
     @staticmethod
     def dedupe(lst):
@@ -904,15 +1293,21 @@ class DHTSearch(object):
     def __init__(self, market_id, key, call="findNode", callback=None):
         self.key = key  # Key to search for
         self.call = call  # Either findNode or findValue depending on search
-        self.callback = callback  # Callback for when search finishes
+        self.callbacks = []  # Callbacks for when search finishes
+        if callback is not None:
+            self.callbacks.append(callback)
         self.shortlist = []  # List of nodes that are being searched against
         self.active_probes = []  #
+        self.probes_sent = {}  # When each probed node was sent its findXXX, by GUID
         self.already_contacted = []  # Nodes are added to this list when they've been sent a findXXX action
         self.previous_closest_node = None  # This is updated to be the closest node found during search
         self.find_value_result = {}  # If a find_value search is found this is the value
+        self.nodes_without_value = []  # Probed nodes that answered a findValue with nodes
         self.slow_node_count = [0]  #
         self.contacted_now = 0  # Counter for how many nodes have been contacted
         self.prev_shortlist_length = 0
+        self.started = time.time()  # When the search was registered
+        self.deadline = None  # Set by the SearchManager
 
         self.log = logging.getLogger(
             '[%s] %s' % (market_id, self.__class__.__name__)
@@ -929,3 +1324,410 @@ class DHTSearch(object):
                 self.shortlist.append(item)
 
         self.log.datadump('Updated short list: %s', self.shortlist)
+
+
+class SearchManager(object):
+    """
+    Keep track of in-flight DHTSearch objects.
+
+    Every search gets a deadline when it is added. Searches leave the
+    manager exactly once: when they finish, when they are cancelled or
+    when their deadline passes, in which case the callback receives the
+    partial shortlist gathered so far.
+    """
+
+    def __init__(self, market_id, timeout=constants.DHT_SEARCH_TIMEOUT_IN_SECONDS):
+        self.timeout = timeout
+        self.searches = {}
+        self.searches_by_key = {}
+
+        # Lifetime counters
+        self.num_started = 0
+        self.num_coalesced = 0
+        self.num_finished = 0
+        self.num_cancelled = 0
+        self.num_timed_out = 0
+        self.num_probes_timed_out = 0
+
+        self.log = logging.getLogger(
+            '[%s] %s' % (market_id, self.__class__.__name__)
+        )
+
+    def __len__(self):
+        return len(self.searches)
+
+    def __contains__(self, find_id):
+        return find_id in self.searches
+
+    def __iter__(self):
+        return iter(self.searches.values())
+
+    def get(self, find_id):
+        return self.searches.get(find_id)
+
+    def add(self, search, timeout=None, coalesce=True):
+        """
+        Register a search and set its deadline.
+
+        @param search: The search to track.
+        @type search: DHTSearch
+
+        @param timeout: Seconds until the search expires; defaults to
+                        the manager's timeout.
+        @type timeout: int
+
+        @param coalesce: Whether later lookups of the same key may attach
+                         to this search (see find). Searches started from
+                         a given shortlist are not found, and do not
+                         replace the one that is.
+        @type coalesce: bool
+        """
+        if timeout is None:
+            timeout = self.timeout
+        search.deadline = search.started + timeout
+        self.searches[search.find_id] = search
+        if coalesce:
+            self.searches_by_key[(search.call, search.key)] = search
+        self.num_started += 1
+
+    def find(self, call, key):
+        """Return the live search of type `call` for `key`, if any."""
+        return self.searches_by_key.get((call, key))
+
+    def attach(self, search, callback):
+        """Have `callback` receive the result of an existing search."""
+        if callback is not None:
+            search.callbacks.append(callback)
+        self.num_coalesced += 1
+
+    def _pop(self, find_id):
+        search = self.searches.pop(find_id, None)
+        if search is not None:
+            by_key = (search.call, search.key)
+            if self.searches_by_key.get(by_key) is search:
+                del self.searches_by_key[by_key]
+        return search
+
+    def finish(self, find_id, result):
+        """
+        Evict the search and hand `result` to its callbacks.
+
+        @return: False if there was no live search with this findID.
+        @rtype: bool
+        """
+        search = self._pop(find_id)
+        if search is None:
+            return False
+        self.num_finished += 1
+        self._run_callback(search, result)
+        return True
+
+    def cancel(self, find_id, callback=None):
+        """
+        Evict the search without invoking its callbacks.
+
+        With `callback`, only that callback is detached, and the search
+        is evicted once no callbacks are left.
+
+        @return: False if there was no live search with this findID, or
+                 callback was not attached to it.
+        @rtype: bool
+        """
+        search = self.searches.get(find_id)
+        if search is None:
+            return False
+        if callback is not None:
+            if callback not in search.callbacks:
+                return False
+            search.callbacks = [cb for cb in search.callbacks if cb != callback]
+            if search.callbacks:
+                self.log.debug('Detached a callback from search %s', find_id)
+                return True
+
+        self._pop(find_id)
+        self.log.debug('Cancelled search %s', find_id)
+        self.num_cancelled += 1
+        return True
+
+    def expire(self, now=None):
+        """
+        Evict every search whose deadline has passed, firing their
+        callbacks with the partial shortlist.
+
+        @return: The number of searches that timed out.
+        @rtype: int
+        """
+        if now is None:
+            now = time.time()
+        expired = [s for s in self.searches.values() if s.deadline <= now]
+        for search in expired:
+            self._pop(search.find_id)
+            self.num_timed_out += 1
+            self.log.info(
+                'Search %s for %s timed out with %d nodes in shortlist',
+                search.find_id, search.key, len(search.shortlist)
+            )
+            self._run_callback(search, search.shortlist)
+        return len(expired)
+
+    def expire_probes(self, timeout, now=None):
+        """
+        Drop the probes of live searches that went unanswered for
+        `timeout` seconds.
+
+        @return: The searches that lost probes.
+        @rtype: list of DHTSearch
+        """
+        if now is None:
+            now = time.time()
+        searches = []
+        for search in self.searches.values():
+            active_probes = [
+                probe for probe in search.active_probes
+                if now - search.probes_sent.get(probe[2], now) < timeout
+            ]
+            if len(active_probes) < len(search.active_probes):
+                self.num_probes_timed_out += len(search.active_probes) - len(active_probes)
+                self.log.debug('Search %s: %d probes timed out', search.find_id,
+                               len(search.active_probes) - len(active_probes))
+                search.active_probes = active_probes
+                searches.append(search)
+        return searches
+
+    def _run_callback(self, search, result):
+        for callback in search.callbacks:
+            try:
+                callback(result)
+            except Exception:
+                self.log.exception('Callback for search %s failed', search.find_id)
+
+    def age_histogram(self, now=None):
+        """
+        Bucket live searches by age.
+
+        @return: (label, count) pairs ordered from youngest to oldest;
+                 the last bucket holds everything older than the
+                 largest bound.
+        @rtype: list of tuple
+        """
+        if now is None:
+            now = time.time()
+        bounds = constants.DHT_SEARCH_AGE_BUCKETS_IN_SECONDS
+        counts = [0] * (len(bounds) + 1)
+        for search in self.searches.values():
+            age = now - search.started
+            idx = 0
+            while idx < len(bounds) and age >= bounds[idx]:
+                idx += 1
+            counts[idx] += 1
+
+        labels = ['<%ds' % bound for bound in bounds]
+        labels.append('>=%ds' % bounds[-1])
+        return zip(labels, counts)
+
+    def get_stats(self):
+        return {
+            'live': len(self.searches),
+            'started': self.num_started,
+            'coalesced': self.num_coalesced,
+            'finished': self.num_finished,
+            'cancelled': self.num_cancelled,
+            'timed_out': self.num_timed_out,
+            'probes_timed_out': self.num_probes_timed_out,
+            'age_histogram': self.age_histogram()
+        }
+
+    def log_stats(self):
+        self.log.info("Search Stats.")
+        self.log.info("Live Searches:      %d", len(self.searches))
+        self.log.info("Started Searches:   %d", self.num_started)
+        self.log.info("Coalesced Lookups:  %d", self.num_coalesced)
+        self.log.info("Finished Searches:  %d", self.num_finished)
+        self.log.info("Cancelled Searches: %d", self.num_cancelled)
+        self.log.info("Timed Out Searches: %d", self.num_timed_out)
+        self.log.info("Timed Out Probes:   %d", self.num_probes_timed_out)
+        for label, count in self.age_histogram():
+            self.log.info("Age %-6s          %d", label, count)
+
+
+class ValueCache(object):
+    """
+    Short-lived, size-bounded memory of values found by findValue
+    lookups, so that bursts of identical queries cost one lookup.
+    """
+
+    def __init__(self, ttl=constants.DHT_VALUE_CACHE_TTL_IN_SECONDS,
+                 max_size=constants.DHT_VALUE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()  # key -> (expiry time, value)
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, now=None):
+        """Return the cached value for `key` or None if absent or stale."""
+        if now is None:
+            now = time.time()
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= now:
+            if entry is not None:
+                del self.entries[key]
+            self.num_misses += 1
+            return None
+        self.num_hits += 1
+        return entry[1]
+
+    def set(self, key, value, now=None):
+        if now is None:
+            now = time.time()
+        self.entries.pop(key, None)
+        self.entries[key] = (now + self.ttl, value)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+
+class StoreStats(object):
+    """Fan-out of iterative_store operations and store batching."""
+
+    def __init__(self, market_id):
+        self.log = logging.getLogger(
+            '[%s] %s' % (market_id, self.__class__.__name__)
+        )
+        self.num_stores = 0
+        self.total_fanout = 0
+        self.max_fanout = 0
+        self.last_fanout = 0
+        self.num_batches = 0
+        self.total_batched_stores = 0
+
+    def add_store(self, fanout):
+        self.num_stores += 1
+        self.total_fanout += fanout
+        self.max_fanout = max(self.max_fanout, fanout)
+        self.last_fanout = fanout
+
+    def add_batch(self, size):
+        self.num_batches += 1
+        self.total_batched_stores += size
+
+    def get_stats(self):
+        return {
+            'stores': self.num_stores,
+            'average_fanout': float(self.total_fanout) / self.num_stores if self.num_stores else 0,
+            'max_fanout': self.max_fanout,
+            'last_fanout': self.last_fanout,
+            'batches': self.num_batches,
+            'batched_stores': self.total_batched_stores
+        }
+
+    def log_stats(self):
+        self.log.info("Store Stats.")
+        self.log.info("Total Stores:           %d", self.num_stores)
+        if self.num_stores:
+            self.log.info("Average Store Fan-out:  %.1f",
+                          float(self.total_fanout) / self.num_stores)
+        self.log.info("Max Store Fan-out:      %d", self.max_fanout)
+        self.log.info("Store Batches Sent:     %d", self.num_batches)
+        self.log.info("Stores Sent In Batches: %d", self.total_batched_stores)
+
+
+class RefreshPacer(object):
+    """
+    Stagger bucket refresh lookups instead of starting them all at once.
+
+    IDs of stale KBuckets are queued and one refresh lookup is started
+    per tick, as long as fewer than `max_concurrent` are running. Right
+    before its lookup starts, a bucket is checked again and skipped if
+    other lookups touched it since it was queued.
+    """
+
+    def __init__(self, market_id, start_lookup, needs_refresh,
+                 max_concurrent=constants.DHT_REFRESH_MAX_CONCURRENT,
+                 lookup_timeout=2 * constants.DHT_SEARCH_TIMEOUT_IN_SECONDS,
+                 clock=time.time):
+        """
+        @param start_lookup: Called with a node ID and a callback to start
+                             a lookup; the callback runs when it is done.
+        @param needs_refresh: Called with a queued node ID; returns whether
+                              its bucket is still stale.
+        @param lookup_timeout: Lookups that never reported back stop
+                               counting as running after this many seconds.
+        """
+        self.log = logging.getLogger(
+            '[%s] %s' % (market_id, self.__class__.__name__)
+        )
+        self._start_lookup = start_lookup
+        self._needs_refresh = needs_refresh
+        self.max_concurrent = max_concurrent
+        self.lookup_timeout = lookup_timeout
+        self._clock = clock
+
+        self.queue = deque()
+        self.running = {}  # node ID -> time its lookup started
+
+        self.num_started = 0
+        self.num_skipped = 0
+        self.num_finished = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def enqueue(self, node_ids):
+        """Queue refresh lookups for the given node IDs, once each."""
+        for node_id in node_ids:
+            if node_id not in self.queue and node_id not in self.running:
+                self.queue.append(node_id)
+
+    def tick(self):
+        """
+        Start the next due refresh lookup, if any may run now.
+
+        @return: The node ID looked up or None.
+        """
+        now = self._clock()
+        for node_id, started in self.running.items():
+            if now - started > self.lookup_timeout:
+                del self.running[node_id]
+
+        if len(self.running) >= self.max_concurrent:
+            return None
+
+        while self.queue:
+            node_id = self.queue.popleft()
+            if not self._needs_refresh(node_id):
+                self.num_skipped += 1
+                continue
+
+            self.running[node_id] = now
+            self.num_started += 1
+            self._start_lookup(node_id, functools.partial(self._on_lookup_done, node_id))
+            return node_id
+
+        return None
+
+    def _on_lookup_done(self, node_id, *args):
+        if self.running.pop(node_id, None) is not None:
+            self.num_finished += 1
+
+    def get_stats(self):
+        return {
+            'queue_depth': len(self.queue),
+            'running': len(self.running),
+            'started': self.num_started,
+            'skipped': self.num_skipped,
+            'finished': self.num_finished
+        }
+
+    def log_stats(self):
+        self.log.info("Refresh Stats.")
+        self.log.info("Refresh Queue Depth:    %d", len(self.queue))
+        self.log.info("Running Refreshes:      %d", len(self.running))
+        self.log.info("Refreshes Started:      %d", self.num_started)
+        self.log.info("Refreshes Skipped:      %d", self.num_skipped)
+        self.log.info("Refreshes Finished:     %d", self.num_finished)
@@ -0,0 +1,108 @@
+"""
+Signed binary envelopes for peer messages.
+
+Legacy messages are serialized to JSON, hex encoded, signed, and then
+wrapped with the hex of the signature in another JSON object, so the
+receiver parses JSON twice and decodes hex twice. An envelope is
+signed once over raw bytes instead:
+
+    ENVELOPE_MAGIC | signature length (2) | signature | body
+
+The body is the message as compact JSON, and the signature covers
+ENVELOPE_MAGIC followed by the body. Both kinds are compressed and
+ECIES encrypted the same way; once inflated, legacy messages start with
+'{'. Peers understand envelopes from protocol version
+ENVELOPE_MIN_VERSION on (supports_envelope).
+"""
+
+import json
+import struct
+
+from node.constants import ENVELOPE_MIN_VERSION
+from node.crypto_util import get_cryptor
+
+ENVELOPE_MAGIC = 'OBE\x01'
+
+_HEADER = struct.Struct('!4sH')
+
+
+def parse_version(version):
+    """
+    Parse a protocol version such as "0.5.1".
+
+    @return: The version as a tuple of ints; empty if malformed.
+    @rtype: tuple
+    """
+    try:
+        return tuple(int(part) for part in version.split('.'))
+    except (AttributeError, ValueError):
+        return ()
+
+
+def supports_envelope(version):
+    """ Return whether a peer with protocol version `version` reads
+    envelopes. """
+    return parse_version(version) >= parse_version(ENVELOPE_MIN_VERSION)
+
+
+def is_envelope(data):
+    return data[:len(ENVELOPE_MAGIC)] == ENVELOPE_MAGIC
+
+
+def encode(message, sign):
+    """
+    Serialize and sign a message.
+
+    @param message: The message; must contain the sender's 'pubkey'.
+    @type message: dict
+
+    @param sign: Signs bytes with the sender's private key.
+    @type sign: function
+
+    @return: The envelope.
+    @rtype: str
+    """
+    body = json.dumps(message, separators=(',', ':'))
+    signature = sign(ENVELOPE_MAGIC + body)
+    return _HEADER.pack(ENVELOPE_MAGIC, len(signature)) + signature + body
+
+
+def parse(data):
+    """
+    Split an envelope without verifying it.
+
+    @return: (message, signature, signed data)
+    @rtype: tuple
+
+    @raise ValueError: The envelope is malformed.
+    """
+    if len(data) < _HEADER.size or not is_envelope(data):
+        raise ValueError('Not an envelope')
+    _, sig_length = _HEADER.unpack_from(data)
+    body_offset = _HEADER.size + sig_length
+    if len(data) <= body_offset:
+        raise ValueError('Truncated envelope')
+
+    body = data[body_offset:]
+    message = json.loads(body)
+    if not isinstance(message, dict):
+        raise ValueError('Envelope body is not an object')
+    return message, data[_HEADER.size:body_offset], ENVELOPE_MAGIC + body
+
+
+def decode(data):
+    """
+    Parse an envelope and verify its signature against the sender's
+    pubkey.
+
+    @return: The message, or None if the signature is invalid.
+    @rtype: dict
+
+    @raise ValueError: The envelope is malformed.
+    """
+    message, signature, signed = parse(data)
+    if not message.get('pubkey'):
+        raise ValueError('Envelope without pubkey')
+    if get_cryptor(message['pubkey']).verify(signature, signed):
+        return message
+    return None
@@ -10,11 +10,13 @@ class GUIDMixin(object):
     Any class that is meant to be used as a GUID
     should inherit this one.
     """
+    __slots__ = ('guid',)
+
     def __init__(self, guid):
         self.guid = guid
 
     def __eq__(self, other):
-        if isinstance(other, self.__class__):
+        if isinstance(other, GUIDMixin):
             return self.guid == other.guid
         elif isinstance(other, basestring):
             # FIXME: This functionality is deprecated. You should
@@ -1,3 +1,4 @@
+import collections
 import logging
 
 from node import constants, guid
@@ -32,6 +33,11 @@ class KBucket(object):
         self.contacts = []
         self.market_id = market_id
 
+        # Contacts seen while the bucket was full, eligible to replace
+        # stale entries. The most recently seen contact is at the tail;
+        # the least recently seen one falls off the head.
+        self.replacement_cache = collections.deque(maxlen=constants.CACHE_K)
+
         self.log = logging.getLogger(
             '[%s] %s' % (market_id, self.__class__.__name__)
         )
@@ -153,6 +159,64 @@ class KBucket(object):
         """
         self.contacts.remove(contact)
 
+    def cache_contact(self, contact):
+        """
+        Put a contact that doesn't fit in the bucket in the replacement
+        cache, or move it to the most recently seen end if it is cached
+        already. Once the cache holds CACHE_K contacts, the least
+        recently seen one is dropped.
+
+        @param contact: The contact to cache.
+        @type contact: guid.GUIDMixin or str or unicode
+        """
+        if isinstance(contact, basestring):
+            contact = guid.GUIDMixin(contact)
+        self.remove_cached_contact(contact)
+        self.replacement_cache.append(contact)
+
+    def remove_cached_contact(self, contact):
+        """
+        Remove given contact from the replacement cache, if present.
+
+        @param contact: The ID of the contact to remove.
+        @type contact: guid.GUIDMixin or str or unicode
+
+        @return: True if the contact was cached, False otherwise.
+        @rtype: bool
+        """
+        try:
+            self.replacement_cache.remove(contact)
+        except ValueError:
+            return False
+        return True
+
+    def pop_cached_contact(self):
+        """
+        Remove and return the most recently seen cached contact.
+
+        @return: The contact or None if the cache is empty.
+        @rtype: guid.GUIDMixin or None
+        """
+        if not self.replacement_cache:
+            return None
+        return self.replacement_cache.pop()
+
+    def get_cached_contacts(self):
+        """
+        Return all cached contacts, least recently seen first.
+
+        @rtype: list of guid.GUIDMixin
+        """
+        return list(self.replacement_cache)
+
+    def fill_from_cache(self):
+        """
+        Move the most recently seen cached contacts to the contact
+        list until the bucket is full or the cache is empty.
+        """
+        while len(self.contacts) < constants.K and self.replacement_cache:
+            self.add_contact(self.replacement_cache.pop())
+
     def key_in_range(self, key):
         """
         Tests whether the specified node ID is in the range of the ID
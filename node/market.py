@@ -18,6 +18,7 @@ from node.data_uri import DataURI
 from node.orders import Orders
 from node.protocol import proto_page, query_page
 import bitcoin
+import functools
 import time
 
 
@@ -94,10 +95,23 @@ class Market(object):
     def start_listing_republisher(self):
         # Periodically refresh buckets
         refresh_cb = ioloop.PeriodicCallback(self.dht._refresh_node,
-                                             constants.REFRESH_TIMEOUT,
+                                             constants.CHECK_REFRESH_INTERVAL * 1000,
                                              io_loop=self.loop)
         refresh_cb.start()
 
+        # Own listings are republished by the DHT's republish scheduler
+        listings = self.db_connection.select_entries("contracts", {"deleted": 0})
+        for listing in listings:
+            self.schedule_contract_republish(listing['key'])
+
+    def schedule_contract_republish(self, contract_key, due=None):
+        """Have the republish scheduler push a contract out periodically"""
+        self.dht.republisher.schedule(
+            'contract-%s' % contract_key,
+            functools.partial(self._republish_contract, contract_key),
+            due
+        )
+
     def disable_welcome_screen(self):
         """This just flags the welcome screen to not show on startup"""
         self.db_connection.update_entries(
@@ -195,7 +209,10 @@ class Market(object):
             )
 
     def update_keywords_on_network(self, key, keywords):
-        """Update keyword for sharing it with nodes"""
+        """Update keyword for sharing it with nodes
+
+        Returns the number of keyword index entries stored.
+        """
         for keyword in keywords:
             keyword = keyword.upper()
             hash_value = hashlib.new('ripemd160')
@@ -215,6 +232,7 @@ class Market(object):
                 }),
                 self.transport.guid
             )
+        return len(keywords)
 
     def refund_recipient(self, recipient_id, order_id):
         self.log.debug('Refunding recipient')
@@ -298,6 +316,8 @@ class Market(object):
         keywords = contract['Contract']['item_keywords']
         self.update_keywords_on_network(contract_key, keywords)
 
+        self.schedule_contract_republish(contract_key)
+
     def shipping_address(self):
         """Get shipping address"""
         settings = self.get_settings()
@@ -371,29 +391,51 @@ class Market(object):
         )
 
     def republish_contracts(self):
-        """Update information about contracts in the network"""
+        """Update information about contracts in the network
+
+        The contracts are queued for immediate republishing; the
+        republish scheduler sends them out as its rate limit allows.
+        """
         listings = self.db_connection.select_entries("contracts", {"deleted": 0})
+        now = time.time()
         for listing in listings:
-            self.transport.store(
-                listing['key'],
-                listing.get('signed_contract_body'),
-                self.transport.guid
-            )
+            self.schedule_contract_republish(listing['key'], now)
 
-            # Push keyword index out again
-            contract_body = json.loads(listing.get('contract_body'))
-            self.log.debug('Listing: %s', listing)
-            self.log.debug('Contract: %s', contract_body)
+        # Updating the DHT index of your store's listings
+        self.update_listings_index()
+
+    def _republish_contract(self, contract_key):
+        """Store a contract and its keyword index entries in the network
+
+        Returns the number of keys stored, for the republish scheduler's
+        rate limit.
+        """
+        listings = self.db_connection.select_entries(
+            "contracts", {"key": contract_key, "deleted": 0}
+        )
+        if not listings:
+            # Removed since it was scheduled
+            self.dht.republisher.unschedule('contract-%s' % contract_key)
+            return 0
+        listing = listings[0]
+
+        self.transport.store(
+            listing['key'],
+            listing.get('signed_contract_body'),
+            self.transport.guid
+        )
 
-            contract = contract_body.get('Contract')
+        # Push keyword index out again
+        contract_body = json.loads(listing.get('contract_body'))
+        self.log.debug('Listing: %s', listing)
+        self.log.debug('Contract: %s', contract_body)
 
-            keywords = contract.get('item_keywords') if contract is not None else []
-            self.log.debug('Found keywords to republish: %s', keywords)
+        contract = contract_body.get('Contract')
 
-            self.update_keywords_on_network(listing.get('key'), keywords)
+        keywords = contract.get('item_keywords') if contract is not None else []
+        self.log.debug('Found keywords to republish: %s', keywords)
 
-        # Updating the DHT index of your store's listings
-        self.update_listings_index()
+        return 1 + self.update_keywords_on_network(listing.get('key'), keywords)
 
     def get_notaries(self):
         """Getting notaries and exchange contact in network"""
@@ -583,7 +625,7 @@ class Market(object):
         })
 
         # Send to peer
-        peer = self.dht.routing_table.get_contact(msg.get('recipient'))
+        peer = self.dht.get_peer(msg.get('recipient'))
         if peer:
             peer.send({
                 'type': 'inbox_message',
@@ -798,7 +840,7 @@ class Market(object):
         settings = []
         settings = self.get_settings()
 
-        peer = self.dht.routing_table.get_contact(msg['senderGUID'])
+        peer = self.dht.get_peer(msg['senderGUID'])
         if not peer:
             peer = self.transport.dht.add_peer(
                 msg['hostname'],
@@ -1,3 +1,4 @@
+import os
 import sys
 from urlparse import urlparse
 import re
@@ -145,6 +146,38 @@ def is_valid_uri(uri):
     )
 
 
+def get_udp_drops(sock, proc_files=('/proc/net/udp', '/proc/net/udp6')):
+    """
+    Return how many datagrams the kernel dropped for a UDP socket, for
+    instance because its receive buffer was full.
+
+    @param sock: A UDP socket.
+    @type sock: socket.socket
+
+    @return: The drop count, or None where the kernel does not report it
+             (it is read from /proc/net/udp on Linux).
+    @rtype: int or None
+    """
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+    except (EnvironmentError, AttributeError):
+        return None
+
+    for path in proc_files:
+        try:
+            with open(path) as proc_file:
+                lines = proc_file.readlines()[1:]
+        except EnvironmentError:
+            continue
+
+        for line in lines:
+            # sl local rem st tx:rx tr:tm retrnsmt uid timeout inode ref pointer drops
+            fields = line.split()
+            if len(fields) >= 13 and fields[9] == inode:
+                return int(fields[12])
+    return None
+
+
 class PacketStats(object):
     def __init__(self):
         self.log = logging.getLogger(
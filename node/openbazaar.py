@@ -55,8 +55,10 @@ def create_argument_parser():
 
     int_args = (
         ('--bm-port',),
+        ('--crypto-workers',),
         ('--dev-nodes', '-n'),
         ('--http-port', '-q'),
+        ('--max-peers',),
         ('--server-port', '-p'),
         ('--mediator-port',)
     )
@@ -199,6 +201,14 @@ openbazaar [options] <command>
         Enable periodic IP address checking.
         Useful in case you expect your IP to change rapidly.
 
+    --max-peers <number>
+        Most peer connections kept open at once (default 128).
+        Idle connections beyond this are closed; the peers stay known.
+
+    --crypto-workers <number>
+        Processes that decrypt and verify incoming messages (default 0:
+        done by the main process). Set to the number of spare cores.
+
     -s, --seeds
         Specify seed servers to bootstrap the network rather than use defaults
 """
@@ -291,7 +301,9 @@ def create_openbazaar_contexts(arguments, nat_status):
                                          arguments.disable_stun_check,
                                          arguments.disable_open_browser,
                                          arguments.disable_sqlite_crypt,
-                                         arguments.enable_ip_checker))
+                                         arguments.enable_ip_checker,
+                                         arguments.max_peers,
+                                         arguments.crypto_workers))
     else:
         # Create an OpenBazaarContext object for each development node.
         db_path = os.path.join(defaults['db_dir'], 'this_will_be_ignored')
@@ -338,7 +350,9 @@ def create_openbazaar_contexts(arguments, nat_status):
                                              arguments.disable_stun_check,
                                              arguments.disable_open_browser,
                                              arguments.disable_sqlite_crypt,
-                                             arguments.enable_ip_checker))
+                                             arguments.enable_ip_checker,
+                                             arguments.max_peers,
+                                             arguments.crypto_workers))
     return ob_ctxs
 
 
@@ -69,7 +69,9 @@ class OpenBazaarContext(object):
                  disable_stun_check,
                  disable_open_browser,
                  disable_sqlite_crypt,
-                 enable_ip_checker):
+                 enable_ip_checker,
+                 max_peers,
+                 crypto_workers):
         self.nat_status = nat_status
         self.server_ip = server_ip
         self.server_port = server_port
@@ -93,6 +95,8 @@ class OpenBazaarContext(object):
         self.disable_open_browser = disable_open_browser
         self.disable_sqlite_crypt = disable_sqlite_crypt
         self.enable_ip_checker = enable_ip_checker
+        self.max_peers = max_peers
+        self.crypto_workers = crypto_workers
 
         # to deduce up-time, and (TODO) average up-time
         # time stamp in (non-local) Coordinated Universal Time format.
@@ -120,6 +124,8 @@ class OpenBazaarContext(object):
                           "disable_open_browser": self.disable_open_browser,
                           "disable_sqlite_crypt": self.disable_sqlite_crypt,
                           "enable_ip_checker": self.enable_ip_checker,
+                          "max_peers": self.max_peers,
+                          "crypto_workers": self.crypto_workers,
                           "started_utc_timestamp": self.started_utc_timestamp,
                           "uptime_in_secs": (int(time.time()) -
                                              int(self.started_utc_timestamp))}
@@ -161,6 +167,8 @@ class OpenBazaarContext(object):
                 'mediator_port': 5000,
                 'mediator': False,
                 'enable_ip_checker': False,
+                'max_peers': constants.PEER_TABLE_MAX_SIZE,
+                'crypto_workers': constants.CRYPTO_POOL_WORKERS,
                 'config_file': None}
 
     @staticmethod
@@ -189,7 +197,9 @@ class OpenBazaarContext(object):
             disable_stun_check=defaults['disable_stun_check'],
             disable_open_browser=defaults['disable_open_browser'],
             disable_sqlite_crypt=defaults['disable_sqlite_crypt'],
-            enable_ip_checker=defaults['enable_ip_checker']
+            enable_ip_checker=defaults['enable_ip_checker'],
+            max_peers=defaults['max_peers'],
+            crypto_workers=defaults['crypto_workers']
         )
 
 
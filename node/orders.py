@@ -755,7 +755,7 @@ class Orders(object):
         while (len(self.db_connection.select_entries("orders", {"id": order_id}))) > 0:
             order_id = random.randint(0, 1000000)
 
-        seller = self.transport.dht.routing_table.get_contact(msg['sellerGUID'])
+        seller = self.transport.dht.get_peer(msg['sellerGUID'])
 
         buyer = {'Buyer': {}}
         buyer['Buyer']['buyer_GUID'] = self.transport.guid
@@ -0,0 +1,103 @@
+"""
+Types of the UDP datagrams peers exchange.
+
+A datagram starts with a one-byte type header (PACKET_TYPE_* in
+node.constants) followed by its payload, so the listener classifies it
+with a single table lookup. Nodes predating the headers send text
+prefixes ('ping', 'relayto <guid> ...') or bare RUDP JSON; those are
+still recognised, and are what encode() produces unless
+PACKET_TYPE_HEADERS is set.
+
+Functions:
+    classify -- Split a datagram into its type and payload.
+    encode -- Build a datagram of a type from its payload.
+    has_header -- Whether a datagram starts with a type header.
+"""
+
+from node.constants import PACKET_TYPE_PING, PACKET_TYPE_PONG, PACKET_TYPE_SEND_RELAY_PING, \
+    PACKET_TYPE_RELAY_PING, PACKET_TYPE_SEND_RELAY_PONG, PACKET_TYPE_RELAY_PONG, \
+    PACKET_TYPE_HEARTBEAT, PACKET_TYPE_RELAYTO, PACKET_TYPE_RELAY, PACKET_TYPE_PUNCH, \
+    PACKET_TYPE_DATA, PACKET_TYPE_RUDP, PACKET_TYPE_HEADERS, MSG_PING_ID, MSG_PONG_ID, MSG_SEND_RELAY_PING_ID, \
+    MSG_RELAY_PING_ID, MSG_SEND_RELAY_PONG_ID, MSG_RELAY_PONG_ID, MSG_HEARTBEAT_ID, MSG_RELAYTO_ID, \
+    MSG_RELAY_ID, MSG_PUNCH_ID
+
+LEGACY_PREFIXES = {
+    PACKET_TYPE_PING: MSG_PING_ID,
+    PACKET_TYPE_PONG: MSG_PONG_ID,
+    PACKET_TYPE_SEND_RELAY_PING: MSG_SEND_RELAY_PING_ID,
+    PACKET_TYPE_RELAY_PING: MSG_RELAY_PING_ID,
+    PACKET_TYPE_SEND_RELAY_PONG: MSG_SEND_RELAY_PONG_ID,
+    PACKET_TYPE_RELAY_PONG: MSG_RELAY_PONG_ID,
+    PACKET_TYPE_HEARTBEAT: MSG_HEARTBEAT_ID,
+    PACKET_TYPE_RELAYTO: MSG_RELAYTO_ID,
+    PACKET_TYPE_RELAY: MSG_RELAY_ID,
+    PACKET_TYPE_PUNCH: MSG_PUNCH_ID,
+}
+
+PACKET_TYPES = frozenset(LEGACY_PREFIXES) | frozenset([PACKET_TYPE_DATA, PACKET_TYPE_RUDP])
+
+_LEGACY_TYPES = dict((prefix, packet_type) for packet_type, prefix in LEGACY_PREFIXES.items())
+_LEGACY_PREFIX_MAX_SIZE = max(len(prefix) for prefix in _LEGACY_TYPES)
+
+
+def has_header(data):
+    return data[:1] in PACKET_TYPES
+
+
+def classify(data):
+    """
+    Split a datagram into its type and payload.
+
+    Legacy datagrams are matched on the word before the first space
+    (or on the whole datagram if it is a bare prefix such as 'ping');
+    anything unrecognised is taken to be RUDP data.
+
+    @param data: The datagram as read from the socket.
+    @type data: str
+
+    @return: The packet type and the payload following its header or
+             prefix; the whole datagram for legacy RUDP data.
+    @rtype: tuple
+    """
+    header = data[:1]
+    if header in PACKET_TYPES:
+        return header, data[1:]
+    if header == '{':
+        return PACKET_TYPE_DATA, data
+
+    end = data.find(' ', 0, _LEGACY_PREFIX_MAX_SIZE + 1)
+    if end < 0:
+        packet_type = _LEGACY_TYPES.get(data[:_LEGACY_PREFIX_MAX_SIZE + 1])
+        if packet_type is not None:
+            return packet_type, ''
+    else:
+        packet_type = _LEGACY_TYPES.get(data[:end])
+        if packet_type is not None:
+            return packet_type, data[end + 1:]
+    return PACKET_TYPE_DATA, data
+
+
+def encode(packet_type, payload='', header=None):
+    """
+    Build a datagram.
+
+    @param packet_type: One of the PACKET_TYPE_* constants.
+    @type packet_type: str
+
+    @param payload: Space separated fields of a control datagram, or
+                    an RUDP packet.
+    @type payload: str
+
+    @param header: Whether to use a type header rather than the legacy
+                   text prefix; PACKET_TYPE_HEADERS if None.
+    @type header: bool
+    """
+    if header is None:
+        header = PACKET_TYPE_HEADERS
+    # Binary RUDP packets have no legacy form
+    if header or packet_type == PACKET_TYPE_RUDP:
+        return packet_type + payload
+    if packet_type == PACKET_TYPE_DATA:
+        return payload
+    prefix = LEGACY_PREFIXES[packet_type]
+    return '%s %s' % (prefix, payload) if payload else prefix
@@ -1,4 +1,5 @@
 from node import constants
+from node.envelope import parse_version
 
 
 def shout(data):
@@ -41,7 +42,7 @@ def query_page(guid):
     return data
 
 
-def proto_store(key, value, original_publisher_id, age):
+def proto_store(key, value, original_publisher_id, age, ttl=None):
     data = {
         'type': 'store',
         'key': key,
@@ -50,4 +51,21 @@ def proto_store(key, value, original_publisher_id, age):
         'age': age,
         'v': constants.VERSION
     }
+    if ttl:
+        data['ttl'] = ttl
     return data
+
+
+def proto_store_batch(stores):
+    data = {
+        'type': 'storeBatch',
+        'stores': stores,
+        'v': constants.VERSION
+    }
+    return data
+
+
+def supports_store_batch(version):
+    """ Return whether a peer with protocol version `version` reads
+    storeBatch messages. """
+    return parse_version(version) >= parse_version(constants.STORE_BATCH_MIN_VERSION)
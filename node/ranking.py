@@ -0,0 +1,176 @@
+"""
+Rank node IDs by XOR distance to a target key.
+
+With NumPy installed, large candidate sets are packed into an array of
+160-bit IDs (two big-endian uint64 words and a uint32 word per ID), XORed
+with the target in bulk and ranked with argpartition and lexsort. Without
+NumPy, or for small sets where the array setup costs more than it saves,
+distances are computed with Python longs.
+
+Classes:
+    DistanceRanker -- Ranks a fixed set of node IDs against any target.
+
+Functions:
+    sort_by_distance -- Sort arbitrary items by the distance of their IDs.
+"""
+
+import binascii
+import heapq
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from node import constants, guid
+
+# Below this many IDs the pure Python ranking is faster
+NUMPY_MIN_CANDIDATES = 64
+
+if numpy is not None:
+    _ID_DTYPE = numpy.dtype([('hi', '>u8'), ('mid', '>u8'), ('lo', '>u4')])
+
+
+def _hex_id(node_id):
+    if isinstance(node_id, guid.GUIDMixin):
+        node_id = node_id.guid
+    if not isinstance(node_id, basestring) or len(node_id) != constants.HEX_NODE_ID_LEN:
+        return None
+    return node_id
+
+
+class DistanceRanker(object):
+    """
+    A set of node IDs that can be ranked by XOR distance to any key.
+
+    IDs which have no distance (None, seed placeholders, malformed IDs)
+    always rank last, in their original order.
+    """
+
+    def __init__(self, node_ids, use_numpy=None):
+        """
+        @param node_ids: The IDs to rank.
+        @type node_ids: iterable of str, unicode or guid.GUIDMixin
+
+        @param use_numpy: Force the NumPy (True) or pure Python (False)
+                          ranking. By default NumPy is used when it is
+                          installed and there are enough IDs.
+        @type use_numpy: bool or None
+        """
+        self.node_ids = list(node_ids)
+
+        if use_numpy is None:
+            use_numpy = numpy is not None and len(self.node_ids) >= NUMPY_MIN_CANDIDATES
+        elif use_numpy and numpy is None:
+            raise ValueError('NumPy is not installed')
+        # Decoding an ID also validates it
+        decode = binascii.unhexlify if use_numpy else lambda hex_id: int(hex_id, 16)
+
+        self.invalid = []
+        indexes = []
+        decoded = []
+        for index, node_id in enumerate(self.node_ids):
+            hex_id = _hex_id(node_id)
+            try:
+                decoded.append(decode(hex_id))
+            except (TypeError, ValueError):
+                self.invalid.append(index)
+            else:
+                indexes.append(index)
+
+        self._packed = None
+        self._ints = None
+        if use_numpy:
+            self._indexes = numpy.array(indexes, dtype=numpy.intp)
+            self._packed = numpy.frombuffer(''.join(decoded), dtype=_ID_DTYPE)
+        else:
+            self._indexes = indexes
+            self._ints = decoded
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def closest(self, target, count=None):
+        """
+        Rank the IDs by distance to `target`.
+
+        @param target: The key to measure distances to.
+        @type target: str or unicode or guid.GUIDMixin
+
+        @param count: How many IDs to return; all of them if None.
+        @type count: int or None
+
+        @return: Indexes into node_ids, closest first.
+        @rtype: list of int
+        """
+        if count is None:
+            count = len(self.node_ids)
+        if count <= 0:
+            return []
+
+        target = _hex_id(target)
+        try:
+            binascii.unhexlify(target)
+        except (TypeError, ValueError):
+            target = None
+        if target is None:
+            # Nothing has a distance to a malformed key; keep the order
+            return range(min(count, len(self.node_ids)))
+
+        if self._packed is not None:
+            ranked = self._closest_numpy(target, count)
+        else:
+            ranked = self._closest_python(target, count)
+        return (ranked + self.invalid)[:count]
+
+    def _closest_python(self, target, count):
+        target_int = int(target, 16)
+        distances = [
+            (node_int ^ target_int, index)
+            for node_int, index in zip(self._ints, self._indexes)
+        ]
+        if count < len(distances):
+            distances = heapq.nsmallest(count, distances)
+        else:
+            distances.sort()
+        return [index for _, index in distances]
+
+    def _closest_numpy(self, target, count):
+        size = len(self._packed)
+        if size == 0:
+            return []
+
+        key = numpy.frombuffer(binascii.unhexlify(target), dtype=_ID_DTYPE)[0]
+        high = self._packed['hi'] ^ key['hi']
+        middle = self._packed['mid'] ^ key['mid']
+        low = self._packed['lo'] ^ key['lo']
+
+        if count < size:
+            # Everything whose top word beats the count-th smallest top
+            # word is in the result; ties are settled by the full sort.
+            kth = numpy.argpartition(high, count - 1)[count - 1]
+            candidates = numpy.flatnonzero(high <= high[kth])
+            order = numpy.lexsort((low[candidates], middle[candidates], high[candidates]))
+            order = candidates[order[:count]]
+        else:
+            order = numpy.lexsort((low, middle, high))
+
+        return self._indexes[order].tolist()
+
+
+def sort_by_distance(items, target, key=None, count=None):
+    """
+    Return `items` sorted by the XOR distance of their IDs to `target`,
+    closest first. Items without a valid ID go last.
+
+    @param key: Extracts the node ID of an item; items are IDs if None.
+    @type key: callable
+
+    @param count: Keep only the `count` closest items.
+    @type count: int or None
+
+    @rtype: list
+    """
+    items = list(items)
+    node_ids = items if key is None else [key(item) for item in items]
+    return [items[index] for index in DistanceRanker(node_ids).closest(target, count)]
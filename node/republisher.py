@@ -0,0 +1,246 @@
+import heapq
+import logging
+import random
+import time
+
+from tornado import ioloop
+
+from node import constants
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket: `rate` tokens are added per second, up to
+    `capacity`; spending more tokens than are available is refused.
+    Charges made after the fact may leave the bucket in debt, which
+    the refill pays off before anything can be consumed again.
+    """
+
+    def __init__(self, rate, capacity, clock=time.time):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self._clock = clock
+        self._last_refill = clock()
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = max(now - self._last_refill, 0)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self._last_refill = now
+
+    def consume(self, tokens=1):
+        """
+        Take `tokens` out of the bucket.
+
+        @return: True if there were enough tokens, False otherwise.
+        @rtype: bool
+        """
+        self._refill()
+        if tokens > self.tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+    def charge(self, tokens):
+        """
+        Take `tokens` out of the bucket even if that leaves it in debt;
+        a negative charge gives tokens back, up to `capacity`.
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - tokens)
+
+
+class RepublishScheduler(object):
+    """
+    Spread republishing of DHT data over the republish interval.
+
+    Every key has its own jittered due time. When a key is due its job
+    runs, but only if the token bucket can pay for one store to `fanout`
+    nodes; otherwise it waits for the next tick. Jobs return how many
+    keys they stored, and the stores beyond the first are charged once
+    the job has run, so later jobs wait until the bucket recovers. Due
+    times are persisted in the republish_schedule table so a restart
+    picks up where the node left off instead of pushing everything.
+    Without a database (db_connection None) nothing is persisted.
+    """
+
+    def __init__(self, db_connection, market_id,
+                 interval=constants.REPUBLISH_INTERVAL_IN_SECONDS,
+                 rate=constants.REPUBLISH_STORES_PER_SECOND,
+                 fanout=constants.K, clock=time.time, loop=None):
+        self.db_connection = db_connection
+        self.market_id = market_id
+        self.interval = interval
+        self.fanout = fanout
+        self.bucket = TokenBucket(rate, max(fanout, rate), clock)
+        self._clock = clock
+        self.loop = loop or ioloop.IOLoop.current()
+
+        self.jobs = {}  # key -> callable doing the republish
+        self.due_times = {}  # key -> time the job runs next
+        self.queue = []  # heap of (due time, key); may hold stale entries
+
+        self.num_runs = 0
+        self.num_throttled = 0
+
+        self.log = logging.getLogger(
+            '[%s] %s' % (market_id, self.__class__.__name__)
+        )
+
+        self._saved_due_times = self._load_due_times()
+        self._ticker = None
+
+    def _load_due_times(self):
+        due_times = {}
+        if self.db_connection is None:
+            return due_times
+        try:
+            rows = self.db_connection.select_entries(
+                "republish_schedule", {"market_id": self.market_id}
+            )
+            for row in rows:
+                due_times[row['key']] = int(row['next_due'])
+        except Exception as exc:
+            self.log.error('Could not load republish schedule: %s', exc)
+        return due_times
+
+    def _save_due_time(self, key, due):
+        if self.db_connection is None:
+            return
+        try:
+            rows = self.db_connection.select_entries(
+                "republish_schedule",
+                {"key": key, "market_id": self.market_id}
+            )
+            if len(rows) == 0:
+                self.db_connection.insert_entry(
+                    "republish_schedule",
+                    {"key": key, "market_id": self.market_id, "next_due": int(due)}
+                )
+            else:
+                self.db_connection.update_entries(
+                    "republish_schedule",
+                    {"next_due": int(due)},
+                    {"key": key, "market_id": self.market_id}
+                )
+        except Exception as exc:
+            self.log.error('Could not save republish time of %s: %s', key, exc)
+
+    def _jittered_interval(self):
+        jitter = constants.REPUBLISH_JITTER
+        return self.interval * random.uniform(1 - jitter, 1 + jitter)
+
+    def start(self):
+        self._ticker = ioloop.PeriodicCallback(
+            self.run_due,
+            constants.REPUBLISH_TICK_IN_SECONDS * 1000,
+            io_loop=self.loop
+        )
+        self._ticker.start()
+
+    def stop(self):
+        if self._ticker is not None:
+            self._ticker.stop()
+            self._ticker = None
+
+    def __contains__(self, key):
+        return key in self.jobs
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def schedule(self, key, job, due=None):
+        """
+        Register `job` to republish `key` once per interval.
+
+        @param key: Unique name of what is republished.
+        @type key: str
+
+        @param job: Callable doing the republish; takes no arguments
+                    and returns the number of keys it stored, each to
+                    `fanout` nodes (None counts as one).
+
+        @param due: When to run the job first. By default the persisted
+                    due time is used, or a random point in the next
+                    interval for keys never seen before.
+        @type due: int or float
+        """
+        if due is None:
+            due = self.due_times.get(key, self._saved_due_times.get(key))
+        if due is None:
+            due = self._clock() + random.uniform(0, self.interval)
+
+        self.jobs[key] = job
+        self._set_due(key, due)
+
+    def unschedule(self, key):
+        self.jobs.pop(key, None)
+        self.due_times.pop(key, None)
+        if self.db_connection is None:
+            return
+        try:
+            self.db_connection.delete_entries(
+                "republish_schedule", {"key": key, "market_id": self.market_id}
+            )
+        except Exception as exc:
+            self.log.error('Could not forget republish time of %s: %s', key, exc)
+
+    def _set_due(self, key, due):
+        if self.due_times.get(key) == due:
+            return
+        self.due_times[key] = due
+        heapq.heappush(self.queue, (due, key))
+        self._save_due_time(key, due)
+
+    def run_due(self, now=None):
+        """
+        Run every due job the token bucket can afford.
+
+        @return: The number of jobs run.
+        @rtype: int
+        """
+        if now is None:
+            now = self._clock()
+
+        runs = 0
+        while self.queue:
+            due, key = self.queue[0]
+            if self.due_times.get(key) != due:
+                # Rescheduled or unscheduled since it was queued
+                heapq.heappop(self.queue)
+                continue
+            if due > now:
+                break
+            if not self.bucket.consume(self.fanout):
+                self.num_throttled += 1
+                break
+
+            heapq.heappop(self.queue)
+            self._set_due(key, now + self._jittered_interval())
+
+            stores = None
+            try:
+                stores = self.jobs[key]()
+            except Exception:
+                self.log.exception('Republishing %s failed', key)
+            if stores is None:
+                stores = 1
+            # The first store was paid for up front
+            self.bucket.charge((stores - 1) * self.fanout)
+            runs += 1
+
+        self.num_runs += runs
+
+        # Drop stale heap entries once they dominate the queue
+        if len(self.queue) > 2 * len(self.due_times) + constants.K:
+            self.queue = [(due, key) for key, due in self.due_times.items()]
+            heapq.heapify(self.queue)
+
+        return runs
+
+    def log_stats(self):
+        self.log.info("Republish Stats.")
+        self.log.info("Scheduled Keys:      %d", len(self.jobs))
+        self.log.info("Jobs Run:            %d", self.num_runs)
+        self.log.info("Throttled Ticks:     %d", self.num_throttled)
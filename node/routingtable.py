@@ -4,13 +4,17 @@ Interface and implementation of a Kademlia routing table.
 Classes:
     RoutingTable -- Interface
     OptimizedTreeRoutingTable -- Implementation
+    CachingTreeRoutingTable -- Adapter for the dht package's routing table
 """
+# node.dht would shadow the top-level dht package otherwise
+from __future__ import absolute_import
 
 from abc import ABCMeta, abstractmethod
 import logging
 import time
 
-from node import constants, guid, kbucket
+from dht import routingtable as dht_routingtable, util as dht_util
+from node import constants, guid, kbucket, ranking
 
 
 class RoutingTable(object):
@@ -212,6 +216,55 @@ class RoutingTable(object):
         """
         pass
 
+    @abstractmethod
+    def kbucket_last_accessed(self, node_id):
+        """
+        Return the "last accessed" timestamp of the KBucket which covers
+        the range containing the specified key in the key/ID space.
+
+        @param node_id: A key in the range of the target KBucket
+        @type node_id: guid.GUIDMixin or str or unicode
+
+        @rtype: int
+        """
+        pass
+
+    @abstractmethod
+    def iter_contacts(self):
+        """
+        Iterate over all contacts in the routing table, together with
+        the lower bound of the ID range of the KBucket holding them.
+
+        @return: An iterator of (contact, bucket range_min) tuples.
+        @rtype: iterator
+        """
+        pass
+
+    def report_unreachable(self, node_id):
+        """
+        Handle a contact that stopped answering pings, e.g. by replacing
+        it with a known live contact. Implementations without a
+        replacement cache keep the contact.
+
+        @param node_id: The ID of the unreachable contact.
+        @type node_id: guid.GUIDMixin or str or unicode
+
+        @return: The contact that took its place, if any.
+        @rtype: guid.GUIDMixin or None
+        """
+        return None
+
+    def restore_layout(self, range_mins):
+        """
+        Recreate a previously saved bucket layout before contacts are
+        added back, given the lower bounds of the saved KBuckets'
+        ranges. Implementations that don't split buckets ignore it.
+
+        @param range_mins: Lower bounds of the saved KBucket ranges.
+        @type range_mins: iterable of int
+        """
+        pass
+
 
 class OptimizedTreeRoutingTable(RoutingTable):
     """
@@ -243,9 +296,6 @@ class OptimizedTreeRoutingTable(RoutingTable):
             parent_node_id, market_id
         )
 
-        # Cache containing nodes eligible to replace stale KBucket entries
-        self.replacement_cache = {}
-
         self.buckets = [
             kbucket.KBucket(
                 range_min=0,
@@ -274,7 +324,9 @@ class OptimizedTreeRoutingTable(RoutingTable):
         old_contact = self.buckets[bucket_index].get_contact(contact.guid)
 
         if old_contact:
-            self.remove_contact(contact.guid)
+            # Remove it from the bucket only; going through remove_contact
+            # would promote a cached contact into the freed slot.
+            self.buckets[bucket_index].remove_contact(contact.guid)
 
         try:
             self.buckets[bucket_index].add_contact(contact)
@@ -295,17 +347,7 @@ class OptimizedTreeRoutingTable(RoutingTable):
                 # Put the new contact in our replacement cache for the
                 # corresponding KBucket (or update it's position if it
                 # exists already)
-
-                if bucket_index not in self.replacement_cache:
-                    self.replacement_cache[bucket_index] = []
-                if contact in self.replacement_cache[bucket_index]:
-                    self.replacement_cache[bucket_index].remove(contact)
-                # TODO: Using k to limit the size of the contact
-                # replacement cache - maybe define a separate value for
-                # this in constants.py?
-                elif len(self.replacement_cache) >= constants.K:
-                    self.replacement_cache.pop(0)
-                self.replacement_cache[bucket_index].append(contact)
+                self.buckets[bucket_index].cache_contact(contact)
         # elif old_contact.port == contact.port:
         #     self.log.info('Remove contact')
         #     self.remove_contact(contact.guid)
@@ -435,25 +477,42 @@ class OptimizedTreeRoutingTable(RoutingTable):
         For details, see RoutingTable documentation.
         """
         bucket_index = self.kbucket_index(node_id)
+        bucket = self.buckets[bucket_index]
         try:
-            self.buckets[bucket_index].remove_contact(node_id)
+            bucket.remove_contact(node_id)
         except ValueError:
-            self.log.error("Attempted to remove absent contact %s.", node_id)
+            if not bucket.remove_cached_contact(node_id):
+                self.log.error("Attempted to remove absent contact %s.", node_id)
         else:
-            # Replace this stale contact with one from our replacement
-            # cache, if available.
-            try:
-                cached = self.replacement_cache[bucket_index].pop()
-            except KeyError:
-                # No replacement cache for this bucket.
-                pass
-            except IndexError:
-                # No cached contact for this bucket.
-                pass
-            else:
-                self.buckets[bucket_index].add_contact(cached)
+            # Replace this stale contact with the most recently seen
+            # one from the bucket's replacement cache, if available.
+            bucket.fill_from_cache()
         finally:
-            self.log.datadump('Contacts: %s', self.buckets[bucket_index].contacts)
+            self.log.datadump('Contacts: %s', bucket.contacts)
+
+    def report_unreachable(self, node_id):
+        """
+        Handle a contact that stopped answering pings.
+
+        As in section 4.1 of the Kademlia paper, a stale contact is only
+        evicted when the replacement cache of its KBucket has a contact
+        to take its place; otherwise it is kept, since a contact that
+        was reachable for long is likely to come back. An unreachable
+        contact in the replacement cache is simply dropped.
+
+        For details, see RoutingTable documentation.
+        """
+        bucket = self.buckets[self.kbucket_index(node_id)]
+        if bucket.remove_cached_contact(node_id):
+            return None
+        if bucket.get_contact(node_id) is None or not bucket.replacement_cache:
+            return None
+
+        replacement = bucket.pop_cached_contact()
+        bucket.remove_contact(node_id)
+        bucket.add_contact(replacement)
+        self.log.debug('Replaced unreachable contact %s with %s', node_id, replacement)
+        return replacement
 
     def update_contact(self, contact):
         """
@@ -478,6 +537,40 @@ class OptimizedTreeRoutingTable(RoutingTable):
         bucket_index = self.kbucket_index(node_id)
         self.buckets[bucket_index].last_accessed = timestamp
 
+    def kbucket_last_accessed(self, node_id):
+        """
+        Return the "last accessed" timestamp of the KBucket which covers
+        the range containing the specified key in the key/ID space.
+
+        For details, see RoutingTable documentation.
+        """
+        return self.buckets[self.kbucket_index(node_id)].last_accessed
+
+    def iter_contacts(self):
+        """
+        Iterate over all contacts in the routing table.
+
+        For details, see RoutingTable documentation.
+        """
+        for bucket in self.buckets:
+            for contact in list(bucket.contacts):
+                yield contact, bucket.range_min
+
+    def restore_layout(self, range_mins):
+        """
+        Split KBuckets until every given range_min starts a KBucket.
+        Only KBuckets covering our own ID are split, as in add_contact.
+
+        For details, see RoutingTable documentation.
+        """
+        for range_min in sorted(set(range_mins)):
+            for _ in range(constants.BIT_NODE_ID_LEN):
+                bucket_index = self.kbucket_index(self.num_to_id(range_min))
+                bucket = self.buckets[bucket_index]
+                if bucket.range_min == range_min or not bucket.key_in_range(self.parent_node_id):
+                    break
+                self.split_bucket(bucket_index)
+
     def kbucket_index(self, node_id):
         """
         Calculate the index of the KBucket which is responsible for the
@@ -542,3 +635,191 @@ class OptimizedTreeRoutingTable(RoutingTable):
         # ...and remove them from the old bucket
         for contact in new_bucket.contacts:
             old_bucket.remove_contact(contact)
+        # Split the replacement cache the same way, keeping its order,
+        # and let the cached contacts fill up the room made by the split.
+        cached_contacts = old_bucket.get_cached_contacts()
+        old_bucket.replacement_cache.clear()
+        for contact in cached_contacts:
+            if new_bucket.key_in_range(contact.guid):
+                new_bucket.cache_contact(contact)
+            else:
+                old_bucket.cache_contact(contact)
+        old_bucket.fill_from_cache()
+        new_bucket.fill_from_cache()
+
+
+class CachingTreeRoutingTable(RoutingTable):
+    """
+    Adapter exposing the routing table of the dht package through the
+    RoutingTable interface.
+
+    The dht package finds KBuckets with a binary search and keeps a
+    replacement cache in every KBucket (CachingKBucket). Contacts are
+    ContactRecords (see node.contact); the dht package only relies on
+    their guid attribute.
+    """
+
+    def __init__(self, parent_node_id, market_id):
+        """
+        Initialize a new CachingTreeRoutingTable.
+
+        For details, see RoutingTable documentation.
+        """
+        super(CachingTreeRoutingTable, self).__init__(
+            parent_node_id, market_id
+        )
+        self.table = dht_routingtable.RoutingTable(
+            self._hex_id(parent_node_id), market_id
+        )
+
+        # All contacts and their DistanceRanker, rebuilt on first use
+        # after contacts joined or left the table
+        self._ranked_contacts = None
+        self._ranker = None
+
+    @staticmethod
+    def _hex_id(node_id):
+        if isinstance(node_id, guid.GUIDMixin):
+            return node_id.guid
+        return node_id
+
+    def _kbucket(self, node_id):
+        # pylint: disable=protected-access
+        return self.table[self.table._get_kbucket_index(self._hex_id(node_id))]
+
+    @property
+    def buckets(self):
+        return list(self.table)
+
+    def add_contact(self, contact):
+        """
+        Add the given contact to the correct KBucket; if it already
+        exists, update its status.
+
+        For details, see RoutingTable documentation.
+        """
+        if not contact.guid:
+            self.log.error('No guid specified')
+            return
+
+        known = self.table.get_contact(contact.guid)
+        self.table.add_contact(contact)
+        # Refreshing a known contact, as on every packet from it, leaves
+        # the ranking as it is
+        if known is not contact and (known is not None or self.table.get_contact(contact.guid) is not None):
+            self._ranker = None
+
+    def find_close_nodes(self, key, count, node_id=None):
+        """
+        Find a number of known nodes closest to the node/value with the
+        specified key.
+
+        For details, see RoutingTable documentation.
+        """
+        if self._ranker is None:
+            self._ranked_contacts = [contact for bucket in self.table for contact in bucket]
+            self._ranker = ranking.DistanceRanker(
+                contact.guid for contact in self._ranked_contacts
+            )
+
+        # Rank one extra contact in case the excluded one is among them
+        if node_id is not None:
+            node_id = self._hex_id(node_id)
+        close_nodes = [
+            self._ranked_contacts[index]
+            for index in self._ranker.closest(key, count + (node_id is not None))
+        ]
+        return [contact for contact in close_nodes if contact.guid != node_id][:count]
+
+    def get_contact(self, node_id):
+        """
+        Return the known node with the specified ID, None if not found.
+
+        For details, see RoutingTable documentation.
+        """
+        return self.table.get_contact(self._hex_id(node_id))
+
+    def get_refresh_list(self, start_index=0, force=False):
+        """
+        Find all KBuckets that need refreshing, starting at the
+        KBucket with the specified index, and return IDs to be searched for
+        in order to refresh those KBuckets.
+
+        For details, see RoutingTable documentation.
+        """
+        return [
+            dht_util.random_guid_in_range(bucket.range_min, bucket.range_max)
+            for bucket in self.table[start_index:]
+            if force or bucket.is_stale()
+        ]
+
+    def remove_contact(self, node_id):
+        """
+        Remove the node with the specified ID from the routing table.
+        Its KBucket is refilled from its replacement cache.
+
+        For details, see RoutingTable documentation.
+        """
+        node_id = self._hex_id(node_id)
+        if self.table.get_contact(node_id) is not None:
+            self._ranker = None
+        self.table.remove_guid(node_id)
+
+    def touch_kbucket(self, node_id, timestamp=None):
+        """
+        Update the "last accessed" timestamp of the KBucket which covers
+        the range containing the specified key in the key/ID space.
+
+        For details, see RoutingTable documentation.
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+        self._kbucket(node_id).last_accessed = timestamp
+
+    def kbucket_last_accessed(self, node_id):
+        """
+        Return the "last accessed" timestamp of the KBucket which covers
+        the range containing the specified key in the key/ID space.
+
+        For details, see RoutingTable documentation.
+        """
+        return self._kbucket(node_id).last_accessed
+
+    def iter_contacts(self):
+        """
+        Iterate over all contacts in the routing table.
+
+        For details, see RoutingTable documentation.
+        """
+        for bucket in self.table:
+            for contact in list(bucket):
+                yield contact, bucket.range_min
+
+    def report_unreachable(self, node_id):
+        """
+        Replace an unreachable contact with the freshest contact of its
+        KBucket's replacement cache, if any.
+
+        For details, see RoutingTable documentation.
+        """
+        replacement = self.table.report_unreachable(self._hex_id(node_id))
+        if replacement is not None:
+            self._ranker = None
+        return replacement
+
+    def restore_layout(self, range_mins):
+        """
+        Split KBuckets until every given range_min starts a KBucket.
+        Only KBuckets covering our own ID are split, as in add_contact.
+
+        For details, see RoutingTable documentation.
+        """
+        own_guid = self._hex_id(self.parent_node_id)
+        for range_min in sorted(set(range_mins)):
+            for _ in range(constants.BIT_NODE_ID_LEN):
+                # pylint: disable=protected-access
+                index = self.table._get_kbucket_index(self.num_to_id(range_min))
+                bucket = self.table[index]
+                if bucket.range_min == range_min or not bucket.guid_in_range(own_guid):
+                    break
+                self.table.split_kbucket(index)
@@ -0,0 +1,530 @@
+"""
+Symmetric sessions between peers.
+
+Sealing every message with ECIES and signing it with ECDSA costs
+several EC point multiplications per message. Instead, two peers run
+one ECDH handshake on ephemeral keys, signed with their node keys, and
+derive a key pair per direction from it. Messages are then encrypted
+with AES-256-CTR and authenticated with HMAC-SHA256, and numbered so
+replayed messages are dropped. Sessions are replaced after
+SESSION_REKEY_INTERVAL_IN_SECONDS or SESSION_REKEY_MESSAGES messages.
+A peer that receives a frame of a session it does not know (it was
+restarted, or pruned the session) answers with 'session_reject', and
+the sender drops the session and starts a new one.
+
+Sealed messages ("frames") are laid out as:
+
+    SESSION_MAGIC | session id (8) | sequence number (8) | ciphertext | tag (16)
+
+Classes:
+    SessionError -- A handshake or frame was rejected.
+    ReplayWindow -- Remembers the recently received sequence numbers.
+    Session -- Keys and counters of one session.
+    SessionManager -- The sessions of a node with its peers.
+"""
+
+import logging
+import os
+import struct
+import time
+
+import pyelliptic as ec
+
+from node import constants
+from node.crypto_util import BTC_CURVE, get_cryptor
+from node.envelope import parse_version
+
+# Legacy messages are ECIES ciphertexts, which start with a random IV,
+# or JSON; a frame is only taken as such if its session is known.
+SESSION_MAGIC = '\x00OBS'
+
+_FRAME_HEADER = struct.Struct('!4s8sQ')
+_TAG_SIZE = 16
+_CIPHER = 'aes-256-ctr'
+_NONCE_SIZE = 16
+_SESSION_ID_SIZE = 8
+
+
+def supports_sessions(version):
+    """ Return whether a peer with protocol version `version` answers
+    session handshakes. """
+    return parse_version(version) >= parse_version(constants.SESSION_MIN_VERSION)
+
+
+class SessionError(Exception):
+    pass
+
+
+class ReplayWindow(object):
+    """
+    Sliding window over the sequence numbers received in a session.
+
+    A number is accepted once, and only if it is not more than size
+    numbers behind the newest one.
+    """
+
+    def __init__(self, size=constants.SESSION_REPLAY_WINDOW):
+        self.size = size
+        self.highest = 0
+        # Bit n is set if highest - n was received
+        self.bitmap = 0
+
+    def accept(self, sequence):
+        """
+        Record a sequence number.
+
+        @return: False if it was received before or is too old.
+        @rtype: bool
+        """
+        if sequence < 1:
+            return False
+
+        if sequence > self.highest:
+            shift = sequence - self.highest
+            self.bitmap = ((self.bitmap << shift) | 1) & ((1 << self.size) - 1)
+            self.highest = sequence
+            return True
+
+        offset = self.highest - sequence
+        if offset >= self.size or self.bitmap & (1 << offset):
+            return False
+        self.bitmap |= 1 << offset
+        return True
+
+
+def _has_magic(data):
+    # Plaintext messages may be passed on already parsed
+    return isinstance(data, str) and data[:len(SESSION_MAGIC)] == SESSION_MAGIC
+
+
+def _session_id_of(frame):
+    return frame[len(SESSION_MAGIC):len(SESSION_MAGIC) + _SESSION_ID_SIZE]
+
+
+def _unhex(value):
+    try:
+        return value.decode('hex')
+    except (AttributeError, TypeError) as exc:
+        raise SessionError('Malformed handshake: %s' % exc)
+
+
+def _derive_keys(shared_key, session_id, initiator_nonce, responder_nonce):
+    """ Derive the encryption and MAC keys of both directions from the
+    ECDH secret. """
+    prk = ec.hmac_sha256(initiator_nonce + responder_nonce, shared_key)
+    return [
+        ec.hmac_sha256(prk, session_id + label)
+        for label in ('initiator enc', 'initiator mac', 'responder enc', 'responder mac')
+    ]
+
+
+class Session(object):
+    """
+    Keys and counters of a session with one peer.
+
+    The initiator can send as soon as the handshake is complete; the
+    responder only once the initiator used the session, which proves
+    it holds the keys (confirmed).
+    """
+
+    def __init__(self, session_id, guid, pubkey, initiator, keys, created):
+        self.session_id = session_id
+        self.guid = guid
+        self.pubkey = pubkey
+        self.initiator = initiator
+        self.created = created
+        self.confirmed = initiator
+        # Set when a newer session with the peer took over
+        self.replaced = None
+
+        if initiator:
+            self._send_key, self._send_mac_key, self._recv_key, self._recv_mac_key = keys
+        else:
+            self._recv_key, self._recv_mac_key, self._send_key, self._send_mac_key = keys
+
+        self.send_sequence = 0
+        self.replay_window = ReplayWindow()
+
+    def seal(self, data):
+        """
+        Encrypt and authenticate a message.
+
+        @param data: The plaintext.
+        @type data: str
+
+        @return: The frame to send.
+        @rtype: str
+        """
+        self.send_sequence += 1
+        header = _FRAME_HEADER.pack(SESSION_MAGIC, self.session_id, self.send_sequence)
+        iv = struct.pack('!QQ', self.send_sequence, 0)
+        ciphertext = ec.Cipher(self._send_key, iv, 1, ciphername=_CIPHER).ciphering(data)
+        body = header + ciphertext
+        return body + ec.hmac_sha256(self._send_mac_key, body)[:_TAG_SIZE]
+
+    def open(self, frame):
+        """
+        Authenticate and decrypt a frame of this session.
+
+        @param frame: The frame as received.
+        @type frame: str
+
+        @return: The plaintext.
+        @rtype: str
+
+        @raise SessionError: The frame is malformed, forged or replayed.
+        """
+        if len(frame) < _FRAME_HEADER.size + _TAG_SIZE:
+            raise SessionError('Truncated frame')
+
+        body, tag = frame[:-_TAG_SIZE], frame[-_TAG_SIZE:]
+        if not ec.equals(ec.hmac_sha256(self._recv_mac_key, body)[:_TAG_SIZE], tag):
+            raise SessionError('Bad authentication tag')
+
+        _, _, sequence = _FRAME_HEADER.unpack_from(body)
+        if not self.replay_window.accept(sequence):
+            raise SessionError('Replayed frame %d' % sequence)
+
+        iv = struct.pack('!QQ', sequence, 0)
+        data = ec.Cipher(self._recv_key, iv, 0, ciphername=_CIPHER).ciphering(body[_FRAME_HEADER.size:])
+        self.confirmed = True
+        return data
+
+
+class SessionManager(object):
+    """
+    Handshakes and sessions of a node with its peers.
+
+    Handshake messages are sent as ordinary (ECIES) messages:
+    'session_init' from the initiator and 'session_accept' from the
+    responder. Each carries an ephemeral public key and a nonce, signed
+    with the node key of its sender together with the recipient's
+    guid, so neither can be replayed to another node.
+    """
+
+    def __init__(self, cryptor, guid, clock=time.time,
+                 rekey_interval=constants.SESSION_REKEY_INTERVAL_IN_SECONDS,
+                 rekey_messages=constants.SESSION_REKEY_MESSAGES,
+                 grace_period=constants.SESSION_GRACE_PERIOD_IN_SECONDS,
+                 handshake_timeout=constants.SESSION_HANDSHAKE_TIMEOUT_IN_SECONDS):
+        """
+        @param cryptor: Signs with the node key.
+        @type cryptor: crypto_util.Cryptor
+
+        @param guid: The guid of this node.
+        @type guid: str
+        """
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.cryptor = cryptor
+        self.guid = guid
+        self.clock = clock
+        self.rekey_interval = rekey_interval
+        self.rekey_messages = rekey_messages
+        self.grace_period = grace_period
+        self.handshake_timeout = handshake_timeout
+
+        # All sessions that may still receive, by session id
+        self.sessions = {}
+        # The session messages to a peer are sealed in, by guid
+        self.send_sessions = {}
+        # Handshakes we started, by session id
+        self._handshakes = {}
+        # When we last started a handshake with a peer, by guid
+        self._handshake_started = {}
+        # When we last rejected a frame of an unknown session, by id
+        self._rejected = {}
+
+        self.num_handshakes = 0
+        self.num_sealed = 0
+        self.num_opened = 0
+        self.num_rejected = 0
+        self.num_unknown = 0
+        self.num_dropped = 0
+
+    def _expired(self, session, now):
+        if session.replaced is not None:
+            return now - session.replaced > self.grace_period
+        return now - session.created > self.rekey_interval + self.grace_period
+
+    def _due_for_rekey(self, session, now):
+        return (now - session.created > self.rekey_interval or
+                session.send_sequence >= self.rekey_messages)
+
+    def _prune(self):
+        now = self.clock()
+        for session_id, session in self.sessions.items():
+            if self._expired(session, now):
+                del self.sessions[session_id]
+                if self.send_sessions.get(session.guid) is session:
+                    del self.send_sessions[session.guid]
+        for session_id, handshake in self._handshakes.items():
+            if now - handshake['started'] > self.handshake_timeout:
+                del self._handshakes[session_id]
+        for session_id, rejected in self._rejected.items():
+            if now - rejected > self.handshake_timeout:
+                del self._rejected[session_id]
+
+    def _add_session(self, session):
+        self.sessions[session.session_id] = session
+        self._update_send_session(session)
+
+    def _update_send_session(self, session):
+        """ Seal new messages to the peer in session, unless it is not
+        confirmed and the current one is. """
+        current = self.send_sessions.get(session.guid)
+        if current is session or (current is not None and current.confirmed and not session.confirmed):
+            return
+        if current is not None:
+            current.replaced = self.clock()
+        self.send_sessions[session.guid] = session
+
+    def get_session(self, guid):
+        """
+        Return the session to seal messages to a peer in.
+
+        @return: The session, or None if there is no confirmed one.
+        @rtype: Session
+        """
+        session = self.send_sessions.get(guid)
+        if session is None or not session.confirmed or self._expired(session, self.clock()):
+            return None
+        return session
+
+    def needs_handshake(self, guid):
+        """ Return whether a (new) session with the peer should be
+        started: there is none, or it is due for rekeying, and no
+        handshake was started recently. """
+        now = self.clock()
+        started = self._handshake_started.get(guid)
+        if started is not None and now - started < self.handshake_timeout:
+            return False
+
+        session = self.send_sessions.get(guid)
+        if session is None or self._due_for_rekey(session, now):
+            return True
+        # An accepted session the initiator never used
+        return not session.confirmed and now - session.created > self.handshake_timeout
+
+    def _sign(self, *fields):
+        return self.cryptor.sign('|'.join(fields)).encode('hex')
+
+    @staticmethod
+    def _verify(pubkey, signature, *fields):
+        try:
+            return get_cryptor(pubkey).verify(_unhex(signature), '|'.join(fields))
+        except Exception as exc:
+            raise SessionError('Cannot verify handshake: %s' % exc)
+
+    def start_handshake(self, guid, pubkey):
+        """
+        Start a session with a peer.
+
+        @param guid: The guid of the peer.
+        @type guid: str
+
+        @param pubkey: The node key of the peer in hex.
+        @type pubkey: str
+
+        @return: The 'session_init' message to send to the peer.
+        @rtype: dict
+        """
+        self._prune()
+
+        session_id = os.urandom(_SESSION_ID_SIZE)
+        ephemeral = ec.ECC(curve=BTC_CURVE)
+        nonce = os.urandom(_NONCE_SIZE)
+        message = {
+            'type': 'session_init',
+            'session_id': session_id.encode('hex'),
+            'ephemeral': ephemeral.get_pubkey().encode('hex'),
+            'nonce': nonce.encode('hex'),
+        }
+        message['session_sig'] = self._sign(
+            message['type'], message['session_id'], message['ephemeral'], message['nonce'], guid
+        )
+
+        now = self.clock()
+        self._handshakes[session_id] = {
+            'guid': guid, 'pubkey': pubkey, 'ephemeral': ephemeral, 'nonce': nonce, 'started': now
+        }
+        self._handshake_started[guid] = now
+        return message
+
+    def accept_handshake(self, msg):
+        """
+        Answer the 'session_init' message of a peer.
+
+        @return: The 'session_accept' message to send to the peer.
+        @rtype: dict
+
+        @raise SessionError: The handshake is invalid.
+        """
+        self._prune()
+
+        if msg.get('guid') != self.guid:
+            raise SessionError('Handshake for another node')
+        if not self._verify(msg['pubkey'], msg['session_sig'], msg['type'], msg['session_id'],
+                            msg['ephemeral'], msg['nonce'], self.guid):
+            self.num_rejected += 1
+            raise SessionError('Bad handshake signature from %s' % msg['senderGUID'])
+
+        session_id = _unhex(msg['session_id'])
+        if len(session_id) != _SESSION_ID_SIZE or session_id in self.sessions or session_id in self._handshakes:
+            raise SessionError('Bad session id')
+
+        ephemeral = ec.ECC(curve=BTC_CURVE)
+        nonce = os.urandom(_NONCE_SIZE)
+        try:
+            shared_key = ephemeral.get_ecdh_key(_unhex(msg['ephemeral']))
+        except Exception as exc:
+            raise SessionError('Bad ephemeral key: %s' % exc)
+
+        keys = _derive_keys(shared_key, session_id, _unhex(msg['nonce']), nonce)
+        self._add_session(Session(session_id, msg['senderGUID'], msg['pubkey'], False, keys, self.clock()))
+
+        answer = {
+            'type': 'session_accept',
+            'session_id': msg['session_id'],
+            'ephemeral': ephemeral.get_pubkey().encode('hex'),
+            'nonce': nonce.encode('hex'),
+        }
+        answer['session_sig'] = self._sign(
+            answer['type'], answer['session_id'], msg['ephemeral'], msg['nonce'],
+            answer['ephemeral'], answer['nonce'], msg['senderGUID']
+        )
+        return answer
+
+    def complete_handshake(self, msg):
+        """
+        Set up the session from the 'session_accept' message of a peer.
+
+        @return: The session.
+        @rtype: Session
+
+        @raise SessionError: The handshake is unknown, timed out or invalid.
+        """
+        session_id = _unhex(msg['session_id'])
+        handshake = self._handshakes.get(session_id)
+        if handshake is None:
+            raise SessionError('Unknown handshake')
+        if msg.get('senderGUID') != handshake['guid'] or msg.get('pubkey') != handshake['pubkey']:
+            raise SessionError('Handshake answered by another node')
+
+        ephemeral_hex = handshake['ephemeral'].get_pubkey().encode('hex')
+        if not self._verify(msg['pubkey'], msg['session_sig'], msg['type'], msg['session_id'],
+                            ephemeral_hex, handshake['nonce'].encode('hex'), msg['ephemeral'], msg['nonce'],
+                            self.guid):
+            self.num_rejected += 1
+            raise SessionError('Bad handshake signature from %s' % msg['senderGUID'])
+
+        try:
+            shared_key = handshake['ephemeral'].get_ecdh_key(_unhex(msg['ephemeral']))
+        except Exception as exc:
+            raise SessionError('Bad ephemeral key: %s' % exc)
+        del self._handshakes[session_id]
+        self._handshake_started.pop(handshake['guid'], None)
+
+        keys = _derive_keys(shared_key, session_id, handshake['nonce'], _unhex(msg['nonce']))
+        session = Session(session_id, handshake['guid'], handshake['pubkey'], True, keys, self.clock())
+        self._add_session(session)
+        self.num_handshakes += 1
+        self.log.debug('Started session with %s', session.guid)
+        return session
+
+    def seal(self, guid, data):
+        """
+        Seal a message to a peer.
+
+        @return: The frame, or None if there is no session with the peer.
+        @rtype: str
+        """
+        session = self.get_session(guid)
+        if session is None:
+            return None
+        self.num_sealed += 1
+        return session.seal(data)
+
+    def is_session_frame(self, data):
+        """ Return whether data is a frame of a known session. """
+        return _has_magic(data) and _session_id_of(data) in self.sessions
+
+    def is_unknown_frame(self, data):
+        """ Return whether data is a frame of a session we do not know. """
+        return (_has_magic(data) and len(data) >= _FRAME_HEADER.size + _TAG_SIZE and
+                _session_id_of(data) not in self.sessions)
+
+    def reject_unknown(self, frame):
+        """
+        Answer a frame of a session we do not know.
+
+        @return: The 'session_reject' message to send to the peer, or
+                 None if the session was rejected recently.
+        @rtype: dict
+        """
+        self._prune()
+        session_id = _session_id_of(frame)
+        self.num_unknown += 1
+        if session_id in self._rejected:
+            return None
+        self._rejected[session_id] = self.clock()
+        return {'type': 'session_reject', 'session_id': session_id.encode('hex')}
+
+    def drop_session(self, msg):
+        """
+        Drop the session a peer rejected in a 'session_reject' message,
+        so the next message to it starts a new one.
+
+        @return: Whether the session was dropped.
+        @rtype: bool
+
+        @raise SessionError: The message is malformed.
+        """
+        session = self.sessions.get(_unhex(msg['session_id']))
+        if session is None or msg.get('senderGUID') != session.guid or msg.get('pubkey') != session.pubkey:
+            return False
+
+        del self.sessions[session.session_id]
+        if self.send_sessions.get(session.guid) is session:
+            del self.send_sessions[session.guid]
+        self._handshake_started.pop(session.guid, None)
+        self.num_dropped += 1
+        self.log.debug('Session with %s rejected', session.guid)
+        return True
+
+    def open(self, frame):
+        """
+        Open a frame from a peer.
+
+        @return: (session, plaintext)
+        @rtype: tuple
+
+        @raise SessionError: The session is unknown or the frame was rejected.
+        """
+        session = self.sessions.get(_session_id_of(frame))
+        if session is None:
+            raise SessionError('Unknown session')
+
+        was_confirmed = session.confirmed
+        try:
+            data = session.open(frame)
+        except SessionError:
+            self.num_rejected += 1
+            raise
+        if not was_confirmed:
+            if not session.initiator:
+                self.num_handshakes += 1
+            self._update_send_session(session)
+
+        self.num_opened += 1
+        return session, data
+
+    def get_stats(self):
+        return {
+            'sessions': len(self.sessions),
+            'handshakes': self.num_handshakes,
+            'sealed': self.num_sealed,
+            'opened': self.num_opened,
+            'rejected': self.num_rejected,
+            'unknown': self.num_unknown,
+            'dropped': self.num_dropped
+        }
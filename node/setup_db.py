@@ -191,6 +191,7 @@ _SCHEMA = (
             'originallyPublished TEXT',
             'originalPublisherID TEXT',
             'value TEXT',
+            'ttl INT DEFAULT 0',
             'FOREIGN KEY(market_id) REFERENCES markets(id)'
         )
     ),
@@ -218,6 +219,31 @@ _SCHEMA = (
             'created INT',
             'received INT'
         )
+    ),
+    (
+        'republish_schedule',
+        (
+            'id INTEGER PRIMARY KEY AUTOINCREMENT',
+            'market_id INT',
+            'key TEXT',
+            'next_due INT'
+        )
+    ),
+    (
+        'routing_snapshot',
+        (
+            'id INTEGER PRIMARY KEY AUTOINCREMENT',
+            'market_id INT',
+            'guid TEXT',
+            'hostname TEXT',
+            'port INT',
+            'pubkey TEXT',
+            'nickname TEXT',
+            'nat_type TEXT',
+            'avatar_url TEXT',
+            'last_reached INT',
+            'bucket_min TEXT'
+        )
     )
 )
 
@@ -0,0 +1,136 @@
+"""
+A hierarchical timing wheel for the many short, coarse timers of peer
+connections (keepalive pings, send retries, NAT punches).
+
+Timers are kept in buckets ("slots") of a few wheels of increasing
+granularity instead of the IOLoop's heap, so scheduling and cancelling
+a timer are O(1). The wheel is advanced by a single periodic callback;
+timers firing on the same tick run together.
+
+Classes:
+    TimingWheel -- Schedules callbacks with a granularity of one tick.
+"""
+
+import logging
+import math
+import time
+
+from node import constants
+
+
+class _Timer(object):
+    __slots__ = ('deadline', 'callback', 'args')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+
+
+class TimingWheel(object):
+    """
+    Wheel `level` has `slots` slots of `slots ** level` ticks each.
+    Timers due within `slots` ticks go to the innermost wheel; later
+    ones go to an outer wheel and cascade inwards as their slot comes
+    round. Timers beyond the outermost wheel cascade until they are due.
+    """
+
+    def __init__(self, tick_interval=constants.TIMING_WHEEL_TICK_IN_SECONDS,
+                 slots=constants.TIMING_WHEEL_SLOTS,
+                 levels=constants.TIMING_WHEEL_LEVELS, clock=time.time):
+        """
+        @param tick_interval: Length of a tick in seconds.
+        @type tick_interval: float
+
+        @param clock: Returns the current time in seconds.
+        @type clock: callable
+        """
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.tick_interval = tick_interval
+        self.slots = slots
+        self.levels = levels
+        self.clock = clock
+
+        self._start = clock()
+        self.current_tick = 0
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._num_pending = 0
+
+    def __len__(self):
+        return self._num_pending
+
+    def call_later(self, delay, callback, *args):
+        """
+        Run `callback(*args)` after `delay` seconds, rounded up to the
+        next tick.
+
+        @return: A handle for remove_timeout.
+        """
+        elapsed = self.clock() - self._start + delay
+        deadline = max(int(math.ceil(elapsed / self.tick_interval)), self.current_tick + 1)
+        timer = _Timer(deadline, callback, args)
+        self._insert(timer)
+        self._num_pending += 1
+        return timer
+
+    def remove_timeout(self, timer):
+        """
+        Cancel a timer returned by call_later. Cancelling a timer that
+        already ran or was cancelled does nothing.
+        """
+        if timer.callback is not None:
+            timer.callback = None
+            timer.args = None
+            self._num_pending -= 1
+
+    def _insert(self, timer):
+        delta = timer.deadline - self.current_tick
+        level = 0
+        while level < self.levels - 1 and delta >= self.slots ** (level + 1):
+            level += 1
+        slot = (timer.deadline // self.slots ** level) % self.slots
+        self._wheels[level][slot].append(timer)
+
+    def _cascade(self):
+        # Outer wheels first, as they may refill the inner slot that is
+        # cascaded next
+        level = 1
+        while level < self.levels and self.current_tick % self.slots ** level == 0:
+            level += 1
+        for level in range(level - 1, 0, -1):
+            wheel = self._wheels[level]
+            slot = (self.current_tick // self.slots ** level) % self.slots
+            timers, wheel[slot] = wheel[slot], []
+            for timer in timers:
+                if timer.callback is not None:
+                    self._insert(timer)
+
+    def tick(self):
+        """
+        Run all timers that are due, catching up on ticks missed since
+        the last call.
+
+        @return: The number of timers run.
+        @rtype: int
+        """
+        target = int((self.clock() - self._start) / self.tick_interval)
+        num_run = 0
+        while self.current_tick < target:
+            self.current_tick += 1
+            self._cascade()
+
+            wheel = self._wheels[0]
+            slot = self.current_tick % self.slots
+            timers, wheel[slot] = wheel[slot], []
+            for timer in timers:
+                if timer.callback is None:
+                    continue
+
+                callback, args = timer.callback, timer.args
+                self.remove_timeout(timer)
+                num_run += 1
+                try:
+                    callback(*args)
+                except Exception:
+                    self.log.exception('Error in timer callback %r', callback)
+        return num_run
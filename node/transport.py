@@ -15,9 +15,16 @@ from sqlite3.dbapi2 import OperationalError, DatabaseError
 from tornado import ioloop
 from tornado.ioloop import PeriodicCallback
 
-from node import connection, network_util, trust
-from node.constants import MSG_PING_ID, MSG_PONG_ID, VERSION
+from node import connection, network_util, packettype, trust
+from node.constants import MSG_PING_ID, MSG_PONG_ID, VERSION, ROUTING_SNAPSHOT_INTERVAL_IN_SECONDS, \
+    PEER_TABLE_MAX_SIZE, PEERCONNECTION_IDLE_TIMEOUT_IN_SECONDS, PEER_EVICTION_INTERVAL_IN_SECONDS, \
+    PEERCONNECTION_SENDING_OUT_DELAY_IN_SECONDS, TIMING_WHEEL_TICK_IN_SECONDS, MEDIATE_MAX_ATTEMPTS, \
+    PUNCH_INTERVAL_IN_SECONDS, PACKET_TYPE_RELAY_PING, PACKET_TYPE_RELAY_PONG, PACKET_TYPE_RELAY, \
+    PACKET_TYPE_PUNCH, PACKET_TYPE_RUDP
+from node.compression import CompressionPolicy
 from node.dht import DHT
+from node.session import SessionError, SessionManager
+from node.timingwheel import TimingWheel
 from rudp.packet import Packet
 from node.crypto_util import Cryptor
 import string
@@ -30,6 +37,12 @@ class TransportLayer(object):
         self.peers = {}
         self.callbacks = defaultdict(list)
         self.timeouts = []
+        # Shared by the timers of all peer connections
+        self.timers = TimingWheel()
+        # Peer connections by the RUDP session of their packets: our own
+        # session for acknowledgements, the peer's for everything else
+        self.rudp_sessions = {}
+        self.remote_rudp_sessions = {}
         self.port = ob_ctx.server_port
         self.hostname = ob_ctx.server_ip
         self.nat_type = ob_ctx.nat_status['nat_type']
@@ -40,6 +53,9 @@ class TransportLayer(object):
         self.handler = None
         self.uri = network_util.get_peer_url(self.hostname, self.port)
         self.listener = None
+        # Symmetric sessions with peers (session.SessionManager), if any
+        self.sessions = None
+        self.compression = CompressionPolicy()
 
         self.mediate_peers = []
 
@@ -114,6 +130,7 @@ class CryptoTransportLayer(TransportLayer):
             'findNode',
             'findNodeResponse',
             'store',
+            'storeBatch',
             'mediate',
             'register',
             'punch',
@@ -121,27 +138,54 @@ class CryptoTransportLayer(TransportLayer):
             MSG_PONG_ID,
             'get_nat_type',
             'nat_type',
-            'relay_msg'
+            'relay_msg',
+            'session_init',
+            'session_accept',
+            'session_reject'
         )
 
         self._setup_settings()
         ob_ctx.market_id = self.market_id
         self.dht = DHT(self, self.market_id, self.settings, self.db_connection)
         TransportLayer.__init__(self, ob_ctx, self.guid, self.nickname, self.avatar_url)
+        self.sessions = SessionManager(self.cryptor, self.guid)
         self.start_listener()
 
         self.ip_checker_caller = None
         if ob_ctx.enable_ip_checker and not ob_ctx.seed_mode and not ob_ctx.dev_mode:
             self.start_ip_address_checker()
 
-        # self.loop.call_later(5, self.truncate_dead_peers)
+        self.evictor = ConnectionEvictor(
+            self.market_id, self.peers, self._close_peer, ob_ctx.max_peers
+        )
+        self._eviction_scheduled = False
+        self.eviction_caller = PeriodicCallback(
+            self.evict_peers, PEER_EVICTION_INTERVAL_IN_SECONDS * 1000, self.loop
+        )
+        self.eviction_caller.start()
 
-    def truncate_dead_peers(self):
-        for peer in self.dht.active_peers:
-            print 'last reached: ', peer.last_reached
-            if peer.last_reached != 0 and time.time() - peer.last_reached <= 15:
-                if peer.guid:
-                    self.dht.remove_peer(peer.guid)
+        self.timer_caller = PeriodicCallback(
+            self.timers.tick, TIMING_WHEEL_TICK_IN_SECONDS * 1000, self.loop
+        )
+        self.timer_caller.start()
+
+    def evict_peers(self):
+        """ Close idle connections, and the least recently used ones
+        while there are more than the configured maximum. """
+        self._eviction_scheduled = False
+        if self.evictor.evict():
+            self.evictor.log_stats()
+            if self.handler:
+                self.handler.refresh_peers()
+
+    def _close_peer(self, peer):
+        peer.close()
+        self.dht.active_peers[:] = [
+            active_peer for active_peer in self.dht.active_peers if active_peer is not peer
+        ]
+        # The node stays known, as a compact contact record
+        self.dht.learn_contact(peer.hostname, peer.port, peer.pub, peer.guid,
+                               peer.nickname, peer.nat_type, peer.avatar_url)
 
     def relay_message(self, data, guid):
         for peer in self.dht.active_peers:
@@ -189,9 +233,11 @@ class CryptoTransportLayer(TransportLayer):
                 })
 
     def update_avatar(self, guid, avatar_url):
-        peer = self.dht.routing_table.get_contact(guid)
-        if peer:
-            peer.avatar_url = avatar_url
+        contact = self.dht.routing_table.get_contact(guid)
+        if contact:
+            contact.avatar_url = avatar_url
+            if guid in self.peers:
+                self.peers[guid].avatar_url = avatar_url
         else:
             self.log.error('Cannot find peer to update avatar')
 
@@ -210,7 +256,11 @@ class CryptoTransportLayer(TransportLayer):
         self.listener = connection.CryptoPeerListener(
             self.hostname, self.port, self.pubkey, self.secret,
             self.guid,
-            self._on_message
+            self._on_message,
+            sessions=self.sessions,
+            crypto_workers=self.ob_ctx.crypto_workers,
+            compression_policy=self.compression,
+            reject_cb=self._send_session_reject
         )
 
         # pylint: disable=unused-variable
@@ -221,25 +271,25 @@ class CryptoTransportLayer(TransportLayer):
                 if active_peer.hostname == addr[0] and active_peer.port == addr[1]:
                     active_peer.reachable = True
                     active_peer.last_reached = time.time()
+                    self.dht.mark_reached(active_peer.guid)
 
         # pylint: disable=unused-variable
         @self.listener.event_emitter.on('on_relay_pong_message')
         def on_relay_pong_message(msg):
-            data, addr = msg[0], msg[1]
-            data = data.split(' ')
+            guid, addr = msg[0], msg[1]
             for active_peer in self.dht.active_peers:
-                if active_peer.guid == data[1]:
+                if active_peer.guid == guid:
                     active_peer.reachable = True
                     active_peer.last_reached = time.time()
+                    self.dht.mark_reached(active_peer.guid)
 
         # pylint: disable=unused-variable
         @self.listener.event_emitter.on('on_send_relay_ping')
         def on_send_relay_ping(msg):
-            data, addr = msg[0], msg[1]
-            data = data.split(' ')
-            peer = self.dht.routing_table.get_contact(data[1])
+            guid, addr = msg[0], msg[1]
+            peer = self.dht.get_peer(guid)
             if peer:
-                peer.send_to_sock('relay_ping %s' % peer.guid)
+                peer.send_to_sock(packettype.encode(PACKET_TYPE_RELAY_PING, peer.guid))
             else:
                 self.log.info('Could not find peer to send relay_ping to.')
 
@@ -248,9 +298,9 @@ class CryptoTransportLayer(TransportLayer):
         def on_send_relay_pong(msg):
             data, addr = msg[0], msg[1]
             data = data.split(' ')
-            peer = self.dht.routing_table.get_contact(data[2])
+            peer = self.dht.get_peer(data[1])
             if peer:
-                peer.send_to_sock('relay_pong %s' % data[1])
+                peer.send_to_sock(packettype.encode(PACKET_TYPE_RELAY_PONG, data[0]))
             else:
                 self.log.info('Could not find peer to send relay_pong to.')
 
@@ -258,51 +308,58 @@ class CryptoTransportLayer(TransportLayer):
         @self.listener.event_emitter.on('on_relayto')
         def on_relayto(data):
 
-            data = data.split(' ', 4)
+            data = data.split(' ', 3)
             self.log.debug('RelayTo Data: %s', data)
-            if len(data) <= 5:
-                peer = self.dht.routing_table.get_contact(data[1])
+            if len(data) == 4:
+                peer = self.dht.get_peer(data[0])
+                relay = packettype.encode(PACKET_TYPE_RELAY, data[3])
 
                 if peer:
-                    peer.send_to_sock('relay %s' % data[4])
+                    peer.send_to_sock(relay)
                 else:
-                    self.log.debug('Relaying to %s:%s', data[2], data[3])
-                    self.listener.socket.sendto('relay %s' % data[4], (data[2], int(data[3])))
+                    self.log.debug('Relaying to %s:%s', data[1], data[2])
+                    self.listener.socket.sendto(relay, (data[1], int(data[2])))
 
         # pylint: disable=unused-variable
-        @self.listener.event_emitter.on('on_message')
-        def on_message(msg):
-
-            data, addr = msg[0], msg[1]
-            self.log.debug('Got Packet: %s from %s', data, addr)
-            relayed_message = False
+        @self.listener.event_emitter.on('on_punch')
+        def on_punch(msg):
+            guid, addr = msg[0], msg[1]
+            peer = self.peers.get(guid)
+            if peer and not peer.closed:
+                peer.reachable = True
+                peer.relaying = False
+                peer._rudp_connection._sender._packet_sender.reachable = True
+                peer._rudp_connection._sender._packet_sender.relaying = False
+            else:
+                self.log.debug('Do not know about this peer yet.')
 
-            # Punch message
-            if data[:5] == 'punch':
-                data = data.split(' ')
-                guid = data[1]
-                peer = self.dht.routing_table.get_contact(guid)
-                if peer:
-                    peer.reachable = True
-                    peer.relaying = False
-                    peer._rudp_connection._sender._packet_sender.reachable = True
-                    peer._rudp_connection._sender._packet_sender.relaying = False
-                else:
-                    self.log.debug('Do not know about this peer yet.')
+        def receive_packet(inbound_peer, packet, relayed_message):
+            if inbound_peer.closed:
+                self.log.debug('Dropping packet for closed connection to %s', inbound_peer.guid)
                 return
+            inbound_peer.reachable = True
+            inbound_peer.last_used = inbound_peer.last_reached = time.time()
+            self.dht.mark_reached(inbound_peer.guid)
 
-            try:
+            if relayed_message:
+                inbound_peer._rudp_connection._sender._packet_sender.relaying = True
+
+            if packet._finish:
+
+                inbound_peer.reset()
+                # del self._connections[address_key]
+            else:
+
+                inbound_peer._rudp_connection.receive(packet)
 
-                # Relayed message
-                if data[:6] == 'relay ':
-                    msg_parts = data.split(' ', 1)
-                    data = msg_parts[1]
-                    data_body = json.loads(data)
+        def on_packet(data, addr, relayed_message):
+            self.log.debug('Got Packet: %s from %s', data, addr)
+            try:
+                data_body = json.loads(data)
+                if relayed_message:
                     hostname = data_body.get('hostname')
                     port = data_body.get('port')
-                    relayed_message = True
                 else:
-                    data_body = json.loads(data)
                     port = addr[1]
                     hostname = addr[0]
 
@@ -315,26 +372,83 @@ class CryptoTransportLayer(TransportLayer):
                 inbound_peer = self.dht.add_peer(hostname, port, pubkey, guid, nickname, nat_type)
 
                 if inbound_peer:
-                    inbound_peer.reachable = True
+                    receive_packet(inbound_peer, Packet(data, packet_buffer=True), relayed_message)
+                else:
+                    self.log.debug('Did not find a peer')
+            except Exception as exc:
+                self.log.error('Could not deserialize message: %s', exc)
 
-                    if relayed_message:
-                        inbound_peer._rudp_connection._sender._packet_sender.relaying = True
+        def on_binary_packet(data, addr, relayed_message):
+            try:
+                packet, identity = Packet.from_binary(data)
+            except ValueError as exc:
+                self.log.error('Could not parse packet from %s: %s', addr, exc)
+                return
 
-                    packet = Packet(data, packet_buffer=True)
+            session_id = packet._session_id
+            if packet._acknowledgement:
+                inbound_peer = self.rudp_sessions.get(session_id)
+            elif identity:
+                if relayed_message:
+                    hostname, port = identity['hostname'], identity['port']
+                else:
+                    hostname, port = addr
+                inbound_peer = self.dht.add_peer(
+                    hostname, port, identity['pubkey'], identity['guid'],
+                    identity['nick'], identity['nat_type']
+                )
+                if inbound_peer and inbound_peer.remote_session_id != session_id:
+                    self.remote_rudp_sessions.pop(inbound_peer.remote_session_id, None)
+                    self.remote_rudp_sessions[session_id] = inbound_peer
+                    inbound_peer.remote_session_id = session_id
+            else:
+                inbound_peer = self.remote_rudp_sessions.get(session_id)
+
+            if inbound_peer is None or inbound_peer.closed:
+                self.log.debug('Packet from %s in unknown session %d', addr, session_id)
+                if not packet._acknowledgement and not relayed_message:
+                    # We closed the connection or restarted; the peer
+                    # has to introduce itself again
+                    unknown_session = Packet.create_unknown_session_packet(packet._sequence_number, session_id)
+                    self.listener.socket.sendto(
+                        packettype.encode(PACKET_TYPE_RUDP, unknown_session.to_binary(session_id), header=True),
+                        addr
+                    )
+                return
 
-                    if packet._finish:
+            packet_sender = inbound_peer._rudp_connection._sender._packet_sender
+            # The peer reads binary packets as well
+            packet_sender.binary = True
+            if packet.is_unknown_session():
+                self.log.debug('%s lost our session; attaching identity again', addr)
+                packet_sender.identity_acknowledged = False
+                return
+            if packet._acknowledgement:
+                packet_sender.identity_acknowledged = True
 
-                        inbound_peer.reset()
-                        return
-                        # del self._connections[address_key]
-                    else:
+            try:
+                receive_packet(inbound_peer, packet, relayed_message)
+            except Exception as exc:
+                self.log.error('Could not handle packet: %s', exc)
 
-                        inbound_peer._rudp_connection.receive(packet)
+        # pylint: disable=unused-variable
+        @self.listener.event_emitter.on('on_relay_message')
+        def on_relay_message(msg):
+            packet_type, data = packettype.classify(msg[0])
+            if packet_type == PACKET_TYPE_RUDP:
+                on_binary_packet(data, msg[1], True)
+            else:
+                on_packet(msg[0], msg[1], True)
 
-                else:
-                    self.log.debug('Did not find a peer')
-            except Exception as exc:
-                self.log.error('Could not deserialize message: %s', exc)
+        # pylint: disable=unused-variable
+        @self.listener.event_emitter.on('on_rudp_packet')
+        def on_rudp_packet(msg):
+            on_binary_packet(msg[0], msg[1], False)
+
+        # pylint: disable=unused-variable
+        @self.listener.event_emitter.on('on_message')
+        def on_message(msg):
+            on_packet(msg[0], msg[1], False)
 
         self.listener.set_ok_msg({
             'type': 'ok',
@@ -435,7 +549,7 @@ class CryptoTransportLayer(TransportLayer):
         if msg['guid2'] == self.guid:
             return
 
-        def send_punches():
+        def send_punches(attempt):
 
             peer1, peer2 = None, None
 
@@ -475,9 +589,13 @@ class CryptoTransportLayer(TransportLayer):
                     'v': VERSION
                 }))
                 return
+            elif attempt < MEDIATE_MAX_ATTEMPTS:
+                self.timers.call_later(
+                    PEERCONNECTION_SENDING_OUT_DELAY_IN_SECONDS, send_punches, attempt + 1
+                )
             else:
-                self.loop.call_later(5, send_punches)
-        send_punches()
+                self.log.debug('Could not mediate between %s and %s', msg['senderGUID'], msg['guid2'])
+        send_punches(1)
 
     def validate_on_relay_msg(self, msg):
         self.log.debug('Validating relay msg')
@@ -485,7 +603,7 @@ class CryptoTransportLayer(TransportLayer):
 
     def on_relay_msg(self, msg):
         self.log.debug('Relaying message to peer')
-        peer = self.dht.routing_table.get_contact(msg['guid'])
+        peer = self.dht.get_peer(msg['guid'])
         if peer:
             peer.send_raw(json.dumps({
                 'type': 'relayed_msg',
@@ -501,7 +619,7 @@ class CryptoTransportLayer(TransportLayer):
 
     def on_relayed_msg(self, msg):
         self.log.debug('Received relayed message to peer')
-        peer = self.dht.routing_table.get_contact(msg['guid'])
+        peer = self.dht.get_peer(msg['guid'])
         if peer:
             peer.send_raw(json.dumps({
                 'type': 'relayed_msg',
@@ -524,12 +642,15 @@ class CryptoTransportLayer(TransportLayer):
 
         if not peer.punching:
             def send(count):
+                if peer.closed:
+                    peer.punching = False
+                    return
                 # Send raw socket punch
-                peer.sock.sendto('punch %s' % self.guid, (peer.hostname, peer.port))
+                peer.sock.sendto(packettype.encode(PACKET_TYPE_PUNCH, self.guid), (peer.hostname, peer.port))
                 self.log.debug('Sending punch to %s:%d', peer.hostname, peer.port)
                 self.log.debug("UDP punching package %d sent", count)
                 if peer.punching:
-                    self.loop.call_later(0.5, send, count + 1)
+                    self.timers.call_later(PUNCH_INTERVAL_IN_SECONDS, send, count + 1)
                 if count >= 25:
                     if not peer.reachable:
                         self.log.debug('Falling back to relaying.')
@@ -573,9 +694,9 @@ class CryptoTransportLayer(TransportLayer):
             return
 
         peer = self.dht.routing_table.get_contact(msg['peer_guid'])
-        requester = self.dht.routing_table.get_contact(msg['senderGUID'])
+        requester = self.dht.get_peer(msg['senderGUID'])
 
-        if peer:
+        if peer and requester:
             nat_type_msg = {
                 'type': 'nat_type',
                 'senderGUID': self.guid,
@@ -590,6 +711,57 @@ class CryptoTransportLayer(TransportLayer):
         else:
             self.log.error('No peer found for this GUID.')
 
+    @staticmethod
+    def _is_valid_handshake(msg):
+        return all(
+            key in msg for key in ('session_id', 'ephemeral', 'nonce', 'session_sig', 'senderGUID', 'pubkey')
+        )
+
+    def validate_on_session_init(self, msg):
+        self.log.debug('Validating session init')
+        return self._is_valid_handshake(msg)
+
+    def on_session_init(self, msg):
+        self.log.debug('Session requested by %s', msg['senderGUID'])
+        try:
+            answer = self.sessions.accept_handshake(msg)
+        except SessionError as exc:
+            self.log.warning('Rejected session with %s: %s', msg['senderGUID'], exc)
+            return
+
+        peer = self.dht.get_peer(msg['senderGUID'])
+        if peer:
+            peer.send(answer)
+        else:
+            self.log.debug('Could not find peer to answer session request.')
+
+    def validate_on_session_accept(self, msg):
+        self.log.debug('Validating session accept')
+        return self._is_valid_handshake(msg)
+
+    def on_session_accept(self, msg):
+        try:
+            self.sessions.complete_handshake(msg)
+        except SessionError as exc:
+            self.log.warning('Rejected session with %s: %s', msg['senderGUID'], exc)
+
+    def _send_session_reject(self, address, reject):
+        for peer in self.peers.values():
+            if (peer.hostname, peer.port) == address:
+                peer.send(reject)
+                return
+        self.log.debug('Could not find peer %s to reject session.', address)
+
+    def validate_on_session_reject(self, msg):
+        self.log.debug('Validating session reject')
+        return all(key in msg for key in ('session_id', 'senderGUID', 'pubkey'))
+
+    def on_session_reject(self, msg):
+        try:
+            self.sessions.drop_session(msg)
+        except SessionError as exc:
+            self.log.warning('Bad session reject from %s: %s', msg['senderGUID'], exc)
+
     def validate_on_nat_type(self, msg):
         self.log.debug('Validating %s', msg['type'])
         return True
@@ -598,7 +770,7 @@ class CryptoTransportLayer(TransportLayer):
         self.log.debug('Received nat type for user: %s', msg['peer_guid'])
 
         for peer in self.dht.active_peers:
-            if peer.guid == msg['peer_guid']:
+            if peer.guid == msg['peer_guid'] and not peer.closed:
                 peer.nat_type = msg['nat_type']
                 if peer.nat_type == 'Symmetric NAT':
                     peer.relaying = True
@@ -618,7 +790,7 @@ class CryptoTransportLayer(TransportLayer):
     def on_ping(self, msg):
         self.log.debug('Got a ping message from: %s:%d', self.hostname, self.port)
 
-        peer = self.dht.routing_table.get_contact(msg['senderGUID'])
+        peer = self.dht.get_peer(msg['senderGUID'])
 
         if peer:
             pong_msg = {
@@ -641,10 +813,11 @@ class CryptoTransportLayer(TransportLayer):
 
     def on_pong(self, msg):
         self.log.debug('Got a pong message from: %s', msg['senderGUID'])
-        peer = self.dht.routing_table.get_contact(msg['senderGUID'])
+        peer = self.dht.get_peer(msg['senderGUID'])
         peer.nat_type = msg['nat_type']
         peer.waiting = False
         peer.reachable = True
+        self.dht.learn_contact(peer.hostname, peer.port, guid=peer.guid, nat_type=peer.nat_type)
         self.log.debug('Updated peer object: %s', peer)
 
     def validate_on_hello(self, msg):
@@ -687,16 +860,32 @@ class CryptoTransportLayer(TransportLayer):
 
     def on_hello_response(self, msg):
         self.log.info('Received Hello Response: %s', json.dumps(msg, ensure_ascii=False))
-        peer = self.dht.routing_table.get_contact(msg['senderGUID'])
+        peer = self.dht.get_peer(msg['senderGUID'])
         peer.nat_type = msg['nat_type']
+        self.dht.learn_contact(peer.hostname, peer.port, guid=peer.guid, nat_type=peer.nat_type)
+
+    @staticmethod
+    def _is_valid_store(msg):
+        return isinstance(msg, dict) and all(
+            key in msg for key in ('key', 'value', 'originalPublisherID', 'age')
+        )
 
     def validate_on_store(self, msg):
         self.log.debugv('Validating store value message.')
-        return True
+        return self._is_valid_store(msg)
 
     def on_store(self, msg):
         self.dht._on_store_value(msg)
 
+    def validate_on_storeBatch(self, msg): # pylint: disable=invalid-name
+        self.log.debugv('Validating store batch message.')
+        stores = msg.get('stores')
+        return isinstance(stores, list) and all(self._is_valid_store(store_msg) for store_msg in stores)
+
+    def on_storeBatch(self, msg): # pylint: disable=invalid-name
+        for store_msg in msg['stores']:
+            self.dht._on_store_value(store_msg)
+
     def validate_on_findNode(self, msg): # pylint: disable=invalid-name
         self.log.debugv('Validating find node message.')
         return True
@@ -873,7 +1062,17 @@ class CryptoTransportLayer(TransportLayer):
             peer_obj.seed = True
             peer_obj.reachable = True  # Seeds should be reachable always
 
-        self.loop.call_later(30, self.search_for_my_node)
+        # Warm start: with a routing table snapshot we can look ourselves
+        # up as soon as it is restored instead of waiting for the seeds.
+        if not self.dht.restore_routing_snapshot(self.search_for_my_node):
+            self.loop.call_later(30, self.search_for_my_node)
+
+        self.snapshot_caller = PeriodicCallback(
+            self.dht.save_routing_snapshot,
+            ROUTING_SNAPSHOT_INTERVAL_IN_SECONDS * 1000,
+            self.loop
+        )
+        self.snapshot_caller.start()
 
         if callback is not None:
             callback('Joined')
@@ -896,6 +1095,9 @@ class CryptoTransportLayer(TransportLayer):
             guid = 'seed%d' % len(self.peers)
 
         if guid not in self.peers:
+            if len(self.peers) >= self.evictor.max_peers and not self._eviction_scheduled:
+                self._eviction_scheduled = True
+                self.loop.add_callback(self.evict_peers)
             self.peers[guid] = connection.CryptoPeerConnection(
                 self,
                 hostname,
@@ -930,7 +1132,7 @@ class CryptoTransportLayer(TransportLayer):
         # Directed message
         if send_to is not None:
 
-            peer = self.dht.routing_table.get_contact(send_to)
+            peer = self.dht.get_peer(send_to)
             if peer is None:
                 for active_peer in self.dht.active_peers:
                     if active_peer.guid == send_to:
@@ -960,11 +1162,8 @@ class CryptoTransportLayer(TransportLayer):
 
             for peer in self.dht.active_peers:
                 try:
-                    routing_peer = self.dht.routing_table.get_contact(peer.guid)
-
-                    if routing_peer is None:
-                        self.dht.routing_table.add_contact(peer)
-                        routing_peer = peer
+                    self.dht.learn_contact(peer.hostname, peer.port, peer.pub, peer.guid,
+                                           peer.nickname, peer.nat_type, peer.avatar_url)
 
                     data['senderGUID'] = self.guid
                     data['pubkey'] = self.pubkey
@@ -972,7 +1171,7 @@ class CryptoTransportLayer(TransportLayer):
                     def log_callback(msg):
                         self.log.debug('Message Back: \n%s', pformat(msg))
 
-                    routing_peer.send(data, log_callback)
+                    peer.send(data, log_callback)
 
                 except Exception:
                     self.log.info("Error sending over peer!")
@@ -989,6 +1188,10 @@ class CryptoTransportLayer(TransportLayer):
         msg_type = msg.get('type')
         namecoin = msg.get('senderNamecoin', '')
 
+        # Answer in the message format the peer understands
+        if guid in self.peers:
+            self.peers[guid].version = msg.get('v')
+
         # Checking for malformed URIs
         # if not network_util.is_valid_uri(uri):
         #     self.log.error('Malformed URI: %s', uri)
@@ -1016,6 +1219,11 @@ class CryptoTransportLayer(TransportLayer):
         print "CryptoTransportLayer.shutdown()!"
         print "Notice: explicit DHT Shutdown not implemented."
 
+        self.dht.save_routing_snapshot()
+
+        if self.listener is not None:
+            self.listener.stop()
+
         try:
             if self.bitmessage_api is not None:
                 self.bitmessage_api.close()
@@ -1025,3 +1233,84 @@ class CryptoTransportLayer(TransportLayer):
             self.log.error(
                 "Could not shutdown bitmessage_api's ServerProxy: %s", exc.message
             )
+
+
+class ConnectionEvictor(object):
+    """
+    Bounds the peer connections of a transport.
+
+    Connections unused for longer than idle_timeout are closed, and so
+    are the least recently used ones while there are more than
+    max_peers. Seed connections and connections with a message in
+    flight are never closed.
+    """
+
+    def __init__(self, market_id, peers, close_peer, max_peers=PEER_TABLE_MAX_SIZE,
+                 idle_timeout=PEERCONNECTION_IDLE_TIMEOUT_IN_SECONDS, clock=time.time):
+        """
+        @param peers: The connections by GUID; evicted ones are removed.
+        @type peers: dict
+
+        @param close_peer: Called with every evicted connection.
+        @type close_peer: callable
+        """
+        self.log = logging.getLogger(
+            '[%s] %s' % (market_id, self.__class__.__name__)
+        )
+        self.peers = peers
+        self.close_peer = close_peer
+        self.max_peers = max_peers
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+
+        self.num_evicted_idle = 0
+        self.num_evicted_lru = 0
+        self.num_kept_busy = 0
+
+    def evict(self):
+        """
+        @return: The number of connections closed.
+        @rtype: int
+        """
+        now = self.clock()
+        candidates = sorted(
+            ((key, peer) for key, peer in self.peers.items() if not peer.seed),
+            key=lambda item: item[1].last_used
+        )
+        excess = len(candidates) - self.max_peers
+
+        num_evicted = 0
+        for key, peer in candidates:
+            idle = now - peer.last_used > self.idle_timeout
+            if not idle and excess <= 0:
+                break
+            if peer.has_pending_messages():
+                self.num_kept_busy += 1
+                continue
+
+            del self.peers[key]
+            self.close_peer(peer)
+            num_evicted += 1
+            excess -= 1
+            if idle:
+                self.num_evicted_idle += 1
+            else:
+                self.num_evicted_lru += 1
+
+        return num_evicted
+
+    def get_stats(self):
+        return {
+            'live': len(self.peers),
+            'max': self.max_peers,
+            'evicted_idle': self.num_evicted_idle,
+            'evicted_lru': self.num_evicted_lru,
+            'kept_busy': self.num_kept_busy
+        }
+
+    def log_stats(self):
+        self.log.info("Connection Stats.")
+        self.log.info("Live Connections:        %d of %d", len(self.peers), self.max_peers)
+        self.log.info("Evicted While Idle:      %d", self.num_evicted_idle)
+        self.log.info("Evicted Over The Cap:    %d", self.num_evicted_lru)
+        self.log.info("Kept With Messages Due:  %d", self.num_kept_busy)
@@ -18,7 +18,7 @@ from bitcoin import (
 from tornado import iostream
 import tornado.websocket
 from twisted.internet import reactor
-from node import constants, protocol, trust
+from node import constants, crypto_util, protocol, trust
 from node.backuptool import BackupTool, Backup, BackupJSONEncoder
 import bitcoin
 
@@ -105,10 +105,15 @@ class ProtocolHandler(object):
             "undo_remove_contract": self.client_undo_remove_contract,
             "refresh_settings": self.client_refresh_settings,
             "refund_recipient": self.client_refund_recipient,
+            "cancel_search": self.client_cancel_search,
+            "search_stats": self.client_search_stats,
         }
 
         self.timeouts = []
 
+        # findIDs of DHT searches started on behalf of the client
+        self.client_searches = set()
+
         # unused for now, wipe it if you want later.
         self.loop = loop_instance
 
@@ -1054,11 +1059,67 @@ class ProtocolHandler(object):
 
         self.log.info("Querying for Contracts %s", msg)
 
-        self.transport.dht.find_listings_by_keyword(
+        dht = self.transport.dht
+        find_id = dht.find_listings_by_keyword(
             msg['key'].upper(),
             callback=self.on_find_products
         )
 
+        # Forget searches that have finished or expired in the meantime
+        self.client_searches = set(
+            search_id for search_id in self.client_searches
+            if dht.active_search_exists(search_id)
+        )
+
+        # The search may already be over if there was nobody to ask
+        if dht.active_search_exists(find_id):
+            self.client_searches.add(find_id)
+            self.send_to_client(None, {
+                "type": "search_started",
+                "findID": find_id,
+                "key": msg['key']
+            })
+
+    def client_cancel_search(self, socket_handler, msg):
+        """Cancel one client search by findID, or all of them."""
+        find_id = msg.get('findID')
+        if find_id:
+            # Searches of other clients are not ours to cancel
+            find_ids = [find_id] if find_id in self.client_searches else []
+        else:
+            find_ids = list(self.client_searches)
+
+        cancelled = []
+        for search_id in find_ids:
+            self.client_searches.discard(search_id)
+            if self.transport.dht.cancel_search(search_id, self.on_find_products):
+                cancelled.append(search_id)
+
+        self.log.info('Cancelled searches: %s', cancelled)
+        self.send_to_client(None, {
+            "type": "search_cancelled",
+            "findIDs": cancelled
+        })
+
+    def client_search_stats(self, socket_handler, msg):
+        dht = self.transport.dht
+        stats = dht.searches.get_stats()
+        stats['value_cache_hits'] = dht.value_cache.num_hits
+        stats['value_cache_misses'] = dht.value_cache.num_misses
+        stats['store'] = dht.store_stats.get_stats()
+        stats['refresh'] = dht.refresh_pacer.get_stats()
+        stats['connections'] = self.transport.evictor.get_stats()
+        stats['listener'] = self.transport.listener.get_stats()
+        stats['sessions'] = self.transport.sessions.get_stats()
+        stats['cryptors'] = crypto_util.cryptor_cache.get_stats()
+        stats['compression'] = self.transport.compression.get_stats()
+        if self.transport.listener.crypto_pool is not None:
+            stats['crypto_pool'] = self.transport.listener.crypto_pool.get_stats()
+        self.send_to_client(None, {
+            "type": "search_stats",
+            "stats": stats
+        })
+
     def client_query_store_products(self, socket_handler, msg):
         self.log.info("Searching network for contracts")
 
@@ -1335,7 +1396,7 @@ class ProtocolHandler(object):
         first = args[0]
         if isinstance(first, dict):
             self.send_to_client(None, first)
-            peer = self.transport.dht.routing_table.get_contact(first.get('senderGUID'))
+            peer = self.transport.peers.get(first.get('senderGUID'))
             if peer:
                 peer.reachable = True
         else:
@@ -31,6 +31,10 @@ class Connection(object):
             self.log.debug('Received reset message')
             #self._sender = Sender(packet_sender)
 
+    def has_pending(self):
+        """ True while a message is being sent or received. """
+        return self._sender.has_pending() or self._receiver.has_pending()
+
     def send(self, data):
         self._sender.send(data)
         count_outgoing_packet(data)
@@ -3,5 +3,12 @@ WINDOW_SIZE = 5
 TIMEOUT = 0.7
 MAX_SIZE = 50000
 MAX_RETRANSMISSION = 500
+# Seconds after which an unacknowledged window is given up
+STALE_WINDOW_TIMEOUT = 5
+# Seconds for which fragments of a received message are still
+# acknowledged, in case the acknowledgement was lost, but dropped
+COMPLETED_MESSAGE_TIMEOUT = 30
+# Version of the binary packet header
+HEADER_VERSION = 1
 RELAY_SERVER_IP = "seed2.openbazaar.org"
 RELAY_SERVER_PORT = 12345
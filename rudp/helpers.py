@@ -20,6 +20,12 @@ def split_array_like(data, length, message_id=None, data_size=None):
     return retval
 
 
+def split_fragments(data, length):
+    """ Split data into pieces of at most length bytes; empty data
+    still makes one piece. """
+    return [data[i:i + length] for i in xrange(0, len(data), length)] or ['']
+
+
 def set_interval(func, sec=0, times=3):
     def func_wrapper():
         set_interval(func, sec, times-1)
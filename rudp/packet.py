@@ -1,11 +1,54 @@
 from pyee import EventEmitter
 import json
 import logging
+import struct
+
+from rudp import constants
+
+FLAG_ACKNOWLEDGEMENT = 0x80
+FLAG_SYNCHRONIZE = 0x40
+FLAG_FINISH = 0x20
+FLAG_RESET = 0x10
+# The sender's identity follows the header
+FLAG_IDENTITY = 0x08
+# The payload is a raw fragment of the message, see rudp.sender.Sender
+FLAG_FRAGMENT = 0x04
+
+# version, flags, session id, sequence number, message id, fragment, fragments
+_HEADER = struct.Struct('!BBIIIHH')
+_FIELD_SIZE = struct.Struct('!H')
+_IDENTITY_FIELDS = ('guid', 'pubkey', 'hostname', 'nick', 'nat_type')
+
+
+def _pack_identity(identity):
+    parts = [_FIELD_SIZE.pack(int(identity.get('port') or 0))]
+    for field in _IDENTITY_FIELDS:
+        value = identity.get(field) or ''
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        parts.append(_FIELD_SIZE.pack(len(value)))
+        parts.append(value)
+    return ''.join(parts)
+
+
+def _unpack_identity(data, offset):
+    identity = {'port': _FIELD_SIZE.unpack_from(data, offset)[0]}
+    offset += _FIELD_SIZE.size
+    for field in _IDENTITY_FIELDS:
+        size = _FIELD_SIZE.unpack_from(data, offset)[0]
+        offset += _FIELD_SIZE.size
+        value = data[offset:offset + size]
+        if len(value) != size:
+            raise ValueError('Truncated peer identity')
+        identity[field] = value or None
+        offset += size
+    return identity, offset
 
 
 class Packet(object):
 
-    def __init__(self, sequence_number, payload=None, synchronize=None, reset=None, packet_buffer=False):
+    def __init__(self, sequence_number, payload=None, synchronize=None, reset=None, packet_buffer=False,
+                 message_id=None, fragment=0, fragments=1, raw_fragment=False):
 
         self.log = logging.getLogger(
             '%s' % self.__class__.__name__
@@ -17,6 +60,11 @@ class Packet(object):
         self.offset = 0
         bools = 0
         self._transmission_count = 0
+        self._session_id = None
+        self._message_id = message_id
+        self._fragment = fragment
+        self._fragments = fragments
+        self._raw_fragment = raw_fragment
 
         if packet_buffer:
 
@@ -43,12 +91,10 @@ class Packet(object):
             self._sequence_number = sequence_number
             self._payload = payload
 
-        self.log = logging.getLogger(
-            '%s' % self.__class__.__name__
-        )
-
     @staticmethod
-    def create_acknowledgement_packet(sequence_number, guid, pubkey):
+    def create_acknowledgement_packet(sequence_number, guid, pubkey, session_id=None):
+        """ session_id is that of the acknowledged packet; binary
+        acknowledgements go out in the sender's session. """
         ack_data = json.dumps({
             'type': 'ack',
             'senderGUID': guid,
@@ -56,8 +102,60 @@ class Packet(object):
         })
         packet = Packet(sequence_number, ack_data, False)
         packet._acknowledgement = True
+        packet._session_id = session_id
+        return packet
+
+    @staticmethod
+    def create_unknown_session_packet(sequence_number, session_id):
+        """ Answer a packet in a session the receiver does not know, so
+        its sender attaches its identity again. This is an
+        acknowledgement with the reset flag; it acknowledges nothing. """
+        packet = Packet(sequence_number, '', False, True)
+        packet._acknowledgement = True
+        packet._session_id = session_id
         return packet
 
+    def is_unknown_session(self):
+        return bool(self._acknowledgement and self._reset)
+
+    @staticmethod
+    def from_binary(data):
+        """
+        Parse a packet built by to_binary.
+
+        @param data: The packet, without the datagram's type header.
+        @type data: str
+
+        @return: The packet, its session id set, and the sender's
+                 identity if it was attached, or None.
+        @rtype: tuple
+
+        @raise ValueError: The packet is truncated or has an unknown
+                           header version.
+        """
+        try:
+            version, flags, session_id, sequence_number, message_id, fragment, fragments = \
+                _HEADER.unpack_from(data)
+            if version != constants.HEADER_VERSION:
+                raise ValueError('Unsupported packet header version %d' % version)
+
+            offset = _HEADER.size
+            identity = None
+            if flags & FLAG_IDENTITY:
+                identity, offset = _unpack_identity(data, offset)
+        except struct.error as exc:
+            raise ValueError('Truncated packet: %s' % exc)
+
+        packet = Packet(sequence_number, data[offset:], message_id=message_id,
+                        fragment=fragment, fragments=fragments, raw_fragment=bool(flags & FLAG_FRAGMENT))
+        packet._acknowledgement = bool(flags & FLAG_ACKNOWLEDGEMENT)
+        packet._synchronize = bool(flags & FLAG_SYNCHRONIZE)
+        packet._finish = bool(flags & FLAG_FINISH)
+        packet._reset = bool(flags & FLAG_RESET)
+        packet._session_id = session_id
+        packet._size = len(packet._payload)
+        return packet, identity
+
     @staticmethod
     def create_finish_packet():
         packet = Packet(0, '', False, False)
@@ -89,14 +187,17 @@ class Packet(object):
     def get_sequence_number(self):
         return self._sequence_number
 
+    def _flags(self):
+        return (
+            (self._acknowledgement and FLAG_ACKNOWLEDGEMENT) |
+            (self._synchronize and FLAG_SYNCHRONIZE) |
+            (self._finish and FLAG_FINISH) |
+            (self._reset and FLAG_RESET)
+        )
+
     def to_buffer(self, guid, pubkey, hostname, port, nick='Default', nat_type=None):
 
-        bools = 0 + (
-            (self._acknowledgement and 0x80) |
-            (self._synchronize and 0x40) |
-            (self._finish and 0x20) |
-            (self._reset and 0x10)
-        )
+        bools = 0 + self._flags()
 
         packet_buffer = {
             'bools': bools,
@@ -112,3 +213,35 @@ class Packet(object):
         }
 
         return json.dumps(packet_buffer)
+
+    def to_binary(self, session_id, identity=None):
+        """
+        Serialize the packet behind a fixed size binary header.
+
+        The peer learns the sender's identity (guid, pubkey, hostname,
+        port, nick and nat_type) once per session and recognises its
+        later packets by session_id. Acknowledgements carry no payload.
+
+        @param session_id: Sender's session with the peer.
+        @type session_id: int
+
+        @param identity: The sender's identity, to attach it.
+        @type identity: dict
+        """
+        flags = self._flags()
+        if identity:
+            flags |= FLAG_IDENTITY
+        if self._raw_fragment:
+            flags |= FLAG_FRAGMENT
+        parts = [_HEADER.pack(
+            constants.HEADER_VERSION, flags, session_id, int(self._sequence_number),
+            self._message_id or 0, self._fragment, self._fragments
+        )]
+        if identity:
+            parts.append(_pack_identity(identity))
+        if not self._acknowledgement:
+            payload = self._payload
+            if isinstance(payload, unicode):
+                payload = payload.encode('utf-8')
+            parts.append(payload)
+        return ''.join(parts)
@@ -1,4 +1,8 @@
+import errno
 import logging
+import random
+from node import packettype
+from node.constants import PACKET_TYPE_RELAYTO, PACKET_TYPE_RUDP, PACKET_TYPE_HEADERS
 from rudp import constants
 
 class PacketSender(object):
@@ -15,27 +19,63 @@ class PacketSender(object):
         self._nat_type = nat_type
         self.relaying = relaying
 
+        # Send binary packets; set once the peer is known to read them
+        self.binary = PACKET_TYPE_HEADERS
+        self.session_id = random.getrandbits(32)
+        # Whether the peer acknowledged a packet carrying our identity
+        self.identity_acknowledged = False
+
         self.log = logging.getLogger(
             '%s' % self.__class__.__name__
         )
 
         self.log.info('Init PacketSender')
 
+    def _to_binary(self, packet):
+        if packet._acknowledgement:
+            # Acknowledgements belong to the session of the peer's packet
+            session_id = self.session_id if packet._session_id is None else packet._session_id
+            identity = None
+        else:
+            session_id = self.session_id
+            identity = None if self.identity_acknowledged else {
+                'guid': self._transport.guid,
+                'pubkey': self._transport.pubkey,
+                'hostname': self._transport.hostname,
+                'port': self._src_port,
+                'nick': self._transport.nickname,
+                'nat_type': self._transport.nat_type,
+            }
+        return packettype.encode(PACKET_TYPE_RUDP, packet.to_binary(session_id, identity), header=True)
+
     def send(self, packet):
-        send_buffer = packet.to_buffer(self._transport.guid,
-                                       self._transport.pubkey,
-                                       self._transport.hostname,
-                                       self._src_port,
-                                       self._transport.nickname,
-                                       self._transport.nat_type)
+        if self.binary:
+            send_buffer = self._to_binary(packet)
+        else:
+            send_buffer = packet.to_buffer(self._transport.guid,
+                                           self._transport.pubkey,
+                                           self._transport.hostname,
+                                           self._src_port,
+                                           self._transport.nickname,
+                                           self._transport.nat_type)
 
         self.log.debug('PacketSender: %s %s', self.relaying, self._nat_type)
 
-        if (not self.relaying and self._nat_type != 'Symmetric NAT') or self._transport.ob_ctx.seed_mode:
-            self.log.debug('Sending packet over the wire: [%s] to %s:%s', send_buffer, self._address, self._port)
-            self._socket.sendto(send_buffer, (self._address, self._port))
-        else:
-            relay_pair = (constants.RELAY_SERVER_IP, constants.RELAY_SERVER_PORT)
-            self.log.debug('Relaying packet: %s', relay_pair)
-            self._socket.sendto('relayto %s %s %s %s' % (self._guid, self._address,
-                                                         self._port, send_buffer), relay_pair)
+        try:
+            if (not self.relaying and self._nat_type != 'Symmetric NAT') or self._transport.ob_ctx.seed_mode:
+                self.log.debug('Sending packet over the wire: [%s] to %s:%s',
+                               send_buffer, self._address, self._port)
+                self._socket.sendto(send_buffer, (self._address, self._port))
+            else:
+                relay_pair = (constants.RELAY_SERVER_IP, constants.RELAY_SERVER_PORT)
+                self.log.debug('Relaying packet: %s', relay_pair)
+                relayto = packettype.encode(PACKET_TYPE_RELAYTO, '%s %s %s %s' % (
+                    self._guid, self._address, self._port, send_buffer
+                ))
+                self._socket.sendto(relayto, relay_pair)
+        except EnvironmentError as exc:
+            if exc.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            # The listener socket is non-blocking; a packet that does not
+            # fit in the send buffer is dropped, as the network might
+            self.log.debug('Send buffer full, dropped packet to %s:%s', self._address, self._port)
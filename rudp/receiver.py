@@ -1,7 +1,9 @@
 import logging
+import time
 from pyee import EventEmitter
 from rudp.packet import Packet
 from rudp.sortedlist import SortedList
+import rudp.constants
 
 
 class IncomingMessage(object):
@@ -33,6 +35,13 @@ class IncomingMessage(object):
             self.body += payload
 
 
+    def is_complete(self):
+        try:
+            return len(self.body) >= int(self.size)
+        except ValueError:
+            # A malformed size can never be reached
+            return True
+
     def reset(self):
         self.log.debug('IncomingMessage Reset')
         self.log.debug('Self Packets: %s', self._packets)
@@ -60,6 +69,29 @@ class IncomingMessage(object):
             self.log.debug('Problem with resetting IncomingMessage: %s', exc)
 
 
+class FragmentedMessage(object):
+    """ A message sent as raw fragments, put together by their index. """
+
+    def __init__(self, message_id, count):
+        self.message_id = message_id
+        self.count = count
+        self.fragments = {}
+        # Sequence numbers of the fragments, by index
+        self.sequence_numbers = {}
+        self.last_received = time.time()
+
+    def add_fragment(self, index, payload, sequence_number=None):
+        self.fragments.setdefault(index, payload)
+        self.sequence_numbers.setdefault(index, sequence_number)
+        self.last_received = time.time()
+
+    def is_complete(self):
+        return len(self.fragments) >= self.count
+
+    def get_body(self):
+        return ''.join(self.fragments[index] for index in xrange(self.count))
+
+
 class Receiver(object):
     def __init__(self, packet_sender):
 
@@ -70,6 +102,10 @@ class Receiver(object):
         self.event_emitter = EventEmitter()
 
         self.incoming_messages = {}
+        self.fragmented_messages = {}
+        # When the fragments of recently completed messages were
+        # completed, by (message id, sequence number)
+        self.completed_fragments = {}
 
         self._synced = False
         self._next_sequence_number = 0
@@ -78,6 +114,7 @@ class Receiver(object):
         self._packets = SortedList()
         self._packet_sender = packet_sender
         self._closed = False
+        self._last_received = 0
 
         self._message = ''
         self._message_id = None
@@ -122,9 +159,73 @@ class Receiver(object):
         except Exception as exc:
             self.log.debug('Not full yet: %s', exc)
 
+    def has_pending(self):
+        """ True while a message is partly received and its packets are
+        still coming in. """
+        if time.time() - self._last_received > rudp.constants.STALE_WINDOW_TIMEOUT:
+            return False
+        self._expire_fragments()
+        if self.fragmented_messages:
+            return True
+        return any(not message.is_complete() for message in self.incoming_messages.values())
+
+    def _expire_fragments(self):
+        """ Forget incomplete messages that stopped arriving, and
+        messages completed long enough ago. """
+        now = time.time()
+        for message_id, message in self.fragmented_messages.items():
+            if now - message.last_received > rudp.constants.STALE_WINDOW_TIMEOUT:
+                self.log.debug('Dropping incomplete message #%d', message_id)
+                del self.fragmented_messages[message_id]
+        for fragment, completed in self.completed_fragments.items():
+            if now - completed > rudp.constants.COMPLETED_MESSAGE_TIMEOUT:
+                del self.completed_fragments[fragment]
+
+    def _acknowledge(self, packet):
+        self._packet_sender.send(Packet.create_acknowledgement_packet(
+            packet._sequence_number,
+            self._packet_sender._transport.guid,
+            self._packet_sender._transport.pubkey,
+            packet._session_id
+        ))
+
+    def _receive_fragment(self, packet):
+        if (packet._message_id, packet._sequence_number) in self.completed_fragments:
+            # Sent again as our acknowledgement was lost
+            self.log.debug('Already received message #%d', packet._message_id)
+            self._acknowledge(packet)
+            return
+
+        message = self.fragmented_messages.get(packet._message_id)
+        if message is None:
+            self._expire_fragments()
+            message = FragmentedMessage(packet._message_id, packet._fragments)
+            self.fragmented_messages[packet._message_id] = message
+
+        if packet._fragment >= message.count:
+            self.log.debug('Dropping fragment %d of a %d fragment message', packet._fragment, message.count)
+            return
+        message.add_fragment(packet._fragment, packet._payload, packet._sequence_number)
+        self._acknowledge(packet)
+
+        if message.is_complete():
+            del self.fragmented_messages[packet._message_id]
+            self._expire_fragments()
+            now = time.time()
+            for sequence_number in message.sequence_numbers.values():
+                self.completed_fragments[(message.message_id, sequence_number)] = now
+            body = message.get_body()
+            self.log.debug('Message #%d complete (%d bytes)', message.message_id, len(body))
+            self.event_emitter.emit('data', {'payload': body, 'size': len(body), 'binary': True})
+
     def receive(self, packet):
 
         self.log.debug('Receive Packet #%s', packet.get_sequence_number())
+        self._last_received = time.time()
+
+        if packet._raw_fragment:
+            self._receive_fragment(packet)
+            return
 
         try:
             packet_data = packet._payload.split('|')
@@ -171,7 +272,8 @@ class Receiver(object):
                     self._packet_sender.send(Packet.create_acknowledgement_packet(
                         packet._sequence_number,
                         self._packet_sender._transport.guid,
-                        self._packet_sender._transport.pubkey
+                        self._packet_sender._transport.pubkey,
+                        packet._session_id
                     ))
 
                     return
@@ -190,7 +292,8 @@ class Receiver(object):
                 self._packet_sender.send(Packet.create_acknowledgement_packet(
                     packet._sequence_number,
                     self._packet_sender._transport.guid,
-                    self._packet_sender._transport.pubkey
+                    self._packet_sender._transport.pubkey,
+                    packet._session_id
                 ))
                 return
             else:
@@ -211,7 +314,8 @@ class Receiver(object):
                     self._packet_sender.send(Packet.create_acknowledgement_packet(
                         packet._sequence_number,
                         self._packet_sender._transport.guid,
-                        self._packet_sender._transport.pubkey
+                        self._packet_sender._transport.pubkey,
+                        packet._session_id
                     ))
                 else:
                     self.log.debug('Already have this packet')
@@ -338,7 +442,8 @@ class Receiver(object):
             # [1] Never send packets directly!
             self._packet_sender.send(Packet.create_acknowledgement_packet(packet.get_sequence_number(),
                                                                           self._packet_sender._transport.guid,
-                                                                          self._packet_sender._transport.pubkey))
+                                                                          self._packet_sender._transport.pubkey,
+                                                                          packet._session_id))
             self._next_sequence_number += 1
 
             self._packets.seek()
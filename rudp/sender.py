@@ -121,22 +121,30 @@ class Sender(object):
         self.event_emitter = EventEmitter()
 
     def send(self, data):
-        data_encoded = data.encode('hex')
-        data_size = str(len(data_encoded))
-
         # Unique message ID
         message_id = random.randint(0, 99999)
 
         # Split message into chunks
-        chunks = rudp.helpers.split_array_like(data_encoded, rudp.constants.UDP_SAFE_SEGMENT_SIZE,
-                                               message_id, data_size)
+        raw_fragments = self._packet_sender.binary
+        if raw_fragments:
+            # The binary header numbers the fragments; the bytes go as they are
+            chunks = rudp.helpers.split_fragments(data, rudp.constants.UDP_SAFE_SEGMENT_SIZE)
+        else:
+            data_encoded = data.encode('hex')
+            data_size = str(len(data_encoded))
+            chunks = rudp.helpers.split_array_like(data_encoded, rudp.constants.UDP_SAFE_SEGMENT_SIZE,
+                                                   message_id, data_size)
+        chunks = [
+            (message_id, fragment, len(chunks), chunk, raw_fragments)
+            for fragment, chunk in enumerate(chunks)
+        ]
         self.log.debug('Sending %d chunks', len(chunks))
 
         # Organize into windows
         windows = rudp.helpers.split_array_like(chunks, rudp.constants.WINDOW_SIZE)
 
         # Clear stale windows
-        if time.time() - self._last_sent > 5 and self._last_sent != 0:
+        if time.time() - self._last_sent > rudp.constants.STALE_WINDOW_TIMEOUT and self._last_sent != 0:
             self._windows = []
             self._sending = None
             self._last_sent = 0
@@ -158,10 +166,13 @@ class Sender(object):
             window = self._windows.pop(0)
 
             # Generate PendingPacket objects to store in Window
-            def get_packet(i, pdata):
-                packet = Packet(float(i) + self._base_sequence_number, pdata, not i, i == (len(window) - 1))
+            def get_packet(i, chunk):
+                message_id, fragment, fragments, pdata, raw_fragment = chunk
+                packet = Packet(float(i) + self._base_sequence_number, pdata, not i, i == (len(window) - 1),
+                                message_id=message_id, fragment=fragment, fragments=fragments,
+                                raw_fragment=raw_fragment)
                 return PendingPacket(packet, self._packet_sender)
-            packets = [get_packet(i, data) for i, data in enumerate(window)]
+            packets = [get_packet(i, chunk) for i, chunk in enumerate(window)]
 
             to_send = Window(packets)
             self._sending = to_send
@@ -183,6 +194,14 @@ class Sender(object):
             else:
                 self.log.debug('All done.')
 
+    def has_pending(self):
+        """ True while messages are queued or a window is waiting for
+        acknowledgements that are not overdue. """
+        if self._windows:
+            return True
+        return self._sending is not None and \
+            time.time() - self._last_sent <= rudp.constants.STALE_WINDOW_TIMEOUT
+
     def verify_acknowledgement(self, sequence_number):
         self.log.debug('ACK: %s', sequence_number)
         if self._sending:
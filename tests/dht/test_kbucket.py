@@ -392,6 +392,13 @@ class TestCachingKBucket(TestKBucket):
         self.assertIn(new_contact1, self.bucket)
         self.assertNotIn(new_contact1, self.bucket.get_cached_contacts())
 
+    def test_remove_cached_guid(self):
+        new_contact = self._make_contact_from_num(self.range_max - 1)
+        self.bucket.cache_contact(new_contact)
+        self.assertTrue(self.bucket.remove_cached_guid(new_contact.guid))
+        self.assertEqual(self.bucket.get_cached_contacts(), [])
+        self.assertFalse(self.bucket.remove_cached_guid(new_contact.guid))
+
     def test_remove_guid_replace(self):
         new_contact1 = self._make_contact_from_num(self.range_max - 1)
         new_contact2 = self._make_contact_from_num(self.range_min)
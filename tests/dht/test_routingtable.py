@@ -177,6 +177,33 @@ class TestRoutingTable(unittest.TestCase):
         except Exception:
             self.fail('RoutingTable crashed on removing absent contact.')
 
+    def test_split_kbucket(self):
+        self.rt.split_kbucket(0)
+        self.assertEqual(len(self.rt), 2)
+        self.assertEqual(self.rt[0].range_max, self.rt[1].range_min)
+        self.assertEqual(self.rt[1].range_max, self.range_max)
+
+    def test_report_unreachable(self):
+        # The contact that caused the split is cached in the far bucket.
+        rt = self._make_rt_with_n_buckets(2)
+        stale_contact = rt[1][0]
+        cached_contact = rt[1].get_cached_contacts()[-1]
+        self.assertEqual(rt.report_unreachable(stale_contact.guid), cached_contact)
+        self.assertNotIn(stale_contact, rt[1])
+        self.assertIn(cached_contact, rt[1])
+
+        # Nothing left to replace it with, so the contact stays
+        stale_contact = rt[1][0]
+        self.assertIsNone(rt.report_unreachable(stale_contact.guid))
+        self.assertIn(stale_contact, rt[1])
+
+    def test_report_unreachable_cached(self):
+        rt = self._make_rt_with_n_buckets(2)
+        cached_contact = rt[1].get_cached_contacts()[-1]
+        self.assertIsNone(rt.report_unreachable(cached_contact.guid))
+        self.assertEqual(rt[1].get_cached_contacts(), [])
+        self.assertNotIn(cached_contact, rt[1])
+
     def _make_rt_with_n_buckets(self, n):
         rt = routingtable.RoutingTable(self.own_guid, 42)
         # Fill the first Kbucket and cause it to split. Since all
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import unittest
+import zlib
+
+from bitcoin import main as arithmetic
+
+from node import compression, envelope
+from node.compression import CompressionPolicy
+from node.connection import CryptoPeerListener
+from node.crypto_util import Cryptor
+
+
+class TestCompressionPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = CompressionPolicy(min_size=128, levels={'store': 9}, default_level=1)
+        self.message = json.dumps({
+            'type': 'findNode', 'senderGUID': 'ab' * 20, 'guid': 'ab' * 20, 'findID': 'cd' * 20,
+            'hostname': '10.0.0.1', 'port': 12345, 'senderNick': 'alice', 'v': '0.5.1',
+            'pubkey': '04' + 'ef' * 64
+        })
+
+    def test_round_trip(self):
+        for msg_type in ('findNode', 'store'):
+            data = self.policy.compress(self.message, msg_type, '0.5.1')
+            self.assertEqual(data[:1], compression.FORMAT_DICTIONARY_1)
+            self.assertEqual(self.policy.decompress(data), self.message)
+
+    def test_dictionary_beats_zlib(self):
+        data = self.policy.compress(self.message, 'findNode', '0.5.1')
+        self.assertLess(len(data), len(zlib.compress(self.message)))
+
+    def test_small_message_left_uncompressed(self):
+        data = self.policy.compress('{"type": "ping"}', 'ping', '0.5.1')
+        self.assertEqual(data, compression.FORMAT_NONE + '{"type": "ping"}')
+        self.assertEqual(compression.decompress(data), '{"type": "ping"}')
+
+    def test_incompressible_message_left_uncompressed(self):
+        noise = os.urandom(1000)
+        data = self.policy.compress(noise, 'store', '0.5.1')
+        self.assertEqual(data, compression.FORMAT_NONE + noise)
+        self.assertEqual(compression.decompress(data), noise)
+
+    def test_legacy_peers_get_zlib(self):
+        for version in (None, '0.5.0', 'unknown'):
+            data = self.policy.compress(self.message, 'findNode', version)
+            self.assertEqual(zlib.decompress(data), self.message)
+        self.assertEqual(compression.decompress(zlib.compress('{}')), '{}')
+        self.assertEqual(compression.decompress(zlib.compress(self.message, 9)), self.message)
+
+    def test_level_by_type(self):
+        for msg_type, level in (('store', 9), ('findNode', 1)):
+            compressor = compression._primed_compressor(level)[0]
+            expected = compressor.compress(self.message) + compressor.flush()
+            self.assertEqual(self.policy.compress(self.message, msg_type, '0.5.1'),
+                             compression.FORMAT_DICTIONARY_1 + expected)
+
+    def test_corrupt_data(self):
+        data = self.policy.compress(self.message, 'findNode', '0.5.1')
+        self.assertRaises(zlib.error, compression.decompress, data[:1] + 'x' * 20)
+
+    def test_stats(self):
+        self.policy.compress(self.message, 'findNode', '0.5.1')
+        self.policy.compress('{}', 'ping', '0.5.1')
+        self.policy.compress(self.message, 'findNode', '0.5.0')
+        stats = self.policy.get_stats()
+        self.assertEqual(
+            (stats['compressed'], stats['uncompressed'], stats['legacy']), (1, 1, 1))
+        self.assertEqual(stats['bytes_in'], 2 * len(self.message) + 2)
+        self.assertLess(stats['ratio'], 1)
+        self.assertGreaterEqual(stats['compress_cpu_seconds'], 0)
+
+    def test_listener_opens_compressed_envelope(self):
+        secret = hashlib.sha256('bob').hexdigest()
+        recipient = Cryptor(privkey_hex=secret)
+        to_recipient = Cryptor(pubkey_hex=arithmetic.privkey_to_pubkey(secret))
+        sender_secret = hashlib.sha256('alice').hexdigest()
+        message = json.loads(self.message)
+        message['pubkey'] = arithmetic.privkey_to_pubkey(sender_secret)
+
+        data = envelope.encode(message, Cryptor(privkey_hex=sender_secret).sign)
+        encrypted = to_recipient.encrypt(self.policy.compress(data, 'findNode', '0.5.1'))
+        self.assertEqual(CryptoPeerListener.open_encrypted_message(recipient, encrypted), message)
+
+
+if __name__ == '__main__':
+    unittest.main()
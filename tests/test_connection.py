@@ -1,5 +1,8 @@
 import unittest
 
+import mock
+from tornado import ioloop
+
 from node import connection, guid, transport
 from tests import test_transport
 import socket
@@ -61,6 +64,47 @@ class TestPeerConnection(unittest.TestCase):
         # self.assertIsNotNone(self.pc1.ctx)
         self.assertEqual(self.pc2.nickname, self.nickname)
 
+    def test_close(self):
+        self.assertFalse(self.pc1.has_pending_messages())
+        timeouts = [self.pc1._pinger_timeout, self.pc1._no_response_timeout]
+
+        self.pc1.close()
+        self.assertTrue(self.pc1.closed)
+        for timeout in timeouts:
+            self.assertIsNone(timeout.callback)
+        self.assertIsNone(self.pc1._pinger_timeout)
+        self.assertIsNone(self.pc1._rudp_connection)
+
+    def test_closed_connection_ignores_stale_calls(self):
+        pinger = self.pc1._pinger_timeout.callback
+        self.pc1.close()
+        with mock.patch.object(self.transport, 'seed_mode', False, create=True):
+            self.pc1.send_raw('late')
+            self.pc1.send_raw('late', relay=True)
+        self.pc1.send_to_rudp('late')
+        self.pc1.reset()
+        self.pc1._flush_send_queue()
+        pinger()
+        self.assertFalse(self.pc1.has_pending_messages())
+        self.assertEqual(self.pc1._send_queue, [])
+        self.assertIsNone(self.pc1._pinger_timeout)
+
+    def test_sends_queued_while_pinging(self):
+        self.pc1.pinging = True
+        with mock.patch.object(self.transport, 'seed_mode', False, create=True), \
+                mock.patch.object(self.pc1, '_send_out') as send_out:
+            self.pc1.send_raw('first')
+            self.pc1.send_raw('second')
+            self.assertFalse(send_out.called)
+            self.assertTrue(self.pc1.has_pending_messages())
+            self.assertIsNotNone(self.pc1._send_timeout)
+
+            self.pc1.pinging = False
+            self.pc1._flush_send_queue()
+            self.assertEqual(send_out.call_args_list, [mock.call('first'), mock.call('second')])
+        self.assertEqual(self.pc1._send_queue, [])
+        self.pc1.close()
+
 
 class TestCryptoPeerConnection(TestPeerConnection):
 
@@ -202,5 +246,119 @@ class TestCryptoPeerConnection(TestPeerConnection):
         self.assertTrue(connection.CryptoPeerListener.validate_signature(signature, data))
         self.assertFalse(connection.CryptoPeerListener.validate_signature(bad_signature, data))
 
+
+class TestPeerListener(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = connection.PeerListener('127.0.0.1', 0, '1', None)
+        self.listener.loop = mock.Mock()
+        self.listener.listen()
+        self.addCleanup(self.listener.socket.close)
+        self.address = self.listener.socket.getsockname()
+
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.settimeout(1)
+        self.addCleanup(self.client.close)
+
+        self.messages = []
+        self.listener.event_emitter.on('on_message', self.messages.append)
+
+    def test_listens_on_loop(self):
+        self.listener.loop.add_handler.assert_called_once_with(
+            self.listener.socket.fileno(), self.listener._on_readable, ioloop.IOLoop.READ
+        )
+        self.assertEqual(self.listener.socket.gettimeout(), 0.0)
+
+        self.listener.stop()
+        self.listener.loop.remove_handler.assert_called_once_with(self.listener.socket.fileno())
+        self.assertFalse(self.listener.is_listening)
+
+    def test_reads_waiting_datagrams(self):
+        self.client.sendto('ping', self.address)
+        self.client.sendto('hello', self.address)
+
+        self.listener._on_readable(self.listener.socket.fileno(), ioloop.IOLoop.READ)
+        self.assertEqual(self.client.recvfrom(16)[0], 'pong')
+        self.assertEqual([msg[0] for msg in self.messages], ['hello'])
+
+        # Nothing left to read
+        self.listener._on_readable(self.listener.socket.fileno(), ioloop.IOLoop.READ)
+        self.assertEqual(len(self.messages), 1)
+
+    def test_answers_in_format_of_request(self):
+        self.client.sendto('\x01', self.address)
+        self.client.sendto('relay_ping 42', self.address)
+        self.client.sendto('\x0442', self.address)
+
+        self.listener._on_readable(self.listener.socket.fileno(), ioloop.IOLoop.READ)
+        self.assertEqual(self.client.recvfrom(64)[0], '\x02')
+        self.assertEqual(self.client.recvfrom(64)[0], 'send_relay_pong 1 42')
+        self.assertEqual(self.client.recvfrom(64)[0], '\x051 42')
+        self.assertEqual(self.messages, [])
+
+    def test_dispatches_control_packets(self):
+        events = []
+        for event in ('on_punch', 'on_relay_message', 'on_relay_pong_message', 'on_relayto'):
+            self.listener.event_emitter.on(event, lambda msg, event=event: events.append((event, msg)))
+
+        self.client.sendto('punch 42', self.address)
+        self.client.sendto('\x09{"seq": 1}', self.address)
+        self.client.sendto('\x0642', self.address)
+        self.client.sendto('relayto 42 10.0.0.1 12345 {"seq": 1}', self.address)
+        self.client.sendto('{"seq": 2}', self.address)
+        client_address = ('127.0.0.1', self.client.getsockname()[1])
+
+        self.listener._on_readable(self.listener.socket.fileno(), ioloop.IOLoop.READ)
+        self.assertEqual(events, [
+            ('on_punch', ('42', client_address)),
+            ('on_relay_message', ('{"seq": 1}', client_address)),
+            ('on_relay_pong_message', ('42', client_address)),
+            ('on_relayto', '42 10.0.0.1 12345 {"seq": 1}'),
+        ])
+        self.assertEqual(self.messages, [('{"seq": 2}', client_address)])
+
+    def test_read_budget(self):
+        for num in range(3):
+            self.client.sendto('message %d' % num, self.address)
+
+        with mock.patch.object(connection, 'PEERLISTENER_RECV_BUDGET', 2):
+            self.listener._on_readable(self.listener.socket.fileno(), ioloop.IOLoop.READ)
+            self.assertEqual(len(self.messages), 2)
+            self.listener._on_readable(self.listener.socket.fileno(), ioloop.IOLoop.READ)
+        self.assertEqual([msg[0] for msg in self.messages], ['message 0', 'message 1', 'message 2'])
+
+    def test_socket_buffers(self):
+        rcvbuf = self.listener.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        # The kernel may cap the size, but never below the default
+        self.assertGreater(rcvbuf, 0)
+        stats = self.listener.get_stats()
+        self.assertEqual(stats['rcvbuf'], rcvbuf)
+        self.assertEqual(stats['recv_buffer_size'], len(self.listener._recv_buffer))
+
+    def test_oversized_datagram_is_dropped(self):
+        listener = connection.PeerListener('127.0.0.1', 0, '1', None, recv_buffer_size=16)
+        listener.loop = mock.Mock()
+        listener.listen()
+        self.addCleanup(listener.socket.close)
+        messages = []
+        listener.event_emitter.on('on_message', messages.append)
+
+        self.client.sendto('x' * 17, listener.socket.getsockname())
+        self.client.sendto('y' * 16, listener.socket.getsockname())
+        listener._on_readable(listener.socket.fileno(), ioloop.IOLoop.READ)
+
+        self.assertEqual([msg[0] for msg in messages], ['y' * 16])
+        self.assertEqual(listener.get_stats()['truncated'], 1)
+        self.assertEqual(listener.get_stats()['received'], 1)
+
+    def test_handler_error_does_not_stop_reading(self):
+        self.listener.event_emitter.on('on_message', mock.Mock(side_effect=ValueError))
+        self.client.sendto('first', self.address)
+        self.client.sendto('second', self.address)
+
+        self.listener._on_readable(self.listener.socket.fileno(), ioloop.IOLoop.READ)
+        self.assertEqual(len(self.messages), 2)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from node import contact, guid
+
+
+class TestContactRecord(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.guid = '0' * 39 + '1'
+
+    def _record(self, **kwargs):
+        return contact.ContactRecord(self.guid, '10.0.0.1', 12345, **kwargs)
+
+    def test_init(self):
+        record = self._record(pub='pub', nickname='nick', last_reached=1000)
+        self.assertEqual(record.guid, self.guid)
+        self.assertEqual((record.hostname, record.port), ('10.0.0.1', 12345))
+        self.assertEqual((record.pub, record.nickname), ('pub', 'nick'))
+        self.assertIsNone(record.nat_type)
+        self.assertIsNone(record.avatar_url)
+        self.assertEqual(record.last_reached, 1000)
+
+    def test_slots(self):
+        record = self._record()
+        self.assertFalse(hasattr(record, '__dict__'))
+        with self.assertRaises(AttributeError):
+            record.reachable = True
+
+    def test_eq(self):
+        record = self._record()
+        self.assertEqual(record, self._record(nickname='other'))
+        self.assertEqual(record, guid.GUIDMixin(self.guid))
+        self.assertEqual(guid.GUIDMixin(self.guid), record)
+        self.assertEqual(record, self.guid)
+        self.assertNotEqual(record, contact.ContactRecord('0' * 40, '10.0.0.1', 12345))
+        self.assertEqual(hash(record), hash(self.guid))
+
+    def test_update(self):
+        record = self._record(pub='pub', nat_type='Full Cone')
+        record.update(port=1, nickname='nick', nat_type=None)
+        self.assertEqual((record.hostname, record.port), ('10.0.0.1', 1))
+        self.assertEqual((record.pub, record.nickname, record.nat_type), ('pub', 'nick', 'Full Cone'))
+
+
+if __name__ == "__main__":
+    unittest.main()
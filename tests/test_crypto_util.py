@@ -141,5 +141,37 @@ class TestCryptoUtil(unittest.TestCase):
         self.assertTrue(self.dual_cryptor.verify(crypto_sig2, ciphertext))
 
 
+class TestCryptorCache(unittest.TestCase):
+
+    def setUp(self):
+        self.pubkeys = [
+            arithmetic.privkey_to_pubkey('%064x' % num) for num in range(1, 4)
+        ]
+
+    def test_reuses_cryptors(self):
+        cache = crypto_util.CryptorCache(max_size=2)
+        cryptor = cache.get(self.pubkeys[0])
+        self.assertFalse(cryptor.has_privkey)
+        self.assertIs(cache.get(self.pubkeys[0]), cryptor)
+        self.assertEqual((cache.num_hits, cache.num_misses), (1, 1))
+
+    def test_evicts_least_recently_used(self):
+        cache = crypto_util.CryptorCache(max_size=2)
+        first = cache.get(self.pubkeys[0])
+        cache.get(self.pubkeys[1])
+        cache.get(self.pubkeys[0])
+        cache.get(self.pubkeys[2])
+
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn(self.pubkeys[1], cache.entries)
+        self.assertIs(cache.get(self.pubkeys[0]), first)
+        self.assertEqual(cache.get_stats(), {'size': 2, 'max': 2, 'hits': 2, 'misses': 3})
+
+    def test_invalid_key_not_cached(self):
+        cache = crypto_util.CryptorCache()
+        self.assertRaises(Exception, cache.get, '04' + '00' * 64)
+        self.assertEqual(len(cache), 0)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import socket
+import unittest
+
+from bitcoin import main as arithmetic
+import mock
+
+from node.connection import CryptoPeerListener
+from node.crypto_util import Cryptor
+from node.cryptopool import CryptoPool
+
+
+def _open(item):
+    if item == 'fail':
+        raise ValueError('cannot open')
+    if item == 'drop':
+        return None
+    return item.upper()
+
+
+def _fd_is_open(fd):
+    try:
+        os.fstat(fd)
+    except OSError:
+        return False
+    return True
+
+
+class TestCryptoPool(unittest.TestCase):
+
+    def setUp(self):
+        self.delivered = []
+        self.loop = mock.Mock()
+        self.pool = CryptoPool(_open, self.delivered.append, 2, batch_size=2, max_pending=8, loop=self.loop)
+        self.addCleanup(self.pool.close)
+
+    def test_delivers_in_order_per_peer(self):
+        for peer, item in (('a', 'a1'), ('b', 'b1'), ('a', 'a2'), ('b', 'b2'), ('a', 'a3')):
+            self.pool.submit(peer, item)
+        self.pool.put('a', 'A4')
+        self.assertEqual(self.delivered, [])
+
+        # The second batch finishes first
+        first, second = self.pool._batches
+        self.pool._complete(second, second.result.get())
+        self.assertEqual(self.delivered, [])
+
+        self.pool.drain()
+        self.assertEqual([item for item in self.delivered if item[0] == 'A'], ['A1', 'A2', 'A3', 'A4'])
+        self.assertEqual([item for item in self.delivered if item[0] == 'B'], ['B1', 'B2'])
+        self.assertEqual(self.pool.num_pending, 0)
+        self.assertEqual(self.pool.get_stats()['batches'], 3)
+
+    def test_put_without_pending_delivers_at_once(self):
+        self.pool.put('a', 'A1')
+        self.assertEqual(self.delivered, ['A1'])
+
+    def test_flushes_partial_batch_on_loop(self):
+        self.pool.submit('a', 'a1')
+        self.assertFalse(self.pool._batches)
+        flush = self.loop.add_callback.call_args[0][0]
+        flush()
+        self.pool.drain()
+        self.assertEqual(self.delivered, ['A1'])
+
+    def test_drops_failed_messages(self):
+        for item in ('fail', 'a1', 'drop', 'a2'):
+            self.pool.submit('a', item)
+        self.pool.drain()
+        self.assertEqual(self.delivered, ['A1', 'A2'])
+        self.assertEqual(self.pool.num_failed, 1)
+
+    def test_workers_close_inherited_sockets(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(sock.close)
+        pool = CryptoPool(_fd_is_open, self.delivered.append, 1, loop=self.loop)
+        self.addCleanup(pool.close)
+
+        pool.submit('a', sock.fileno())
+        pool.drain()
+        self.assertEqual(self.delivered, [False])
+
+    def test_waits_when_full(self):
+        self.pool.max_pending = 4
+        for num in range(4):
+            self.pool.submit('a', 'a%d' % num)
+        self.assertEqual(self.delivered, [])
+
+        self.pool.submit('a', 'a4')
+        self.assertEqual(self.delivered, ['A0', 'A1'])
+        self.assertEqual(self.pool.num_waits, 1)
+        self.assertEqual(self.pool.num_pending, 3)
+
+
+class TestCryptoPeerListenerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.secret = hashlib.sha256('bob').hexdigest()
+        self.pubkey = arithmetic.privkey_to_pubkey(self.secret)
+        self.messages = []
+        self.listener = CryptoPeerListener(
+            '127.0.0.1', 0, self.pubkey, self.secret, 'bob', self.messages.append, crypto_workers=1
+        )
+        self.listener.crypto_pool.loop = mock.Mock()
+        self.addCleanup(self.listener.crypto_pool.close)
+
+    def _encrypt(self, message):
+        sender_secret = hashlib.sha256('alice').hexdigest()
+        message = dict(message, pubkey=arithmetic.privkey_to_pubkey(sender_secret))
+        sig_data = json.dumps(message).encode('hex')
+        signature = Cryptor(privkey_hex=sender_secret).sign(sig_data).encode('hex')
+        return Cryptor(pubkey_hex=self.pubkey).encrypt(
+            json.dumps({'sig': signature, 'data': sig_data}).encode('zlib')
+        ), message
+
+    def test_opens_on_workers_in_order(self):
+        first, first_message = self._encrypt({'type': 'store', 'seq': 1})
+        second, second_message = self._encrypt({'type': 'store', 'seq': 2})
+        self.listener.on_raw_message(first, ('10.0.0.1', 12345))
+        self.listener.on_raw_message('garbage', ('10.0.0.1', 12345))
+        self.listener.on_raw_message(second, ('10.0.0.1', 12345))
+        self.listener.on_raw_message(json.dumps({'type': 'hello'}), ('10.0.0.1', 12345))
+        self.assertEqual(self.messages, [])
+
+        self.listener.crypto_pool.drain()
+        self.assertEqual(self.messages, [first_message, second_message, {'type': 'hello'}])
+
+    def test_stop_closes_pool(self):
+        pool = self.listener.crypto_pool
+        self.listener.stop()
+        self.assertTrue(pool.closed)
+        self.assertIsNone(self.listener.crypto_pool)
+
+        message, expected = self._encrypt({'type': 'store', 'seq': 1})
+        self.listener.on_raw_message(message, ('10.0.0.1', 12345))
+        self.assertEqual(self.messages, [expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
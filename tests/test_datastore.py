@@ -39,3 +39,83 @@ class TestSqliteDatastore(unittest.TestCase):
 
     def test_set_item(self):
         pass
+
+
+class TestSqliteDatastoreTTL(unittest.TestCase):
+    def setUp(self):
+        self.db_mock = mock.MagicMock(spec=db_store.Obdb)
+        self.row = {
+            'key': 'abcd',
+            'value': 'value',
+            'lastPublished': '1000',
+            'originallyPublished': '1000',
+            'originalPublisherID': 'guid',
+            'ttl': 0
+        }
+        self.db_mock.select_entries.return_value = [self.row]
+        self.sqlite_datastore = datastore.SqliteDataStore(self.db_mock)
+
+    def test_set_item_ttl(self):
+        self.db_mock.select_entries.return_value = []
+        self.sqlite_datastore.set_item('abcd', 'value', 1000, 1000, 'guid', 1, 60)
+        inserted = self.db_mock.insert_entry.call_args[0][1]
+        self.assertEqual(inserted['ttl'], 60)
+
+    def test_set_item_without_ttl(self):
+        self.db_mock.select_entries.return_value = []
+        self.sqlite_datastore.set_item('abcd', 'value', 1000, 1000, 'guid')
+        inserted = self.db_mock.insert_entry.call_args[0][1]
+        self.assertEqual(inserted['ttl'], 0)
+
+    @mock.patch('time.time', return_value=10 ** 9)
+    def test_permanent_entry(self, _):
+        self.assertEqual(self.sqlite_datastore.get_ttl('abcd'), 0)
+        self.assertFalse(self.sqlite_datastore.is_expired('abcd'))
+        self.assertEqual(self.sqlite_datastore['abcd'], 'value')
+
+    def test_cached_entry(self):
+        self.row['ttl'] = 60
+        self.assertEqual(self.sqlite_datastore.get_ttl('abcd'), 60)
+        self.assertFalse(self.sqlite_datastore.is_expired('abcd', now=1059))
+        self.assertTrue(self.sqlite_datastore.is_expired('abcd', now=1060))
+
+        with mock.patch('time.time', return_value=1059):
+            self.assertEqual(self.sqlite_datastore['abcd'], 'value')
+        with mock.patch('time.time', return_value=1060):
+            self.assertIsNone(self.sqlite_datastore['abcd'])
+
+    def test_missing_entry(self):
+        self.db_mock.select_entries.return_value = []
+        self.assertIsNone(self.sqlite_datastore['abcd'])
+
+
+class TestMemoryDatastore(unittest.TestCase):
+    def setUp(self):
+        self.datastore = datastore.MemoryDataStore()
+        self.datastore.set_item('abcd', 'value', 1000, 900, 'guid')
+
+    def test_set_item(self):
+        self.assertEqual(self.datastore.keys(), ['abcd'])
+        self.assertIn('abcd', self.datastore)
+        self.assertEqual(self.datastore['abcd'], 'value')
+        self.assertEqual(self.datastore.get_last_published('abcd'), 1000)
+        self.assertEqual(self.datastore.get_original_publish_time('abcd'), 900)
+        self.assertEqual(self.datastore.get_original_publisher_id('abcd'), 'guid')
+        self.assertEqual(self.datastore.get_ttl('abcd'), 0)
+
+    def test_missing_entry(self):
+        self.assertNotIn('efgh', self.datastore)
+        self.assertIsNone(self.datastore['efgh'])
+        self.assertEqual(self.datastore.get_ttl('efgh'), 0)
+
+    def test_cached_entry(self):
+        self.datastore.set_item('abcd', 'value', 1000, 1000, 'guid', 1, 60)
+        with mock.patch('time.time', return_value=1059):
+            self.assertEqual(self.datastore['abcd'], 'value')
+        with mock.patch('time.time', return_value=1060):
+            self.assertIsNone(self.datastore['abcd'])
+
+    def test_delete(self):
+        del self.datastore['abcd']
+        self.assertEqual(self.datastore.keys(), [])
+        del self.datastore['abcd']
@@ -38,6 +38,43 @@ class TestDbOperations(unittest.TestCase):
             disable_sqlite_crypt=self.disable_sqlite_crypt
         )
 
+    def test_insert_entries(self):
+        reviews = [
+            {"pubKey": "bulk", "subject": "Review %d" % num, "rating": num}
+            for num in range(3)
+        ]
+        self.obdb.insert_entries("reviews", reviews)
+        retrieved_reviews = self.obdb.select_entries("reviews", {"pubKey": "bulk"})
+        self.assertEqual(
+            [review["subject"] for review in retrieved_reviews],
+            ["Review 0", "Review 1", "Review 2"]
+        )
+
+        # Nothing to insert is fine too
+        self.obdb.insert_entries("reviews", [])
+
+        # Other tests count the reviews
+        self.obdb.delete_entries("reviews", {"pubKey": "bulk"})
+
+    def test_replace_entries(self):
+        old = [{"pubKey": "replaced", "subject": "Old", "rating": 1}]
+        self.obdb.insert_entries("reviews", old)
+
+        # A failed insert leaves the old rows in place
+        self.assertRaises(
+            Exception, self.obdb.replace_entries,
+            "reviews", {"pubKey": "replaced"}, [{"pubKey": "replaced", "no_such_field": 1}]
+        )
+        retrieved_reviews = self.obdb.select_entries("reviews", {"pubKey": "replaced"})
+        self.assertEqual([review["subject"] for review in retrieved_reviews], ["Old"])
+
+        new = [{"pubKey": "replaced", "subject": "New %d" % num, "rating": num} for num in range(2)]
+        self.obdb.replace_entries("reviews", {"pubKey": "replaced"}, new)
+        retrieved_reviews = self.obdb.select_entries("reviews", {"pubKey": "replaced"})
+        self.assertEqual([review["subject"] for review in retrieved_reviews], ["New 0", "New 1"])
+
+        self.obdb.delete_entries("reviews", {"pubKey": "replaced"})
+
     def test_insert_select_operations(self):
         # Create a dictionary of a random review
         review_to_store = {"pubKey": "123",
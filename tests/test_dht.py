@@ -0,0 +1,776 @@
+import os
+import shutil
+import tempfile
+import thread
+import threading
+import time
+import unittest
+
+import mock
+from tornado import ioloop
+
+from node import constants, contact, db_store, dht, guid, setup_db
+
+
+class FakePeer(guid.GUIDMixin):
+    def __init__(self, guid_, hostname, port, pubkey=None, nickname=None,
+                 nat_type=None, avatar_url=None):
+        super(FakePeer, self).__init__(guid_)
+        self.hostname = hostname
+        self.port = port
+        self.pub = pubkey
+        self.nickname = nickname
+        self.nat_type = nat_type
+        self.avatar_url = avatar_url
+        self.last_reached = time.time()
+        self.sent = []
+
+    def send(self, data, callback=None):
+        self.sent.append(data)
+
+
+class TestSearchManager(unittest.TestCase):
+    def setUp(self):
+        self.manager = dht.SearchManager(1, timeout=10)
+        self.callback = mock.Mock()
+        self.search = dht.DHTSearch(1, 'a' * 40, callback=self.callback)
+        self.manager.add(self.search)
+
+    def test_add(self):
+        self.assertIn(self.search.find_id, self.manager)
+        self.assertEqual(len(self.manager), 1)
+        self.assertEqual(self.search.deadline, self.search.started + 10)
+        self.assertEqual(self.manager.num_started, 1)
+
+    def test_finish(self):
+        self.assertTrue(self.manager.finish(self.search.find_id, 'value'))
+        self.callback.assert_called_once_with('value')
+        self.assertNotIn(self.search.find_id, self.manager)
+        self.assertEqual(self.manager.num_finished, 1)
+
+        # A second response for the same search is ignored.
+        self.assertFalse(self.manager.finish(self.search.find_id, 'value'))
+        self.assertEqual(self.callback.call_count, 1)
+
+    def test_finish_callback_error(self):
+        self.callback.side_effect = ValueError
+        self.assertTrue(self.manager.finish(self.search.find_id, 'value'))
+        self.assertEqual(len(self.manager), 0)
+
+    def test_cancel(self):
+        self.assertTrue(self.manager.cancel(self.search.find_id))
+        self.assertFalse(self.callback.called)
+        self.assertEqual(len(self.manager), 0)
+        self.assertEqual(self.manager.num_cancelled, 1)
+        self.assertFalse(self.manager.cancel(self.search.find_id))
+
+    def test_expire(self):
+        self.search.shortlist = [('127.0.0.1', 12345, 'b' * 40)]
+        self.assertEqual(self.manager.expire(self.search.started + 5), 0)
+        self.assertFalse(self.callback.called)
+
+        self.assertEqual(self.manager.expire(self.search.started + 10), 1)
+        self.callback.assert_called_once_with(self.search.shortlist)
+        self.assertEqual(len(self.manager), 0)
+        self.assertEqual(self.manager.num_timed_out, 1)
+
+    def test_age_histogram(self):
+        older = dht.DHTSearch(1, 'c' * 40)
+        older.started -= 100
+        self.manager.add(older)
+
+        histogram = dict(self.manager.age_histogram(self.search.started))
+        bounds = constants.DHT_SEARCH_AGE_BUCKETS_IN_SECONDS
+        self.assertEqual(histogram['<%ds' % bounds[0]], 1)
+        self.assertEqual(histogram['>=%ds' % bounds[-1]], 1)
+        self.assertEqual(sum(histogram.values()), 2)
+
+    def test_get_stats(self):
+        stats = self.manager.get_stats()
+        self.assertEqual(stats['live'], 1)
+        self.assertEqual(stats['started'], 1)
+
+
+class TestDHTSearches(unittest.TestCase):
+    def setUp(self):
+        self.transport = mock.Mock()
+        self.transport.guid = 'f' * 40
+        self.dht = dht.DHT(
+            self.transport, 1, {'guid': self.transport.guid},
+            mock.MagicMock(spec=db_store.Obdb)
+        )
+
+    def tearDown(self):
+        self.dht._search_sweeper.stop()
+
+    def test_search_without_contacts_is_evicted(self):
+        callback = mock.Mock()
+        find_id = self.dht.iterative_find('a' * 40, callback=callback)
+        callback.assert_called_once_with([])
+        self.assertFalse(self.dht.active_search_exists(find_id))
+
+    def _start_search(self, callback, call='findNode'):
+        search = dht.DHTSearch(1, 'a' * 40, call, callback=callback)
+        search.shortlist = [('10.0.0.1', 1, 'b' * 40)]
+        search.active_probes = [('10.0.0.1', 1, 'b' * 40, 'pub', 'nick', None)]
+        self.dht.searches.add(search)
+        return search
+
+    def _response(self, search, **kwargs):
+        msg = {
+            'senderGUID': 'b' * 40,
+            'senderNick': 'nick',
+            'pubkey': 'pub',
+            'hostname': '10.0.0.1',
+            'port': 1,
+            'findID': search.find_id
+        }
+        msg.update(kwargs)
+        return msg
+
+    def test_found_key_finishes_search(self):
+        callback = mock.Mock()
+        search = self._start_search(callback)
+        self.dht.on_find_node_response(self._response(search, foundKey='value'))
+        callback.assert_called_once_with('value')
+        self.assertEqual(len(self.dht.searches), 0)
+
+    def test_last_probe_finishes_search(self):
+        callback = mock.Mock()
+        search = self._start_search(callback)
+        self.dht.on_find_node_response(self._response(search, foundNodes=[]))
+        self.assertEqual(search.active_probes, [])
+        callback.assert_called_once_with(search.shortlist)
+        self.assertEqual(len(self.dht.searches), 0)
+
+    def test_found_nodes_are_not_store_targets_until_reached(self):
+        search = self._start_search(mock.Mock())
+        self.dht.learn_contact('10.0.0.1', 1, 'pub', 'b' * 40)
+        self.dht.mark_reached('b' * 40)
+        self.dht.get_peer = mock.Mock(return_value=None)
+
+        found = ['c' * 40, '10.0.0.3', 3, 'pub3', 'nick', None, None]
+        self.dht.on_find_node_response(self._response(search, foundNodes=[found]))
+        self.assertIn('c' * 40, [node[2] for node in search.shortlist])
+        self.assertEqual(self.dht.routing_table.get_contact('c' * 40).last_reached, 0)
+
+        targets = self.dht._closest_responsive_nodes(search.key, search.shortlist)
+        self.assertEqual(targets, [('10.0.0.1', 1, 'b' * 40)])
+
+        # Once it answers, it is a target too
+        self.dht.mark_reached('c' * 40)
+        targets = self.dht._closest_responsive_nodes(search.key, search.shortlist)
+        self.assertEqual(sorted(node[2] for node in targets), ['b' * 40, 'c' * 40])
+
+    def test_unanswered_probe_times_out(self):
+        callback = mock.Mock()
+        search = self._start_search(callback)
+        search.already_contacted = [search.shortlist[0]]
+        search.probes_sent['b' * 40] = time.time() - constants.DHT_PROBE_TIMEOUT_IN_SECONDS
+        next_node = ('10.0.0.2', 1, 'c' * 40)
+        search.shortlist.append(next_node)
+        peer = FakePeer('c' * 40, '10.0.0.2', 1)
+        self.dht.get_peer = mock.Mock(return_value=peer)
+
+        # The next closest node is queried instead
+        self.dht._expire_probes()
+        self.assertEqual(search.active_probes, [next_node])
+        self.assertEqual([msg['findID'] for msg in peer.sent], [search.find_id])
+        self.assertFalse(callback.called)
+
+        # With none left, the search finishes
+        self.dht._expire_probes(time.time() + constants.DHT_PROBE_TIMEOUT_IN_SECONDS)
+        callback.assert_called_once_with(search.shortlist)
+        self.assertEqual(self.dht.searches.get_stats()['probes_timed_out'], 2)
+
+    def test_cancel_search(self):
+        callback = mock.Mock()
+        search = self._start_search(callback)
+        self.assertTrue(self.dht.cancel_search(search.find_id))
+        self.dht.on_find_node_response(self._response(search, foundKey='value'))
+        self.assertFalse(callback.called)
+
+    def test_identical_lookups_are_coalesced(self):
+        first, second = mock.Mock(), mock.Mock()
+        search = self._start_search(first, 'findValue')
+
+        find_id = self.dht.iterative_find_value(search.key, second)
+        self.assertEqual(find_id, search.find_id)
+        self.assertEqual(len(self.dht.searches), 1)
+
+        self.dht.on_find_node_response(self._response(search, foundKey='value'))
+        first.assert_called_once_with('value')
+        second.assert_called_once_with('value')
+
+    def test_cancel_coalesced_lookup(self):
+        first, second = mock.Mock(), mock.Mock()
+        search = self._start_search(first, 'findValue')
+        self.dht.iterative_find_value(search.key, second)
+
+        # Only the cancelling caller's callback goes
+        self.assertFalse(self.dht.cancel_search(search.find_id, mock.Mock()))
+        self.assertTrue(self.dht.cancel_search(search.find_id, first))
+        self.assertTrue(self.dht.active_search_exists(search.find_id))
+        self.dht.on_find_node_response(self._response(search, foundKey='value'))
+        self.assertFalse(first.called)
+        second.assert_called_once_with('value')
+
+        search = self._start_search(first, 'findValue')
+        self.assertTrue(self.dht.cancel_search(search.find_id, first))
+        self.assertFalse(self.dht.active_search_exists(search.find_id))
+
+    def test_shortlist_search_is_not_coalesced(self):
+        first, second, third = mock.Mock(), mock.Mock(), mock.Mock()
+        search = self._start_search(first, 'findValue')
+        shortlist_find_id = self.dht.iterative_find(
+            search.key, [('10.0.0.2', 2, 'c' * 40)], 'findValue', second
+        )
+        self.assertNotEqual(shortlist_find_id, search.find_id)
+
+        # Later lookups still share the first search
+        self.assertEqual(self.dht.iterative_find_value(search.key, third), search.find_id)
+        self.assertTrue(self.dht.cancel_search(shortlist_find_id, second))
+        self.assertEqual(self.dht.searches.find('findValue', search.key), search)
+        self.assertTrue(self.dht.cancel_search(search.find_id, third))
+        self.assertTrue(self.dht.active_search_exists(search.find_id))
+
+    def test_found_value_is_cached(self):
+        search = self._start_search(mock.Mock(), 'findValue')
+        self.dht.on_find_node_response(self._response(search, foundKey='value'))
+
+        callback = mock.Mock()
+        self.assertIsNone(self.dht.iterative_find_value(search.key, callback))
+        callback.assert_called_once_with('value')
+        self.assertEqual(self.dht.value_cache.num_hits, 1)
+
+
+class TestValueCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = dht.ValueCache(ttl=10, max_size=2)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('k', now=0))
+        self.cache.set('k', 'v', now=0)
+        self.assertEqual(self.cache.get('k', now=5), 'v')
+        self.assertEqual(self.cache.num_hits, 1)
+        self.assertEqual(self.cache.num_misses, 1)
+
+    def test_expiry(self):
+        self.cache.set('k', 'v', now=0)
+        self.assertIsNone(self.cache.get('k', now=10))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_max_size(self):
+        for key in ('a', 'b', 'c'):
+            self.cache.set(key, key, now=0)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get('a', now=0))
+
+    def test_discard(self):
+        self.cache.set('k', 'v', now=0)
+        self.cache.discard('k')
+        self.cache.discard('missing')
+        self.assertIsNone(self.cache.get('k', now=0))
+
+
+class TestPathCaching(unittest.TestCase):
+    def setUp(self):
+        self.transport = mock.Mock()
+        self.transport.guid = 'f' * 40
+        self.dht = dht.DHT(
+            self.transport, 1, {'guid': self.transport.guid},
+            mock.MagicMock(spec=db_store.Obdb)
+        )
+        self.dht.routing_table = mock.Mock()
+        self.dht.routing_table.distance = lambda guid1, guid2: int(guid1, 16) ^ int(guid2, 16)
+        self.peer = mock.Mock()
+        self.dht.routing_table.get_contact.side_effect = lambda guid: mock.Mock(guid=guid)
+        self.transport.peers = {}
+        self.transport.get_crypto_peer.return_value = self.peer
+
+        self.search = dht.DHTSearch(1, '0' * 40, 'findValue')
+        self.dht.searches.add(self.search)
+
+    def tearDown(self):
+        self.dht._search_sweeper.stop()
+
+    def _respond(self, guid, **kwargs):
+        msg = {
+            'senderGUID': guid,
+            'senderNick': 'nick',
+            'pubkey': 'pub',
+            'hostname': '10.0.0.1',
+            'port': 1,
+            'findID': self.search.find_id
+        }
+        msg.update(kwargs)
+        self.dht.on_find_node_response(msg)
+
+    def test_cache_at_closest_node_without_value(self):
+        near, far = '0' * 39 + '2', '0' * 39 + '8'
+        holder = '0' * 39 + '1'
+        self.search.already_contacted = [('10.0.0.1', 1, guid) for guid in (near, far, holder)]
+        self.search.active_probes = list(self.search.already_contacted)
+
+        self._respond(far, foundNodes=[])
+        self._respond(near, foundNodes=[])
+        self._respond(holder, foundKey='value')
+        self.assertEqual(self.dht.pending_stores.keys(), [near])
+
+        self.dht._flush_stores()
+        self.dht.routing_table.get_contact.assert_any_call(near)
+        msg = self.peer.send.call_args[0][0]
+        self.assertEqual(msg['type'], 'store')
+        self.assertEqual(msg['value'], 'value')
+        # Only the holder is closer to the key than the caching node.
+        self.assertEqual(msg['ttl'], constants.DATE_EXPIRE_TIMEOUT // 2)
+
+    def test_no_cache_without_candidates(self):
+        self._respond('0' * 39 + '1', foundKey='value')
+        self.assertEqual(self.dht.pending_stores, {})
+
+    def test_cached_store_does_not_replace_permanent_copy(self):
+        self.dht.data_store = mock.MagicMock()
+        self.dht.data_store.__getitem__.return_value = 'value'
+        self.dht.data_store.get_ttl.return_value = 0
+        self.dht._on_store_value({
+            'key': 'abcd', 'value': 'new', 'originalPublisherID': 'guid', 'age': 0, 'ttl': 60
+        })
+        self.assertFalse(self.dht.data_store.set_item.called)
+
+
+class TestTargetedStore(unittest.TestCase):
+    def setUp(self):
+        self.transport = mock.Mock()
+        self.transport.guid = 'f' * 40
+        self.dht = dht.DHT(
+            self.transport, 1, {'guid': self.transport.guid},
+            mock.MagicMock(spec=db_store.Obdb)
+        )
+        self.dht.data_store = mock.MagicMock()
+        self.dht.loop = mock.Mock()
+        self.dht.routing_table = mock.Mock()
+        self.dht.routing_table.distance = lambda guid1, guid2: int(guid1, 16) ^ int(guid2, 16)
+
+        self.contacts = {}
+        self.dht.routing_table.get_contact.side_effect = self.contacts.get
+        self.transport.peers = {}
+
+    def tearDown(self):
+        self.dht._search_sweeper.stop()
+
+    def _add_contact(self, guid, last_reached=None):
+        contact = mock.Mock(guid=guid)
+        contact.last_reached = time.time() if last_reached is None else last_reached
+        self.contacts[guid] = contact
+        return contact
+
+    def test_closest_responsive_nodes(self):
+        near, far, stale = '0' * 39 + '1', '0' * 39 + '9', '0' * 39 + '2'
+        self._add_contact(near)
+        self._add_contact(far)
+        self._add_contact(stale, last_reached=0)
+        unknown = '0' * 39 + '3'
+
+        shortlist = [
+            ('10.0.0.9', 9, far), ('10.0.0.1', 1, near, 'pub', 'nick', None),
+            ('10.0.0.1', 1, near), ('10.0.0.2', 2, stale), ('10.0.0.3', 3, unknown),
+            ('10.0.0.15', 15, self.transport.guid)
+        ]
+        targets = self.dht._closest_responsive_nodes('0' * 40, shortlist)
+        self.assertEqual(targets, [('10.0.0.1', 1, near), ('10.0.0.9', 9, far)])
+
+        self.assertEqual(len(self.dht._closest_responsive_nodes('0' * 40, shortlist, 1)), 1)
+        self.assertEqual(self.dht._closest_responsive_nodes('0' * 40, ('tuple',)), [])
+
+    def test_iterative_store_does_not_broadcast(self):
+        peer = mock.Mock()
+        self.dht.active_peers = [peer]
+        self.dht.iterative_find_node = mock.Mock()
+        self.dht.iterative_store('0' * 40, 'value')
+        self.assertFalse(peer.send.called)
+        self.assertEqual(self.dht.pending_stores, {})
+
+        # The lookup result decides where the value goes
+        guid = '0' * 39 + '1'
+        self._add_contact(guid)
+        lookup_callback = self.dht.iterative_find_node.call_args[0][1]
+        lookup_callback([('10.0.0.1', 1, guid)])
+        self.assertEqual(self.dht.pending_stores.keys(), [guid])
+        self.assertEqual(self.dht.store_stats.last_fanout, 1)
+
+    def test_stores_to_same_node_are_batched(self):
+        guid = '0' * 39 + '1'
+        contact = self._add_contact(guid)
+        nodes = [('10.0.0.1', 1, guid), ('10.0.0.1', 1, guid)]
+        self.dht.store_key_value(nodes, 'a' * 40, 'value1', 'publisher', 0)
+        self.dht.store_key_value(nodes, 'b' * 40, 'value2', 'publisher', 0)
+        self.dht.store_key_value(nodes, 'b' * 40, 'value3', 'publisher', 0)
+        self.assertEqual(self.dht.loop.add_callback.call_count, 1)
+
+        # The connection is only made to send the batch
+        self.assertFalse(self.transport.get_crypto_peer.called)
+        peer = self.transport.get_crypto_peer.return_value
+        peer.version = constants.VERSION
+        self.dht._flush_stores()
+        self.assertEqual(self.transport.get_crypto_peer.call_args[0][:3],
+                         (guid, contact.hostname, contact.port))
+        self.assertEqual(peer.send.call_count, 1)
+        msg = peer.send.call_args[0][0]
+        self.assertEqual(msg['type'], 'storeBatch')
+        self.assertEqual([store['value'] for store in msg['stores']], ['value1', 'value3'])
+        self.assertEqual(self.dht.pending_stores, {})
+        self.assertEqual(self.dht.store_stats.max_fanout, 1)
+
+    def test_older_peers_get_one_store_per_key(self):
+        guid = '0' * 39 + '1'
+        self._add_contact(guid)
+        nodes = [('10.0.0.1', 1, guid)]
+        self.dht.store_key_value(nodes, 'a' * 40, 'value1', 'publisher', 0)
+        self.dht.store_key_value(nodes, 'b' * 40, 'value2', 'publisher', 0)
+
+        peer = self.transport.get_crypto_peer.return_value
+        peer.version = '0.5.0'
+        self.dht._flush_stores()
+        self.assertEqual([msg['type'] for msg in (args[0][0] for args in peer.send.call_args_list)],
+                         ['store', 'store'])
+
+
+class TestSqliteRepublish(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        db_path = os.path.join(self.db_dir, 'testdb.db')
+        setup_db.setup_db(db_path, disable_sqlite_crypt=True)
+        self.db_connection = db_store.Obdb(db_path, disable_sqlite_crypt=True)
+        transport = mock.Mock()
+        transport.guid = 'f' * 40
+        self.dht = dht.DHT(transport, 1, {'guid': transport.guid}, self.db_connection)
+
+    def tearDown(self):
+        self.dht._search_sweeper.stop()
+        self.dht.republisher.stop()
+        shutil.rmtree(self.db_dir)
+
+    def test_expired_cached_copy_is_deleted(self):
+        now = int(time.time())
+        self.dht.data_store.set_item('cached'.encode('hex'), 'value', now - 100, now - 100, 'a' * 40, ttl=10)
+        self.dht.data_store.set_item('kept'.encode('hex'), 'value', now, now, 'a' * 40, ttl=1000)
+        self.assertEqual(sorted(self.dht.data_store.keys()), ['cached', 'kept'])
+
+        self.assertEqual(self.dht._republish_keys(self.dht.data_store.keys()), 0)
+        self.assertEqual(self.dht.data_store.keys(), ['kept'])
+        self.assertEqual(len(self.db_connection.select_entries("datastore")), 1)
+
+
+class TestRoutingSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        db_path = os.path.join(self.db_dir, 'testdb.db')
+        setup_db.setup_db(db_path, disable_sqlite_crypt=True)
+        self.db_connection = db_store.Obdb(db_path, disable_sqlite_crypt=True)
+        self.dhts = []
+
+    def tearDown(self):
+        for node in self.dhts:
+            node._search_sweeper.stop()
+            node.republisher.stop()
+        shutil.rmtree(self.db_dir)
+
+    def _make_dht(self):
+        transport = mock.Mock()
+        transport.guid = 'f' * 40
+        transport.handler = None
+        transport.get_crypto_peer.side_effect = (
+            lambda guid_, hostname, port, pubkey=None, nickname=None, nat_type=None, avatar_url=None:
+            FakePeer(guid_, hostname, port, pubkey, nickname, nat_type, avatar_url)
+        )
+        node = dht.DHT(transport, 1, {'guid': transport.guid}, self.db_connection)
+        node.loop = mock.Mock()
+        self.dhts.append(node)
+        return node
+
+    def test_save_and_restore(self):
+        node = self._make_dht()
+        guids = ['%040x' % (num * (2 ** 160 // 60)) for num in range(1, 60)]
+        for num, peer_guid in enumerate(guids):
+            node.learn_contact(
+                '10.0.0.%d' % num, 1000 + num, 'pub%d' % num, peer_guid, 'nick',
+                last_reached=1000 + num
+            )
+        # Contacts we never got a public key from are not saved
+        keyless_guid = 'e' * 40
+        node.learn_contact('10.0.0.200', 1, None, keyless_guid)
+        node.save_routing_snapshot()
+
+        saved_contacts = len(list(node.routing_table.iter_contacts())) - 1
+        self.assertGreater(len(node.routing_table.buckets), 1)
+
+        restored = self._make_dht()
+        callback = mock.Mock()
+        self.assertEqual(restored.restore_routing_snapshot(callback), saved_contacts)
+
+        # Restoring yields to the loop between batches
+        while restored.loop.add_callback.called:
+            next_batch = restored.loop.add_callback.call_args[0][0]
+            restored.loop.add_callback.reset_mock()
+            next_batch()
+        callback.assert_called_once_with()
+        self.assertIsNone(restored.routing_table.get_contact(keyless_guid))
+        self.assertFalse(restored.transport.get_crypto_peer.called)
+
+        self.assertEqual(
+            [(b.range_min, b.range_max) for b in restored.routing_table.buckets],
+            [(b.range_min, b.range_max) for b in node.routing_table.buckets]
+        )
+        for num, peer_guid in enumerate(guids):
+            contact = restored.routing_table.get_contact(peer_guid)
+            original = node.routing_table.get_contact(peer_guid)
+            if original is None:
+                continue
+            self.assertEqual(contact.pub, 'pub%d' % num)
+            self.assertEqual(contact.port, 1000 + num)
+            self.assertEqual(contact.last_reached, 1000 + num)
+
+    def test_empty_snapshot(self):
+        callback = mock.Mock()
+        self.assertEqual(self._make_dht().restore_routing_snapshot(callback), 0)
+        callback.assert_called_once_with()
+
+
+class TestContactRecords(unittest.TestCase):
+    def setUp(self):
+        self.transport = mock.Mock()
+        self.transport.guid = 'f' * 40
+        self.transport.handler = None
+        self.transport.peers = {}
+        self.transport.get_crypto_peer.side_effect = self._connect
+        self.dht = dht.DHT(
+            self.transport, 1, {'guid': self.transport.guid},
+            mock.MagicMock(spec=db_store.Obdb)
+        )
+        self.guid = '0' * 39 + '1'
+
+    def tearDown(self):
+        self.dht._search_sweeper.stop()
+        self.dht._refresh_ticker.stop()
+
+    def _connect(self, guid_, hostname, port, pubkey=None, nickname=None,
+                 nat_type=None, avatar_url=None):
+        peer = FakePeer(guid_, hostname, port, pubkey, nickname, nat_type, avatar_url)
+        self.transport.peers[guid_] = peer
+        return peer
+
+    def test_learn_contact_does_not_connect(self):
+        record = self.dht.learn_contact('10.0.0.1', 1, 'pub', self.guid, 'nick')
+        self.assertIsInstance(record, contact.ContactRecord)
+        self.assertIs(self.dht.routing_table.get_contact(self.guid), record)
+        self.assertFalse(self.transport.get_crypto_peer.called)
+        self.assertEqual(self.dht.active_peers, [])
+
+        # Hearsay updates the record but does not make it fresher
+        record.last_reached = 1000
+        self.assertIs(self.dht.learn_contact('10.0.0.2', 2, guid=self.guid), record)
+        self.assertEqual((record.hostname, record.port, record.pub), ('10.0.0.2', 2, 'pub'))
+        self.assertEqual(record.last_reached, 1000)
+
+        self.assertIsNone(self.dht.learn_contact('10.0.0.1', 1, guid='seed0'))
+        self.assertIsNone(self.dht.learn_contact('10.0.0.1', 1, guid=self.transport.guid))
+
+    def test_get_peer_connects_once(self):
+        self.assertIsNone(self.dht.get_peer(self.guid))
+
+        self.dht.learn_contact('10.0.0.1', 1, 'pub', self.guid, 'nick')
+        peer = self.dht.get_peer(self.guid)
+        self.assertEqual((peer.guid, peer.hostname, peer.pub), (self.guid, '10.0.0.1', 'pub'))
+        self.assertEqual(self.dht.active_peers, [peer])
+        self.assertIs(self.dht.get_peer(self.guid), peer)
+        self.assertEqual(self.transport.get_crypto_peer.call_count, 1)
+
+        # The routing table keeps the record, not the connection
+        self.assertIsInstance(self.dht.routing_table.get_contact(self.guid), contact.ContactRecord)
+
+    def test_mark_reached(self):
+        record = self.dht.learn_contact('10.0.0.1', 1, 'pub', self.guid, last_reached=0)
+        self.dht.mark_reached(self.guid)
+        self.assertGreater(record.last_reached, 0)
+        self.dht.mark_reached('0' * 39 + '2')
+        self.assertIsNone(self.dht.routing_table.get_contact('0' * 39 + '2'))
+
+    def test_search_probes_nodes_missing_from_routing_table(self):
+        learned = ('10.0.0.1', 1, self.guid, 'pub', 'nick', None)
+        unknown = ('10.0.0.2', 2, '0' * 39 + '2')
+        search = dht.DHTSearch(1, 'a' * 40)
+        search.shortlist = [learned, unknown]
+        self.dht.searches.add(search)
+
+        with mock.patch.object(self.dht.routing_table, 'get_contact', return_value=None):
+            self.dht._search_iteration(search)
+
+        # Connected from the shortlist entry; nothing to connect to for the other
+        self.assertEqual(search.active_probes, [learned])
+        peer = self.transport.peers[self.guid]
+        self.assertEqual(peer.pub, 'pub')
+        self.assertEqual(peer.sent[0]['type'], 'findNode')
+        self.assertEqual(len(search.already_contacted), 2)
+
+
+class TestLoopConfinement(unittest.TestCase):
+    NUM_THREADS = 8
+    CALLS_PER_THREAD = 200
+
+    def setUp(self):
+        self.loop = ioloop.IOLoop()
+        self.loop.make_current()
+        self.transport = mock.Mock()
+        self.transport.guid = 'f' * 40
+        self.dht = dht.DHT(
+            self.transport, 1, {'guid': self.transport.guid},
+            mock.MagicMock(spec=db_store.Obdb)
+        )
+
+    def tearDown(self):
+        self.dht._search_sweeper.stop()
+        self.loop.close(all_fds=True)
+        ioloop.IOLoop.clear_current()
+
+    def test_calls_from_other_threads_run_on_loop(self):
+        loop_threads = set()
+        results = []
+
+        def callback(result):
+            loop_threads.add(thread.get_ident())
+            results.append(result)
+
+        def hammer(thread_num):
+            for call_num in range(self.CALLS_PER_THREAD):
+                guid = '%020x%020x' % (thread_num, call_num)
+                self.dht._add_known_node(('tcp://10.0.0.1:1', guid, 'nick'))
+                self.dht.iterative_find_value(guid, callback)
+
+        def run_threads():
+            workers = [
+                threading.Thread(target=hammer, args=(num,))
+                for num in range(self.NUM_THREADS)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            # Queued after every handed-over call
+            self.loop.add_callback(self.loop.stop)
+
+        self.loop.add_callback(threading.Thread(target=run_threads).start)
+        self.loop.start()
+
+        total = self.NUM_THREADS * self.CALLS_PER_THREAD
+        self.assertEqual(loop_threads, set([thread.get_ident()]))
+        self.assertEqual(len(results), total)
+        self.assertEqual(len(self.dht.known_nodes), total)
+        self.assertEqual(len(self.dht.searches), 0)
+        self.assertEqual(self.dht.searches.num_finished, total)
+
+    def test_calls_from_other_threads_return_future(self):
+        guid = 'a' * 40
+        futures = []
+
+        def call():
+            self.dht._add_known_node(('tcp://10.0.0.1:1', guid, 'nick'))
+            futures.append(self.dht.active_search_exists(guid))
+            futures.append(self.dht.close_nodes(guid))
+            self.loop.add_callback(self.loop.stop)
+
+        self.loop.add_callback(threading.Thread(target=call).start)
+        self.loop.start()
+
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertIs(futures[0].result(), False)
+        self.assertEqual(futures[1].result(), self.dht.close_nodes(guid))
+
+
+class TestMaintenanceBatches(unittest.TestCase):
+    def setUp(self):
+        self.transport = mock.Mock()
+        self.transport.guid = 'f' * 40
+        self.dht = dht.DHT(
+            self.transport, 1, {'guid': self.transport.guid},
+            mock.MagicMock(spec=db_store.Obdb)
+        )
+        self.dht.loop = mock.Mock()
+
+    def tearDown(self):
+        self.dht._search_sweeper.stop()
+        self.dht._refresh_ticker.stop()
+
+    def test_refresh_queues_stale_buckets(self):
+        node_ids = ['a' * 40, 'b' * 40]
+        self.dht.routing_table = mock.Mock()
+        self.dht.routing_table.get_refresh_list.return_value = node_ids
+        self.dht.iterative_find_node = mock.Mock()
+
+        # Nothing is looked up right away
+        self.dht._refresh_routing_table()
+        self.assertFalse(self.dht.iterative_find_node.called)
+        self.assertEqual(list(self.dht.refresh_pacer.queue), node_ids)
+
+    def test_bucket_needs_refresh(self):
+        self.dht.routing_table.touch_kbucket('a' * 40)
+        self.assertFalse(self.dht._bucket_needs_refresh('a' * 40))
+        self.dht.routing_table.touch_kbucket('a' * 40, timestamp=0)
+        self.assertTrue(self.dht._bucket_needs_refresh('a' * 40))
+
+
+class TestRefreshPacer(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.start_lookup = mock.Mock()
+        self.stale = set()
+        self.pacer = dht.RefreshPacer(
+            1, self.start_lookup, lambda node_id: node_id in self.stale,
+            max_concurrent=2, lookup_timeout=30, clock=lambda: self.now
+        )
+
+    def _finish(self, num):
+        callback = self.start_lookup.call_args_list[num][0][1]
+        callback([])
+
+    def test_one_lookup_per_tick(self):
+        self.stale.update(['a', 'b'])
+        self.pacer.enqueue(['a', 'b'])
+        self.assertEqual(self.pacer.tick(), 'a')
+        self.assertEqual(self.start_lookup.call_count, 1)
+        self.assertEqual(self.pacer.get_stats()['queue_depth'], 1)
+        self.assertEqual(self.pacer.tick(), 'b')
+        self.assertIsNone(self.pacer.tick())
+
+    def test_enqueue_deduplicates(self):
+        self.pacer.enqueue(['a', 'a', 'b'])
+        self.pacer.enqueue(['b'])
+        self.assertEqual(len(self.pacer), 2)
+
+    def test_skips_recently_used_buckets(self):
+        self.stale.add('b')
+        self.pacer.enqueue(['a', 'b'])
+        self.assertEqual(self.pacer.tick(), 'b')
+        self.assertEqual(self.pacer.num_skipped, 1)
+        self.assertEqual(self.start_lookup.call_args[0][0], 'b')
+
+    def test_caps_concurrent_lookups(self):
+        self.stale.update(['a', 'b', 'c'])
+        self.pacer.enqueue(['a', 'b', 'c'])
+        self.pacer.tick()
+        self.pacer.tick()
+        self.assertIsNone(self.pacer.tick())
+        self.assertEqual(self.pacer.get_stats()['running'], 2)
+
+        self._finish(0)
+        self.assertEqual(self.pacer.tick(), 'c')
+        self.assertEqual(self.pacer.num_finished, 1)
+
+    def test_lookups_that_never_finish_time_out(self):
+        self.stale.update(['a', 'b', 'c'])
+        self.pacer.enqueue(['a', 'b', 'c'])
+        self.pacer.tick()
+        self.pacer.tick()
+        self.now += 31
+        self.assertEqual(self.pacer.tick(), 'c')
+
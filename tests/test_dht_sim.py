@@ -0,0 +1,57 @@
+import unittest
+
+from bench import dht_sim
+from node import constants
+
+
+class TestSimulation(unittest.TestCase):
+
+    def _simulation(self, **kwargs):
+        sim = dht_sim.Simulation(60, random_contacts=5, **kwargs)
+        self.addCleanup(sim.close)
+        return sim
+
+    def test_node_lookups(self):
+        sim = self._simulation()
+        for _ in range(5):
+            lookup = sim.lookup('findNode')
+            self.assertTrue(lookup['success'])
+            self.assertFalse(lookup['timed_out'])
+            self.assertGreaterEqual(lookup['hops'], 1)
+            self.assertGreater(lookup['messages'], 0)
+
+        stats = sim.get_stats()
+        self.assertEqual(stats['lookups'], 5)
+        self.assertEqual(stats['success_rate'], 1.0)
+        self.assertEqual(stats['messages_lost'], 0)
+
+    def test_value_lookups(self):
+        sim = self._simulation()
+        sim.store_values(3)
+        for _ in range(5):
+            lookup = sim.lookup('findValue')
+            if lookup['success']:
+                self.assertIsNotNone(lookup['hops'])
+        self.assertGreater(sim.get_stats()['success_rate'], 0)
+
+    def test_lost_messages_time_out(self):
+        sim = self._simulation(loss=1.0)
+        lookup = sim.lookup('findNode')
+        # The unanswered probes time out, not the whole lookup
+        self.assertFalse(lookup['timed_out'])
+        self.assertEqual(lookup['latency'], constants.DHT_PROBE_TIMEOUT_IN_SECONDS)
+        self.assertFalse(lookup['success'])
+        self.assertEqual(sim.network.num_lost, sim.network.num_sent)
+
+    def test_churn(self):
+        sim = self._simulation()
+        before = set(sim.network.nodes)
+        sim.churn(0.1)
+        after = set(sim.network.nodes)
+        self.assertEqual(len(after), len(before))
+        self.assertEqual(len(before - after), 6)
+        self.assertTrue(sim.lookup('findNode')['success'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import unittest
+
+from bitcoin import main as arithmetic
+
+from node import envelope
+from node.connection import CryptoPeerListener
+from node.crypto_util import Cryptor
+
+
+class TestEnvelope(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        secret = hashlib.sha256('alice').hexdigest()
+        cls.cryptor = Cryptor(privkey_hex=secret)
+        cls.message = {
+            'type': 'store', 'key': 'ab' * 20, 'value': u'caf\xe9',
+            'pubkey': arithmetic.privkey_to_pubkey(secret), 'v': '0.5.1'
+        }
+
+    def test_round_trip(self):
+        data = envelope.encode(self.message, self.cryptor.sign)
+        self.assertTrue(envelope.is_envelope(data))
+        self.assertEqual(envelope.decode(data), self.message)
+
+        legacy = json.dumps({'sig': 'ab' * 72, 'data': json.dumps(self.message).encode('hex')})
+        self.assertLess(len(data), len(legacy) * 2 / 3)
+
+    def test_rejects_tampered_body(self):
+        data = envelope.encode(self.message, self.cryptor.sign)
+        self.assertIsNone(envelope.decode(data.replace('store', 'stord')))
+
+    def test_rejects_signature_by_other_key(self):
+        forger = Cryptor(privkey_hex=hashlib.sha256('mallory').hexdigest())
+        self.assertIsNone(envelope.decode(envelope.encode(self.message, forger.sign)))
+
+    def test_malformed(self):
+        data = envelope.encode(self.message, self.cryptor.sign)
+        for malformed in ('{"type": "store"}', data[:5], data[:80],
+                          envelope.encode(dict(self.message, pubkey=''), self.cryptor.sign)):
+            self.assertRaises(ValueError, envelope.decode, malformed)
+
+    def test_supports_envelope(self):
+        self.assertTrue(envelope.supports_envelope('0.5.1'))
+        self.assertTrue(envelope.supports_envelope('0.10.0'))
+        self.assertFalse(envelope.supports_envelope('0.5.0'))
+        self.assertFalse(envelope.supports_envelope(None))
+        self.assertFalse(envelope.supports_envelope('unknown'))
+
+    def test_listener_opens_both_formats(self):
+        secret = hashlib.sha256('bob').hexdigest()
+        recipient = Cryptor(privkey_hex=secret)
+        to_recipient = Cryptor(pubkey_hex=arithmetic.privkey_to_pubkey(secret))
+
+        data = envelope.encode(self.message, self.cryptor.sign)
+        encrypted = to_recipient.encrypt(data.encode('zlib'))
+        self.assertEqual(CryptoPeerListener.open_encrypted_message(recipient, encrypted), self.message)
+
+        sig_data = json.dumps(self.message).encode('hex')
+        legacy = json.dumps({'sig': self.cryptor.sign(sig_data).encode('hex'), 'data': sig_data})
+        encrypted = to_recipient.encrypt(legacy.encode('zlib'))
+        self.assertEqual(CryptoPeerListener.open_encrypted_message(recipient, encrypted), self.message)
+
+
+if __name__ == '__main__':
+    unittest.main()
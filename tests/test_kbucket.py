@@ -177,6 +177,33 @@ class TestKBucket(unittest.TestCase):
             "Contact list was modified before raising exception."
         )
 
+    def test_cache_contact(self):
+        cached_ids = range(self.range_max, self.range_max + 2 * constants.CACHE_K)
+        for i in cached_ids:
+            self.bucket.cache_contact(self._mk_contact_by_num(i))
+
+        # Only the CACHE_K most recently seen contacts are kept
+        expected = [self._mk_contact_by_num(i) for i in cached_ids[-constants.CACHE_K:]]
+        self.assertEqual(self.bucket.get_cached_contacts(), expected)
+
+        # Seeing a cached contact again moves it to the tail
+        self.bucket.cache_contact(str(cached_ids[-constants.CACHE_K]))
+        self.assertEqual(self.bucket.get_cached_contacts(), expected[1:] + expected[:1])
+        self.assertEqual(self.bucket.pop_cached_contact(), expected[0])
+
+    def test_pop_cached_contact_empty(self):
+        self.assertIsNone(self.bucket.pop_cached_contact())
+
+    def test_fill_from_cache(self):
+        for i in range(self.range_max, self.range_max + 3):
+            self.bucket.cache_contact(self._mk_contact_by_num(i))
+
+        # Only one slot left; the most recently seen contact takes it
+        self.bucket.fill_from_cache()
+        self.assertEqual(len(self.bucket), constants.K)
+        self.assertIn(self._mk_contact_by_num(self.range_max + 2), self.bucket)
+        self.assertEqual(len(self.bucket.get_cached_contacts()), 2)
+
     def test_get_contact(self):
         for i in range(self.init_contact_count):
             c_id = self.range_min + i
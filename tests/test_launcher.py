@@ -34,6 +34,8 @@ class TestLauncher(unittest.TestCase):
         self.assertEqual(arguments.disable_open_browser, self.default_ctx.disable_open_browser)
         self.assertEqual(arguments.config_file, None)
         self.assertEqual(arguments.enable_ip_checker, self.default_ctx.enable_ip_checker)
+        self.assertEqual(arguments.max_peers, self.default_ctx.max_peers)
+        self.assertEqual(arguments.crypto_workers, self.default_ctx.crypto_workers)
 
         # todo: add more cases to make sure arguments are being parsed correctly.
 
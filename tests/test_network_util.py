@@ -1,4 +1,7 @@
 import mock
+import os
+import socket
+import tempfile
 import unittest
 
 import requests
@@ -143,6 +146,24 @@ class TestNodeNetworkUtil(unittest.TestCase):
             network_util.is_valid_hostname('@#FADSFJSK@#RKFSAJASDJKF@#lkdafj')
         )
 
+    def test_get_udp_drops(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(sock.close)
+        inode = os.fstat(sock.fileno()).st_ino
+        proc_file = tempfile.NamedTemporaryFile()
+        self.addCleanup(proc_file.close)
+        proc_file.write(
+            '  sl  local_address rem_address   st tx_queue rx_queue tr tm->when '
+            'retrnsmt   uid  timeout inode ref pointer drops\n'
+            '  1: 0100007F:3039 00000000:0000 07 00000000:00000000 00:00000000 '
+            '00000000  1000        0 %d 2 ffff8800b8d1e000 42\n' % inode
+        )
+        proc_file.flush()
+
+        self.assertEqual(network_util.get_udp_drops(sock, ('/nonexistent', proc_file.name)), 42)
+        self.assertIsNone(network_util.get_udp_drops(sock, ('/nonexistent',)))
+        self.assertIsNone(network_util.get_udp_drops(None))
+
 
 
 if __name__ == '__main__':
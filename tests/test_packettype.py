@@ -0,0 +1,50 @@
+import unittest
+
+import mock
+
+from node import packettype
+from node.constants import PACKET_TYPE_PING, PACKET_TYPE_PONG, PACKET_TYPE_RELAY, PACKET_TYPE_RELAY_PING, \
+    PACKET_TYPE_RELAY_PONG, PACKET_TYPE_RELAYTO, PACKET_TYPE_PUNCH, PACKET_TYPE_DATA, PACKET_TYPE_RUDP
+
+
+class TestPacketType(unittest.TestCase):
+
+    def test_classify_header(self):
+        self.assertEqual(packettype.classify('\x01'), (PACKET_TYPE_PING, ''))
+        self.assertEqual(packettype.classify('\x0a1234'), (PACKET_TYPE_PUNCH, '1234'))
+        self.assertEqual(packettype.classify('\x0b{"seq": 1}'), (PACKET_TYPE_DATA, '{"seq": 1}'))
+
+    def test_classify_legacy(self):
+        self.assertEqual(packettype.classify('ping'), (PACKET_TYPE_PING, ''))
+        self.assertEqual(packettype.classify('pong'), (PACKET_TYPE_PONG, ''))
+        self.assertEqual(packettype.classify('relay_ping 1234'), (PACKET_TYPE_RELAY_PING, '1234'))
+        self.assertEqual(packettype.classify('relay_pong 1234'), (PACKET_TYPE_RELAY_PONG, '1234'))
+        self.assertEqual(packettype.classify('relay {"seq": 1}'), (PACKET_TYPE_RELAY, '{"seq": 1}'))
+        self.assertEqual(
+            packettype.classify('relayto 1234 10.0.0.1 12345 {"seq": 1}'),
+            (PACKET_TYPE_RELAYTO, '1234 10.0.0.1 12345 {"seq": 1}')
+        )
+
+    def test_classify_data(self):
+        for data in ('{"seq": 1}', 'hello', 'pingpong', 'relayed 1234', '', 'x' * 100):
+            self.assertEqual(packettype.classify(data), (PACKET_TYPE_DATA, data))
+
+    def test_encode(self):
+        self.assertEqual(packettype.encode(PACKET_TYPE_PING), 'ping')
+        self.assertEqual(packettype.encode(PACKET_TYPE_PUNCH, '1234'), 'punch 1234')
+        self.assertEqual(packettype.encode(PACKET_TYPE_PUNCH, '1234', header=True), '\x0a1234')
+        self.assertEqual(packettype.encode(PACKET_TYPE_DATA, '{}'), '{}')
+        self.assertEqual(packettype.encode(PACKET_TYPE_RUDP, '\x01'), '\x0c\x01')
+        with mock.patch.object(packettype, 'PACKET_TYPE_HEADERS', True):
+            self.assertEqual(packettype.encode(PACKET_TYPE_PING), '\x01')
+
+    def test_round_trip(self):
+        for packet_type in packettype.PACKET_TYPES - set([PACKET_TYPE_RUDP]):
+            for header in (True, False):
+                data = packettype.encode(packet_type, '{"guid": "1234"}', header=header)
+                self.assertEqual(packettype.has_header(data), header)
+                self.assertEqual(packettype.classify(data), (packet_type, '{"guid": "1234"}'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import random
+import unittest
+
+from node import guid, ranking
+
+
+def random_id(rng):
+    return '%040x' % rng.getrandbits(160)
+
+
+class TestDistanceRanker(unittest.TestCase):
+    use_numpy = False
+
+    def setUp(self):
+        self.rng = random.Random(42)
+        self.node_ids = [random_id(self.rng) for _ in range(300)]
+        self.target = random_id(self.rng)
+
+    def _expected(self, node_ids, target):
+        target_int = int(target, 16)
+        return sorted(
+            range(len(node_ids)),
+            key=lambda index: int(node_ids[index], 16) ^ target_int
+        )
+
+    def _ranker(self, node_ids):
+        return ranking.DistanceRanker(node_ids, use_numpy=self.use_numpy)
+
+    def test_full_ranking(self):
+        ranker = self._ranker(self.node_ids)
+        self.assertEqual(ranker.closest(self.target), self._expected(self.node_ids, self.target))
+
+    def test_top_count(self):
+        ranker = self._ranker(self.node_ids)
+        expected = self._expected(self.node_ids, self.target)
+        for count in (1, 24, 299, 300, 1000):
+            self.assertEqual(ranker.closest(self.target, count), expected[:count])
+        self.assertEqual(ranker.closest(self.target, 0), [])
+
+    def test_ties_in_top_word(self):
+        # IDs sharing their first 16 bytes only differ in the last word
+        prefix = 'ab' * 16
+        node_ids = [prefix + '%08x' % num for num in (7, 3, 9, 1, 5)]
+        ranker = self._ranker(node_ids)
+        self.assertEqual(ranker.closest(prefix + '00000000', 3), [3, 1, 4])
+
+    def test_invalid_ids_rank_last(self):
+        node_ids = [None, self.node_ids[0], 'seed1', self.node_ids[1], 'x' * 40]
+        ranker = self._ranker(node_ids)
+        ranked = ranker.closest(self.target)
+        self.assertEqual(ranked[-3:], [0, 2, 4])
+        self.assertItemsEqual(ranked[:2], [1, 3])
+
+    def test_guid_mixin(self):
+        ranker = self._ranker([guid.GUIDMixin(node_id) for node_id in self.node_ids])
+        self.assertEqual(
+            ranker.closest(guid.GUIDMixin(self.target), 5),
+            self._expected(self.node_ids, self.target)[:5]
+        )
+
+    def test_invalid_target_keeps_order(self):
+        ranker = self._ranker(self.node_ids[:3])
+        self.assertEqual(ranker.closest('seed'), [0, 1, 2])
+
+
+@unittest.skipIf(ranking.numpy is None, 'NumPy is not installed')
+class TestNumpyDistanceRanker(TestDistanceRanker):
+    use_numpy = True
+
+
+class TestSortByDistance(unittest.TestCase):
+    def test_sort_by_distance(self):
+        nodes = [
+            ('127.0.0.1', 1, 'f' * 40),
+            ('127.0.0.1', 2, None),
+            ('127.0.0.1', 3, '0' * 40),
+            ('127.0.0.1', 4, '8' * 40),
+        ]
+        ranked = ranking.sort_by_distance(nodes, '1' * 40, key=lambda node: node[2])
+        self.assertEqual([node[1] for node in ranked], [3, 4, 1, 2])
+
+        closest = ranking.sort_by_distance(nodes, '1' * 40, key=lambda node: node[2], count=1)
+        self.assertEqual(closest, [nodes[2]])
+
+if __name__ == "__main__":
+    unittest.main()
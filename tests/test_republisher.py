@@ -0,0 +1,160 @@
+import json
+import unittest
+
+import mock
+
+from node import constants, db_store, republisher
+from node.market import Market
+
+
+class FakeClock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = republisher.TokenBucket(2, 4, self.clock)
+
+    def test_starts_full(self):
+        self.assertTrue(self.bucket.consume(4))
+        self.assertFalse(self.bucket.consume(1))
+
+    def test_refill(self):
+        self.bucket.consume(4)
+        self.clock.now += 1
+        self.assertTrue(self.bucket.consume(2))
+        self.assertFalse(self.bucket.consume(1))
+
+    def test_capacity(self):
+        self.bucket.consume(4)
+        self.clock.now += 100
+        self.assertFalse(self.bucket.consume(5))
+        self.assertTrue(self.bucket.consume(4))
+
+    def test_charge_into_debt(self):
+        self.bucket.charge(8)
+        self.clock.now += 1
+        self.assertFalse(self.bucket.consume(1))
+        self.clock.now += 1
+        self.assertTrue(self.bucket.consume(0))
+        self.assertFalse(self.bucket.consume(1))
+
+        self.bucket.charge(-100)
+        self.assertTrue(self.bucket.consume(4))
+
+
+class TestRepublishScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.db_mock = mock.MagicMock(spec=db_store.Obdb)
+        self.db_mock.select_entries.return_value = []
+        self.scheduler = self._make_scheduler()
+
+    def _make_scheduler(self, rate=10, fanout=5):
+        return republisher.RepublishScheduler(
+            self.db_mock, 1, interval=100, rate=rate, fanout=fanout,
+            clock=self.clock, loop=mock.Mock()
+        )
+
+    def test_first_due_time_is_spread_over_interval(self):
+        for num in range(50):
+            self.scheduler.schedule('key%d' % num, mock.Mock())
+        due_times = self.scheduler.due_times.values()
+        self.assertTrue(all(self.clock.now <= due <= self.clock.now + 100 for due in due_times))
+        self.assertGreater(len(set(due_times)), 1)
+
+    def test_run_due(self):
+        job = mock.Mock(return_value=1)
+        self.scheduler.schedule('key', job, due=self.clock.now + 10)
+        self.assertEqual(self.scheduler.run_due(), 0)
+
+        self.clock.now += 10
+        self.assertEqual(self.scheduler.run_due(), 1)
+        job.assert_called_once_with()
+
+        # Rescheduled about one interval later
+        next_due = self.scheduler.due_times['key']
+        jitter = 100 * constants.REPUBLISH_JITTER
+        self.assertTrue(self.clock.now + 100 - jitter <= next_due <= self.clock.now + 100 + jitter)
+        self.assertEqual(self.scheduler.run_due(), 0)
+
+    def test_rate_limit(self):
+        jobs = [mock.Mock(return_value=1) for _ in range(10)]
+        for num, job in enumerate(jobs):
+            self.scheduler.schedule('key%d' % num, job, due=self.clock.now)
+
+        # The bucket holds 10 tokens and every job costs a fanout of 5
+        self.assertEqual(self.scheduler.run_due(), 2)
+        self.assertEqual(self.scheduler.num_throttled, 1)
+
+        self.clock.now += 1
+        self.assertEqual(self.scheduler.run_due(), 2)
+        self.assertEqual(sum(job.call_count for job in jobs), 4)
+
+    def test_rate_limit_counts_every_store(self):
+        # A contract with three keywords stores four keys to 5 nodes each
+        market = Market.__new__(Market)
+        market.log = mock.Mock()
+        market.transport = mock.Mock()
+        market.dht = mock.Mock()
+        # Stores one keyword index entry per keyword
+        market.update_keywords_on_network = mock.Mock(side_effect=lambda key, keywords: len(keywords))
+        market.db_connection = mock.Mock()
+        market.db_connection.select_entries.return_value = [{
+            'key': 'contract',
+            'signed_contract_body': 'signed',
+            'contract_body': json.dumps({'Contract': {'item_keywords': ['a', 'b', 'c']}})
+        }]
+        self.scheduler.schedule('contract', lambda: market._republish_contract('contract'),
+                                due=self.clock.now)
+        other_job = mock.Mock(return_value=1)
+        self.scheduler.schedule('other', other_job, due=self.clock.now)
+
+        self.assertEqual(self.scheduler.run_due(), 1)
+        self.assertEqual(market.transport.store.call_count, 1)
+        market.update_keywords_on_network.assert_called_once_with('contract', ['a', 'b', 'c'])
+        self.assertFalse(other_job.called)
+
+        # 20 tokens were spent at 10 per second; 5 more pay for the next job
+        self.clock.now += 1.4
+        self.assertEqual(self.scheduler.run_due(), 0)
+        self.clock.now += 0.1
+        self.assertEqual(self.scheduler.run_due(), 1)
+        other_job.assert_called_once_with()
+
+    def test_job_storing_nothing_is_refunded(self):
+        jobs = [mock.Mock(return_value=0) for _ in range(5)]
+        for num, job in enumerate(jobs):
+            self.scheduler.schedule('key%d' % num, job, due=self.clock.now)
+        self.assertEqual(self.scheduler.run_due(), 5)
+
+    def test_failing_job(self):
+        job = mock.Mock(side_effect=ValueError)
+        self.scheduler.schedule('key', job, due=self.clock.now)
+        self.assertEqual(self.scheduler.run_due(), 1)
+        self.assertIn('key', self.scheduler)
+
+    def test_unschedule(self):
+        job = mock.Mock()
+        self.scheduler.schedule('key', job, due=self.clock.now)
+        self.scheduler.unschedule('key')
+        self.assertNotIn('key', self.scheduler)
+        self.assertEqual(self.scheduler.run_due(), 0)
+        self.assertFalse(job.called)
+
+    def test_due_times_are_persisted(self):
+        self.scheduler.schedule('key', mock.Mock(), due=1234)
+        self.db_mock.insert_entry.assert_called_once_with(
+            "republish_schedule", {"key": "key", "market_id": 1, "next_due": 1234}
+        )
+
+    def test_restart_resumes_saved_schedule(self):
+        self.db_mock.select_entries.return_value = [{'key': 'key', 'next_due': '5000'}]
+        scheduler = self._make_scheduler()
+        scheduler.schedule('key', mock.Mock())
+        self.assertEqual(scheduler.due_times['key'], 5000)
@@ -128,8 +128,7 @@ class TestOptimizedTreeRoutingTable(TestRoutingTable):
         self.assertEqual(self.routingtable.market_id, self.market_id)
         self.assertTrue(hasattr(self.routingtable, 'log'))
         self.assertTrue(hasattr(self.routingtable, 'buckets'))
-        self.assertTrue(hasattr(self.routingtable, 'replacement_cache'))
-        self.assertEqual(self.routingtable.replacement_cache, dict())
+        self.assertEqual(self.routingtable.buckets[0].get_cached_contacts(), [])
 
         self.addTypeEqualityFunc(kbucket.KBucket, self._ad_hoc_kbucket_eq)
         # The following check cannot be simplified due to this bug
@@ -274,5 +273,258 @@ class TestOptimizedTreeRoutingTable(TestRoutingTable):
         self.assertEqual(1, self.routingtable.kbucket_index(unicode(hex_key)))
         self.assertEqual(1, self.routingtable.kbucket_index(guid.GUIDMixin(hex_key)))
 
+    def test_iter_contacts(self):
+        half_range = self._init_n_buckets(2)
+        low_id = self.routingtable.num_to_id(half_range - 1)
+        high_id = self.routingtable.num_to_id(half_range)
+        self.routingtable.buckets[0].add_contact(low_id)
+        self.routingtable.buckets[1].add_contact(high_id)
+
+        self.assertEqual(
+            list(self.routingtable.iter_contacts()),
+            [(low_id, self.range_min), (high_id, half_range)]
+        )
+
+    def test_restore_layout(self):
+        # Split the buckets around our own ID a few times
+        for _ in range(3):
+            self.routingtable.split_bucket(
+                self.routingtable.kbucket_index(self.parent_node_id)
+            )
+        range_mins = [bucket.range_min for bucket in self.routingtable.buckets]
+
+        restored = routingtable.OptimizedTreeRoutingTable(
+            self.parent_node_id,
+            self.market_id
+        )
+        restored.restore_layout(reversed(range_mins))
+        self.assertEqual(
+            [(bucket.range_min, bucket.range_max) for bucket in restored.buckets],
+            [(bucket.range_min, bucket.range_max) for bucket in self.routingtable.buckets]
+        )
+
+        # Ranges that don't cover our own ID are not split
+        restored.restore_layout([self.range_max - 1])
+        self.assertEqual(len(restored.buckets), len(range_mins))
+
+    def _fill_far_bucket(self, count):
+        # The upper half doesn't cover our own ID, so it is never split.
+        half_range = self._init_n_buckets(2)
+        contacts = [
+            guid.GUIDMixin(self.routingtable.num_to_id(half_range + i))
+            for i in range(count)
+        ]
+        for contact in contacts:
+            self.routingtable.add_contact(contact)
+        return self.routingtable.buckets[1], contacts
+
+    def test_replacement_cache_bounded(self):
+        bucket, contacts = self._fill_far_bucket(constants.K + 3 * constants.CACHE_K)
+        self.assertEqual(bucket.contacts, contacts[:constants.K])
+        self.assertEqual(bucket.get_cached_contacts(), contacts[-constants.CACHE_K:])
+
+    def test_replacement_cache_most_recently_seen(self):
+        bucket, contacts = self._fill_far_bucket(constants.K + 3)
+        self.routingtable.add_contact(contacts[constants.K])
+        self.assertEqual(bucket.get_cached_contacts()[-1], contacts[constants.K])
+        self.assertEqual(len(bucket.get_cached_contacts()), 3)
+
+    def test_remove_contact_promotes_cached(self):
+        bucket, contacts = self._fill_far_bucket(constants.K + 2)
+        self.routingtable.remove_contact(contacts[0])
+        self.assertNotIn(contacts[0], bucket)
+        self.assertIn(contacts[-1], bucket)
+        self.assertEqual(bucket.get_cached_contacts(), [contacts[-2]])
+
+        # Removing a cached contact only drops it from the cache
+        self.routingtable.remove_contact(contacts[-2])
+        self.assertEqual(bucket.get_cached_contacts(), [])
+        self.assertEqual(len(bucket), constants.K)
+
+    def test_refresh_contact_keeps_its_slot(self):
+        bucket, contacts = self._fill_far_bucket(constants.K + 1)
+        self.routingtable.add_contact(contacts[0])
+        self.assertEqual(bucket.contacts[-1], contacts[0])
+        self.assertEqual(bucket.get_cached_contacts(), [contacts[-1]])
+
+    def test_report_unreachable(self):
+        bucket, contacts = self._fill_far_bucket(constants.K)
+
+        # Nothing to replace it with, so the contact stays
+        self.assertIsNone(self.routingtable.report_unreachable(contacts[0]))
+        self.assertIn(contacts[0], bucket)
+
+        for contact in contacts[:2]:
+            bucket.cache_contact(
+                self.routingtable.num_to_id(int(contact.guid, 16) + constants.K)
+            )
+        cached = bucket.get_cached_contacts()
+        replacement = self.routingtable.report_unreachable(contacts[0])
+        self.assertEqual(replacement, cached[-1])
+        self.assertNotIn(contacts[0], bucket)
+        self.assertIn(replacement, bucket)
+
+        # An unreachable cached contact is dropped from the cache
+        self.assertIsNone(self.routingtable.report_unreachable(cached[0]))
+        self.assertEqual(bucket.get_cached_contacts(), [])
+        self.assertEqual(len(bucket), constants.K)
+
+    def test_split_bucket_partitions_cache(self):
+        bucket = self.routingtable.buckets[0]
+        half_range = self.range_max // 2
+        for i in range(constants.K):
+            bucket.add_contact(self.routingtable.num_to_id(i + 1))
+        low_cached = self.routingtable.num_to_id(constants.K + 1)
+        high_cached = [
+            self.routingtable.num_to_id(half_range + i) for i in range(3)
+        ]
+        bucket.cache_contact(low_cached)
+        for contact_id in high_cached:
+            bucket.cache_contact(contact_id)
+
+        self.routingtable.split_bucket(0)
+        low_bucket, high_bucket = self.routingtable.buckets
+
+        # The upper half was empty, so its cached contacts moved in
+        self.assertEqual(low_bucket.get_cached_contacts(), [low_cached])
+        self.assertEqual(high_bucket.get_cached_contacts(), [])
+        self.assertItemsEqual(high_bucket.contacts, high_cached)
+
+
+class TestCachingTreeRoutingTable(TestRoutingTable):
+    """Test the adapter for the routing table of the dht package."""
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestCachingTreeRoutingTable, cls).setUpClass()
+        cls.parent_node_id = routingtable.RoutingTable.num_to_id(1)
+
+    def setUp(self):
+        self.routingtable = routingtable.CachingTreeRoutingTable(
+            self.parent_node_id,
+            self.market_id
+        )
+
+    def _contact(self, num):
+        return guid.GUIDMixin(self.routingtable.num_to_id(num))
+
+    def _fill_far_bucket(self, count):
+        # All contacts are in the upper half, which is split off once
+        # and never split again.
+        top = 2**constants.BIT_NODE_ID_LEN
+        contacts = [self._contact(top - 1 - i) for i in range(count)]
+        for contact in contacts:
+            self.routingtable.add_contact(contact)
+        return contacts
+
+    def test_subclassing(self):
+        self.assertIsInstance(self.routingtable, routingtable.RoutingTable)
+
+    def test_add_get_remove(self):
+        contact = self._contact(2)
+        self.routingtable.add_contact(contact)
+        self.assertIs(self.routingtable.get_contact(contact.guid), contact)
+        self.assertIs(self.routingtable.get_contact(contact), contact)
+        self.assertIsNone(self.routingtable.get_contact(self._contact(3)))
+
+        self.routingtable.remove_contact(contact)
+        self.assertIsNone(self.routingtable.get_contact(contact.guid))
+
+    def test_add_without_guid(self):
+        self.routingtable.add_contact(guid.GUIDMixin(None))
+        self.assertEqual(list(self.routingtable.iter_contacts()), [])
+
+    def test_remove_contact_promotes_cached(self):
+        contacts = self._fill_far_bucket(constants.K + 2)
+        self.routingtable.remove_contact(contacts[0])
+        self.assertIsNotNone(self.routingtable.get_contact(contacts[-1]))
+        self.assertIsNone(self.routingtable.get_contact(contacts[0]))
+
+    def test_report_unreachable(self):
+        contacts = self._fill_far_bucket(constants.K + 1)
+        self.assertEqual(self.routingtable.report_unreachable(contacts[0]), contacts[-1])
+        self.assertIsNone(self.routingtable.get_contact(contacts[0]))
+        self.assertIsNone(self.routingtable.report_unreachable(contacts[1]))
+
+    def test_find_close_nodes(self):
+        contacts = self._fill_far_bucket(constants.K)
+        close_nodes = self.routingtable.find_close_nodes(
+            contacts[0].guid, constants.K, contacts[1]
+        )
+        self.assertEqual(len(close_nodes), constants.K - 1)
+        self.assertNotIn(contacts[1], close_nodes)
+
+    def test_find_close_nodes_by_xor_distance(self):
+        contacts = self._fill_far_bucket(constants.K)
+        key = contacts[5].guid
+        close_nodes = self.routingtable.find_close_nodes(key, 4)
+        self.assertEqual(
+            close_nodes,
+            sorted(contacts, key=lambda contact: self.routingtable.distance(contact.guid, key))[:4]
+        )
+
+        # The ranking follows changes to the table
+        self.routingtable.remove_contact(contacts[5])
+        self.assertNotIn(contacts[5], self.routingtable.find_close_nodes(key, 4))
+
+    def test_ranking_rebuilt_only_when_contacts_change(self):
+        contacts = self._fill_far_bucket(4)
+        self.routingtable.find_close_nodes(contacts[0].guid, 2)
+        ranker = self.routingtable._ranker
+
+        # Refreshing a contact, or caching one for a full bucket, keeps it
+        self.routingtable.add_contact(contacts[1])
+        self.assertIs(self.routingtable._ranker, ranker)
+        self.routingtable.remove_contact(self._contact(3))
+        self.assertIs(self.routingtable._ranker, ranker)
+
+        # A new record of a known contact is ranked in its place
+        renewed = self._contact(int(contacts[0].guid, 16))
+        self.routingtable.add_contact(renewed)
+        self.assertIs(self.routingtable.find_close_nodes(renewed.guid, 1)[0], renewed)
+        ranker = self.routingtable._ranker
+
+        contacts += self._fill_far_bucket(constants.K + 1)[4:]
+        self.assertIsNot(self.routingtable._ranker, ranker)
+        self.routingtable.find_close_nodes(contacts[0].guid, 2)
+        ranker = self.routingtable._ranker
+        self.routingtable.add_contact(self._contact(2 ** constants.BIT_NODE_ID_LEN - 100))
+        self.assertIs(self.routingtable._ranker, ranker)
+
+    def test_get_refresh_list(self):
+        self._fill_far_bucket(constants.K + 1)
+        buckets = self.routingtable.buckets
+        self.assertEqual(self.routingtable.get_refresh_list(0, False), [])
+
+        node_ids = self.routingtable.get_refresh_list(0, True)
+        self.assertEqual(len(node_ids), len(buckets))
+        for bucket, node_id in zip(buckets, node_ids):
+            self.assertTrue(bucket.guid_in_range(node_id))
+
+        self.routingtable.touch_kbucket(node_ids[-1], timestamp=0)
+        self.assertEqual(len(self.routingtable.get_refresh_list(0, False)), 1)
+
+    def test_iter_contacts(self):
+        contacts = self._fill_far_bucket(3)
+        self.assertItemsEqual(
+            [contact for contact, _ in self.routingtable.iter_contacts()],
+            contacts
+        )
+
+    def test_restore_layout(self):
+        self._fill_far_bucket(constants.K + 1)
+        range_mins = [bucket.range_min for bucket in self.routingtable.buckets]
+
+        restored = routingtable.CachingTreeRoutingTable(
+            self.parent_node_id,
+            self.market_id
+        )
+        restored.restore_layout(range_mins)
+        self.assertEqual(
+            [bucket.range_min for bucket in restored.buckets],
+            range_mins
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,212 @@
+import json
+import unittest
+
+import mock
+
+from node.constants import PACKET_TYPE_RUDP
+from rudp import constants
+from rudp.packet import Packet
+from rudp.packetsender import PacketSender
+from rudp.receiver import Receiver
+from rudp.sender import Sender
+
+
+IDENTITY = {
+    'guid': '8c8a5bd6d0a2a5ee3a9d6f6e1e09e8c2bf4e1ba2',
+    'pubkey': '04' + 'ab' * 64,
+    'hostname': '10.0.0.1',
+    'port': 12345,
+    'nick': 'Default',
+    'nat_type': 'Full Cone',
+}
+
+
+class TestPacket(unittest.TestCase):
+
+    def test_binary_round_trip(self):
+        packet = Packet(1234.0, '42|5|hello', True, True, message_id=42, fragment=3, fragments=7)
+        packet, identity = Packet.from_binary(packet.to_binary(99))
+
+        self.assertIsNone(identity)
+        self.assertEqual(packet._session_id, 99)
+        self.assertEqual(packet.get_sequence_number(), 1234)
+        self.assertEqual(packet._payload, '42|5|hello')
+        self.assertEqual(packet._size, 10)
+        self.assertEqual((packet._message_id, packet._fragment, packet._fragments), (42, 3, 7))
+        self.assertTrue(packet._synchronize)
+        self.assertTrue(packet._reset)
+        self.assertFalse(packet._acknowledgement)
+        self.assertFalse(packet._finish)
+
+    def test_binary_identity(self):
+        packet, identity = Packet.from_binary(Packet(1, 'hello').to_binary(99, IDENTITY))
+        self.assertEqual(identity, IDENTITY)
+        self.assertEqual(packet._payload, 'hello')
+
+        packet, identity = Packet.from_binary(Packet(1, '').to_binary(99, dict(IDENTITY, nat_type=None)))
+        self.assertIsNone(identity['nat_type'])
+        self.assertEqual(packet._payload, '')
+
+    def test_binary_acknowledgement(self):
+        ack = Packet.create_acknowledgement_packet(1234, IDENTITY['guid'], IDENTITY['pubkey'], 99)
+        data = ack.to_binary(ack._session_id)
+        packet, identity = Packet.from_binary(data)
+
+        self.assertTrue(packet._acknowledgement)
+        self.assertEqual(packet._session_id, 99)
+        self.assertEqual(packet._payload, '')
+        self.assertLess(len(data) * 5, len(ack.to_buffer(**IDENTITY)))
+
+    def test_binary_smaller_than_json(self):
+        packet = Packet(1234.0, 'ab' * 500, message_id=42, fragments=1)
+        self.assertLess(len(packet.to_binary(99)) - 1000, (len(packet.to_buffer(**IDENTITY)) - 1000) / 10)
+
+    def test_binary_unknown_session(self):
+        packet, identity = Packet.from_binary(Packet.create_unknown_session_packet(1234, 99).to_binary(99))
+        self.assertTrue(packet.is_unknown_session())
+        self.assertEqual((packet._session_id, packet.get_sequence_number()), (99, 1234))
+        self.assertIsNone(identity)
+
+        ack, _ = Packet.from_binary(Packet.create_acknowledgement_packet(1234, 'guid', 'pubkey', 99).to_binary(99))
+        self.assertFalse(ack.is_unknown_session())
+
+    def test_malformed_binary(self):
+        data = Packet(1, 'hello').to_binary(99, IDENTITY)
+        for malformed in (data[:10], data[:30], chr(constants.HEADER_VERSION + 1) + data[1:]):
+            self.assertRaises(ValueError, Packet.from_binary, malformed)
+
+
+class TestPacketSender(unittest.TestCase):
+
+    def setUp(self):
+        self.socket = mock.Mock()
+        transport = mock.Mock(
+            guid=IDENTITY['guid'], pubkey=IDENTITY['pubkey'], hostname=IDENTITY['hostname'],
+            port=IDENTITY['port'], nickname=IDENTITY['nick'], nat_type=IDENTITY['nat_type']
+        )
+        self.sender = PacketSender(self.socket, '127.0.0.1', 12346, '1', transport, 'Full Cone')
+
+    def _sent(self):
+        return self.socket.sendto.call_args[0][0]
+
+    def test_legacy_json(self):
+        self.sender.send(Packet(1, 'hello'))
+        self.assertEqual(json.loads(self._sent())['guid'], IDENTITY['guid'])
+
+    def test_identity_until_acknowledged(self):
+        self.sender.binary = True
+        self.sender.send(Packet(1, 'hello'))
+        data = self._sent()
+        self.assertEqual(data[:1], PACKET_TYPE_RUDP)
+        packet, identity = Packet.from_binary(data[1:])
+        self.assertEqual(packet._session_id, self.sender.session_id)
+        self.assertEqual(identity, IDENTITY)
+
+        self.sender.identity_acknowledged = True
+        self.sender.send(Packet(2, 'hello'))
+        packet, identity = Packet.from_binary(self._sent()[1:])
+        self.assertIsNone(identity)
+        self.assertEqual(packet._payload, 'hello')
+
+    def test_acknowledgement_in_peer_session(self):
+        self.sender.binary = True
+        self.sender.send(Packet.create_acknowledgement_packet(1, 'guid', 'pubkey', self.sender.session_id + 1))
+        packet, identity = Packet.from_binary(self._sent()[1:])
+        self.assertTrue(packet._acknowledgement)
+        self.assertEqual(packet._session_id, self.sender.session_id + 1)
+        self.assertIsNone(identity)
+
+
+class TestFragments(unittest.TestCase):
+
+    def setUp(self):
+        self.packet_sender = mock.Mock(binary=True)
+        self.packet_sender._transport.guid = IDENTITY['guid']
+        self.packet_sender._transport.pubkey = IDENTITY['pubkey']
+
+    def _sent_packets(self):
+        return [call[0][0] for call in self.packet_sender.send.call_args_list]
+
+    def test_sender_sends_raw_fragments(self):
+        data = ''.join(chr(num % 256) for num in range(2500))
+        Sender(self.packet_sender).send(data)
+
+        # Only the synchronization packet goes out before it is acknowledged
+        packet = self._sent_packets()[0]
+        self.assertTrue(packet._raw_fragment)
+        self.assertEqual((packet._fragment, packet._fragments), (0, 3))
+        self.assertEqual(packet._payload, data[:constants.UDP_SAFE_SEGMENT_SIZE])
+
+        packet, _ = Packet.from_binary(packet.to_binary(99))
+        self.assertTrue(packet._raw_fragment)
+
+    def test_sender_hex_encodes_for_legacy_peers(self):
+        self.packet_sender.binary = False
+        Sender(self.packet_sender).send('{"type": "hello"}')
+        packet = self._sent_packets()[0]
+        self.assertFalse(packet._raw_fragment)
+        self.assertTrue(packet._payload.endswith('|%s' % '{"type": "hello"}'.encode('hex')))
+
+    def test_receiver_reassembles_fragments(self):
+        receiver = Receiver(self.packet_sender)
+        messages = []
+        receiver.event_emitter.on('data', messages.append)
+
+        chunks = ['a|b', '\x00|\xff', '{"x": 1}']
+        packets = [
+            Packet(100 + num, chunk, message_id=7, fragment=num, fragments=3, raw_fragment=True)
+            for num, chunk in enumerate(chunks)
+        ]
+        for num in (2, 0, 0, 1):
+            packet, _ = Packet.from_binary(packets[num].to_binary(99))
+            receiver.receive(packet)
+            if num != 1:
+                self.assertTrue(receiver.has_pending())
+
+        self.assertEqual(messages, [{'payload': ''.join(chunks), 'size': 14, 'binary': True}])
+        self.assertFalse(receiver.has_pending())
+        acks = self._sent_packets()
+        self.assertEqual([ack.get_sequence_number() for ack in acks], [102, 100, 100, 101])
+        self.assertTrue(all(ack._acknowledgement and ack._session_id == 99 for ack in acks))
+
+    def test_receiver_drops_retransmitted_fragments(self):
+        receiver = Receiver(self.packet_sender)
+        messages = []
+        receiver.event_emitter.on('data', messages.append)
+
+        single = Packet(100, 'hello', message_id=7, fragment=0, fragments=1, raw_fragment=True)
+        receiver.receive(single)
+        receiver.receive(single)
+        self.assertEqual(len(messages), 1)
+
+        packets = [Packet(200 + num, 'ab', message_id=8, fragment=num, fragments=2, raw_fragment=True)
+                   for num in xrange(2)]
+        for packet in packets + packets[:1]:
+            receiver.receive(packet)
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(receiver.fragmented_messages, {})
+        self.assertFalse(receiver.has_pending())
+        # Still acknowledged, as the first acknowledgements may be lost
+        self.assertEqual([ack.get_sequence_number() for ack in self._sent_packets()], [100, 100, 200, 201, 200])
+
+        # A new message may reuse the id
+        receiver.receive(Packet(300, 'again', message_id=7, fragment=0, fragments=1, raw_fragment=True))
+        self.assertEqual(messages[-1]['payload'], 'again')
+
+    def test_receiver_expires_incomplete_messages(self):
+        receiver = Receiver(self.packet_sender)
+        receiver.receive(Packet(100, 'ab', message_id=7, fragment=0, fragments=2, raw_fragment=True))
+        self.assertTrue(receiver.has_pending())
+
+        receiver.fragmented_messages[7].last_received -= constants.STALE_WINDOW_TIMEOUT + 1
+        receiver.receive(Packet(200, 'ab', message_id=8, fragment=0, fragments=2, raw_fragment=True))
+        self.assertEqual(receiver.fragmented_messages.keys(), [8])
+
+    def test_receiver_drops_fragment_out_of_range(self):
+        receiver = Receiver(self.packet_sender)
+        receiver.receive(Packet(100, 'x', message_id=7, fragment=3, fragments=3, raw_fragment=True))
+        self.assertFalse(self.packet_sender.send.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
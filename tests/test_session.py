@@ -0,0 +1,258 @@
+import hashlib
+import json
+import time
+import unittest
+
+from bitcoin import main as arithmetic
+
+import mock
+
+from node.connection import CryptoPeerConnection, CryptoPeerListener
+from node.crypto_util import Cryptor
+from node.session import ReplayWindow, SessionError, SessionManager
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_node(guid, clock):
+    privkey_hex = hashlib.sha256(guid).hexdigest()
+    pubkey_hex = arithmetic.privkey_to_pubkey(privkey_hex)
+    manager = SessionManager(Cryptor(pubkey_hex=pubkey_hex, privkey_hex=privkey_hex), guid, clock=clock,
+                             rekey_interval=3600, rekey_messages=100, grace_period=300, handshake_timeout=60)
+    return manager, pubkey_hex
+
+
+def as_sent(msg, sender, sender_pubkey, recipient):
+    """ Add the fields CryptoPeerConnection.send adds. """
+    return dict(msg, senderGUID=sender, pubkey=sender_pubkey, guid=recipient)
+
+
+class TestReplayWindow(unittest.TestCase):
+
+    def test_accepts_each_number_once(self):
+        window = ReplayWindow(size=8)
+        for sequence in (1, 3, 2, 10, 5):
+            self.assertTrue(window.accept(sequence))
+        for sequence in (0, 1, 3, 2, 10, 5):
+            self.assertFalse(window.accept(sequence))
+
+    def test_rejects_numbers_behind_window(self):
+        window = ReplayWindow(size=8)
+        self.assertTrue(window.accept(20))
+        self.assertFalse(window.accept(12))
+        self.assertTrue(window.accept(13))
+
+
+class TestSessionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.alice, self.alice_pubkey = make_node('alice', self.clock)
+        self.bob, self.bob_pubkey = make_node('bob', self.clock)
+
+    def _handshake(self):
+        init = as_sent(self.alice.start_handshake('bob', self.bob_pubkey), 'alice', self.alice_pubkey, 'bob')
+        accept = as_sent(self.bob.accept_handshake(init), 'bob', self.bob_pubkey, 'alice')
+        return self.alice.complete_handshake(accept)
+
+    def test_handshake(self):
+        self.assertTrue(self.alice.needs_handshake('bob'))
+        session = self._handshake()
+
+        self.assertEqual((session.guid, session.pubkey), ('bob', self.bob_pubkey))
+        self.assertIs(self.alice.get_session('bob'), session)
+        self.assertFalse(self.alice.needs_handshake('bob'))
+
+        # Bob only sends in the session once Alice used it
+        self.assertIsNone(self.bob.get_session('alice'))
+        self.assertFalse(self.bob.needs_handshake('alice'))
+        frame = self.alice.seal('bob', 'hello')
+        self.assertTrue(self.bob.is_session_frame(frame))
+        bob_session, data = self.bob.open(frame)
+        self.assertEqual(data, 'hello')
+        self.assertEqual((bob_session.guid, bob_session.pubkey), ('alice', self.alice_pubkey))
+        self.assertIs(self.bob.get_session('alice'), bob_session)
+
+        self.assertEqual(self.alice.open(self.bob.seal('alice', 'hi'))[1], 'hi')
+        self.assertEqual(self.bob.get_stats()['handshakes'], 1)
+
+    def test_rejects_replayed_and_tampered_frames(self):
+        self._handshake()
+        frame = self.alice.seal('bob', 'hello')
+        self.bob.open(frame)
+        self.assertRaises(SessionError, self.bob.open, frame)
+
+        frame = self.alice.seal('bob', 'hello')
+        tampered = frame[:25] + chr(ord(frame[25]) ^ 1) + frame[26:]
+        self.assertRaises(SessionError, self.bob.open, tampered)
+        self.assertRaises(SessionError, self.bob.open, frame[:30])
+        self.assertEqual(self.bob.open(frame)[1], 'hello')
+
+        # Frames are sealed per direction
+        self.assertRaises(SessionError, self.alice.open, self.alice.seal('bob', 'hello'))
+        self.assertEqual(self.bob.get_stats()['rejected'], 3)
+
+    def test_rejects_forged_handshakes(self):
+        init = as_sent(self.alice.start_handshake('bob', self.bob_pubkey), 'alice', self.alice_pubkey, 'bob')
+
+        # Replayed to another node
+        carol, _ = make_node('carol', self.clock)
+        self.assertRaises(SessionError, carol.accept_handshake, dict(init, guid='carol'))
+
+        # Ephemeral key swapped by a man in the middle
+        mallory = SessionManager(self.bob.cryptor, 'mallory').start_handshake('bob', self.bob_pubkey)
+        self.assertRaises(SessionError, self.bob.accept_handshake, dict(init, ephemeral=mallory['ephemeral']))
+        self.assertRaises(SessionError, self.bob.accept_handshake, dict(init, nonce='zz'))
+
+        accept = as_sent(self.bob.accept_handshake(init), 'bob', self.bob_pubkey, 'alice')
+        self.assertRaises(SessionError, self.alice.complete_handshake, dict(accept, senderGUID='carol'))
+        self.assertRaises(SessionError, self.alice.complete_handshake, dict(accept, nonce=init['nonce']))
+        self.alice.complete_handshake(accept)
+        self.assertRaises(SessionError, self.alice.complete_handshake, accept)
+
+    def test_unknown_session(self):
+        self.assertFalse(self.bob.is_session_frame('\x00OBS' + '\x00' * 40))
+        self.assertFalse(self.bob.is_session_frame('{"type": "hello"}'))
+        self.assertRaises(SessionError, self.bob.open, '\x00OBS' + '\x00' * 40)
+
+    def test_peer_restarted(self):
+        self._handshake()
+        frame = self.alice.seal('bob', 'hello')
+        self.bob, _ = make_node('bob', self.clock)
+
+        self.assertFalse(self.bob.is_session_frame(frame))
+        self.assertTrue(self.bob.is_unknown_frame(frame))
+        reject = as_sent(self.bob.reject_unknown(frame), 'bob', self.bob_pubkey, 'alice')
+        # Rejected once, not for every frame
+        self.assertIsNone(self.bob.reject_unknown(self.alice.seal('bob', 'hello')))
+
+        # Only the peer of the session can have it dropped
+        self.assertFalse(self.alice.drop_session(dict(reject, senderGUID='carol')))
+        self.assertIsNotNone(self.alice.get_session('bob'))
+        self.assertTrue(self.alice.drop_session(reject))
+        self.assertIsNone(self.alice.get_session('bob'))
+        self.assertTrue(self.alice.needs_handshake('bob'))
+
+        self._handshake()
+        self.assertEqual(self.bob.open(self.alice.seal('bob', 'again'))[1], 'again')
+
+    def test_handshake_retried_after_timeout(self):
+        self.alice.start_handshake('bob', self.bob_pubkey)
+        self.assertFalse(self.alice.needs_handshake('bob'))
+        self.clock.now += 61
+        self.assertTrue(self.alice.needs_handshake('bob'))
+
+    def test_rekey(self):
+        old = self._handshake()
+        for _ in xrange(99):
+            self.bob.open(self.alice.seal('bob', 'hello'))
+        self.assertFalse(self.alice.needs_handshake('bob'))
+        frame = self.alice.seal('bob', 'hello')
+        self.assertTrue(self.alice.needs_handshake('bob'))
+
+        new = self._handshake()
+        self.assertIs(self.alice.get_session('bob'), new)
+        self.assertEqual(self.bob.open(self.alice.seal('bob', 'new'))[1], 'new')
+
+        # Messages in flight in the old session still arrive, until the
+        # grace period is over
+        self.assertEqual(self.bob.open(frame)[1], 'hello')
+        self.assertIsNotNone(old.replaced)
+        self.clock.now += 301
+        self.alice.start_handshake('bob', self.bob_pubkey)
+        self.assertNotIn(old.session_id, self.alice.sessions)
+        self.assertIn(new.session_id, self.alice.sessions)
+
+    def test_expired_session_not_used(self):
+        self._handshake()
+        self.clock.now += 3601
+        self.assertIsNotNone(self.alice.get_session('bob'))
+        self.assertTrue(self.alice.needs_handshake('bob'))
+        self.clock.now += 300
+        self.assertIsNone(self.alice.get_session('bob'))
+        self.assertIsNone(self.alice.seal('bob', 'hello'))
+
+
+class TestCryptoPeerListener(unittest.TestCase):
+
+    def setUp(self):
+        self.alice, self.alice_pubkey = make_node('alice', time.time)
+        self.bob, self.bob_pubkey = make_node('bob', time.time)
+        init = as_sent(self.alice.start_handshake('bob', self.bob_pubkey), 'alice', self.alice_pubkey, 'bob')
+        self.alice.complete_handshake(as_sent(self.bob.accept_handshake(init), 'bob', self.bob_pubkey, 'alice'))
+
+        self.messages = []
+        self.rejects = []
+        self.listener = CryptoPeerListener(
+            '127.0.0.1', 0, self.bob_pubkey, hashlib.sha256('bob').hexdigest(), 'bob', self.messages.append,
+            sessions=self.bob, reject_cb=lambda peer, reject: self.rejects.append((peer, reject))
+        )
+
+    def _seal(self, message):
+        return self.alice.seal('bob', json.dumps(message).encode('zlib'))
+
+    def test_opens_session_messages(self):
+        message = as_sent({'type': 'hello'}, 'alice', self.alice_pubkey, 'bob')
+        self.listener.on_raw_message(self._seal(message))
+        self.assertEqual(self.messages, [message])
+
+    def test_drops_messages_claiming_another_sender(self):
+        self.listener.on_raw_message(self._seal(as_sent({'type': 'hello'}, 'carol', self.alice_pubkey, 'bob')))
+        self.listener.on_raw_message(self._seal(as_sent({'type': 'hello'}, 'alice', self.bob_pubkey, 'bob')))
+        self.assertEqual(self.messages, [])
+
+    def test_rejects_messages_in_unknown_session(self):
+        self.listener.sessions, _ = make_node('bob', time.time)
+        session_id = self.alice.get_session('bob').session_id
+        self.listener.on_raw_message(self._seal(as_sent({'type': 'hello'}, 'alice', self.alice_pubkey, 'bob')),
+                                     ('10.0.0.1', 12345))
+        self.assertEqual(self.messages, [])
+        self.assertEqual(self.rejects, [
+            (('10.0.0.1', 12345), {'type': 'session_reject', 'session_id': session_id.encode('hex')})
+        ])
+
+
+
+class TestCryptoPeerConnectionHandshake(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.alice, _ = make_node('alice', self.clock)
+        _, self.bob_pubkey = make_node('bob', self.clock)
+        self.peer = CryptoPeerConnection.__new__(CryptoPeerConnection)
+        self.peer.log = mock.Mock()
+        self.peer.guid = 'bob'
+        self.peer.pub = self.bob_pubkey
+        self.peer.hostname = '10.0.0.1'
+        self.peer.transport = mock.Mock(
+            sessions=self.alice, guid='alice', pubkey='alice pubkey', nickname='', settings={},
+            namecoin_id=None
+        )
+        self.peer.encrypt = mock.Mock(return_value='sealed')
+        self.peer.sign = mock.Mock(return_value='signature')
+        self.peer.send_raw = mock.Mock()
+
+    def test_no_handshake_with_older_or_unknown_peers(self):
+        for version in (None, '0.5.0'):
+            self.peer.version = version
+            self.peer.send({'type': 'findNode'})
+        # No handshake was started
+        self.assertTrue(self.alice.needs_handshake('bob'))
+        self.assertEqual(self.peer.encrypt.call_count, 2)
+
+    def test_handshake_with_current_peers(self):
+        self.peer.version = '0.5.1'
+        self.peer.send({'type': 'findNode'})
+        self.assertFalse(self.alice.needs_handshake('bob'))
+        self.assertEqual(self.peer.encrypt.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
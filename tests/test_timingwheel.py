@@ -0,0 +1,101 @@
+import unittest
+
+import mock
+
+from node import timingwheel
+
+
+class TestTimingWheel(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.fired = []
+        self.wheel = timingwheel.TimingWheel(
+            tick_interval=1, slots=4, levels=3, clock=lambda: self.now
+        )
+
+    def _advance(self, seconds):
+        self.now += seconds
+        return self.wheel.tick()
+
+    def _schedule(self, delay, name):
+        return self.wheel.call_later(delay, self.fired.append, name)
+
+    def test_fires_in_order(self):
+        self._schedule(3, 'c')
+        self._schedule(1, 'a')
+        self._schedule(2, 'b')
+        self.assertEqual(len(self.wheel), 3)
+
+        self.assertEqual(self._advance(1), 1)
+        self.assertEqual(self.fired, ['a'])
+        self.assertEqual(self._advance(2), 2)
+        self.assertEqual(self.fired, ['a', 'b', 'c'])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_delay_rounds_up_to_next_tick(self):
+        self._schedule(0, 'now')
+        self._schedule(1.2, 'later')
+        self._advance(1)
+        self.assertEqual(self.fired, ['now'])
+        self._advance(1)
+        self.assertEqual(self.fired, ['now', 'later'])
+
+    def test_remove_timeout(self):
+        timer = self._schedule(1, 'a')
+        self._schedule(1, 'b')
+        self.wheel.remove_timeout(timer)
+        self.wheel.remove_timeout(timer)
+        self.assertEqual(len(self.wheel), 1)
+
+        self._advance(1)
+        self.assertEqual(self.fired, ['b'])
+        self.wheel.remove_timeout(timer)
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_cascades_through_levels(self):
+        # 4 slots per wheel: 4 ** 1 and 4 ** 2 ticks start the outer wheels
+        for delay in (70, 3, 17, 5, 64):
+            self._schedule(delay, delay)
+        for _ in range(80):
+            self._advance(1)
+            self.assertEqual(self.fired, sorted(self.fired))
+            self.assertTrue(all(delay <= self.wheel.current_tick for delay in self.fired))
+        self.assertEqual(self.fired, [3, 5, 17, 64, 70])
+
+    def test_beyond_outermost_wheel(self):
+        self._schedule(200, 'far')
+        for _ in range(199):
+            self._advance(1)
+        self.assertEqual(self.fired, [])
+        self._advance(1)
+        self.assertEqual(self.fired, ['far'])
+
+    def test_catches_up_on_missed_ticks(self):
+        self._schedule(2, 'a')
+        self._schedule(30, 'b')
+        self.assertEqual(self._advance(40), 2)
+        self.assertEqual(self.fired, ['a', 'b'])
+
+    def test_callback_can_reschedule(self):
+        def callback(count):
+            self.fired.append(count)
+            if count < 3:
+                self.wheel.call_later(1, callback, count + 1)
+
+        self.wheel.call_later(1, callback, 1)
+        for _ in range(5):
+            self._advance(1)
+        self.assertEqual(self.fired, [1, 2, 3])
+
+    def test_callback_error_is_logged(self):
+        self.wheel.log = mock.Mock()
+        self.wheel.call_later(1, mock.Mock(side_effect=ValueError))
+        self._schedule(1, 'a')
+        self.assertEqual(self._advance(1), 2)
+        self.assertEqual(self.fired, ['a'])
+        self.assertEqual(self.wheel.log.exception.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
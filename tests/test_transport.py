@@ -63,5 +63,72 @@ class TestTransportLayerCallbacks(unittest.TestCase):
         self.assertEqual(self.callback5.call_count, 0)
 
 
+
+class TestStoreValidation(unittest.TestCase):
+
+    def setUp(self):
+        self.transport_layer = transport.CryptoTransportLayer.__new__(transport.CryptoTransportLayer)
+        self.transport_layer.log = mock.Mock()
+        self.store = {'type': 'store', 'key': 'a' * 40, 'value': 'value',
+                      'originalPublisherID': 'b' * 40, 'age': 0}
+
+    def test_store(self):
+        self.assertTrue(self.transport_layer.validate_on_store(self.store))
+        del self.store['originalPublisherID']
+        self.assertFalse(self.transport_layer.validate_on_store(self.store))
+
+    def test_store_batch(self):
+        validate = self.transport_layer.validate_on_storeBatch
+        self.assertTrue(validate({'type': 'storeBatch', 'stores': [self.store, self.store]}))
+        self.assertFalse(validate({'type': 'storeBatch', 'stores': [self.store, 'store']}))
+        self.assertFalse(validate({'type': 'storeBatch', 'stores': [self.store, {'key': 'a' * 40}]}))
+        self.assertFalse(validate({'type': 'storeBatch', 'stores': {}}))
+
+
+class TestConnectionEvictor(unittest.TestCase):
+    def setUp(self):
+        self.now = 10000
+        self.peers = {}
+        self.closed = []
+        self.evictor = transport.ConnectionEvictor(
+            1, self.peers, self.closed.append, max_peers=3, idle_timeout=100,
+            clock=lambda: self.now
+        )
+
+    def _add_peer(self, guid, idle_for, seed=False, busy=False):
+        peer = mock.Mock()
+        peer.last_used = self.now - idle_for
+        peer.seed = seed
+        peer.has_pending_messages.return_value = busy
+        self.peers[guid] = peer
+        return peer
+
+    def test_evicts_idle_peers(self):
+        idle = self._add_peer('idle', 200)
+        self._add_peer('recent', 10)
+        self._add_peer('seed0', 1000, seed=True)
+        self.assertEqual(self.evictor.evict(), 1)
+        self.assertEqual(self.closed, [idle])
+        self.assertEqual(sorted(self.peers), ['recent', 'seed0'])
+        self.assertEqual(self.evictor.num_evicted_idle, 1)
+
+    def test_evicts_least_recently_used_over_cap(self):
+        for num in range(5):
+            self._add_peer('peer%d' % num, num)
+        self._add_peer('seed0', 0, seed=True)
+        self.assertEqual(self.evictor.evict(), 2)
+        self.assertEqual(sorted(self.peers), ['peer0', 'peer1', 'peer2', 'seed0'])
+        self.assertEqual(self.evictor.get_stats()['evicted_lru'], 2)
+        self.assertEqual(self.evictor.get_stats()['live'], 4)
+
+    def test_keeps_peers_with_messages_in_flight(self):
+        self._add_peer('busy', 500, busy=True)
+        for num in range(4):
+            self._add_peer('peer%d' % num, num)
+        self.assertEqual(self.evictor.evict(), 2)
+        self.assertEqual(sorted(self.peers), ['busy', 'peer0', 'peer1'])
+        self.assertEqual(self.evictor.num_kept_busy, 1)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -19,9 +19,15 @@ if [ -z "$1" ]; then
     $PYTHON -m db.migrations.migration2 upgrade
     $PYTHON -m db.migrations.migration3 upgrade
     $PYTHON -m db.migrations.migration4 upgrade
+    $PYTHON -m db.migrations.migration5 upgrade
+    $PYTHON -m db.migrations.migration6 upgrade
+    $PYTHON -m db.migrations.migration7 upgrade
 else
     $PYTHON -m db.migrations.migration1 upgrade --path $1
     $PYTHON -m db.migrations.migration2 upgrade --path $1
     $PYTHON -m db.migrations.migration3 upgrade --path $1
     $PYTHON -m db.migrations.migration4 upgrade --path $1
+    $PYTHON -m db.migrations.migration5 upgrade --path $1
+    $PYTHON -m db.migrations.migration6 upgrade --path $1
+    $PYTHON -m db.migrations.migration7 upgrade --path $1
 fi